@@ -18,14 +18,17 @@
 #
 # http://numenta.org/licenses/
 # ----------------------------------------------------------------------
+from collections import deque, namedtuple
+import copy
 import itertools
 
+import numpy
+
 from nupic.algorithms import anomaly_likelihood as algorithms
 from htmengine import repository
 from htmengine.exceptions import MetricNotActiveError
 from htmengine.htmengine_logging import getMetricLogPrefix
 from htmengine.repository.queries import MetricStatus
-from htmengine.utils import jsonDecode
 
 
 
@@ -35,6 +38,208 @@ NUM_SKIP_RECORDS = 288 # One day of records
 
 
 
+# Forced refresh of anomaly likelihood params: after an anomaly score above
+# this threshold ...
+FORCED_REFRESH_ANOMALY_SCORE_THRESHOLD = 0.99
+# ... if more than this number of rows were processed since the last refresh
+FORCED_REFRESH_MIN_ROWS = 3
+
+
+
+class _AnomalyLikelihoodBatch(object):
+  """ Anomaly likelihoods of a run of raw anomaly scores computed in one numpy
+  pass. The likelihoods and the params after any number of the scores are
+  bit-for-bit the same as those of calling algorithms.updateAnomalyLikelihoods
+  once per score: the moving average accumulates the window's total in the
+  same order of operations, and the likelihoods are filtered against the
+  previous unfiltered likelihood in the same way.
+  """
+
+  # Thresholds of the likelihood filter of algorithms.updateAnomalyLikelihoods:
+  # a likelihood in the red zone that follows one in the red zone is replaced
+  # with the yellow zone threshold
+  _RED_ZONE_THRESHOLD = 1.0 - 0.99999
+  _YELLOW_ZONE_THRESHOLD = 1.0 - 0.999
+
+
+  def __init__(self, rawAnomalyScores, params):
+    """
+    :param rawAnomalyScores: non-empty sequence of raw anomaly scores in the
+      processed order
+    :param params: anomaly likelihood params, as returned by
+      algorithms.estimateAnomalyLikelihoods or
+      algorithms.updateAnomalyLikelihoods; not modified
+
+    :raises ValueError: if params are not valid anomaly likelihood params
+    """
+    # Anomaly scores, i.e., 1 - filtered likelihood, of rawAnomalyScores;
+    # numpy array
+    self.anomalyScores = None
+
+    if not algorithms.isValidEstimatorParams(params):
+      raise ValueError("'params' is not a valid params structure")
+
+    self._rawAnomalyScores = list(rawAnomalyScores)
+    self._params = params
+
+    movingAverage = params["movingAverage"]
+    windowSize = movingAverage["windowSize"]
+    historicalValues = movingAverage["historicalValues"]
+    numHistorical = len(historicalValues)
+    numScores = len(self._rawAnomalyScores)
+
+    # The moving average pops the oldest value once the window is full, then
+    # adds the new value: accumulate the interleaved negated popped values and
+    # new values sequentially to reproduce each intermediate total exactly. A
+    # -0.0 stands in for not popping, which leaves the total unchanged.
+    allValues = numpy.array(list(historicalValues) + self._rawAnomalyScores,
+                            dtype=float)
+    newIndices = numpy.arange(numHistorical, numHistorical + numScores)
+    popIndices = newIndices - windowSize
+    deltas = numpy.empty(2 * numScores + 1, dtype=float)
+    deltas[0] = movingAverage["total"]
+    deltas[1::2] = numpy.where(popIndices >= 0,
+                               -allValues[numpy.maximum(popIndices, 0)],
+                               -0.0)
+    deltas[2::2] = allValues[numHistorical:]
+    self._totals = numpy.add.accumulate(deltas)[2::2]
+
+    averages = self._totals / numpy.minimum(windowSize, newIndices + 1)
+
+    distribution = params["distribution"]
+    self._likelihoods = numpy.array(
+      [algorithms.normalProbability(average, distribution)
+       for average in averages.tolist()],
+      dtype=float)
+
+    self._historicalLikelihoods = params.get("historicalLikelihoods", [1.0])
+
+    # Filter each likelihood against the previous unfiltered one; without
+    # historical likelihoods, the first likelihood is left as is
+    previous = numpy.concatenate(
+      (self._historicalLikelihoods[-1:] or [1.0], self._likelihoods[:-1]))
+    redZone = numpy.logical_and(self._likelihoods <= self._RED_ZONE_THRESHOLD,
+                                previous <= self._RED_ZONE_THRESHOLD)
+
+    self.anomalyScores = 1.0 - numpy.where(redZone,
+                                           self._YELLOW_ZONE_THRESHOLD,
+                                           self._likelihoods)
+
+
+  def getParams(self, numScores):
+    """
+    :param numScores: number of the leading scores to account for; 1 or more
+
+    :returns: the anomaly likelihood params after processing the given number
+      of the leading scores
+    """
+    movingAverage = self._params["movingAverage"]
+    windowSize = movingAverage["windowSize"]
+
+    historicalValues = (list(movingAverage["historicalValues"]) +
+                        self._rawAnomalyScores[:numScores])
+    historicalLikelihoods = (list(self._historicalLikelihoods) +
+                             list(self._likelihoods[:numScores]))
+
+    return {
+      "distribution": self._params["distribution"],
+      "movingAverage": {
+        "historicalValues": historicalValues[-windowSize:],
+        "total": float(self._totals[numScores - 1]),
+        "windowSize": windowSize,
+      },
+      "historicalLikelihoods": historicalLikelihoods[-windowSize:],
+    }
+
+
+
+# The attributes of a metric_data row that anomaly likelihood statistics use
+_StatisticsSample = namedtuple("_StatisticsSample",
+                               "rowid timestamp metric_value raw_anomaly_score")
+
+
+
+class StatisticsSampleTail(object):
+  """ In-process copy of the tail of a metric's metric_data rows with raw anomaly
+  scores, which spares AnomalyLikelihoodHelper from loading it from metric_data
+  for each result batch.
+
+  It's loaded from metric_data when first needed, and must then be kept up to
+  date via append() with the rows of each result batch of the metric once the
+  batch is saved. It's only the tail of metric_data as long as nothing else
+  saves raw anomaly scores of the metric, so append() invalidates it when a
+  batch doesn't follow the tail (e.g., redelivered results), and so should
+  its owner whenever it doesn't know what was saved.
+  """
+
+  def __init__(self, size):
+    """
+    :param size: max number of samples to keep; the statistics sample size
+    """
+    self._samples = deque(maxlen=size)
+    self._loaded = False
+
+
+  @property
+  def isLoaded(self):
+    """ True if the tail was loaded from metric_data and is still valid """
+    return self._loaded
+
+
+  def load(self, rows):
+    """ Replace the tail with the given rows
+
+    :param rows: up to `size` of the metric's tail metric_data rows with raw
+      anomaly scores in the processed order; all such rows if there are fewer
+    """
+    self._samples.clear()
+    self._extend(rows)
+    self._loaded = True
+
+
+  def append(self, rows):
+    """ Append the given rows, which were just saved to metric_data with their
+    raw anomaly scores
+
+    :param rows: a sequence of MetricData instances in the processed order
+    """
+    if not self._loaded or not rows:
+      return
+
+    if self._samples and rows[0].rowid <= self._samples[-1].rowid:
+      # The rows don't follow the tail, so it's no longer known
+      self.invalidate()
+      return
+
+    self._extend(rows)
+
+
+  def invalidate(self):
+    """ Forget the tail; it will be loaded from metric_data when needed """
+    self._samples.clear()
+    self._loaded = False
+
+
+  def _extend(self, rows):
+    self._samples.extend(
+      _StatisticsSample(row.rowid, row.timestamp, row.metric_value,
+                        row.raw_anomaly_score)
+      for row in rows)
+
+
+  def getSamples(self, limit):
+    """
+    :param limit: max number of tail samples to return
+
+    :returns: a list of up to `limit` tail samples in the processed order
+    """
+    numSamples = min(limit, len(self._samples))
+    return list(itertools.islice(self._samples,
+                                 len(self._samples) - numSamples,
+                                 len(self._samples)))
+
+
+
 class AnomalyLikelihoodHelper(object):
   """ Helper class for running AnomalyLikelihood calculations in
   htmengine.runtime.anomaly_service.AnomalyService.
@@ -66,6 +271,14 @@ class AnomalyLikelihoodHelper(object):
       config.getint("anomaly_likelihood", "statistics_sample_size"))
 
 
+  def createStatisticsSampleTail(self):
+    """
+    :returns: an empty StatisticsSampleTail instance sized for our statistics
+      for passing to updateModelAnomalyScores
+    """
+    return StatisticsSampleTail(self._statisticsSampleSize)
+
+
   def _generateAnomalyParams(self, metricID, statsSampleCache,
                              defaultAnomalyParams):
     """
@@ -157,7 +370,8 @@ class AnomalyLikelihoodHelper(object):
     return int(max(self._minStatisticsRefreshInterval, batchSize * 0.1))
 
 
-  def _initAnomalyLikelihoodModel(self, engine, metricObj, metricDataRows):
+  def _initAnomalyLikelihoodModel(self, engine, metricObj, metricDataRows,
+                                  sampleTail):
     """ Create the anomaly likelihood model for the given Metric instance.
     Assumes that the metric doesn't have anomaly params yet.
 
@@ -170,6 +384,8 @@ class AnomalyLikelihoodHelper(object):
       (ascending by rowid and timestamp) with updated raw_anomaly_score and
       zeroed out anomaly_score corresponding to the new model inference results,
       but not yet updated in the database. Will not alter this sequence.
+    :param sampleTail: the metric's StatisticsSampleTail instance; None to load
+      the samples from the metric_data table
 
     :returns: the tuple (anomalyParams, statsSampleCache, startRowIndex)
       anomalyParams: None, if there are too few samples; otherwise, the anomaly
@@ -191,10 +407,7 @@ class AnomalyLikelihoodHelper(object):
                                     metricObj.status,
                                     metricObj.server,))
 
-    modelParams = jsonDecode(metricObj.model_params)
-    anomalyParams = modelParams.get("anomalyLikelihoodParams", None)
-
-    assert not anomalyParams, anomalyParams
+    anomalyParams = None
 
     statsSampleCache = None
 
@@ -220,7 +433,8 @@ class AnomalyLikelihoodHelper(object):
         metricID=metricObj.uid,
         statsSampleCache=None,
         consumedSamples=consumedSamples,
-        defaultAnomalyParams=anomalyParams)
+        defaultAnomalyParams=anomalyParams,
+        sampleTail=sampleTail)
 
       # If this assertion fails, it implies that the count retrieved by our
       # call to MetricData.count above is no longer correct
@@ -240,7 +454,8 @@ class AnomalyLikelihoodHelper(object):
 
 
   def _refreshAnomalyParams(self, engine, metricID, statsSampleCache,
-                            consumedSamples, defaultAnomalyParams):
+                            consumedSamples, defaultAnomalyParams,
+                            sampleTail):
     """ Refresh anomaly likelihood parameters from the tail of
     statsSampleCache and consumedSamples up to self._statisticsSampleSize.
 
@@ -263,6 +478,9 @@ class AnomalyLikelihoodHelper(object):
       appended to statsSampleCache
     :param defaultAnomalyParams: the default anomaly params value; if can't
       generate new ones, this value will be returned in the result tuple
+    :param sampleTail: the metric's StatisticsSampleTail instance for
+      initializing statsSampleCache; None to load the samples from the
+      metric_data table
 
     :returns: the tuple (anomalyParams, statsSampleCache,)
 
@@ -287,10 +505,19 @@ class AnomalyLikelihoodHelper(object):
       # anomaly params are being refreshed for the first time within an
       # inference result batch.
       # TODO: unit-test this
-      tail = self._tailMetricDataWithRawAnomalyScoresIter(
-        engine,
-        metricID,
-        max(0, self._statisticsSampleSize - len(consumedSamples)))
+      limit = max(0, self._statisticsSampleSize - len(consumedSamples))
+
+      if sampleTail is None:
+        tail = self._tailMetricDataWithRawAnomalyScoresIter(engine, metricID,
+                                                            limit)
+      else:
+        if not sampleTail.isLoaded:
+          # Load the whole tail, so that later refreshes with fewer consumed
+          # samples find enough samples in it
+          sampleTail.load(self._tailMetricDataWithRawAnomalyScoresIter(
+            engine, metricID, self._statisticsSampleSize))
+
+        tail = sampleTail.getSamples(limit)
 
       statsSampleCache = list(itertools.chain(tail, consumedSamples))
     else:
@@ -332,7 +559,63 @@ class AnomalyLikelihoodHelper(object):
     return reversed(rows)
 
 
-  def updateModelAnomalyScores(self, engine, metricObj, metricDataRows):
+  def _processAnomalyRun(self, metricObj, runRows, anomalyParams,
+                         statsSampleCache):
+    """ Calculate the anomaly scores of a run of rows from the anomaly
+    likelihoods in one batch, up to and including the first row whose anomaly
+    score forces a refresh of the anomaly likelihood params.
+
+    :param metricObj: the model's Metric instance
+    :param runRows: a sequence of MetricData instances of the run in the
+      processed order; may be empty. Will update the anomaly_score properties of
+      the consumed ones.
+    :param anomalyParams: the model's anomaly likelihood params; its "params"
+      are replaced with the ones after the consumed rows
+    :param statsSampleCache: the cached list of MetricData instances for
+      updating anomaly likelihood params; None if not initialized yet
+
+    :returns: a list of the consumed leading MetricData instances of runRows
+    """
+    if not runRows:
+      return []
+
+    batch = _AnomalyLikelihoodBatch(
+      rawAnomalyScores=[md.raw_anomaly_score for md in runRows],
+      params=anomalyParams["params"])
+
+    # If anomaly score > 0.99 then we greedily update the statistics. 0.99
+    # should not repeat too often, but to be safe we wait a few more records
+    # before updating again, in order to avoid overloading the DB.
+    forcesRefresh = numpy.logical_and(
+      batch.anomalyScores > FORCED_REFRESH_ANOMALY_SCORE_THRESHOLD,
+      (anomalyParams["last_rowid_for_stats"] + FORCED_REFRESH_MIN_ROWS) <
+      numpy.array([md.rowid for md in runRows]))
+
+    if statsSampleCache is not None:
+      # There must be enough samples for the refresh, counting the consumed rows
+      forcesRefresh &= (
+        len(statsSampleCache) + numpy.arange(1, len(runRows) + 1) >=
+        self._statisticsMinSampleSize)
+
+    numConsumed = len(runRows)
+    if forcesRefresh.any():
+      numConsumed = int(forcesRefresh.argmax()) + 1
+      self._log.info("Forcing refresh of anomaly params for model=%s due "
+                     "to exceeded anomaly_score threshold in sample=%r",
+                     metricObj.uid, runRows[numConsumed - 1])
+
+    consumedSamples = list(runRows[:numConsumed])
+    for md, anomalyScore in itertools.izip(consumedSamples,
+                                           batch.anomalyScores.tolist()):
+      md.anomaly_score = anomalyScore
+
+    anomalyParams["params"] = batch.getParams(numConsumed)
+
+    return consumedSamples
+
+
+  def updateModelAnomalyScores(self, engine, metricObj, metricDataRows,
+                               anomalyLikelihoodParams, sampleTail=None):
     """
     Calculate the anomaly scores based on the anomaly likelihoods. Update
     anomaly scores in the given metricDataRows MetricData instances, and
@@ -346,6 +629,12 @@ class AnomalyLikelihoodHelper(object):
       and zeroed out anomaly_score corresponding to the new model inference
       results, but not yet updated in the database. Will update their
       anomaly_score properties, as needed.
+    :param anomalyLikelihoodParams: the model's saved anomaly likelihood
+      params, as returned by a previous call; None if there are none yet. Not
+      modified.
+    :param sampleTail: the metric's StatisticsSampleTail instance; None to load
+      the tail samples for refreshing the anomaly likelihood params from the
+      metric_data table
 
     :returns: new anomaly likelihood params for the model
 
@@ -376,15 +665,19 @@ class AnomalyLikelihoodHelper(object):
                                     metricObj.status,
                                     metricObj.server,))
 
-    modelParams = jsonDecode(metricObj.model_params)
-    anomalyParams = modelParams.get("anomalyLikelihoodParams", None)
+    anomalyParams = anomalyLikelihoodParams
     if not anomalyParams:
       # We don't have a likelihood model yet. Create one if we have sufficient
       # records with raw anomaly scores
       (anomalyParams, statsSampleCache, startRowIndex) = (
         self._initAnomalyLikelihoodModel(engine=engine,
                                          metricObj=metricObj,
-                                         metricDataRows=metricDataRows))
+                                         metricDataRows=metricDataRows,
+                                         sampleTail=sampleTail))
+    else:
+      # Our anomaly runs replace its "params"; the caller's
+      # anomalyLikelihoodParams are not to be modified
+      anomalyParams = copy.copy(anomalyParams)
 
     # Do anomaly likelihood processing on the rest of the new samples
     # NOTE: this loop will be skipped if there are still not enough samples for
@@ -472,34 +765,11 @@ class AnomalyLikelihoodHelper(object):
         endRowID, anomalyParams["last_rowid_for_stats"],
         statisticsRefreshInterval, len(metricDataRows))
 
-      consumedSamples = []
-      for md in itertools.islice(metricDataRows, startRowIndex, limitIndex):
-        consumedSamples.append(md)
-
-        (likelihood,), _, anomalyParams["params"] = (
-          algorithms.updateAnomalyLikelihoods(
-            ((md.timestamp, md.metric_value, md.raw_anomaly_score),),
-            anomalyParams["params"]))
-
-        # TODO: the float "cast" here seems redundant
-        md.anomaly_score = float(1.0 - likelihood)
-
-        # If anomaly score > 0.99 then we greedily update the statistics. 0.99
-        # should not repeat too often, but to be safe we wait a few more
-        # records before updating again, in order to avoid overloading the DB.
-        #
-        # TODO: the magic 0.99 and the magic 3 value below should either
-        #  be constants or config settings. Where should they be defined?
-        if (md.anomaly_score > 0.99 and
-            (anomalyParams["last_rowid_for_stats"] + 3) < md.rowid):
-          if statsSampleCache is None or (
-              len(statsSampleCache) + len(consumedSamples) >=
-              self._statisticsMinSampleSize):
-            # TODO: unit-test this
-            self._log.info("Forcing refresh of anomaly params for model=%s due "
-                           "to exceeded anomaly_score threshold in sample=%r",
-                           metricObj.uid, md)
-            break
+      consumedSamples = self._processAnomalyRun(
+        metricObj=metricObj,
+        runRows=metricDataRows[startRowIndex:limitIndex],
+        anomalyParams=anomalyParams,
+        statsSampleCache=statsSampleCache)
 
       if startRowIndex + len(consumedSamples) < len(metricDataRows) or (
           consumedSamples[-1].rowid >= endRowID):
@@ -511,7 +781,8 @@ class AnomalyLikelihoodHelper(object):
           metricID=metricObj.uid,
           statsSampleCache=statsSampleCache,
           consumedSamples=consumedSamples,
-          defaultAnomalyParams=anomalyParams)
+          defaultAnomalyParams=anomalyParams,
+          sampleTail=sampleTail)
 
 
       startRowIndex += len(consumedSamples)
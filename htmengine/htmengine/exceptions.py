@@ -100,6 +100,14 @@ class MetricStatusChangedError(HTMEngineError):
 
 
 
+class AnomalyLikelihoodParamsChangedError(HTMEngineError):
+  """ Metric's anomaly likelihood params were saved or deleted by someone else
+  (e.g., when its model was deleted) since they were loaded
+  """
+  pass
+
+
+
 class DuplicateRecordError(HTMEngineError):
   """Adding a database record failed due to existing duplicate record."""
   pass
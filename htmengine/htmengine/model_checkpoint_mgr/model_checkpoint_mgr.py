@@ -24,12 +24,19 @@ This module implements the Model Checkpoint Manager that's responsible for
 saving and loading models to persistent storage.
 """
 
+from contextlib import contextmanager
+import ctypes
+import ctypes.util
 import errno
+import fcntl
+import gzip
 import json
 import os
 import shutil
+import tarfile
 import tempfile
 import time
+import zlib
 
 from nupic.frameworks.opf.modelfactory import ModelFactory
 
@@ -37,6 +44,7 @@ from htmengine import htmengine_logging
 
 from nta.utils import makeDirectoryFromAbsolutePath
 from nta.utils.config import Config
+from nta.utils.file_lock import ExclusiveFileLock
 
 
 
@@ -73,11 +81,207 @@ class ModelAlreadyExists(Exception):
 
 
 
+class ModelCheckpointCorrupted(Exception):
+  """ Raised from load() if the model instance archive of the checkpoint
+  fails integrity verification
+  """
+  pass
+
+
+
 def _getLogger():
   return htmengine_logging.getExtendedLogger(_MODULE_NAME)
 
 
 
+_libc = None
+
+
+
+def _getLibc():
+  global _libc  # pylint: disable=W0603
+  if _libc is None:
+    _libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+
+  return _libc
+
+
+
+# posix_fadvise(2) advice that the data will be accessed in the near future
+_POSIX_FADV_WILLNEED = 3
+
+
+
+def _fadviseWillNeed(fd):
+  """ Advise the kernel to read the given open file into the page cache
+  asynchronously via posix_fadvise(2); no-op where posix_fadvise isn't
+  available.
+
+  :param fd: file descriptor of an open file
+  """
+  libc = _getLibc()
+
+  try:
+    fadvise = libc.posix_fadvise64
+  except AttributeError:
+    return
+
+  fadvise.argtypes = (ctypes.c_int, ctypes.c_int64, ctypes.c_int64,
+                      ctypes.c_int)
+
+  # NOTE: posix_fadvise returns the error number instead of setting errno;
+  # length 0 means through the end of the file
+  err = fadvise(fd, 0, 0, _POSIX_FADV_WILLNEED)
+  if err != 0:
+    raise OSError(err, os.strerror(err))
+
+
+
+def _syncfs(fd):
+  """ Commit the filesystem containing the given open file to disk via Linux
+  syncfs(2); falls back to sync(2), which commits all filesystems, where
+  syncfs isn't available.
+
+  :param fd: file descriptor of an open file
+  """
+  libc = _getLibc()
+
+  try:
+    syncfs = libc.syncfs
+  except AttributeError:
+    libc.sync()
+    return
+
+  while syncfs(fd) != 0:
+    err = ctypes.get_errno()
+    if err != errno.EINTR:
+      raise OSError(err, os.strerror(err))
+
+
+
+# ioctl(2) request that makes the destination file share the source file's
+# extents copy-on-write (Linux FICLONE; supported by btrfs and XFS, for example)
+_FICLONE = 0x40049409
+
+
+
+def _reflinkFile(srcPath, destPath):
+  """ Create destPath as a copy-on-write clone of srcPath via FICLONE
+
+  :raises: IOError or OSError if the filesystem doesn't support reflinks; the
+    destination file is removed in that case
+  """
+  with open(srcPath, "rb") as srcFileObj:
+    destFileObj = open(destPath, "wb")
+    try:
+      fcntl.ioctl(destFileObj.fileno(), _FICLONE, srcFileObj.fileno())
+    except:
+      destFileObj.close()
+      os.unlink(destPath)
+      raise
+    else:
+      destFileObj.close()
+
+
+
+class _GroupCommit(object):
+  """ Makes writes durable by committing the whole checkpoint filesystem via
+  syncfs, batching concurrent requests from all processes that share the
+  checkpoint storage root into a single commit.
+
+  Commits are numbered by generations that are tracked in a state file in the
+  scratch directory. A requester reads the number of the latest started
+  commit after its writes complete, so any commit with a greater number is
+  guaranteed to have started after those writes. Requesters serialize on a file
+  lock; while one of them commits, the others wait on the lock, and those whose
+  writes are covered by that commit then return without committing again.
+  """
+
+  _LOCK_FILE_NAME = "group_commit.lock"
+
+  _STATE_FILE_NAME = "group_commit.state"
+
+
+  def __init__(self, scratchDir, windowSec):
+    """
+    :param scratchDir: scratch directory in the checkpoint filesystem
+    :param windowSec: number of seconds that the committing requester waits for
+      more requests to join its commit
+    """
+    self._scratchDir = scratchDir
+    self._windowSec = windowSec
+    self._lockFilePath = os.path.join(scratchDir, self._LOCK_FILE_NAME)
+    self._stateFilePath = os.path.join(scratchDir, self._STATE_FILE_NAME)
+
+
+  def sync(self):
+    """ Make all writes to the checkpoint filesystem that completed before
+    this call durable
+
+    :returns: True if this call committed the filesystem; False if a commit
+      by another request covered it
+    """
+    startedGeneration, _ = self._readState()
+    return self._syncAfter(startedGeneration)
+
+
+  def _syncAfter(self, generation):
+    """ Make sure that a commit numbered greater than the given generation
+    completes
+
+    :param generation: number of the latest started commit that was read after
+      the writes to be committed completed
+    :returns: True if this call committed the filesystem; False if another
+      request's commit covered it
+    """
+    with open(self._lockFilePath, "a") as lockFile:
+      with ExclusiveFileLock(lockFile):
+        startedGeneration, completedGeneration = self._readState()
+        if completedGeneration > generation:
+          return False
+
+        if self._windowSec > 0:
+          # Let more requests join this commit; they read the started
+          # generation before we advance it below
+          time.sleep(self._windowSec)
+
+        startedGeneration += 1
+        self._writeState(startedGeneration, completedGeneration)
+
+        _syncfs(lockFile.fileno())
+
+        self._writeState(startedGeneration, startedGeneration)
+
+    return True
+
+
+  def _readState(self):
+    """
+    :returns: two-tuple of the numbers of the latest started and latest
+      completed commits
+    """
+    try:
+      with open(self._stateFilePath) as fileObj:
+        started, completed = fileObj.read().split()
+    except IOError as e:
+      if e.errno == errno.ENOENT:
+        return 0, 0
+      raise
+
+    return int(started), int(completed)
+
+
+  def _writeState(self, startedGeneration, completedGeneration):
+    # Replace the state file atomically, so that it may be read without locking
+    (tempFd, tempPath) = tempfile.mkstemp(prefix=self._STATE_FILE_NAME,
+                                          dir=self._scratchDir)
+    with os.fdopen(tempFd, "wb") as fileObj:
+      fileObj.write("%d %d" % (startedGeneration, completedGeneration))
+
+    os.rename(tempPath, self._stateFilePath)
+
+
+
 class ModelCheckpointMgr(object):
   """
   Goal: saving of model definitions, checkpoints and attributes must be atomic -
@@ -97,6 +301,16 @@ class ModelCheckpointMgr(object):
     current_checkpoint --> (a link to checkpoint_store_<timestamp> dir)
 
     checkpoint_store_1389761327.552464/ (seconds since epoch as suffix)
+      attributes.data
+      model_instance.tar.gz (archive of the model_instance/ directory)
+
+  The model instance is stored as a single gzip-compressed tar stream of the
+  directory generated by the CLA model's save(). It's written and read
+  sequentially in a single pass, and gzip's CRC-32 and length trailer let load()
+  detect a damaged checkpoint. Checkpoint stores of "2.0" model entries contain
+  the model_instance/ directory instead; load() supports both formats:
+
+    checkpoint_store_1389761327.552464/
       attributes.data
       model_instance/ (the contents are generated by CLA model)
         model.pkl
@@ -104,11 +318,47 @@ class ModelCheckpointMgr(object):
           TemporalAnomaly-network.nta/
             R0-pkl
             . . .
+
+  The format of new checkpoints is determined by the "instance_format" option
+  in the storage section of model-checkpoint.conf.
+
+  New model entries and checkpoint stores are made durable before they're
+  renamed into place, either by fsync of each of their files and directories or,
+  with the "syncfs" sync_mode, by a group commit of the whole checkpoint
+  filesystem that's shared by concurrent saves (see _GroupCommit). Either way,
+  the current_checkpoint link never points at a store that isn't durable.
+
+  Files of a model entry are never modified in place: save() creates a new
+  checkpoint store and updateCheckpointAttributes() replaces the attributes
+  file by rename. This allows clone() to share the files of the source entry
+  with the clone via hard links or reflinks, per the "clone_mode" option in the
+  storage section of model-checkpoint.conf.
   """
 
 
-  # Current model entry version
-  _MODEL_ENTRY_VERSION = "2.0"
+  # Current model entry version: model instance is saved as an archive
+  _MODEL_ENTRY_VERSION = "3.0"
+
+  # Model entry version whose checkpoint stores contain the model_instance
+  # directory; used for new entries when "instance_format" is "directory"
+  _DIRECTORY_MODEL_ENTRY_VERSION = "2.0"
+
+  # Values of the "instance_format" configuration option
+  _INSTANCE_FORMAT_ARCHIVE = "archive"
+  _INSTANCE_FORMAT_DIRECTORY = "directory"
+
+  # Values of the "sync_mode" configuration option
+  _SYNC_MODE_FSYNC = "fsync"
+  _SYNC_MODE_SYNCFS = "syncfs"
+
+  # Values of the "clone_mode" configuration option
+  _CLONE_MODE_LINK = "link"
+  _CLONE_MODE_COPY = "copy"
+
+  # Errors of link(2) that indicate that the filesystem can't hard-link the
+  # file, in which case clone() falls back to reflink or copy
+  _LINK_UNSUPPORTED_ERRNOS = frozenset([errno.EXDEV, errno.EPERM, errno.EMLINK,
+                                        errno.EOPNOTSUPP, errno.ENOSYS])
 
   # Root-level directory for creating temporary directories or files; located in
   # the root storage directory; NOTE: this location in the same filesystem as
@@ -138,13 +388,42 @@ class ModelCheckpointMgr(object):
   _CHECKPOINT_ATTRIBUTES_FILE_NAME = "attributes.data"
 
   # Name of directory that contains the pickled model instance; located in the
-  # actual model checkpoint store directory
+  # actual model checkpoint store directory of "2.0" entries and at the top
+  # level of the model instance archive
   _CHECKPOINT_INSTANCE_DIR_NAME = "model_instance"
 
+  # Name of the model instance archive file; located in the actual model
+  # checkpoint store directory
+  _CHECKPOINT_INSTANCE_ARCHIVE_NAME = "model_instance.tar.gz"
+
+  # Size of reads when draining the model instance archive
+  _ARCHIVE_READ_CHUNK_SIZE = 64 * 1024
+
 
   def __init__(self):
     self._logger = _getLogger()
 
+    config = ModelCheckpointConfig()
+
+    self._instanceFormat = config.get("storage", "instance_format")
+    if self._instanceFormat not in (self._INSTANCE_FORMAT_ARCHIVE,
+                                    self._INSTANCE_FORMAT_DIRECTORY):
+      raise ValueError("Unexpected model checkpoint instance_format=%r" %
+                       (self._instanceFormat,))
+
+    self._archiveCompressionLevel = config.getint(
+      "storage", "archive_compression_level")
+
+    self._syncMode = config.get("storage", "sync_mode")
+    if self._syncMode not in (self._SYNC_MODE_FSYNC, self._SYNC_MODE_SYNCFS):
+      raise ValueError("Unexpected model checkpoint sync_mode=%r" %
+                       (self._syncMode,))
+
+    self._cloneMode = config.get("storage", "clone_mode")
+    if self._cloneMode not in (self._CLONE_MODE_LINK, self._CLONE_MODE_COPY):
+      raise ValueError("Unexpected model checkpoint clone_mode=%r" %
+                       (self._cloneMode,))
+
     # Get the directory in which to save/load checkpoints
     self._storageRoot = self._getStorageRoot()
 
@@ -157,6 +436,13 @@ class ModelCheckpointMgr(object):
     if not os.path.exists(self._scratchDir):
       makeDirectoryFromAbsolutePath(self._scratchDir)
 
+    if self._syncMode == self._SYNC_MODE_SYNCFS:
+      self._groupCommit = _GroupCommit(
+        self._scratchDir,
+        windowSec=config.getfloat("storage", "group_commit_window_sec"))
+    else:
+      self._groupCommit = None
+
 
   @classmethod
   def _getStorageRoot(cls):
@@ -270,6 +556,114 @@ class ModelCheckpointMgr(object):
     self._fsyncDirectoryOnly(rootPath)
 
 
+  @classmethod
+  def _getDirectoryTreeSize(cls, rootPath):
+    """
+    param rootPath: the path of the root directory of the tree
+
+    retval: total number of bytes in the files of the tree
+    """
+    return sum(
+      os.path.getsize(os.path.join(parentPath, f))
+      for (parentPath, _dirNames, fileNames) in os.walk(rootPath)
+      for f in fileNames)
+
+
+  def _syncDirectoryTree(self, rootPath):
+    """ Make the directory tree durable per the configured sync_mode: fsync of
+    each file and directory or a group commit of the checkpoint filesystem
+
+    param rootPath: the path of the root directory of the tree to sync
+    """
+    if self._groupCommit is None:
+      self._fsyncDirectoryTreeRecursively(rootPath)
+      return
+
+    startTime = time.time()
+    committed = self._groupCommit.sync()
+    self._logger.debug(
+      "{TAG:MCKPT.GROUP.COMMIT} Synced tree=%s: committed=%s; duration=%ss",
+      rootPath, committed, time.time() - startTime)
+
+
+  def _shareFile(self, srcPath, destPath):
+    """ Create destPath with the content of srcPath: as a hard link, falling
+    back to a reflink and then to a copy where the filesystem doesn't support
+    the former; or just as a copy if clone_mode is "copy"
+
+    :returns: one of "link", "reflink" or "copy"
+    """
+    if self._cloneMode == self._CLONE_MODE_LINK:
+      try:
+        os.link(srcPath, destPath)
+        return "link"
+      except OSError as e:
+        if e.errno not in self._LINK_UNSUPPORTED_ERRNOS:
+          raise
+
+      try:
+        _reflinkFile(srcPath, destPath)
+        return "reflink"
+      except EnvironmentError:
+        pass
+
+    shutil.copy2(srcPath, destPath)
+    return "copy"
+
+
+  def _shareDirectoryTree(self, srcDirPath, destDirPath):
+    """ Recreate the directory tree at srcDirPath as destDirPath, sharing its
+    files per clone_mode (see _shareFile). Symlinks are recreated as is.
+
+    :returns: a two-tuple: list of paths of files that were reflinked or copied
+      and a dict of the number of files that were linked, reflinked and copied
+    """
+    unsharedFilePaths = []
+    counts = dict(link=0, reflink=0, copy=0)
+
+    for (srcParentPath, dirNames, fileNames) in os.walk(
+        srcDirPath, topdown=True, onerror=None, followlinks=False):
+      destParentPath = os.path.normpath(
+        os.path.join(destDirPath, os.path.relpath(srcParentPath, srcDirPath)))
+      os.mkdir(destParentPath)
+
+      for name in dirNames + fileNames:
+        srcPath = os.path.join(srcParentPath, name)
+        destPath = os.path.join(destParentPath, name)
+
+        if os.path.islink(srcPath):
+          os.symlink(os.readlink(srcPath), destPath)
+        elif name in fileNames:
+          how = self._shareFile(srcPath, destPath)
+          counts[how] += 1
+          if how != "link":
+            unsharedFilePaths.append(destPath)
+
+    return unsharedFilePaths, counts
+
+
+  def _syncClonedDirectoryTree(self, rootPath, unsharedFilePaths):
+    """ Make the cloned directory tree durable. Files that are hard links to
+    files of a durable model entry don't need to be synced, so unless
+    sync_mode is "syncfs", only the given unshared files and the directories
+    are fsync'ed.
+
+    param rootPath: the path of the root directory of the cloned tree
+    param unsharedFilePaths: paths of files in the tree that were reflinked or
+      copied
+    """
+    if self._groupCommit is not None:
+      self._syncDirectoryTree(rootPath)
+      return
+
+    for filePath in unsharedFilePaths:
+      self._fsyncFile(filePath)
+
+    for (parentPath, _dirNames, _fileNames) in os.walk(
+        rootPath, topdown=False, onerror=None, followlinks=False):
+      self._fsyncDirectoryOnly(parentPath)
+
+
   def define(self, modelID, definition):
     """ Define a new model in model checkpoint archive.
 
@@ -303,7 +697,10 @@ class ModelCheckpointMgr(object):
       verFilePath = os.path.join(tempModelEntryDirPath,
                                  self._MODEL_ENTRY_VERSION_FILE_NAME)
       with open(verFilePath, "wb") as fileObj:
-        fileObj.write(self._MODEL_ENTRY_VERSION)
+        if self._instanceFormat == self._INSTANCE_FORMAT_ARCHIVE:
+          fileObj.write(self._MODEL_ENTRY_VERSION)
+        else:
+          fileObj.write(self._DIRECTORY_MODEL_ENTRY_VERSION)
 
       # Create the model definition file
       definitionFilePath = os.path.join(tempModelEntryDirPath,
@@ -312,7 +709,7 @@ class ModelCheckpointMgr(object):
         json.dump(definition, fileObj)
 
       # Get temp model entry tree in consistent state
-      self._fsyncDirectoryTreeRecursively(tempModelEntryDirPath)
+      self._syncDirectoryTree(tempModelEntryDirPath)
 
       # Atomically rename the temp model entry dir as the actual model entry dir
       os.rename(tempModelEntryDirPath, modelEntryDirPath)
@@ -360,6 +757,8 @@ class ModelCheckpointMgr(object):
       integral component of the checkpoint. It may later be retrieved separately
       via ModelCheckpointMgr.loadCheckpointAttributes()
 
+    :returns: number of bytes in the files of the new checkpoint
+
     :raises: ModelNotFound if model's entry doesn't exit in the checkpoint
       archive
     """
@@ -386,13 +785,27 @@ class ModelCheckpointMgr(object):
         json.dump(attributes, fileObj)
 
       # Save the model
-      model.save(
-        saveModelDir=os.path.join(
-          tempCheckpointStoreDirPath,
-          self._CHECKPOINT_INSTANCE_DIR_NAME))
+      if self._instanceFormat == self._INSTANCE_FORMAT_ARCHIVE:
+        # The model saves itself into a directory, which we then stream into
+        # the archive; only the archive needs to be fsync'ed
+        modelInstanceDirPath = os.path.join(tempRoot,
+                                            self._CHECKPOINT_INSTANCE_DIR_NAME)
+        model.save(saveModelDir=modelInstanceDirPath)
+
+        self._archiveModelInstance(
+          modelInstanceDirPath,
+          os.path.join(tempCheckpointStoreDirPath,
+                       self._CHECKPOINT_INSTANCE_ARCHIVE_NAME))
+      else:
+        model.save(
+          saveModelDir=os.path.join(
+            tempCheckpointStoreDirPath,
+            self._CHECKPOINT_INSTANCE_DIR_NAME))
 
       # Get temp checkpoint store tree in consistent state
-      self._fsyncDirectoryTreeRecursively(tempCheckpointStoreDirPath)
+      self._syncDirectoryTree(tempCheckpointStoreDirPath)
+
+      numBytes = self._getDirectoryTreeSize(tempCheckpointStoreDirPath)
 
       # Atomically rename the temp checkpoint store dir into model entry dir
       newCheckpointStoreDirPath = os.path.join(
@@ -440,8 +853,11 @@ class ModelCheckpointMgr(object):
       shutil.rmtree(tempRoot)
 
     self._logger.info(
-      "{TAG:MCKPT.SAVE} Saved model=%s: duration=%ss; directory=%s",
-      modelID, time.time() - startTime, newCheckpointStoreDirPath)
+      "{TAG:MCKPT.SAVE} Saved model=%s: duration=%ss; numBytes=%s; "
+      "directory=%s", modelID, time.time() - startTime, numBytes,
+      newCheckpointStoreDirPath)
+
+    return numBytes
 
 
   def load(self, modelID):
@@ -459,10 +875,9 @@ class ModelCheckpointMgr(object):
 
     checkpointStoreDirPath = self._getCurrentCheckpointRealPath(modelID)
 
-    modelInstanceDirPath = os.path.join(checkpointStoreDirPath,
-                                        self._CHECKPOINT_INSTANCE_DIR_NAME)
-
-    model = ModelFactory.loadFromCheckpoint(modelInstanceDirPath)
+    with self._openModelInstanceDir(checkpointStoreDirPath) as (
+        modelInstanceDirPath):
+      model = ModelFactory.loadFromCheckpoint(modelInstanceDirPath)
 
     self._logger.info(
       "{TAG:MCKPT.LOAD} Loaded model=%s: duration=%ss; directory=%s",
@@ -471,6 +886,130 @@ class ModelCheckpointMgr(object):
     return model
 
 
+  def _archiveModelInstance(self, modelInstanceDirPath, archiveFilePath):
+    """ Write the model instance directory to a new archive file as a
+    gzip-compressed tar stream
+
+    :param modelInstanceDirPath: path of the directory generated by the
+      model's save()
+    :param archiveFilePath: path of the archive file to create
+    """
+    with open(archiveFilePath, "wb") as fileObj:
+      # NOTE: mtime=0 keeps the archive of the same model instance identical
+      # from save to save
+      with gzip.GzipFile(filename="", mode="wb",
+                         compresslevel=self._archiveCompressionLevel,
+                         fileobj=fileObj, mtime=0) as gzipFile:
+        with tarfile.open(fileobj=gzipFile, mode="w|") as tar:
+          tar.add(modelInstanceDirPath,
+                  arcname=self._CHECKPOINT_INSTANCE_DIR_NAME)
+
+
+  @contextmanager
+  def _openModelInstanceDir(self, checkpointStoreDirPath):
+    """ Context manager that provides the path of the model instance directory
+    of the given checkpoint store for the duration of the context; extracts the
+    model instance archive into a temp directory, if the store has one.
+
+    :param checkpointStoreDirPath: path of the checkpoint store directory
+
+    :raises: ModelCheckpointCorrupted if the archive fails verification
+    """
+    archiveFilePath = os.path.join(checkpointStoreDirPath,
+                                   self._CHECKPOINT_INSTANCE_ARCHIVE_NAME)
+    if not os.path.exists(archiveFilePath):
+      # Model instance directory from a "2.0" model entry
+      yield os.path.join(checkpointStoreDirPath,
+                         self._CHECKPOINT_INSTANCE_DIR_NAME)
+      return
+
+    tempRoot = tempfile.mkdtemp(prefix=self._CHECKPOINT_INSTANCE_DIR_NAME,
+                                dir=self._scratchDir)
+    try:
+      self._extractModelInstanceArchive(archiveFilePath, tempRoot)
+
+      yield os.path.join(tempRoot, self._CHECKPOINT_INSTANCE_DIR_NAME)
+    finally:
+      shutil.rmtree(tempRoot)
+
+
+  def _extractModelInstanceArchive(self, archiveFilePath, destDirPath):
+    """ Extract the model instance archive in a single sequential pass,
+    verifying its integrity
+
+    :param archiveFilePath: path of the model instance archive file
+    :param destDirPath: path of the directory to extract into
+
+    :raises: ModelCheckpointCorrupted if the archive fails verification
+    """
+    def checkMembers(tar):
+      for member in tar:
+        memberPath = os.path.normpath(member.name)
+        if (not (member.isfile() or member.isdir()) or
+            os.path.isabs(memberPath) or
+            memberPath.split(os.sep)[0] != self._CHECKPOINT_INSTANCE_DIR_NAME):
+          raise ModelCheckpointCorrupted(
+            "Unexpected member=%r in model instance archive=%s" %
+            (member.name, archiveFilePath))
+        yield member
+
+    with open(archiveFilePath, "rb") as fileObj:
+      try:
+        gzipFile = gzip.GzipFile(fileobj=fileObj, mode="rb")
+        with tarfile.open(fileobj=gzipFile, mode="r|") as tar:
+          tar.extractall(destDirPath, members=checkMembers(tar))
+
+        # The tar reader stops at the end-of-archive marker; read through the
+        # end of the gzip stream for GzipFile to verify the CRC-32 and length
+        while gzipFile.read(self._ARCHIVE_READ_CHUNK_SIZE):
+          pass
+      except (IOError, EOFError, zlib.error, tarfile.TarError) as e:
+        raise ModelCheckpointCorrupted(
+          "Failed to read model instance archive=%s: %r" %
+          (archiveFilePath, e))
+
+    if not os.path.isdir(os.path.join(destDirPath,
+                                      self._CHECKPOINT_INSTANCE_DIR_NAME)):
+      raise ModelCheckpointCorrupted(
+        "Model instance directory not found in archive=%s" %
+        (archiveFilePath,))
+
+
+  def prefetch(self, modelID):
+    """ Advise the kernel to read the model's current checkpoint into the page
+    cache asynchronously, so that a subsequent load() doesn't have to wait for
+    the disk. Returns without waiting for the reads.
+
+    param modelID: unique model ID
+
+    retval: number of bytes in the checkpoint's files
+
+    raises:
+      ModelNotFound if the model checkpoint hasn't been saved yet or if this
+        model's entry doesn't exist in the checkpoint archive
+    """
+    checkpointStoreDirPath = self._getCurrentCheckpointRealPath(modelID)
+
+    numBytes = 0
+    for (parentPath, _dirNames, fileNames) in os.walk(checkpointStoreDirPath):
+      for fileName in fileNames:
+        try:
+          fd = os.open(os.path.join(parentPath, fileName), os.O_RDONLY)
+        except OSError as e:
+          if e.errno == errno.ENOENT:
+            # A concurrent save replaced the checkpoint store
+            continue
+          raise
+
+        try:
+          numBytes += os.fstat(fd).st_size
+          _fadviseWillNeed(fd)
+        finally:
+          os.close(fd)
+
+    return numBytes
+
+
   def updateCheckpointAttributes(self, modelID, attributes):
     """ Update model checkpoint attributes
 
@@ -555,11 +1094,12 @@ class ModelCheckpointMgr(object):
 
     tempRoot = tempfile.mkdtemp(prefix=destModelID, dir=self._scratchDir)
     try:
-      # Copy the source model entry to destination entry in temp tree
+      # Recreate the source model entry as destination entry in temp tree,
+      # sharing rather than copying its files where possible
       tempModelEntryDirPath = os.path.join(tempRoot, destModelID)
-      shutil.copytree(srcModelEntryDirPath,
-                      tempModelEntryDirPath,
-                      symlinks=True)
+      unsharedFilePaths, counts = self._shareDirectoryTree(
+        srcModelEntryDirPath,
+        tempModelEntryDirPath)
 
       # Fix up the checkpoint store link, if present
       tempStoreSymlinkPath = os.path.join(tempModelEntryDirPath,
@@ -573,7 +1113,7 @@ class ModelCheckpointMgr(object):
           tempStoreSymlinkPath)
 
       # Get temp model entry tree in consistent state
-      self._fsyncDirectoryTreeRecursively(tempModelEntryDirPath)
+      self._syncClonedDirectoryTree(tempModelEntryDirPath, unsharedFilePaths)
 
       # Atomically relocate the temp model entry tree to the model archive
       os.rename(tempModelEntryDirPath, destModelEntryDirPath)
@@ -586,8 +1126,10 @@ class ModelCheckpointMgr(object):
 
     self._logger.info(
       "{TAG:MCKPT.CLONE} "
-      "Cloned srcModel=%s to destModel=%s: duration=%ss; directory=%s",
-      modelID, destModelID, time.time() - startTime, destModelEntryDirPath)
+      "Cloned srcModel=%s to destModel=%s: duration=%ss; numLinked=%d; "
+      "numReflinked=%d; numCopied=%d; directory=%s",
+      modelID, destModelID, time.time() - startTime, counts["link"],
+      counts["reflink"], counts["copy"], destModelEntryDirPath)
 
 
   def remove(self, modelID):
@@ -0,0 +1,178 @@
+# ----------------------------------------------------------------------
+# Numenta Platform for Intelligent Computing (NuPIC)
+# Copyright (C) 2015, Numenta, Inc.  Unless you have purchased from
+# Numenta, Inc. a separate commercial license for this software code, the
+# following terms and conditions apply:
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero Public License for more details.
+#
+# You should have received a copy of the GNU Affero Public License
+# along with this program.  If not, see http://www.gnu.org/licenses.
+#
+# http://numenta.org/licenses/
+# ----------------------------------------------------------------------
+
+"""
+This module implements CheckpointPrefetcher, which SwapController uses to warm
+the page cache with the checkpoints of models that are about to be scheduled,
+so that their ModelRunners don't have to cold-read them from disk.
+"""
+
+import Queue
+import threading
+import time
+
+from nta.utils.error_handling import logExceptions
+
+from htmengine import htmengine_logging
+from htmengine.model_checkpoint_mgr.model_checkpoint_mgr import (
+  ModelCheckpointMgr,
+  ModelNotFound)
+
+
+
+_MODULE_NAME = "htmengine.model_swapper.checkpoint_prefetcher"
+
+
+
+def _getLogger():
+  return htmengine_logging.getExtendedLogger(_MODULE_NAME)
+
+
+
+class CheckpointPrefetcher(object):
+  """ Issues read-ahead hints for model checkpoints from a background thread
+  and keeps track of how many started models found their checkpoint prefetched:
+
+    hit - the read-ahead hint was issued before the model started
+    late - prefetch was requested, but the hint wasn't issued by the time the
+      model started
+    miss - prefetch wasn't requested for the model before it started
+  """
+
+  # Values returned by noteModelStarted
+  HIT = "hit"
+  LATE = "late"
+  MISS = "miss"
+
+
+  def __init__(self):
+    self._logger = _getLogger()
+
+    self._mutex = threading.Lock()
+
+    # Map of modelIDs of models for which prefetch was requested to True once
+    # the read-ahead hint was issued, False until then
+    self._prefetchedMap = dict()
+
+    # Model IDs of requested prefetches; None requests the thread to stop
+    self._requestQ = Queue.Queue()
+
+    # Statistics
+    self._numHits = 0
+    self._numLate = 0
+    self._numMisses = 0
+    self._numPrefetches = 0
+    self._numBytesPrefetched = 0
+    self._totalPrefetchSec = 0.0
+
+    self._prefetchThread = threading.Thread(target=self._runPrefetchThread,
+                                            name="checkpoint-prefetcher")
+    # Allow process to exit even if thread is still running
+    self._prefetchThread.setDaemon(True)
+    self._prefetchThread.start()
+
+
+  def close(self):
+    """ Stop the prefetch thread and log statistics """
+    self._requestQ.put(None)
+    self._prefetchThread.join()
+
+    self._logger.info(
+      "{TAG:SWAP.PREFETCH.STATS} numHits=%s; numLate=%s; numMisses=%s; "
+      "numPrefetches=%s; numBytesPrefetched=%s; totalPrefetchSec=%.3f",
+      self._numHits, self._numLate, self._numMisses, self._numPrefetches,
+      self._numBytesPrefetched, self._totalPrefetchSec)
+
+
+  def requestPrefetch(self, modelID):
+    """ [thread-safe; non-blocking] Request prefetch of the model's current
+    checkpoint, unless already requested since the model last started
+
+    :param modelID: model ID
+    """
+    with self._mutex:
+      if modelID in self._prefetchedMap:
+        return
+
+      self._prefetchedMap[modelID] = False
+
+    self._requestQ.put(modelID)
+
+
+  def noteModelStarted(self, modelID):
+    """ [thread-safe] Account for the start of the given model
+
+    :param modelID: model ID
+
+    :returns: one of CheckpointPrefetcher.HIT, LATE, or MISS
+    """
+    with self._mutex:
+      prefetched = self._prefetchedMap.pop(modelID, None)
+
+      if prefetched is None:
+        self._numMisses += 1
+        return self.MISS
+      elif prefetched:
+        self._numHits += 1
+        return self.HIT
+      else:
+        self._numLate += 1
+        return self.LATE
+
+
+  @logExceptions(_getLogger())
+  def _runPrefetchThread(self):
+    checkpointMgr = ModelCheckpointMgr()
+
+    while True:
+      modelID = self._requestQ.get()
+      if modelID is None:
+        break
+
+      with self._mutex:
+        if modelID not in self._prefetchedMap:
+          # The model started before we got to it
+          continue
+
+      startTime = time.time()
+      try:
+        numBytes = checkpointMgr.prefetch(modelID)
+      except ModelNotFound:
+        # The model hasn't been checkpointed yet
+        numBytes = 0
+      except Exception:  # pylint: disable=W0703
+        # Prefetch is only an optimization
+        self._logger.exception("Checkpoint prefetch failed for model=%s",
+                               modelID)
+        numBytes = 0
+      duration = time.time() - startTime
+
+      with self._mutex:
+        if modelID in self._prefetchedMap:
+          self._prefetchedMap[modelID] = True
+
+        self._numPrefetches += 1
+        self._numBytesPrefetched += numBytes
+        self._totalPrefetchSec += duration
+
+      self._logger.debug(
+        "{TAG:SWAP.PREFETCH.DONE} model=%s; numBytes=%s; duration=%.4fs",
+        modelID, numBytes, duration)
@@ -0,0 +1,114 @@
+# ----------------------------------------------------------------------
+# Numenta Platform for Intelligent Computing (NuPIC)
+# Copyright (C) 2015, Numenta, Inc.  Unless you have purchased from
+# Numenta, Inc. a separate commercial license for this software code, the
+# following terms and conditions apply:
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero Public License for more details.
+#
+# You should have received a copy of the GNU Affero Public License
+# along with this program.  If not, see http://www.gnu.org/licenses.
+#
+# http://numenta.org/licenses/
+# ----------------------------------------------------------------------
+
+"""
+This module implements InputShardDemultiplexer, which SwapController uses when
+the model swapper interface hashes models onto shared input shard queues: it
+moves request batches from the shard queues into the per-model input spools
+that ModelRunners consume from, and lets SwapController know which models have
+new input.
+"""
+
+import threading
+
+from nta.utils.error_handling import abortProgramOnAnyException
+from nta.utils.error_handling import logExceptions
+
+from htmengine import htmengine_logging
+from htmengine.model_swapper.model_swapper_interface import (
+    ModelSwapperInterface)
+
+
+
+_MODULE_NAME = "htmengine.model_swapper.input_shard_demultiplexer"
+
+
+
+def _getLogger():
+  return htmengine_logging.getExtendedLogger(_MODULE_NAME)
+
+
+
+class InputShardDemultiplexer(object):
+  """ Demultiplexes the input shard queues with one thread per shard. Each
+  shard has a single consumer, and each batch is acked in the shard queue only
+  after it's durably spooled, which preserves the order and the at-least-once
+  delivery of each model's batches.
+  """
+
+  _EXIT_CODE_ON_FAILURE_OF_SHARD_THREAD = 1
+
+
+  def __init__(self, numShards, onNewInputTS):
+    """
+    :param numShards: number of input shard queues
+    :param onNewInputTS: thread-safe `NoneType onNewInputTS(modelID)` that's
+      called after a batch is spooled for the model
+    """
+    self._logger = _getLogger()
+
+    self._onNewInputTS = onNewInputTS
+
+    self._shardThreads = tuple(
+      threading.Thread(target=self._runShardThread, args=(shardIndex,),
+                       name="input-shard-demux-%s" % (shardIndex,))
+      for shardIndex in xrange(numShards))
+
+    for thread in self._shardThreads:
+      # Allow process to exit even if thread is still running
+      thread.setDaemon(True)
+
+
+  def start(self):
+    """ Start demultiplexing the input shard queues """
+    with ModelSwapperInterface() as swapperAPI:
+      # Make sure that the shard queues exist before consuming them
+      swapperAPI.initInputShards()
+
+    for thread in self._shardThreads:
+      thread.start()
+
+    self._logger.info("Started demultiplexing numShards=%s",
+                      len(self._shardThreads))
+
+
+  @abortProgramOnAnyException(
+    _EXIT_CODE_ON_FAILURE_OF_SHARD_THREAD,
+    logger=_getLogger())
+  @logExceptions(_getLogger())
+  def _runShardThread(self, shardIndex):
+    """ Move batches from the shard queue into the input spools of their models
+    in the order they were published, using our own ModelSwapperInterface,
+    since its connection can't be shared between threads
+    """
+    with ModelSwapperInterface() as swapperAPI:
+      with swapperAPI.consumeInputShard(shardIndex) as consumer:
+        for msg in consumer:
+          swapperAPI.spoolInputShardMessage(msg)
+
+          # NOTE: if we go down before the ack, the batch is spooled again
+          # right after itself, where ModelRunner detects the duplicate
+          msg.ack()
+
+          self._onNewInputTS(msg.modelID)
+        else:
+          raise Exception("Unexpected termination of consumer loop of input "
+                          "shard=%s" % (shardIndex,))
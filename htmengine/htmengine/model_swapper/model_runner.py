@@ -26,17 +26,26 @@ processes are started by the Model Scheduler service.
 """
 
 import base64
+from collections import deque, OrderedDict
 import cPickle as pickle
 from datetime import datetime
+import json
 import logging
 from optparse import OptionParser
+import os
+import Queue
 import select
 import sys
+import threading
 import time
 import traceback
+import uuid
 
+import psutil
 
-from nupic.data.fieldmeta import FieldMetaInfo
+
+from nupic.data.fieldmeta import (FieldMetaInfo, FieldMetaSpecial,
+                                  FieldMetaType)
 from nupic.data.record_stream import RecordStreamIface
 from nupic.frameworks.opf.modelfactory import ModelFactory
 
@@ -49,6 +58,8 @@ from htmengine.model_checkpoint_mgr import model_checkpoint_mgr
 from htmengine.model_checkpoint_mgr.model_checkpoint_mgr import (
   ModelCheckpointMgr)
 from htmengine.model_swapper import ModelSwapperConfig
+from htmengine.model_swapper.model_template_cache import ModelTemplateCache
+from htmengine.model_swapper.runtime_stats import ModelRunStats
 from htmengine.model_swapper.model_swapper_interface import (
   ModelCommand, ModelCommandResult, ModelInferenceResult, ModelInputRow,
   ModelSwapperInterface)
@@ -64,6 +75,25 @@ def _getLogger():
 
 
 
+def _getProcessRSS():
+  """
+  :returns: resident set size of this process in bytes
+  """
+  return psutil.Process(os.getpid()).get_memory_info().rss
+
+
+
+def _reportToSlotAgent(controlStream, **report):
+  """ Write a report as a JSON line to SlotAgent via the given control stream
+
+  :param controlStream: file object of the control stream
+  :param report: report fields; always includes "modelID"
+  """
+  controlStream.write(json.dumps(report) + "\n")
+  controlStream.flush()
+
+
+
 class _ModelRunnerError(Exception):
   """ Exception with a htmengineerrno error code accessible via the "errno"
   instance variable
@@ -90,26 +120,84 @@ class ModelRunner(object):
   _MAX_TRACEBACK_TAIL = 400
 
 
-  def __init__(self, modelID):
+  def __init__(self, modelID, archiver=None, swapperAPI=None,
+               controlStream=None, resultSubmitter=None):
     """
     :param modelID: model ID; string
+    :param archiver: optional _ModelArchiver instance of the given model, with
+      the model possibly already loaded (used by ResidentModelRunner); if None,
+      a new _ModelArchiver instance will be created.
+    :param swapperAPI: optional ModelSwapperInterface instance owned by the
+      caller; it will not be closed by this ModelRunner. If None, ModelRunner
+      creates its own instance and closes it in close().
+    :param controlStream: optional file object for reporting the model's memory
+      footprint to SlotAgent after the model is loaded and the statistics of
+      the run at the end of the run
+    :param resultSubmitter: optional _ResultSubmitter instance owned by the
+      caller for use in pipelined mode; it will not be closed by this
+      ModelRunner. If None, ModelRunner creates its own instance in pipelined
+      mode and closes it in close().
     """
     self._logger = _getLogger()
 
     self._modelID = modelID
 
-    self._swapperAPI = ModelSwapperInterface()
+    self._controlStream = controlStream
 
-    self._archiver = _ModelArchiver(self._modelID)
+    self._ownsSwapperAPI = swapperAPI is None
+    self._swapperAPI = (ModelSwapperInterface() if swapperAPI is None
+                        else swapperAPI)
+
+    self._archiver = (_ModelArchiver(self._modelID) if archiver is None
+                      else archiver)
 
     # "deleteModel" command handler sets this flag to force our processing
     # loop to terminate
     self._done = False
 
+    # Statistics of this run of the model, reported to SlotAgent at the end of
+    # the run
+    self._runStats = ModelRunStats()
+
     modelSwapperConfig = ModelSwapperConfig()
 
-    self._targetMaxRequestsPerCheckpoint = modelSwapperConfig.getint(
-      "model_runner", "target_requests_per_checkpoint")
+    # Decides when a run of batches is complete, so that the model is
+    # checkpointed and its batches acked
+    self._runLengthPolicy = _RunLengthPolicy.createFromConfig(
+      modelSwapperConfig)
+
+    # When True, full checkpoints are saved by a forked child process while we
+    # continue processing input
+    self._backgroundCheckpoint = modelSwapperConfig.getboolean(
+      "model_runner", "background_checkpoint")
+
+    # While a full checkpoint is being saved in the background, this is a
+    # two-tuple of the consumer and the last request batch of the run covered
+    # by the checkpoint; the batches are acked when the checkpoint completes.
+    # The consumer stays open until then, so that the broker doesn't redeliver
+    # the unacked batches in the meantime.
+    self._pendingCheckpointAck = None
+
+    # When True, the next request batch is read and decoded in the background
+    # while we process the current one, and results are submitted in the
+    # background while we process the following batches
+    self._pipelined = modelSwapperConfig.getboolean("model_runner", "pipelined")
+
+    if self._backgroundCheckpoint and self._pipelined:
+      # The background checkpoint is saved by a child forked from this process,
+      # which would inherit locks (e.g., of logging) held by the pipeline's
+      # threads at the time of the fork
+      raise ValueError("Model swapper background_checkpoint can't be combined "
+                       "with pipelined")
+
+    # _ResultSubmitter instance in pipelined mode; None otherwise
+    self._ownsResultSubmitter = self._pipelined and resultSubmitter is None
+    if self._ownsResultSubmitter:
+      self._resultSubmitter = _ResultSubmitter()
+    elif self._pipelined:
+      self._resultSubmitter = resultSubmitter
+    else:
+      self._resultSubmitter = None
 
     self._profiling = (
       modelSwapperConfig.getboolean("debugging", "profiling") or
@@ -119,6 +207,15 @@ class ModelRunner(object):
       self._logger.info("Profiling is turned on")
 
       self._modelLoadSec = 0
+      self._modelReplaySec = 0
+
+
+  @property
+  def archiver(self):
+    """ The model's _ModelArchiver instance; NOTE: the "deleteModel" command
+    replaces it with a new instance
+    """
+    return self._archiver
 
 
   @property
@@ -166,7 +263,12 @@ class ModelRunner(object):
   def close(self):
     """ Clean up """
     self._logger.debug("%r: Closing...", self)
-    self._swapperAPI.close()
+    try:
+      if self._ownsResultSubmitter:
+        self._resultSubmitter.close()
+    finally:
+      if self._ownsSwapperAPI:
+        self._swapperAPI.close()
 
 
   @logExceptions(_getLogger())
@@ -190,15 +292,17 @@ class ModelRunner(object):
         currentRunNumRequests = 0
         lastRequestBatch = None
 
-        with self._swapperAPI.consumeRequests(
-            modelID=self._modelID, blocking=False) as consumer:
-
+        consumer = self._swapperAPI.consumeRequests(modelID=self._modelID,
+                                                    blocking=False)
+        prefetcher = _BatchPrefetcher(consumer) if self._pipelined else None
+        try:
           if self._profiling:
             batchStartTime = time.time()
 
-          # Process the next run of batches until
-          # self._targetMaxRequestsPerCheckpoint is reached or exceeded
-          for candidateBatch in consumer:
+          # Process the next run of batches until self._runLengthPolicy deems
+          # the run complete
+          for candidateBatch in (consumer if prefetcher is None
+                                 else prefetcher):
             if (candidateBatch.batchID in currentRunBatchIDSet or
                 candidateBatch.batchID in modelCheckpointBatchIDSet):
               self._logger.warn(
@@ -209,6 +313,9 @@ class ModelRunner(object):
               # Make it go away for good
               candidateBatch.ack()
               totalDupBatches += 1
+
+              if prefetcher is not None:
+                prefetcher.prefetchNext()
               continue
 
             # NOTE: lastRequestBatch is used after this loop to ack this and
@@ -224,24 +331,59 @@ class ModelRunner(object):
             currentRunNumRequests += numItems
             totalRequests += numItems
 
+            # NOTE: decided before processing the batch, which updates the
+            # processing cost estimate, so that the prefetch below and the end
+            # of the run agree
+            runComplete = self._runLengthPolicy.isRunComplete(
+              numRequests=currentRunNumRequests,
+              secPerRequestEstimate=(
+                self._archiver.processSecPerRequestEstimate))
+
+            if (prefetcher is not None and not runComplete and
+                not any(isinstance(obj, ModelCommand) for obj in inputObjects)):
+              # Read and decode the next batch while we process this one. NOTE:
+              # we don't read past the end of this run, because a batch that we
+              # read stays unacked while its consumer is open, so a batch
+              # fetched but not processed in this run could be overtaken by
+              # later batches in the next run while this run's consumer awaits
+              # its background checkpoint. Nor do we read ahead of commands,
+              # since their processing may use the message bus connection that
+              # the background read uses (e.g., deleteModel deletes the input
+              # queue being read).
+              prefetcher.prefetchNext()
+
             self._logger.debug(
               "%r: Processing input batch #%s; batch=%s, numItems=%s...",
               self, totalBatches, lastRequestBatch.batchID, numItems)
 
+            procStartTime = time.time()
+            loadSecBefore = self._runStats.loadSec
+
             if self._profiling:
-              procStartTime = time.time()
               self._modelLoadSec = 0
+              self._modelReplaySec = 0
 
             # Process the input batch
             results = self._processInputBatch(inputObjects,
                                               currentRunInputSamples)
 
+            batchProcessSec = (time.time() - procStartTime -
+                               (self._runStats.loadSec - loadSecBefore))
+            self._runStats.numRowsProcessed += sum(
+              1 for obj in inputObjects if isinstance(obj, ModelInputRow))
+            self._runStats.processSec += batchProcessSec
+            self._archiver.noteRequestsProcessed(numItems, batchProcessSec)
+
             # Send results
             if self._profiling:
               submitStartTime = time.time()
 
-            self._swapperAPI.submitResults(modelID=self._modelID,
+            if self._resultSubmitter is not None:
+              self._resultSubmitter.submit(modelID=self._modelID,
                                            results=results)
+            else:
+              self._swapperAPI.submitResults(modelID=self._modelID,
+                                             results=results)
 
             if self._profiling:
               now = time.time()
@@ -256,10 +398,12 @@ class ModelRunner(object):
               self._logger.info(
                 "{TAG:SWAP.MR.BATCH.DONE} model=%s; batch=%s; numItems=%s; "
                 "tailRowID=%s; tailRowTS=%s; duration=%.4fs; "
-                "loadDuration=%.4fs; procDuration=%.4fs; submitDuration=%.4fs; "
+                "loadDuration=%.4fs; replayDuration=%.4fs; "
+                "procDuration=%.4fs; submitDuration=%.4fs; "
                 "totalBatches=%s; totalItems=%s", self._modelID,
                 lastRequestBatch.batchID, len(results), tailRowID,
                 tailRowTimestampISO, now - batchStartTime, self._modelLoadSec,
+                self._modelReplaySec,
                 submitStartTime - procStartTime - self._modelLoadSec,
                 now - submitStartTime, totalBatches, totalRequests)
 
@@ -268,7 +412,7 @@ class ModelRunner(object):
                                  "consumer loop", self)
               break
 
-            if currentRunNumRequests >= self._targetMaxRequestsPerCheckpoint:
+            if runComplete:
               self._logger.debug("End of current run: currentRunNumRequests=%s",
                                  currentRunNumRequests)
               break
@@ -284,26 +428,52 @@ class ModelRunner(object):
 
             modelCheckpointBatchIDSet = currentRunBatchIDSet
 
+            # The model's checkpoints must be saved in order, and the batches
+            # of the previous run must be acked before those of this run
+            self._completeBackgroundCheckpoint()
+
+            savingInBackground = False
+
             # Checkpoint the model.
             if self._model is not None:
 
-              if self._profiling:
-                checkpointStartTime = time.time()
+              checkpointStartTime = time.time()
 
-              self._archiver.saveModel(
+              savingInBackground = self._archiver.saveModel(
                 currentRunBatchIDSet=currentRunBatchIDSet,
-                currentRunInputSamples=currentRunInputSamples)
+                currentRunInputSamples=currentRunInputSamples,
+                background=self._backgroundCheckpoint,
+                childInheritedFiles=(
+                  (self._controlStream,) if self._controlStream is not None
+                  else ()))
+
+              checkpointSec = time.time() - checkpointStartTime
+              self._runStats.numCheckpoints += 1
+              self._runStats.checkpointSec += checkpointSec
+              self._runStats.checkpointBytes += (
+                self._archiver.lastCheckpointNumBytes)
 
               if self._profiling:
                 self._logger.info(
                   "%r: {TAG:SWAP.MR.CHKPT.DONE} currentRunNumRequests=%s; "
-                  "currentRunNumBatches=%s; duration=%.4fs",
-                  self, currentRunNumRequests, len(currentRunBatchIDSet),
-                  time.time() - checkpointStartTime)
-
-            # Ack the last request batch and all unacked batches before it
-            # consumed during this run
-            lastRequestBatch.ack(multiple=True)
+                  "currentRunNumBatches=%s; full=%s; background=%s; "
+                  "duration=%.4fs", self, currentRunNumRequests,
+                  len(currentRunBatchIDSet),
+                  self._archiver.lastCheckpointWasFull, savingInBackground,
+                  checkpointSec)
+
+            if savingInBackground:
+              # Defer the ack until the checkpoint is saved
+              self._pendingCheckpointAck = (consumer, lastRequestBatch)
+            else:
+              # The results must be confirmed before their request batches are
+              # acked
+              if self._resultSubmitter is not None:
+                self._resultSubmitter.flush()
+
+              # Ack the last request batch and all unacked batches before it
+              # consumed during this run
+              lastRequestBatch.ack(multiple=True)
 
           if not self._done:
             # Check if SwapController wants to preempt us (it closes the other
@@ -313,15 +483,62 @@ class ModelRunner(object):
               self._logger.debug("%r: SwapController wants to preempt us, "
                                  "leaving", self)
               self._done = True
+        finally:
+          if prefetcher is not None:
+            prefetcher.close()
+
+          if (self._pendingCheckpointAck is None or
+              self._pendingCheckpointAck[0] is not consumer):
+            consumer.close()
+
+      self._completeBackgroundCheckpoint()
     finally:
       if totalBatches == 0:
         self._logger.warn("%r: zero input batches were processed", self)
 
       self._logger.info(
         "%r: {TAG:SWAP.MR.FINAL.SUMMARY} totalBatches=%s; totalRequests=%s; "
-        "totalDupBatches=%s; duration=%s", self, totalBatches, totalRequests,
-        totalDupBatches, time.time() - startTime)
+        "totalDupBatches=%s; duration=%s; runStats=%r", self, totalBatches,
+        totalRequests, totalDupBatches, time.time() - startTime,
+        self._runStats)
+
+      if self._controlStream is not None:
+        # Let SwapController account for this run of the model
+        _reportToSlotAgent(self._controlStream, modelID=self._modelID,
+                           runtimeStats=self._runStats.toReport())
+
 
+  def _completeBackgroundCheckpoint(self):
+    """ Wait for the full checkpoint that is being saved in the background, if
+    any, and ack the request batches that it covers
+
+    :raises _ModelRunnerError: if the background checkpoint failed; the
+      batches are left unacked for redelivery
+    """
+    if self._pendingCheckpointAck is None:
+      return
+
+    consumer, lastRequestBatch = self._pendingCheckpointAck
+    self._pendingCheckpointAck = None
+
+    try:
+      waitStartTime = time.time()
+
+      self._archiver.completeBackgroundSave()
+
+      waitSec = time.time() - waitStartTime
+      self._runStats.checkpointSec += waitSec
+
+      if self._profiling:
+        self._logger.info("%r: {TAG:SWAP.MR.CHKPT.BG.WAIT} duration=%.4fs",
+                          self, waitSec)
+
+      if self._resultSubmitter is not None:
+        self._resultSubmitter.flush()
+
+      lastRequestBatch.ack(multiple=True)
+    finally:
+      consumer.close()
 
 
   def _processInputBatch(self, inputObjects, currentRunInputSamples):
@@ -358,6 +575,11 @@ class ModelRunner(object):
     Returns: a ModelCommandResult instance
     """
     self._logger.info("%r: Processing model command: %r", self, command)
+
+    # Commands may delete, clone, or replace the model's checkpoint, so let a
+    # background checkpoint complete first
+    self._completeBackgroundCheckpoint()
+
     try:
       if command.method == "defineModel":
         return self._defineModel(command)
@@ -476,6 +698,9 @@ class ModelRunner(object):
                           "suppressing error", self._modelID)
       # Clean up model's resources in ModelSwapperInterface
       self._swapperAPI.cleanUpAfterModelDeletion(self._modelID)
+
+      # Let SwapController forget the model
+      self._runStats.numDeletions += 1
     finally:
       self._archiver = _ModelArchiver(self._modelID)
       self._done = True
@@ -507,11 +732,15 @@ class ModelRunner(object):
 
       currentRunInputSamples.append(row.data)
 
+      timestamp, value = self._inputRowEncoder.getTimestampAndValue(row.data)
+
       return ModelInferenceResult(
         rowID=row.rowID,
         status=0,
         anomalyScore=r.inferences["anomalyScore"],
-        multiStepBestPredictions=r.inferences.get("multiStepBestPredictions"))
+        multiStepBestPredictions=r.inferences.get("multiStepBestPredictions"),
+        timestamp=timestamp,
+        value=value)
 
     except (Exception, _ModelRunnerError) as e:  # pylint: disable=W0703
       self._logger.exception("%r: Inference failed for row=%r", self, row)
@@ -529,18 +758,319 @@ class ModelRunner(object):
   def _loadModel(self):
     """ Load the model and construct the input row encoder
 
-    Side-effect: self._model and self._inputRowEncoder are loaded;
-      self._modelLoadSec is set if profiling is turned on
+    Side-effect: self._model and self._inputRowEncoder are loaded; the load is
+      accounted in self._runStats; self._modelLoadSec and self._modelReplaySec
+      are set if profiling is turned on
     """
     if self._model is None:
-      if self._profiling:
-        startTime = time.time()
+      startTime = time.time()
 
       # Load the model
       self._archiver.loadModel()
 
+      loadSec = time.time() - startTime
+      self._runStats.numLoads += 1
+      self._runStats.loadSec += loadSec
+      self._runStats.replaySec += self._archiver.lastReplaySec
+      self._runStats.numReplayedSamples += self._archiver.lastReplayNumSamples
+
       if self._profiling:
-        self._modelLoadSec = time.time() - startTime
+        self._modelLoadSec = loadSec
+        self._modelReplaySec = self._archiver.lastReplaySec
+
+        self._logger.info(
+          "%r: {TAG:SWAP.MR.LOAD.DONE} duration=%.4fs; replayDuration=%.4fs; "
+          "numReplayedSamples=%s", self, self._modelLoadSec,
+          self._modelReplaySec, self._archiver.lastReplayNumSamples)
+
+      if self._controlStream is not None:
+        # Let SwapController know how much memory the model costs us
+        _reportToSlotAgent(self._controlStream, modelID=self._modelID,
+                           memoryFootprint=_getProcessRSS())
+
+
+
+class _RunLengthPolicy(object):
+  """ Decides when ModelRunner's run of request batches is complete, so that it
+  checkpoints the model and acks the batches.
+
+  By default, a run is complete when it reaches the target number of requests.
+  With the adaptive checkpoint interval, a run is complete when its estimated
+  processing time reaches the target interval, so that models whose requests
+  are cheap checkpoint less often per request, while expensive ones still
+  checkpoint, and respond to preemption, in bounded time. The target number of
+  requests applies until the model's processing cost is measured.
+  """
+
+  def __init__(self, targetRequests, adaptive=False, targetIntervalSec=None,
+               maxRequests=None):
+    """
+    :param targetRequests: number of requests that complete a run; may be
+      exceeded, since all requests in a batch are processed
+    :param adaptive: True to complete runs by estimated processing time
+    :param targetIntervalSec: estimated processing seconds that complete a run
+      in adaptive mode
+    :param maxRequests: number of requests that complete a run in adaptive mode
+      regardless of the estimate
+    """
+    self._targetRequests = targetRequests
+    self._adaptive = adaptive
+    self._targetIntervalSec = targetIntervalSec
+    self._maxRequests = maxRequests
+
+
+  @classmethod
+  def createFromConfig(cls, config):
+    """
+    :param config: ModelSwapperConfig instance
+    """
+    adaptive = config.getboolean("model_runner",
+                                 "adaptive_checkpoint_interval")
+    return cls(
+      targetRequests=config.getint("model_runner",
+                                   "target_requests_per_checkpoint"),
+      adaptive=adaptive,
+      targetIntervalSec=(
+        config.getfloat("model_runner", "target_checkpoint_interval_sec")
+        if adaptive else None),
+      maxRequests=(
+        config.getint("model_runner", "max_requests_per_checkpoint")
+        if adaptive else None))
+
+
+  def isRunComplete(self, numRequests, secPerRequestEstimate):
+    """
+    :param numRequests: number of requests in the run so far, including the
+      batch about to be processed
+    :param secPerRequestEstimate: estimated duration of processing one
+      request; None if not measured yet
+
+    :returns: True if the run is complete after the batch about to be
+      processed
+    """
+    if self._adaptive:
+      if numRequests >= self._maxRequests:
+        return True
+
+      if secPerRequestEstimate is not None:
+        return numRequests * secPerRequestEstimate >= self._targetIntervalSec
+
+    return numRequests >= self._targetRequests
+
+
+
+class _PrefetchFailure(object):
+  """ Marks a failed background read of _BatchPrefetcher; carries the
+  three-tuple from sys.exc_info() for re-raising in the consuming thread
+  """
+
+  __slots__ = ("excInfo",)
+
+  def __init__(self, excInfo):
+    self.excInfo = excInfo
+
+
+
+class _BatchPrefetcher(object):
+  """ Reads and decodes request batches from a request consumer ahead of
+  ModelRunner in a background thread. An instance is an iterable that yields
+  the consumer's _ConsumedRequestBatch instances in order. A batch is read in
+  the background only when requested via prefetchNext(); otherwise, the
+  iterable reads it synchronously.
+
+  Acks of the yielded batches are serialized with the background reads, since
+  the consumer's message bus channel can't be used by two threads at once.
+  """
+
+  def __init__(self, consumer):
+    """
+    :param consumer: request consumer from ModelSwapperInterface.consumeRequests
+    """
+    # Serializes the use of the consumer between threads
+    self._consumerLock = threading.Lock()
+
+    self._batchIter = iter(consumer)
+
+    # True while a background read was requested and not yet taken
+    self._prefetchPending = False
+
+    # Read requests to the thread: True to read the next batch; None to exit
+    self._requestQ = Queue.Queue()
+
+    # Results of the background reads: _ConsumedRequestBatch instance; None at
+    # the end of batches; or _PrefetchFailure instance on failure
+    self._resultQ = Queue.Queue()
+
+    self._thread = threading.Thread(target=self._runPrefetchThread,
+                                    name="mrunner-batch-prefetch")
+    # Allow process to exit even if thread is still running
+    self._thread.setDaemon(True)
+    self._thread.start()
+
+
+  def __iter__(self):
+    while True:
+      if self._prefetchPending:
+        self._prefetchPending = False
+        result = self._resultQ.get()
+        if isinstance(result, _PrefetchFailure):
+          raise result.excInfo[0], result.excInfo[1], result.excInfo[2]
+        batch = result
+      else:
+        batch = self._readNext()
+
+      if batch is None:
+        break
+
+      originalAck = batch.ack
+
+      def ack(multiple=False, originalAck=originalAck):
+        with self._consumerLock:
+          originalAck(multiple=multiple)
+
+      yield batch._replace(ack=ack)
+
+
+  def prefetchNext(self):
+    """ Start reading the next batch in the background, unless already started
+    """
+    if not self._prefetchPending:
+      self._prefetchPending = True
+      self._requestQ.put(True)
+
+
+  def close(self):
+    """ Stop the background thread; NOTE: doesn't close the consumer """
+    self._requestQ.put(None)
+    self._thread.join()
+
+
+  def _readNext(self):
+    with self._consumerLock:
+      return next(self._batchIter, None)
+
+
+  @logExceptions(_getLogger())
+  def _runPrefetchThread(self):
+    while self._requestQ.get() is not None:
+      try:
+        result = self._readNext()
+      except Exception:  # pylint: disable=W0703
+        result = _PrefetchFailure(sys.exc_info())
+
+      self._resultQ.put(result)
+
+
+
+class _ResultSubmitter(object):
+  """ Submits result batches in order from a background thread via its own
+  ModelSwapperInterface instance, so that ModelRunner can process the next
+  input batch while the message bus confirms the results of the previous ones.
+  """
+
+  def __init__(self):
+    self._logger = _getLogger()
+
+    self._cond = threading.Condition()
+
+    # Queue of (modelID, results) waiting to be submitted; guarded by _cond
+    self._pending = deque()
+
+    # Counts of queued and confirmed result batches; guarded by _cond
+    self._numQueued = 0
+    self._numConfirmed = 0
+
+    # Exception that failed a submission; once set, nothing more is submitted
+    self._error = None
+
+    self._closing = False
+
+    self._thread = threading.Thread(target=self._runSubmitterThread,
+                                    name="mrunner-result-submitter")
+    # Allow process to exit even if thread is still running
+    self._thread.setDaemon(True)
+    self._thread.start()
+
+
+  def submit(self, modelID, results):
+    """ Queue a batch of results for submission; non-blocking
+
+    :param modelID: a string that uniquely identifies the model
+    :param results: a sequence of ModelCommandResult and/or
+      ModelInferenceResult instances
+
+    :raises _ModelRunnerError: if a previous submission failed
+    """
+    with self._cond:
+      self._raiseIfFailed()
+
+      self._pending.append((modelID, results))
+      self._numQueued += 1
+      self._cond.notifyAll()
+
+
+  def flush(self):
+    """ Wait until all result batches queued so far are confirmed by the
+    message bus
+
+    :raises _ModelRunnerError: if a submission failed
+    """
+    with self._cond:
+      target = self._numQueued
+      while self._numConfirmed < target and self._error is None:
+        self._cond.wait()
+
+      self._raiseIfFailed()
+
+
+  def close(self):
+    """ Submit the remaining results and stop the background thread """
+    with self._cond:
+      self._closing = True
+      self._cond.notifyAll()
+
+    self._thread.join()
+
+
+  def _raiseIfFailed(self):
+    """ [must be called with self._cond held] """
+    if self._error is not None:
+      raise _ModelRunnerError(
+        errno=htmengineerrno.ERR,
+        msg="Submission of results failed: %r" % (self._error,))
+
+
+  @logExceptions(_getLogger())
+  def _runSubmitterThread(self):
+    swapperAPI = ModelSwapperInterface()
+    try:
+      while True:
+        with self._cond:
+          while not self._pending and not self._closing:
+            self._cond.wait()
+
+          if not self._pending:
+            break
+
+          modelID, results = self._pending[0]
+
+        try:
+          swapperAPI.submitResults(modelID=modelID, results=results)
+        except Exception as e:  # pylint: disable=W0703
+          self._logger.exception("Failed to submit results of model=%s",
+                                 modelID)
+          with self._cond:
+            self._error = e
+            self._pending.clear()
+            self._cond.notifyAll()
+          break
+
+        with self._cond:
+          self._pending.popleft()
+          self._numConfirmed += 1
+          self._cond.notifyAll()
+    finally:
+      swapperAPI.close()
 
 
 
@@ -559,15 +1089,53 @@ class _ModelArchiver(object):
   # model checkpoint for new input. The value is in pickle string format.
   _INPUT_SAMPLES_SINCE_CHECKPOINT_ATTR_NAME = "incrementalInputSamples"
 
+  # Name of the attribute that is stored as an integral component of the
+  # checkpoint when checkpoint tokens are tracked. It's a unique string that is
+  # regenerated by every checkpoint, which allows a ResidentModelRunner to
+  # detect that its in-memory model was superseded by a checkpoint from another
+  # ModelRunner.
+  _CHECKPOINT_TOKEN_ATTR_NAME = "checkpointToken"
+
+  # Name of the attribute that is stored as an integral component of the
+  # checkpoint when adaptive checkpointing or the adaptive checkpoint interval
+  # is enabled. It's a dict of the model's measured cost estimates:
+  # "fullSaveSec" - duration of a full checkpoint; "replaySecPerSample" -
+  # duration of replaying one incremental input sample when loading the model;
+  # "processSecPerRequest" - duration of processing one input request.
+  _CHECKPOINT_COSTS_ATTR_NAME = "checkpointCosts"
+
   _MAX_INCREMENTAL_CHECKPOINT_DATA_ROWS = 100
 
+  # Weight of a new measurement in the exponential moving averages of the
+  # checkpoint cost estimates
+  _COST_ESTIMATE_WEIGHT = 0.3
+
 
-  def __init__(self, modelID):
+  def __init__(self, modelID, durabilityIntervalSec=None,
+               trackCheckpointToken=False):
     """
     :param modelID: model ID; string
+    :param durabilityIntervalSec: if not None, saveModel performs a full
+      checkpoint when at least this many seconds elapsed since the model was
+      loaded from or saved to a full checkpoint; otherwise, only the number of
+      incremental input samples triggers a full checkpoint.
+    :param trackCheckpointToken: True to store a new checkpoint token with each
+      checkpoint for use by isCheckpointCurrent()
     """
     self._modelID = modelID
 
+    self._durabilityIntervalSec = durabilityIntervalSec
+
+    self._trackCheckpointToken = trackCheckpointToken
+
+    # Checkpoint token of the model's checkpoint that corresponds to the
+    # in-memory model; None if not tracked or not known
+    self._checkpointToken = None
+
+    # Time (time.time()) when the model was loaded from or saved to a full
+    # checkpoint
+    self._lastFullCheckpointTime = None
+
     # The model object from OPF ModelFactory; set up by the loadModel() method
     self._model = None
 
@@ -586,6 +1154,49 @@ class _ModelArchiver(object):
     # Input data samples that have accumulated since last full checkpoint
     self._inputSamplesSinceLastFullCheckpointCache = None
 
+    # Process ID of the child process that is saving a full checkpoint in the
+    # background; None if none
+    self._backgroundSavePid = None
+
+    # When True, saveModel performs a full checkpoint instead of an incremental
+    # one when replaying the incremental input samples on the next load is
+    # expected to cost at least as much as a full checkpoint
+    self._adaptiveCheckpoint = ModelSwapperConfig().getboolean(
+      "model_runner", "adaptive_checkpoint")
+
+    # When True, the processing cost estimate is saved with the checkpoint for
+    # the run length policy of the next ModelRunner of the model
+    self._adaptiveCheckpointInterval = ModelSwapperConfig().getboolean(
+      "model_runner", "adaptive_checkpoint_interval")
+
+    # ModelTemplateCache instance for creating the model from params when it
+    # has no checkpoint yet; None to create it via ModelFactory
+    if ModelSwapperConfig().getboolean("model_runner", "model_template_cache"):
+      self._modelTemplateCache = ModelTemplateCache(
+        ModelSwapperConfig().get("model_runner", "model_template_dir"))
+    else:
+      self._modelTemplateCache = None
+
+    # Estimated duration of a full checkpoint of the model and of replaying
+    # one incremental input sample; None until measured
+    self._fullSaveSecEstimate = None
+    self._replaySecPerSampleEstimate = None
+
+    # Estimated duration of processing one input request; None until measured
+    self._processSecPerRequestEstimate = None
+
+    # Duration of replaying incremental input samples and their number in the
+    # most recent loadModel
+    self._lastReplaySec = 0.0
+    self._lastReplayNumSamples = 0
+
+    # True if the most recent saveModel performed a full checkpoint
+    self._lastCheckpointWasFull = False
+
+    # Number of bytes of the checkpoint saved by the most recent saveModel; 0
+    # if it was incremental or saved in the background
+    self._lastCheckpointNumBytes = 0
+
 
   @property
   def model(self):
@@ -614,6 +1225,69 @@ class _ModelArchiver(object):
     return self._checkpointMgr
 
 
+  @property
+  def lastReplaySec(self):
+    """ Duration of replaying incremental input samples in the most recent
+    loadModel
+    """
+    return self._lastReplaySec
+
+
+  @property
+  def lastReplayNumSamples(self):
+    """ Number of incremental input samples replayed in the most recent
+    loadModel
+    """
+    return self._lastReplayNumSamples
+
+
+  @property
+  def lastCheckpointWasFull(self):
+    """ True if the most recent saveModel performed a full checkpoint """
+    return self._lastCheckpointWasFull
+
+
+  @property
+  def processSecPerRequestEstimate(self):
+    """ Estimated duration of processing one input request; None until
+    measured
+    """
+    return self._processSecPerRequestEstimate
+
+
+  @property
+  def lastCheckpointNumBytes(self):
+    """ Number of bytes of the full checkpoint saved synchronously by the most
+    recent saveModel; 0 if the checkpoint was incremental or saved in the
+    background
+    """
+    return self._lastCheckpointNumBytes
+
+
+  def isCheckpointCurrent(self):
+    """ Check whether the model's latest checkpoint is the one that was last
+    loaded or saved via this _ModelArchiver instance. Requires
+    trackCheckpointToken=True.
+
+    :returns: True if the model's latest checkpoint was produced by this
+      instance; False if the model's checkpoint was superseded or the model was
+      deleted, in which case the in-memory model is stale and must not be used.
+    """
+    assert self._trackCheckpointToken
+
+    if self._checkpointToken is None:
+      return False
+
+    try:
+      checkpointAttributes = self._checkpointMgr.loadCheckpointAttributes(
+        self._modelID)
+    except model_checkpoint_mgr.ModelNotFound:
+      return False
+
+    return (checkpointAttributes.get(self._CHECKPOINT_TOKEN_ATTR_NAME) ==
+            self._checkpointToken)
+
+
   @property
   def _inputSamplesSinceLastFullCheckpoint(self):
     if self._inputSamplesSinceLastFullCheckpointCache is None:
@@ -661,6 +1335,16 @@ class _ModelArchiver(object):
       self._modelCheckpointBatchIDSetCache = set(
         checkpointAttributes[self._BATCH_IDS_CHECKPOINT_ATTR_NAME])
 
+      if self._trackCheckpointToken:
+        self._checkpointToken = checkpointAttributes.get(
+          self._CHECKPOINT_TOKEN_ATTR_NAME)
+
+      costs = checkpointAttributes.get(self._CHECKPOINT_COSTS_ATTR_NAME)
+      if costs:
+        self._fullSaveSecEstimate = costs.get("fullSaveSec")
+        self._replaySecPerSampleEstimate = costs.get("replaySecPerSample")
+        self._processSecPerRequestEstimate = costs.get("processSecPerRequest")
+
       inputSamples = checkpointAttributes.get(
         self._INPUT_SAMPLES_SINCE_CHECKPOINT_ATTR_NAME)
       if inputSamples:
@@ -685,6 +1369,7 @@ class _ModelArchiver(object):
     try:
       self._model = self._checkpointMgr.load(self._modelID)
       self._hasCheckpoint = True
+      self._lastFullCheckpointTime = time.time()
     except model_checkpoint_mgr.ModelNotFound:
       # So, we didn't have a checkpoint... try to create our model from model
       # definition params
@@ -700,8 +1385,12 @@ class _ModelArchiver(object):
       # TODO: when creating the model from params, do we need to call
       #   its model.setFieldStatistics() method? And where will the
       #   fieldStats come from, anyway?
-      self._model = ModelFactory.create(
-        modelConfig=modelParams["modelConfig"])
+      if self._modelTemplateCache is not None:
+        self._model = self._modelTemplateCache.createModel(
+          modelParams["modelConfig"])
+      else:
+        self._model = ModelFactory.create(
+          modelConfig=modelParams["modelConfig"])
       self._model.enableLearning()
       self._model.enableInference(modelParams["inferenceArgs"])
 
@@ -726,6 +1415,8 @@ class _ModelArchiver(object):
     self._inputRowEncoder = _InputRowEncoder(fieldsMeta=inputFieldsMeta)
 
     # If the checkpoint was incremental, feed the cached data into the model
+    replayStartTime = time.time()
+
     for inputSample in self._inputSamplesSinceLastFullCheckpoint:
       # Convert a flat input sample into a format that is consumable by an OPF
       # model
@@ -734,8 +1425,17 @@ class _ModelArchiver(object):
       # Infer
       self._model.run(self._inputRowEncoder.getNextRecordDict())
 
+    self._lastReplaySec = time.time() - replayStartTime
+    self._lastReplayNumSamples = len(self._inputSamplesSinceLastFullCheckpoint)
 
-  def saveModel(self, currentRunBatchIDSet, currentRunInputSamples):
+    if self._lastReplayNumSamples:
+      self._replaySecPerSampleEstimate = self._updateCostEstimate(
+        self._replaySecPerSampleEstimate,
+        self._lastReplaySec / self._lastReplayNumSamples)
+
+
+  def saveModel(self, currentRunBatchIDSet, currentRunInputSamples,
+                background=False, childInheritedFiles=()):
     """
     :param currentRunBatchIDSet: a set of batch ids to be saved in model
       checkpoint attributes
@@ -743,26 +1443,62 @@ class _ModelArchiver(object):
     :param currentRunInputSamples: a sequence of model input data sample objects
       for incremental checkpoint; will be saved in checkpoint attributes if an
       incremental checkpoint is performed.
+
+    :param background: if True, a full checkpoint is saved by a forked child
+      process from a copy-on-write snapshot of the model, and this method
+      returns without waiting for it; the caller MUST call
+      completeBackgroundSave() before relying on the checkpoint's durability.
+      NOTE: the process MUST NOT be running other threads at the time, since
+      the child might inherit the locks that they hold.
+
+    :param childInheritedFiles: file objects whose descriptors the forked child
+      closes without flushing before saving the checkpoint (e.g., the control
+      stream to SlotAgent)
+
+    :returns: True if a full checkpoint is being saved in the background; False
+      if the checkpoint was saved before returning
     """
+    # Checkpoints must be saved in order
+    self.completeBackgroundSave()
+
+    self._lastCheckpointNumBytes = 0
+
     if self._model is not None:
       self._modelCheckpointBatchIDSetCache = currentRunBatchIDSet.copy()
 
       if (not self._hasCheckpoint or
-          (len(self._inputSamplesSinceLastFullCheckpoint) +
-           len(currentRunInputSamples)) >
-          self._MAX_INCREMENTAL_CHECKPOINT_DATA_ROWS):
+          self._isFullCheckpointDue(
+            len(self._inputSamplesSinceLastFullCheckpoint) +
+            len(currentRunInputSamples))):
         # Perform a full checkpoint
         self._inputSamplesSinceLastFullCheckpointCache = []
+        self._lastCheckpointWasFull = True
 
-        self._checkpointMgr.save(
-          modelID=self._modelID, model=self._model,
-          attributes={
-            self._BATCH_IDS_CHECKPOINT_ATTR_NAME:
-              list(self._modelCheckpointBatchIDSetCache)})
+        attributes = self._addCheckpointCosts(self._addCheckpointToken({
+          self._BATCH_IDS_CHECKPOINT_ATTR_NAME:
+            list(self._modelCheckpointBatchIDSetCache)}))
+
+        if background:
+          # NOTE: the save duration isn't measured, since the child does the
+          # work; the estimate from synchronous saves remains in effect
+          self._saveFullCheckpointInBackground(attributes,
+                                               childInheritedFiles)
+        else:
+          saveStartTime = time.time()
+
+          self._lastCheckpointNumBytes = self._checkpointMgr.save(
+            modelID=self._modelID, model=self._model, attributes=attributes)
+
+          self._fullSaveSecEstimate = self._updateCostEstimate(
+            self._fullSaveSecEstimate, time.time() - saveStartTime)
 
         self._hasCheckpoint = True
+        self._lastFullCheckpointTime = time.time()
+
+        return background
       else:
         # Perform an incremental checkpoint
+        self._lastCheckpointWasFull = False
         self._inputSamplesSinceLastFullCheckpoint.extend(currentRunInputSamples)
         attributes = {
           self._BATCH_IDS_CHECKPOINT_ATTR_NAME:
@@ -772,8 +1508,160 @@ class _ModelArchiver(object):
             self._encodeDataSamples(self._inputSamplesSinceLastFullCheckpoint)
         }
 
-        self._checkpointMgr.updateCheckpointAttributes(self._modelID,
-                                                       attributes)
+        self._checkpointMgr.updateCheckpointAttributes(
+          self._modelID,
+          self._addCheckpointCosts(self._addCheckpointToken(attributes)))
+
+    return False
+
+
+  def _isFullCheckpointDue(self, numIncrementalSamples):
+    """ Decide whether a model that has a checkpoint needs a full checkpoint
+    rather than an incremental one
+
+    :param numIncrementalSamples: number of input samples since the last full
+      checkpoint that an incremental checkpoint would have to store, all of
+      which would be replayed when the model is loaded next time
+
+    :returns: True if a full checkpoint should be performed
+    """
+    if numIncrementalSamples > self._MAX_INCREMENTAL_CHECKPOINT_DATA_ROWS:
+      return True
+
+    if self._isDurabilityIntervalExpired():
+      return True
+
+    if (self._adaptiveCheckpoint and
+        self._fullSaveSecEstimate is not None and
+        self._replaySecPerSampleEstimate is not None):
+      # Replay would cost at least as much as saving the model now
+      return (numIncrementalSamples * self._replaySecPerSampleEstimate >=
+              self._fullSaveSecEstimate)
+
+    return False
+
+
+  @classmethod
+  def _updateCostEstimate(cls, estimate, measurement):
+    """
+    :returns: the cost estimate updated with the new measurement
+    """
+    if estimate is None:
+      return measurement
+
+    return (cls._COST_ESTIMATE_WEIGHT * measurement +
+            (1 - cls._COST_ESTIMATE_WEIGHT) * estimate)
+
+
+  def noteRequestsProcessed(self, numRequests, durationSec):
+    """ Update the processing cost estimate with a measurement
+
+    :param numRequests: number of input requests processed
+    :param durationSec: duration of processing them, excluding model load
+    """
+    if numRequests:
+      self._processSecPerRequestEstimate = self._updateCostEstimate(
+        self._processSecPerRequestEstimate, float(durationSec) / numRequests)
+
+
+  def completeBackgroundSave(self):
+    """ Wait for the full checkpoint that is being saved in the background, if
+    any
+
+    :raises _ModelRunnerError: if the background checkpoint failed
+    """
+    if self._backgroundSavePid is None:
+      return
+
+    pid = self._backgroundSavePid
+    self._backgroundSavePid = None
+
+    _, status = os.waitpid(pid, 0)
+
+    if not (os.WIFEXITED(status) and os.WEXITSTATUS(status) == 0):
+      # The in-memory model no longer corresponds to any checkpoint
+      self._checkpointToken = None
+
+      raise _ModelRunnerError(
+        errno=htmengineerrno.ERR,
+        msg="Background checkpoint of modelID=%s failed with status=%s" % (
+          self._modelID, status))
+
+
+  def _saveFullCheckpointInBackground(self, attributes, childInheritedFiles):
+    """ Fork a child process that saves a full checkpoint of the model's
+    copy-on-write snapshot, and return without waiting for it
+
+    :param attributes: checkpoint attributes dict
+    :param childInheritedFiles: file objects whose descriptors the child closes
+    """
+    pid = os.fork()
+
+    if pid == 0:
+      # Child: save the checkpoint and exit without running the parent's
+      # cleanup handlers or touching its message bus connections
+      exitStatus = 1
+      try:
+        # Close the descriptors directly, since flushing the file objects would
+        # duplicate the parent's buffered output
+        for fileObj in childInheritedFiles:
+          os.close(fileObj.fileno())
+
+        self._checkpointMgr.save(
+          modelID=self._modelID, model=self._model, attributes=attributes)
+        exitStatus = 0
+      except Exception:  # pylint: disable=W0703
+        _getLogger().exception("Background checkpoint of model=%s failed",
+                               self._modelID)
+      finally:
+        os._exit(exitStatus)  # pylint: disable=W0212
+
+    self._backgroundSavePid = pid
+
+
+  def _isDurabilityIntervalExpired(self):
+    """
+    :returns: True if the durability interval is in effect and at least that
+      much time elapsed since the model was loaded from or saved to a full
+      checkpoint
+    """
+    return (self._durabilityIntervalSec is not None and
+            self._lastFullCheckpointTime is not None and
+            (time.time() - self._lastFullCheckpointTime >=
+             self._durabilityIntervalSec))
+
+
+  def _addCheckpointCosts(self, attributes):
+    """ Add the cost estimates to the given checkpoint attributes if adaptive
+    checkpointing or the adaptive checkpoint interval is enabled, so that they
+    carry over to the next ModelRunner of the model
+
+    :param attributes: dict of checkpoint attributes; modified in place
+
+    :returns: the attributes dict
+    """
+    if self._adaptiveCheckpoint or self._adaptiveCheckpointInterval:
+      attributes[self._CHECKPOINT_COSTS_ATTR_NAME] = {
+        "fullSaveSec": self._fullSaveSecEstimate,
+        "replaySecPerSample": self._replaySecPerSampleEstimate,
+        "processSecPerRequest": self._processSecPerRequestEstimate}
+
+    return attributes
+
+
+  def _addCheckpointToken(self, attributes):
+    """ Add a new checkpoint token to the given checkpoint attributes if
+    checkpoint tokens are tracked
+
+    :param attributes: dict of checkpoint attributes; modified in place
+
+    :returns: the attributes dict
+    """
+    if self._trackCheckpointToken:
+      self._checkpointToken = uuid.uuid1().hex
+      attributes[self._CHECKPOINT_TOKEN_ATTR_NAME] = self._checkpointToken
+
+    return attributes
 
 
 
@@ -791,6 +1679,36 @@ class _InputRowEncoder(RecordStreamIface):
     self._fieldNames = tuple(f.name for f in fieldsMeta)
     self._row = None
 
+    # Positions of the timestamp and value fields in rows of scalar metric
+    # models, whose input schema consists of a timestamp field and one numeric
+    # field; None for other input schemas
+    self._timestampIndex = None
+    self._valueIndex = None
+
+    timestampIndexes = [i for i, f in enumerate(fieldsMeta)
+                        if f.special == FieldMetaSpecial.timestamp]
+    if len(fieldsMeta) == 2 and len(timestampIndexes) == 1:
+      valueIndex = 1 - timestampIndexes[0]
+      if fieldsMeta[valueIndex].type in (FieldMetaType.float,
+                                         FieldMetaType.integer):
+        self._timestampIndex = timestampIndexes[0]
+        self._valueIndex = valueIndex
+
+
+  def getTimestampAndValue(self, record):
+    """ Extract the timestamp and metric value from an input row for inclusion
+    in its inference result
+
+    :param record: flat input row as passed to appendRecord()
+
+    :returns: a (timestamp, value) pair; (None, None) if the input schema isn't
+      that of a scalar metric model
+    """
+    if self._timestampIndex is None:
+      return None, None
+
+    return record[self._timestampIndex], record[self._valueIndex]
+
 
   def appendRecord(self, record, inputRef=None):
     """ [ABC method implementation] Saves the record in the underlying storage.
@@ -856,6 +1774,228 @@ class _InputRowEncoder(RecordStreamIface):
 
 
 
+class ResidentModelRunner(object):
+  """ Long-lived ModelRunner process mode used by SlotAgent when resident model
+  runners are enabled.
+
+  Runs the models that SlotAgent assigns to it via stdin one at a time and keeps
+  a memory-bounded LRU cache of recently-run models, so that a model that runs
+  here again doesn't need to be reloaded from its checkpoint. Each run still
+  ends with a (normally incremental) checkpoint before its input batches are
+  acked, so evicting a model from the cache doesn't require checkpointing it;
+  full checkpoints are taken when the durability interval expires or too many
+  incremental input samples accumulate.
+
+  Protocol: SlotAgent writes a model ID line to stdin to run that model, and a
+  STOP_MODEL_COMMAND line to preempt the current model; ResidentModelRunner
+  writes a JSON line {"modelID": <modelID>, "memoryFootprint": <bytes>} to the
+  control stream when the model is loaded or found in memory,
+  {"modelID": <modelID>, "runtimeStats": <ModelRunStats report>} at the end of
+  the model's run, and {"modelID": <modelID>, "done": true,
+  "evictedModelIDs": [<modelID>, ...]} when it's done running the model, where
+  evictedModelIDs lists the models that left the cache during the run,
+  including the model itself if it wasn't cached (e.g., it was deleted).
+  STOP_MODEL_COMMAND lines received while idle are stale and are ignored.
+  ResidentModelRunner exits when stdin is closed.
+  """
+
+  # Preemption request line from SlotAgent
+  STOP_MODEL_COMMAND = "stop"
+
+
+  def __init__(self, controlStream):
+    """
+    :param controlStream: file object for reporting memory footprint, runtime
+      statistics, and model completion to SlotAgent
+    """
+    self._logger = _getLogger()
+
+    self._controlStream = controlStream
+
+    config = ModelSwapperConfig()
+
+    self._maxModelCacheBytes = config.getint(
+      "resident_model_runner", "model_cache_mb") * 1024 * 1024
+
+    self._durabilityIntervalSec = config.getint(
+      "resident_model_runner", "durability_interval_sec")
+
+    # ModelSwapperInterface instance shared by the ModelRunner instances that
+    # we create
+    self._swapperAPI = ModelSwapperInterface()
+
+    # _ResultSubmitter instance shared by the ModelRunner instances that we
+    # create in pipelined mode; None otherwise
+    self._resultSubmitter = (
+      _ResultSubmitter() if config.getboolean("model_runner", "pipelined")
+      else None)
+
+    # LRU cache of models: modelID -> _CachedModel; most-recently-used last
+    self._modelCache = OrderedDict()
+
+    self._numCacheHits = 0
+    self._numCacheMisses = 0
+
+
+  def __enter__(self):
+    return self
+
+
+  def __exit__(self, _excType, _excVal, _excTb):
+    self.close()
+    return False
+
+
+  def close(self):
+    """ Clean up """
+    self._modelCache.clear()
+    try:
+      if self._resultSubmitter is not None:
+        self._resultSubmitter.close()
+    finally:
+      self._swapperAPI.close()
+
+
+  def run(self):
+    """ Run the models that SlotAgent assigns to us until stdin is closed """
+    while True:
+      line = _readLineFromStdin()
+      if line is None:
+        self._logger.info(
+          "{TAG:SWAP.MR.RESIDENT.EXIT} numCacheHits=%s; numCacheMisses=%s",
+          self._numCacheHits, self._numCacheMisses)
+        break
+
+      if line == self.STOP_MODEL_COMMAND:
+        # The model already finished before we got to the preemption request
+        continue
+
+      modelID = line
+      evictedModelIDs = self._runModel(modelID)
+
+      _reportToSlotAgent(self._controlStream, modelID=modelID, done=True,
+                         evictedModelIDs=evictedModelIDs)
+
+
+  def _runModel(self, modelID):
+    """ Run the given model, reusing the in-memory model if it's current, and
+    update the model cache
+
+    :returns: list of IDs of the models that are no longer in the model cache
+      as the result of the run
+    """
+    archiver = None
+    footprint = 0
+
+    cachedModel = self._modelCache.pop(modelID, None)
+    if cachedModel is not None:
+      if cachedModel.archiver.isCheckpointCurrent():
+        archiver = cachedModel.archiver
+        footprint = cachedModel.footprint
+        self._numCacheHits += 1
+      else:
+        self._logger.info(
+          "{TAG:SWAP.MR.RESIDENT.STALE} model=%s was checkpointed elsewhere "
+          "or deleted; discarding in-memory model", modelID)
+
+    if archiver is None:
+      archiver = _ModelArchiver(
+        modelID,
+        durabilityIntervalSec=self._durabilityIntervalSec,
+        trackCheckpointToken=True)
+      self._numCacheMisses += 1
+    else:
+      # NOTE: ModelRunner reports memory footprint only when it loads the model
+      _reportToSlotAgent(self._controlStream, modelID=modelID,
+                         memoryFootprint=_getProcessRSS())
+
+    rssBefore = _getProcessRSS()
+
+    with ModelRunner(modelID=modelID, archiver=archiver,
+                     swapperAPI=self._swapperAPI,
+                     controlStream=self._controlStream,
+                     resultSubmitter=self._resultSubmitter) as runner:
+      runner.run()
+
+      # NOTE: the "deleteModel" command replaces the archiver
+      archiver = runner.archiver
+
+    if archiver.model is None:
+      # Model was deleted or had no input to load it for
+      return [modelID]
+
+    if not footprint:
+      footprint = max(_getProcessRSS() - rssBefore, 0)
+
+    self._modelCache[modelID] = _CachedModel(archiver=archiver,
+                                             footprint=footprint)
+
+    return self._evictModelsIfNeeded()
+
+
+  def _evictModelsIfNeeded(self):
+    """ Evict least-recently-used models until the estimated memory footprint
+    of the cached models fits within the model cache budget
+
+    :returns: list of IDs of the evicted models
+    """
+    evictedModelIDs = []
+
+    totalFootprint = sum(m.footprint for m in self._modelCache.itervalues())
+
+    while self._modelCache and totalFootprint > self._maxModelCacheBytes:
+      modelID, cachedModel = self._modelCache.popitem(last=False)
+      totalFootprint -= cachedModel.footprint
+      evictedModelIDs.append(modelID)
+
+      self._logger.debug(
+        "{TAG:SWAP.MR.RESIDENT.EVICT} model=%s; footprint=%s; "
+        "numCachedModels=%s; totalFootprint=%s", modelID,
+        cachedModel.footprint, len(self._modelCache), totalFootprint)
+
+    return evictedModelIDs
+
+
+
+class _CachedModel(object):
+  """ A model kept in memory by ResidentModelRunner """
+
+  __slots__ = ("archiver", "footprint")
+
+
+  def __init__(self, archiver, footprint):
+    # _ModelArchiver instance with the model loaded
+    self.archiver = archiver
+
+    # Estimated memory footprint of the model in bytes; NOTE: estimated from
+    # the growth of our process's RSS while the model was loaded, so it's
+    # approximate.
+    self.footprint = footprint
+
+
+
+def _readLineFromStdin():
+  """ Read a control line, such as the model ID line that ModelRunnerPool sends
+  to a warm ModelRunner.
+
+  NOTE: we read stdin unbuffered one byte at a time so as not to consume
+  anything beyond the line; ModelRunner.run relies on select() to detect when
+  SwapController requests preemption via stdin.
+
+  :returns: the line without the line separator; None if stdin was closed
+    before a complete line was received
+  """
+  chars = []
+  while True:
+    c = os.read(sys.stdin.fileno(), 1)
+    if not c:
+      return None
+    if c == "\n":
+      return "".join(chars)
+    chars.append(c)
+
+
+
 def main(argv):
   # Parse command line options
   helpString = (
@@ -867,14 +2007,51 @@ def main(argv):
                     help=("The Model ID string that identifies the model to "
                           "run."))
 
+  parser.add_option("--warm", action="store_true", default=False,
+                    help=("Start as a warm ModelRunner in a ModelRunnerPool: "
+                          "wait for the model ID to arrive on stdin, then "
+                          "run that model."))
+
+  parser.add_option("--resident", action="store_true", default=False,
+                    help=("Start as a ResidentModelRunner that runs the models "
+                          "assigned to it via stdin one at a time and reports "
+                          "completion on stdout."))
+
   (options, args) = parser.parse_args(argv[1:])
   if len(args) > 0:
     parser.error("Didn't expect any positional args (%r)." % (args,))
 
-  if options.modelID is None:
+  # Reserve the original stdout for reporting to SlotAgent, and redirect
+  # anything else that might be written to stdout to stderr
+  controlStream = os.fdopen(os.dup(sys.stdout.fileno()), "w")
+  os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+
+  if options.resident:
+    if options.modelID is not None or options.warm:
+      parser.error("--resident is mutually exclusive with --modelID and "
+                   "--warm")
+
+    with ResidentModelRunner(controlStream=controlStream) as runner:
+      runner.run()
+    return
+
+  if options.warm:
+    if options.modelID is not None:
+      parser.error("--modelID and --warm are mutually exclusive")
+
+    options.modelID = _readLineFromStdin()
+    if options.modelID is None:
+      _getLogger().debug("Warm ModelRunner released without a model")
+      return
+
+    _getLogger().info("{TAG:SWAP.MR.WARM.ASSIGNED} model=%s",
+                      options.modelID)
+
+  elif options.modelID is None:
     parser.error("Missing model ID in command-line")
 
-  with ModelRunner(modelID=options.modelID) as runner:
+  with ModelRunner(modelID=options.modelID,
+                   controlStream=controlStream) as runner:
     runner.run()
 
 
@@ -0,0 +1,243 @@
+# ----------------------------------------------------------------------
+# Numenta Platform for Intelligent Computing (NuPIC)
+# Copyright (C) 2015, Numenta, Inc.  Unless you have purchased from
+# Numenta, Inc. a separate commercial license for this software code, the
+# following terms and conditions apply:
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero Public License for more details.
+#
+# You should have received a copy of the GNU Affero Public License
+# along with this program.  If not, see http://www.gnu.org/licenses.
+#
+# http://numenta.org/licenses/
+# ----------------------------------------------------------------------
+
+"""
+This module implements ModelRunnerPool, which maintains a pool of pre-started
+"warm" ModelRunner processes for use by SlotAgent.
+
+A warm ModelRunner process has already paid the cost of starting the Python
+interpreter and importing OPF and ModelCheckpointMgr; it waits for a model ID
+on its stdin and then proceeds just like a ModelRunner process that was started
+with the --modelID command-line option.
+"""
+
+from collections import deque
+import subprocess
+import sys
+import threading
+
+from nta.utils.error_handling import logExceptions
+
+from htmengine import htmengine_logging
+
+
+
+_MODULE_NAME = "htmengine.model_swapper.model_runner_pool"
+
+
+
+def _getLogger():
+  return htmengine_logging.getExtendedLogger(_MODULE_NAME)
+
+
+
+def _startModelRunnerProcess(args):
+  """ Start a ModelRunner process with the given ModelRunner command-line args
+
+  :param args: sequence of ModelRunner command-line args
+
+  :returns: subprocess.Popen instance of the ModelRunner process; its stdout
+    carries the ModelRunner's reports to SlotAgent
+  """
+  return subprocess.Popen(
+    args=[sys.executable,
+          "-m", "htmengine.model_swapper.model_runner"] + list(args),
+    stdin=subprocess.PIPE,
+    stdout=subprocess.PIPE,
+    close_fds=True)
+
+
+
+class ModelRunnerPool(object):
+  """ Must be initialized only from the main thread and used only as a
+  singleton!
+
+  Maintains a pool of warm ModelRunner processes and hands them out to
+  SlotAgents. When the pool is not initialized or runs dry, a new ModelRunner
+  process is started the traditional way.
+  """
+
+
+  _singleton = None
+
+
+  @classmethod
+  def init(cls, poolSize):
+    """ [WARNING: NOT thread-safe] Initialize ModelRunnerPool. MUST be called
+    from the MAIN thread of the process before starting any SlotAgents.
+
+    :param poolSize: number of warm ModelRunner processes to maintain; 0
+      disables the pool.
+    """
+    if cls._singleton is None and poolSize > 0:
+      cls._singleton = cls(poolSize=poolSize)
+
+
+  @classmethod
+  def close(cls):
+    """ [WARNING: NOT thread-safe] Stop all idle warm ModelRunner processes and
+    destroy the pool singleton; subsequent ModelRunner processes will be started
+    the traditional way until the pool is initialized again.
+    """
+    if cls._singleton is not None:
+      try:
+        cls._singleton._close()  # pylint: disable=W0212
+      finally:
+        cls._singleton = None
+
+
+  @classmethod
+  def startModelRunner(cls, modelID):
+    """ [thread-safe] Start a ModelRunner process for the given model, using a
+    warm ModelRunner process from the pool if one is available.
+
+    :param modelID: model ID; string
+
+    :returns: subprocess.Popen instance of the ModelRunner process; the caller
+      may signal preemption by closing its stdin and MUST read its stdout
+    """
+    pool = cls._singleton
+    if pool is not None:
+      process = pool._assignModel(modelID)  # pylint: disable=W0212
+      if process is not None:
+        return process
+
+    return _startModelRunnerProcess(["--modelID=" + str(modelID)])
+
+
+  def __init__(self, poolSize):
+    assert self._singleton is None
+
+    self._logger = _getLogger()
+
+    self._poolSize = poolSize
+
+    self._mutex = threading.Lock()
+    self._replenishCondition = threading.Condition(self._mutex)
+
+    # subprocess.Popen instances of idle warm ModelRunner processes
+    self._idleProcesses = deque()
+
+    self._closed = False
+
+    # Statistics for profiling
+    self._numWarmStarts = 0
+    self._numColdStarts = 0
+
+    self._replenishThread = threading.Thread(target=self._runReplenishThread,
+                                             name="model-runner-pool")
+    # Allow process to exit even if thread is still running
+    self._replenishThread.setDaemon(True)
+    self._replenishThread.start()
+
+    self._logger.info("{TAG:SWAP.POOL.INIT} poolSize=%s", poolSize)
+
+
+  def _close(self):
+    with self._mutex:
+      self._closed = True
+      idleProcesses = tuple(self._idleProcesses)
+      self._idleProcesses.clear()
+      self._replenishCondition.notify()
+
+    self._replenishThread.join()
+
+    # Warm ModelRunner processes exit without running a model when they read
+    # EOF on stdin
+    for process in idleProcesses:
+      try:
+        process.stdin.close()
+      except IOError:
+        pass
+
+    for process in idleProcesses:
+      process.wait()
+
+    self._logger.info(
+      "{TAG:SWAP.POOL.CLOSED} numWarmStarts=%s; numColdStarts=%s",
+      self._numWarmStarts, self._numColdStarts)
+
+
+  def _assignModel(self, modelID):
+    """ Hand the model ID to an idle warm ModelRunner process
+
+    :returns: subprocess.Popen instance of the ModelRunner process that was
+      assigned the model; None if no healthy warm process was available
+    """
+    while True:
+      with self._mutex:
+        if not self._idleProcesses:
+          self._numColdStarts += 1
+          self._logger.debug(
+            "{TAG:SWAP.POOL.MISS} model=%s; numColdStarts=%s",
+            modelID, self._numColdStarts)
+          self._replenishCondition.notify()
+          return None
+
+        process = self._idleProcesses.popleft()
+        self._replenishCondition.notify()
+
+      if process.poll() is not None:
+        self._logger.error(
+          "Warm ModelRunner pid=%s exited prematurely with returnCode=%s",
+          process.pid, process.returncode)
+        continue
+
+      try:
+        process.stdin.write(str(modelID) + "\n")
+        process.stdin.flush()
+      except IOError:
+        self._logger.exception(
+          "IO error handing model=%s to warm ModelRunner pid=%s", modelID,
+          process.pid)
+        process.wait()
+        continue
+
+      with self._mutex:
+        self._numWarmStarts += 1
+
+      self._logger.debug("{TAG:SWAP.POOL.HIT} model=%s; pid=%s",
+                         modelID, process.pid)
+      return process
+
+
+  @logExceptions(_getLogger())
+  def _runReplenishThread(self):
+    while True:
+      with self._mutex:
+        while (not self._closed and
+               len(self._idleProcesses) >= self._poolSize):
+          self._replenishCondition.wait()
+
+        if self._closed:
+          break
+
+      # Start the new process outside of the lock so that SlotAgents may
+      # continue to draw on the remaining idle processes meanwhile
+      process = _startModelRunnerProcess(["--warm"])
+
+      with self._mutex:
+        if self._closed:
+          process.stdin.close()
+          process.wait()
+          break
+
+        self._idleProcesses.append(process)
@@ -40,6 +40,8 @@ import psutil
 
 from htmengine.htmengine_logging import getExtendedLogger, getStandardLogPrefix
 
+from htmengine.model_swapper import ModelSwapperConfig
+from htmengine.model_swapper.model_runner_pool import ModelRunnerPool
 from htmengine.model_swapper.swap_controller import SwapController
 
 from nta.utils.error_handling import abortProgramOnAnyException
@@ -217,10 +219,18 @@ def main(argv):
 
   options.concurrency = _getDefaultConcurrency(options.concurrency)
 
-  needRestart = True
-  while needRestart:
-    with ModelSchedulerService(concurrency=options.concurrency) as scheduler:
-      needRestart = scheduler.run()
+  # Pre-start warm ModelRunner processes to hide interpreter start-up and
+  # import costs from model swaps
+  ModelRunnerPool.init(
+    poolSize=ModelSwapperConfig().getint("model_runner_pool",
+                                         "warm_pool_size"))
+  try:
+    needRestart = True
+    while needRestart:
+      with ModelSchedulerService(concurrency=options.concurrency) as scheduler:
+        needRestart = scheduler.run()
+  finally:
+    ModelRunnerPool.close()
 
 
 
@@ -69,17 +69,30 @@ App layer reads results::
 
 from collections import namedtuple
 import datetime
+import errno
+import heapq
+from itertools import groupby, izip, repeat
 import json
 import numbers
+import os
+import shutil
+import tempfile
+import threading
+import time
 import types
 import uuid
 import weakref
+import zlib
+
+import msgpack
 
 from htmengine import exceptions as engine_exceptions
 from htmengine import htmengine_logging
 from htmengine.model_swapper import ModelSwapperConfig
 
+from nta.utils import makeDirectoryFromAbsolutePath
 from nta.utils.date_time_utils import epochFromNaiveUTCDatetime
+from nta.utils.error_handling import logExceptions
 from nta.utils import message_bus_connector
 from nta.utils.message_bus_connector import MessageBusConnector
 
@@ -375,13 +388,16 @@ class ModelInferenceResult(_ModelRequestResultBase):
 
   # NOTE: also used by serialization/deserialization in our base class
   __slots__ = ("rowID", "status", "anomalyScore", "errorMessage",
-               "multiStepBestPredictions")
+               "multiStepBestPredictions", "timestamp", "value")
 
-  __STATE_SIGNATURE__ = "iRv2"
+  __STATE_SIGNATURE__ = "iRv3"
+
+  # Position of the timestamp in the state returned by __getstate__
+  _TIMESTAMP_STATE_INDEX = 1 + __slots__.index("timestamp")
 
 
   def __init__(self, rowID, status, errorMessage=None, anomalyScore=None,
-               multiStepBestPredictions=None):
+               multiStepBestPredictions=None, timestamp=None, value=None):
     """ A model inference result instance must fall under one of two use cases:
     1) It encapsulates a standard result in which case it contains an anomaly
     score and/or multi-step best predictions. Additionally, the error message
@@ -405,6 +421,11 @@ class ModelInferenceResult(_ModelRequestResultBase):
      of htmengine/adapters/datasource/model_spec_schema.json for details.
     :type multiStepBestPredictions: dict or None
     :param errorMessage: error message if status is non-zero, omit otherwise
+    :param timestamp: optional timestamp of the corresponding input record, so
+      that consumers don't have to look it up by rowID; None if not provided
+    :type timestamp: datetime.datetime or None
+    :param value: optional metric value of the corresponding input record;
+      None if not provided
     """
     assert isinstance(status, (int, long)), (
       "Expected int or long as status, but got: " + repr(status))
@@ -429,11 +450,18 @@ class ModelInferenceResult(_ModelRequestResultBase):
         "Unexpected multiStepBestPredictions with non-zero status: " +
         repr(errorMessage))
 
+    assert timestamp is None or isinstance(timestamp, datetime.datetime), (
+      "Expected None or datetime as timestamp, but got: " + repr(timestamp))
+    assert value is None or isinstance(value, numbers.Number), (
+      "Expected None or numeric value, but got: " + repr(value))
+
     self.rowID = rowID
     self.status = status
     self.anomalyScore = anomalyScore
     self.multiStepBestPredictions = multiStepBestPredictions
     self.errorMessage = errorMessage
+    self.timestamp = timestamp
+    self.value = value
 
 
   def __repr__(self):
@@ -447,6 +475,26 @@ class ModelInferenceResult(_ModelRequestResultBase):
                                           self.status, reprBody)
 
 
+  def __getstate__(self):
+    """ Return state suitable for serializing; used by BatchPackager. NOTE: we
+    extend the default serializer because of special handling of datetime.
+    """
+    state = super(ModelInferenceResult, self).__getstate__()
+    if self.timestamp is not None:
+      state[self._TIMESTAMP_STATE_INDEX] = ModelInputRow._encodeDateTime(
+        self.timestamp)
+    return state
+
+
+  def __setstate__(self, state):
+    """ Initialize instance members from given state that was produced by
+    __getstate__; used by BatchPackager.
+    """
+    super(ModelInferenceResult, self).__setstate__(state)
+    if self.timestamp is not None:
+      self.timestamp = ModelInputRow._decodeDateTime(self.timestamp)
+
+
 
 @_ModelRequestResultBase.__register__
 class ModelInferenceResultLegacyV1(ModelInferenceResult):
@@ -458,30 +506,82 @@ class ModelInferenceResultLegacyV1(ModelInferenceResult):
     # Convert STATE_SIGNATURE
     self.__STATE_SIGNATURE__ = ModelInferenceResult.__STATE_SIGNATURE__
 
-    # Convert STATE_SIGNATURE and append None for multiStepBestPredictions value
+    # Convert STATE_SIGNATURE and append None for multiStepBestPredictions,
+    # timestamp and value
     super(ModelInferenceResultLegacyV1, self).__setstate__(
-      [ModelInferenceResult.__STATE_SIGNATURE__] + state[1:] + [None])
+      [ModelInferenceResult.__STATE_SIGNATURE__] + state[1:] +
+      [None, None, None])
+
+
+
+@_ModelRequestResultBase.__register__
+class ModelInferenceResultLegacyV2(ModelInferenceResult):
+  """ Legacy model inference result lacking the input timestamp and value. """
+
+  __STATE_SIGNATURE__ = "iRv2"
+
+  def __setstate__(self, state):
+    # Convert STATE_SIGNATURE
+    self.__STATE_SIGNATURE__ = ModelInferenceResult.__STATE_SIGNATURE__
+
+    # Convert STATE_SIGNATURE and append None for timestamp and value
+    super(ModelInferenceResultLegacyV2, self).__setstate__(
+      [ModelInferenceResult.__STATE_SIGNATURE__] + state[1:] + [None, None])
 
 
 
 class BatchPackager(object):
-  """ Serializer for a batch of request or result items """
+  """ Serializer for a batch of request or result items
+
+  Two batch formats are supported:
+
+    json - a JSON list of the items' __getstate__() values; the batch state
+      contains no newlines
+
+    msgpack - a binary header followed by a msgpack-encoded list of segments.
+      Each segment holds a run of consecutive items of the same kind: runs of
+      ModelInputRow and ModelInferenceResult items are stored column by column
+      (rowIDs, timestamps, values, etc.), and other items as a JSON list of
+      their __getstate__() values. The batch state may contain any bytes,
+      including newlines.
+
+  unmarshal() detects the format of the given batch state, so consumers can
+  read batches in either format, such as messages that were published before
+  the producer's format was changed.
+  """
+
+  # Values of the batchFormat arg of marshal() and of the "batch_format"
+  # option in the interface_bus section of model-swapper.conf
+  FORMAT_JSON = "json"
+  FORMAT_MSGPACK = "msgpack"
+
+  # Header of msgpack batch states: a magic prefix that can't start a JSON
+  # batch state followed by the format version
+  _MSGPACK_MAGIC = "\x00mb"
+  _MSGPACK_VERSION = 1
+  _MSGPACK_HEADER = _MSGPACK_MAGIC + chr(_MSGPACK_VERSION)
+
+  # Signature of msgpack segments that hold the JSON-encoded states of items
+  # other than ModelInputRow and ModelInferenceResult
+  _JSON_SEGMENT_SIGNATURE = "json"
 
 
   @classmethod
-  def marshal(cls, batch):
+  def marshal(cls, batch, batchFormat=FORMAT_JSON):
     """ Marshal a batch of requests or results into a string, preserving their
     order.
 
-    The returned string will NOT contain newlines (this makes it convenient to
-    write newline-separated batches to stdout and readline them from stdin
-    without further escaping of the data).
+    With the default "json" batchFormat, the returned string will NOT contain
+    newlines (this makes it convenient to write newline-separated batches to
+    stdout and readline them from stdin without further escaping of the data).
 
     :param batch: a sequence of requests or results (instances of ModelCommand,
       ModelInputRow)
 
+    :param batchFormat: BatchPackager.FORMAT_JSON or
+      BatchPackager.FORMAT_MSGPACK
+
     :returns: a string representation of the given batch, preserving order.
-      The returned string will not contain newlines.
 
     Example::
 
@@ -493,7 +593,12 @@ class BatchPackager(object):
 
     And similar for a result batch.
     """
-    return json.dumps([o.__getstate__() for o in batch])
+    if batchFormat == cls.FORMAT_JSON:
+      return json.dumps([o.__getstate__() for o in batch])
+    elif batchFormat == cls.FORMAT_MSGPACK:
+      return cls._MSGPACK_HEADER + msgpack.packb(cls._encodeSegments(batch))
+    else:
+      raise ValueError("Unexpected batchFormat=%r" % (batchFormat,))
 
 
   @classmethod
@@ -501,11 +606,150 @@ class BatchPackager(object):
     """ Unmarshal the given batchState string into a sequence of request or
     result instances (e.g., ModelCommand, ModelInputRow), preserving the
     original order
+
+    :param batchState: batch state string in any of the supported formats, as
+      returned by BatchPackager.marshal()
     """
+    if batchState.startswith(cls._MSGPACK_MAGIC):
+      version = ord(batchState[len(cls._MSGPACK_MAGIC)])
+      if version != cls._MSGPACK_VERSION:
+        raise ValueError("Unsupported msgpack batch format version=%s" %
+                         (version,))
+
+      return cls._decodeSegments(
+        msgpack.unpackb(batchState[len(cls._MSGPACK_HEADER):],
+                        encoding="utf-8"))
+
     return tuple(_ModelRequestResultBase.__createFromState__(itemState)
                  for itemState in json.loads(batchState))
 
 
+  @classmethod
+  def _encodeSegments(cls, batch):
+    """ Split the batch into runs of items of the same kind and encode each run
+    as a segment for the msgpack batch format
+
+    :returns: list of segments; each segment is a list whose first element is
+      the segment's signature
+    """
+    return [cls._encodeSegment(key, list(items))
+            for key, items in groupby(batch, key=cls._getSegmentKey)]
+
+
+  @classmethod
+  def _getSegmentKey(cls, item):
+    """ Items with equal segment keys may be stored in the same segment """
+    signature = item.__STATE_SIGNATURE__
+
+    if signature == ModelInputRow.__STATE_SIGNATURE__:
+      # Input rows are stored column by column, so rows of a segment must have
+      # the same number of fields and datetime fields in the same positions
+      return (signature, len(item.data),
+              tuple(i for i, value in enumerate(item.data)
+                    if isinstance(value, datetime.datetime)))
+    elif signature == ModelInferenceResult.__STATE_SIGNATURE__:
+      return signature
+    else:
+      return cls._JSON_SEGMENT_SIGNATURE
+
+
+  @classmethod
+  def _encodeSegment(cls, key, items):
+    """ Encode a run of items with the given segment key """
+    if key == ModelInferenceResult.__STATE_SIGNATURE__:
+      # NOTE: multiStepBestPredictions dicts are JSON-encoded, because their
+      # keys are integers, which the json format converts to strings
+      return [key,
+              [r.rowID for r in items],
+              [r.status for r in items],
+              [r.anomalyScore for r in items],
+              [r.errorMessage for r in items],
+              json.dumps([r.multiStepBestPredictions for r in items]),
+              [(None if r.timestamp is None else
+                ModelInputRow._encodeDateTime(r.timestamp))
+               for r in items],
+              [r.value for r in items]]
+    elif key == cls._JSON_SEGMENT_SIGNATURE:
+      return [key, json.dumps([o.__getstate__() for o in items])]
+
+    # ModelInputRow
+    signature, numFields, datetimeIndexes = key
+
+    columns = [list(column)
+               for column in izip(*[row.data for row in items])]
+
+    for i in datetimeIndexes:
+      encodedDatetimes = [ModelInputRow._encodeDateTime(value)
+                          for value in columns[i]]
+      columns[i] = [[seconds for seconds, _ in encodedDatetimes],
+                    [microseconds for _, microseconds in encodedDatetimes]]
+
+    assert len(columns) == numFields, (len(columns), numFields)
+
+    return [signature,
+            [row.rowID for row in items],
+            list(datetimeIndexes),
+            columns]
+
+
+  @classmethod
+  def _decodeSegments(cls, segments):
+    """ Decode the segments of a msgpack batch state
+
+    :returns: tuple of request or result instances
+    """
+    items = []
+
+    for segment in segments:
+      signature = segment[0]
+
+      if signature == ModelInputRow.__STATE_SIGNATURE__:
+        _, rowIDs, datetimeIndexes, columns = segment
+
+        for i in datetimeIndexes:
+          columns[i] = [ModelInputRow._decodeDateTime(encodedDatetime)
+                        for encodedDatetime in izip(*columns[i])]
+
+        for rowID, data in izip(rowIDs, izip(*columns)):
+          row = object.__new__(ModelInputRow)
+          row.rowID = rowID
+          row.data = list(data)
+          items.append(row)
+
+      elif signature in (ModelInferenceResult.__STATE_SIGNATURE__,
+                         ModelInferenceResultLegacyV2.__STATE_SIGNATURE__):
+        if signature == ModelInferenceResult.__STATE_SIGNATURE__:
+          timestamps, values = segment[6], segment[7]
+        else:
+          # Segments of legacy results lack input timestamps and values
+          timestamps = values = repeat(None)
+
+        for (rowID, status, anomalyScore, errorMessage,
+             multiStepBestPredictions, timestamp, value) in izip(
+               segment[1], segment[2], segment[3], segment[4],
+               json.loads(segment[5]), timestamps, values):
+          result = object.__new__(ModelInferenceResult)
+          result.rowID = rowID
+          result.status = status
+          result.anomalyScore = anomalyScore
+          result.errorMessage = errorMessage
+          result.multiStepBestPredictions = multiStepBestPredictions
+          result.timestamp = (None if timestamp is None else
+                              ModelInputRow._decodeDateTime(timestamp))
+          result.value = value
+          items.append(result)
+
+      elif signature == cls._JSON_SEGMENT_SIGNATURE:
+        items.extend(_ModelRequestResultBase.__createFromState__(itemState)
+                     for itemState in json.loads(segment[1]))
+
+      else:
+        raise ValueError("Unexpected msgpack batch segment signature=%r" %
+                         (signature,))
+
+    return tuple(items)
+
+
 
 class RequestMessagePackager(object):
   """ Serializer for a request message """
@@ -594,6 +838,479 @@ class ResultMessagePackager(object):
 
 
 
+class ShardRequestMessagePackager(object):
+  """ Serializer for a request message that is published to a shared input
+  shard queue: the request message is prefixed with the ID of its target model,
+  so that the shard's demultiplexer can route it to the model's input spool
+  """
+
+  _UnmarshalResultSet = namedtuple("_UnmarshalResultSet", "modelID requestMsg")
+
+  @classmethod
+  def marshal(cls, modelID, requestMsg):
+    """ Combine the modelID and the request message into a shard message string
+
+    :param modelID: id of the model; string; must not contain newline characters
+    :param requestMsg: request message as returned by
+      RequestMessagePackager.marshal()
+    """
+    return modelID + "\n" + requestMsg
+
+
+  @classmethod
+  def unmarshal(cls, msg):
+    """ Unmarshal a shard message string
+
+    :returns: a ShardRequestMessagePackager._UnmarshalResultSet instance
+
+    Example:
+      r = ShardRequestMessagePackager.unmarshal(msg)
+      spoolRequestMessage(r.modelID, r.requestMsg)
+    """
+    modelID, requestMsg = msg.split("\n", 1)
+    return cls._UnmarshalResultSet(modelID=modelID, requestMsg=requestMsg)
+
+
+
+class _ModelInputSpool(object):
+  """ Durable per-model spool of the request messages that were demultiplexed
+  from the shared input shard queues. Each model's request messages are stored
+  in the model's own directory under the spool root, one file per message. The
+  file names are zero-padded sequence numbers that preserve the order in which
+  the messages were spooled.
+
+  Only the demultiplexer of the model's shard adds messages to a model's spool,
+  and it acks each message in the shard queue only after spooling it, so a
+  message is redelivered and spooled again only if it is the most recently
+  spooled message of its model. Like a message redelivered by a model input
+  queue, such a duplicate immediately follows its original, so ModelRunner's
+  batch ID checks skip it.
+  """
+
+  # Suffix of files that are being written and aren't part of the spool yet
+  _TEMP_SUFFIX = ".tmp"
+
+  _SEQUENCE_NUMBER_FORMAT = "%020d"
+
+
+  def __init__(self, rootDir):
+    """
+    :param rootDir: absolute path of the spool's root directory
+    """
+    self._rootDir = rootDir
+
+
+  def getModelDir(self, modelID):
+    return os.path.join(self._rootDir, modelID)
+
+
+  @classmethod
+  def listMessages(cls, modelDir):
+    """
+    :returns: sorted sequence of names of the spooled message files in the
+      directory; empty if the directory doesn't exist
+    """
+    try:
+      names = os.listdir(modelDir)
+    except OSError as e:
+      if e.errno != errno.ENOENT:
+        raise
+      return ()
+
+    return sorted(name for name in names
+                  if not name.endswith(cls._TEMP_SUFFIX))
+
+
+  def append(self, modelID, requestMsg):
+    """ Durably add a request message to the end of the model's spool
+
+    :param modelID: model ID
+    :param requestMsg: request message as returned by
+      RequestMessagePackager.marshal()
+    """
+    modelDir = self.getModelDir(modelID)
+
+    if not os.path.exists(modelDir):
+      makeDirectoryFromAbsolutePath(modelDir)
+      self._fsyncDirectory(self._rootDir)
+
+    names = self.listMessages(modelDir)
+    sequenceNumber = int(names[-1]) + 1 if names else 0
+
+    msgPath = os.path.join(modelDir,
+                           self._SEQUENCE_NUMBER_FORMAT % (sequenceNumber,))
+    tempPath = msgPath + self._TEMP_SUFFIX
+
+    with open(tempPath, "wb") as fileObj:
+      fileObj.write(requestMsg)
+      fileObj.flush()
+      os.fsync(fileObj.fileno())
+
+    os.rename(tempPath, msgPath)
+    self._fsyncDirectory(modelDir)
+
+
+  def hasMessages(self, modelID):
+    """
+    :returns: True if the model's spool is non-empty; False if it's empty or
+      doesn't exist
+    """
+    return bool(self.listMessages(self.getModelDir(modelID)))
+
+
+  def getMessageCount(self, modelID):
+    """
+    :returns: number of messages in the model's spool; 0 if it doesn't exist
+    """
+    return len(self.listMessages(self.getModelDir(modelID)))
+
+
+  def iterModelsWithMessages(self):
+    """ Generate IDs of models with non-empty spools """
+    try:
+      modelIDs = os.listdir(self._rootDir)
+    except OSError as e:
+      if e.errno != errno.ENOENT:
+        raise
+      return
+
+    for modelID in modelIDs:
+      if self.hasMessages(modelID):
+        yield modelID
+
+
+  def purge(self, modelID):
+    """ Remove all messages from the model's spool, if any """
+    modelDir = self.getModelDir(modelID)
+    for name in self.listMessages(modelDir):
+      self.removeMessage(os.path.join(modelDir, name))
+
+
+  def remove(self, modelID):
+    """ Remove the model's spool directory along with its messages, if any """
+    try:
+      shutil.rmtree(self.getModelDir(modelID))
+    except OSError as e:
+      if e.errno != errno.ENOENT:
+        raise
+
+
+  @classmethod
+  def removeMessage(cls, msgPath):
+    """ Remove a spooled message file; it's not an error if it was already
+    removed (e.g., the model's spool was purged)
+    """
+    try:
+      os.unlink(msgPath)
+    except OSError as e:
+      if e.errno != errno.ENOENT:
+        raise
+
+
+  @classmethod
+  def _fsyncDirectory(cls, dirPath):
+    fd = os.open(dirPath, os.O_RDONLY)
+    try:
+      os.fsync(fd)
+    finally:
+      os.close(fd)
+
+
+
+class _NotificationCoalescer(object):
+  """ Coalesces the Model Scheduler's "model has new input" notifications
+  published by submitRequests(): after a notification for a model, further
+  notifications for the same model are suppressed for the duration of the
+  coalescing window. If any were suppressed, a single trailing notification is
+  published when the window ends, so that the Model Scheduler always receives a
+  notification after the last request batch was published, even if the model
+  ran and drained its input queue in the meantime.
+
+  One coalescer is shared by all ModelSwapperInterface instances of a process
+  (see acquire() and release()). The time of the last notification of each model is also
+  shared with other processes on the same host via stamp files, so producer
+  processes suppress each other's redundant notifications, too.
+  """
+
+  # Coalescers by (notification queue name, window, stamp directory); guarded
+  # by _instancesLock
+  _instances = dict()
+
+  _instancesLock = threading.Lock()
+
+  _FLUSH_THREAD_JOIN_TIMEOUT_SEC = 10
+
+
+  def __init__(self, mqName, windowSec, stampDir):
+    """
+    :param mqName: name of the Model Scheduler notification message queue
+    :param windowSec: coalescing window in seconds
+    :param stampDir: directory for the files that hold the time of the last
+      notification of each model
+    """
+    self._logger = _getLogger()
+
+    self._mqName = mqName
+    self._windowSec = windowSec
+
+    self._stampDir = stampDir
+    if not os.path.exists(self._stampDir):
+      makeDirectoryFromAbsolutePath(self._stampDir)
+
+    self._cond = threading.Condition()
+
+    # Map of modelIDs with suppressed notifications to the time of the latest
+    # suppressed notification
+    self._pendingMap = dict()
+
+    # Heap of (trailing notification time, modelID) of models in _pendingMap
+    self._trailingHeap = []
+
+    self._numSuppressed = 0
+
+    # Publishes the trailing notifications; started on demand
+    self._flushThread = None
+
+    # Set by close() to stop the flush thread
+    self._closed = False
+
+    # Key in _instances and number of acquire() calls not yet matched by
+    # release(); guarded by _instancesLock
+    self._instanceKey = None
+    self._refCount = 0
+
+
+  @classmethod
+  def acquire(cls, mqName, windowSec):
+    """ Get the process's coalescer for the given queue and window; the caller
+    must release() it when done with it
+    """
+    stampDir = os.path.join(tempfile.gettempdir(),
+                            "htmengine-mswapper-notifications", mqName)
+    key = (mqName, windowSec, stampDir)
+
+    with cls._instancesLock:
+      coalescer = cls._instances.get(key)
+      if coalescer is None:
+        coalescer = cls._instances[key] = cls(mqName, windowSec, stampDir)
+        coalescer._instanceKey = key
+
+      coalescer._refCount += 1
+
+    return coalescer
+
+
+  def release(self):
+    """ Release a coalescer obtained from acquire(); the last release closes
+    it
+    """
+    with self._instancesLock:
+      assert self._refCount > 0, self._refCount
+      self._refCount -= 1
+      if self._refCount:
+        return
+
+      del self._instances[self._instanceKey]
+
+    self.close()
+
+
+  def close(self):
+    """ Stop the flush thread, if any; blocking. Trailing notifications that
+    are still pending are discarded, so flush() first to publish them.
+    """
+    with self._cond:
+      self._closed = True
+      self._cond.notifyAll()
+      flushThread = self._flushThread
+
+    if flushThread is not None:
+      flushThread.join(timeout=self._FLUSH_THREAD_JOIN_TIMEOUT_SEC)
+      if flushThread.isAlive():
+        self._logger.error("Notification flush thread didn't stop")
+
+
+  @property
+  def numSuppressed(self):
+    """ Number of notifications suppressed by this coalescer """
+    return self._numSuppressed
+
+
+  def notify(self, modelID, bus):
+    """ Publish a notification for the model, unless the model was notified
+    within the coalescing window
+
+    :param modelID: model ID
+    :param bus: the caller's MessageBusConnector instance
+
+    :returns: True if the notification was published; False if suppressed
+    """
+    now = time.time()
+
+    with self._cond:
+      lastNotifyTime = self._getLastNotifyTime(modelID)
+      if (lastNotifyTime is None or
+          not lastNotifyTime <= now < lastNotifyTime + self._windowSec):
+        self._setLastNotifyTime(modelID, now)
+        suppressed = False
+      else:
+        self._numSuppressed += 1
+        suppressed = True
+
+        if modelID not in self._pendingMap:
+          heapq.heappush(self._trailingHeap,
+                         (lastNotifyTime + self._windowSec, modelID))
+          self._startFlushThreadIfNeeded()
+          self._cond.notify()
+
+        self._pendingMap[modelID] = now
+
+    if suppressed:
+      return False
+
+    self._publish(bus, modelID)
+    return True
+
+
+  def flush(self, bus):
+    """ Publish the trailing notifications of all models with suppressed
+    notifications now; e.g., before the process exits
+
+    :param bus: the caller's MessageBusConnector instance
+    """
+    with self._cond:
+      modelIDs = self._popTrailingNotifications(deadline=None)
+
+    for modelID in modelIDs:
+      self._publish(bus, modelID)
+
+
+  def forget(self, modelID):
+    """ Discard the state of a deleted model """
+    with self._cond:
+      self._pendingMap.pop(modelID, None)
+
+      try:
+        os.unlink(self._getStampPath(modelID))
+      except OSError as e:
+        if e.errno != errno.ENOENT:
+          raise
+
+
+  def _getStampPath(self, modelID):
+    return os.path.join(self._stampDir, modelID)
+
+
+  def _getLastNotifyTime(self, modelID):
+    """
+    :returns: time of the model's last notification by any process; None if
+      unknown
+    """
+    try:
+      return os.stat(self._getStampPath(modelID)).st_mtime
+    except OSError as e:
+      if e.errno != errno.ENOENT:
+        raise
+      return None
+
+
+  def _setLastNotifyTime(self, modelID, notifyTime):
+    stampPath = self._getStampPath(modelID)
+    with open(stampPath, "a"):
+      pass
+    os.utime(stampPath, (notifyTime, notifyTime))
+
+
+  def _popTrailingNotifications(self, deadline):
+    """ [must be called with self._cond held] Remove the models whose trailing
+    notifications are due from the pending state and record their notification
+    time. Models that another process notified after their latest suppressed
+    notification need no trailing notification.
+
+    :param deadline: trailing notifications due at this time are popped; None
+      to pop all of them
+
+    :returns: sequence of IDs of models to notify
+    """
+    now = time.time()
+    modelIDs = []
+
+    while self._trailingHeap and (deadline is None or
+                                  self._trailingHeap[0][0] <= deadline):
+      _, modelID = heapq.heappop(self._trailingHeap)
+
+      suppressedTime = self._pendingMap.pop(modelID, None)
+      if suppressedTime is None:
+        # The model was forgotten
+        continue
+
+      lastNotifyTime = self._getLastNotifyTime(modelID)
+      if lastNotifyTime is not None and lastNotifyTime > suppressedTime:
+        continue
+
+      self._setLastNotifyTime(modelID, now)
+      modelIDs.append(modelID)
+
+    return modelIDs
+
+
+  def _publish(self, bus, modelID):
+    try:
+      bus.publish(self._mqName, json.dumps(modelID), persistent=False)
+    except message_bus_connector.MessageQueueNotFound:
+      # If it's not fully up yet, its notification queue might not have been
+      # created, which is ok
+      self._logger.warn(
+        "Couldn't send model data notification to Model Scheduler: mq=%s not "
+        "found. Model Scheduler service not started or initialized the mq yet?",
+        self._mqName)
+
+
+  def _startFlushThreadIfNeeded(self):
+    """ [must be called with self._cond held] """
+    if self._flushThread is None:
+      self._flushThread = threading.Thread(
+        target=self._runFlushThread,
+        name="mswapper-notification-flush")
+      # Allow process to exit even if thread is still running
+      self._flushThread.setDaemon(True)
+      self._flushThread.start()
+
+
+  @logExceptions(_getLogger())
+  def _runFlushThread(self):
+    """ Publish trailing notifications as they come due, using our own message
+    bus connection, since connections can't be shared between threads
+    """
+    bus = MessageBusConnector()
+
+    try:
+      while True:
+        with self._cond:
+          while not self._trailingHeap and not self._closed:
+            self._cond.wait()
+
+          if self._closed:
+            return
+
+          delay = self._trailingHeap[0][0] - time.time()
+          if delay > 0:
+            self._cond.wait(delay)
+            continue
+
+          modelIDs = self._popTrailingNotifications(deadline=time.time())
+
+        for modelID in modelIDs:
+          try:
+            self._publish(bus, modelID)
+          except Exception:  # pylint: disable=W0703
+            self._logger.exception(
+              "Failed to publish trailing notification for model=%s", modelID)
+    finally:
+      bus.close()
+
+
+
 class ModelSwapperInterface(object):
   """
   This is the interface class to connect the application layer to the Model
@@ -622,6 +1339,14 @@ class ModelSwapperInterface(object):
 
   _MODEL_INPUT_Q_PREFIX_OPTION_NAME = "model_input_queue_prefix"
 
+  _BATCH_FORMAT_OPTION_NAME = "batch_format"
+
+  _NOTIFICATION_COALESCE_WINDOW_OPTION_NAME = "notification_coalesce_window_sec"
+
+  _NUM_INPUT_SHARDS_OPTION_NAME = "num_input_shards"
+
+  _INPUT_SPOOL_DIR_OPTION_NAME = "input_spool_dir"
+
 
   def __init__(self):
     """
@@ -643,6 +1368,45 @@ class ModelSwapperInterface(object):
     self._schedulerNotificationQueueName = config.get(
       self._CONFIG_SECTION, self._SCHEDULER_NOTIFICATION_Q_OPTION_NAME)
 
+    # Format of the request and result batches that we submit
+    self._batchFormat = config.get(
+      self._CONFIG_SECTION, self._BATCH_FORMAT_OPTION_NAME)
+    if self._batchFormat not in (BatchPackager.FORMAT_JSON,
+                                 BatchPackager.FORMAT_MSGPACK):
+      raise ValueError("Unexpected model swapper batch_format=%r" %
+                       (self._batchFormat,))
+
+    # Number of shared input shard queues that models are hashed onto; 0 if
+    # each model has its own input queue
+    self._numInputShards = config.getint(
+      self._CONFIG_SECTION, self._NUM_INPUT_SHARDS_OPTION_NAME)
+    if self._numInputShards < 0:
+      raise ValueError("Unexpected model swapper num_input_shards=%r" %
+                       (self._numInputShards,))
+
+    # With input shards, the spool of request messages that were
+    # demultiplexed from the shard queues; None otherwise
+    if self._numInputShards > 0:
+      spoolDir = os.path.expanduser(os.path.expandvars(config.get(
+        self._CONFIG_SECTION, self._INPUT_SPOOL_DIR_OPTION_NAME)))
+      if not os.path.isabs(spoolDir):
+        raise ValueError("Model input spool path is not absolute: %r" %
+                         (spoolDir,))
+
+      self._inputSpool = _ModelInputSpool(os.path.realpath(spoolDir))
+    else:
+      self._inputSpool = None
+
+    # Coalesces Model Scheduler notifications from submitRequests; None if
+    # coalescing is disabled
+    coalesceWindowSec = config.getfloat(
+      self._CONFIG_SECTION, self._NOTIFICATION_COALESCE_WINDOW_OPTION_NAME)
+    if coalesceWindowSec > 0:
+      self._notificationCoalescer = _NotificationCoalescer.acquire(
+        self._schedulerNotificationQueueName, coalesceWindowSec)
+    else:
+      self._notificationCoalescer = None
+
     # Message bus connector
     self._bus = MessageBusConnector()
 
@@ -689,9 +1453,28 @@ class ModelSwapperInterface(object):
       assert not self._consumers
 
     try:
-      self._bus.close()
+      if self._notificationCoalescer is not None:
+        try:
+          # Don't let trailing notifications be lost if the process exits
+          self._notificationCoalescer.flush(self._bus)
+        finally:
+          self._notificationCoalescer.release()
     finally:
-      self._bus = None
+      try:
+        self._bus.close()
+      finally:
+        self._bus = None
+
+
+  @property
+  def numSuppressedNotifications(self):
+    """ Number of Model Scheduler notifications suppressed by coalescing in this
+    process
+    """
+    if self._notificationCoalescer is None:
+      return 0
+
+    return self._notificationCoalescer.numSuppressed
 
 
   def _onConsumerClosed(self, consumer):
@@ -712,6 +1495,25 @@ class ModelSwapperInterface(object):
     return mqName[len(self._modelInputQueueNamePrefix):]
 
 
+  def _getInputShardQName(self, shardIndex):
+    return "%sshard.%d" % (self._modelInputQueueNamePrefix, shardIndex)
+
+
+  def _getInputShardIndex(self, modelID):
+    # NOTE: crc32 is stable across processes and platforms, unlike hash()
+    return (zlib.crc32(modelID) & 0xffffffff) % self._numInputShards
+
+
+  def _getRequestQName(self, modelID):
+    """ Get the name of the message queue that the model's requests are
+    published to: its input shard queue or its own input queue
+    """
+    if self._numInputShards:
+      return self._getInputShardQName(self._getInputShardIndex(modelID))
+
+    return self._getModelInputQName(modelID)
+
+
   def defineModel(self, modelID, args, commandID):
     """ Initialize model's input message queue and send the "defineModel"
     command. The ModelCommandResult will be delivered asynchronously, along with
@@ -735,7 +1537,9 @@ class ModelSwapperInterface(object):
     """
     # TODO: validate input args dict against schema
 
-    mqName = self._getModelInputQName(modelID)
+    # NOTE: with input shards, this declares the model's shard queue, which is
+    # shared with other models
+    mqName = self._getRequestQName(modelID)
 
     self._bus.createMessageQueue(mqName, durable=True)
 
@@ -758,7 +1562,7 @@ class ModelSwapperInterface(object):
     :raises: ModelNotFound if the source model's input endpoint doesn't exist
     """
     # Create the model input message queue for the new model
-    self._bus.createMessageQueue(self._getModelInputQName(newModelID),
+    self._bus.createMessageQueue(self._getRequestQName(newModelID),
                                  durable=True)
 
     self.submitRequests(
@@ -777,6 +1581,20 @@ class ModelSwapperInterface(object):
     :param commandID: a numeric or string id to associate with the command and
                       result.
     """
+    if self._numInputShards:
+      # The model's shard queue is shared with other models, so only the
+      # model's spooled input can be purged. The spool doesn't tell whether the
+      # model was already deleted, so submit the command in any case;
+      # ModelRunner handles repeated deleteModel commands.
+      self._logger.info("deleteModel: purging input spool before submitting "
+                        "deleteModel command for model=%s", modelID)
+      self._inputSpool.purge(modelID)
+      try:
+        self.submitRequests(modelID, (ModelCommand(commandID, "deleteModel"),))
+      except ModelNotFound:
+        pass
+      return
+
     # First, purge unread input messages for this model, if any, to avoid
     # unnecessary processing before the model is deleted
     mq = self._getModelInputQName(modelID)
@@ -800,9 +1618,15 @@ class ModelSwapperInterface(object):
   def cleanUpAfterModelDeletion(self, modelID):
     """ For use by Engine's ModelRunner after it deletes a model: clean up
     resources that ModelSwapperInterface created to support the model, such
-    as deleting the model's input message queue
+    as deleting the model's input message queue or input spool
     """
-    self._bus.deleteMessageQueue(self._getModelInputQName(modelID))
+    if self._numInputShards:
+      self._inputSpool.remove(modelID)
+    else:
+      self._bus.deleteMessageQueue(self._getModelInputQName(modelID))
+
+    if self._notificationCoalescer is not None:
+      self._notificationCoalescer.forget(modelID)
 
 
   def modelInputPending(self, modelID):
@@ -813,18 +1637,46 @@ class ModelSwapperInterface(object):
     :returns: True if the model's input queue exists and is non-empty;
               False if the model's input queue is non-empty or doesn't exist
     """
+    if self._numInputShards:
+      return self._inputSpool.hasMessages(modelID)
+
     try:
       return not self._bus.isEmpty(self._getModelInputQName(modelID))
     except message_bus_connector.MessageQueueNotFound:
       return False
 
 
+  def getModelInputBacklog(self, modelID):
+    """ Get the number of input request batches pending for a model that isn't
+    running; batches that a running model consumed but hasn't acked yet may or
+    may not be counted.
+
+    NOTE: with input shards, only the batches that were already demultiplexed
+    into the model's input spool are counted.
+
+    :param modelID: a string that uniquely identifies the target model.
+
+    :returns: number of pending request batches; 0 if the model's input queue
+      doesn't exist
+    """
+    if self._numInputShards:
+      return self._inputSpool.getMessageCount(modelID)
+
+    try:
+      return self._bus.getMessageCount(self._getModelInputQName(modelID))
+    except message_bus_connector.MessageQueueNotFound:
+      return 0
+
+
   def getModelsWithInputPending(self):
     """ Get model IDs of all models with pending input (non-empty input queues)
 
     :returns: (possibly empty) sequence of model IDs whose input streams are
       non-empty
     """
+    if self._numInputShards:
+      return tuple(self._inputSpool.iterModelsWithMessages())
+
     # NOTE: queues may be deleted as we're running through the list, so we need
     # to play it safe
     def safeIsInputPending(mq):
@@ -833,11 +1685,25 @@ class ModelSwapperInterface(object):
       except message_bus_connector.MessageQueueNotFound:
         return False
 
+    # Get the message counts of all model input queues in bulk instead of
+    # querying each queue; only queues that the broker has no statistics for
+    # yet are queried individually.
+    #
+    # NOTE: the bulk message counts may lag behind by the broker's statistics
+    # interval. That's ok for Model Scheduler's startup: input that was
+    # submitted since then is followed by a notification in its notification
+    # queue, which it consumes next.
+    def isInputPending(queueDepth):
+      if queueDepth.messageCount is None:
+        return safeIsInputPending(queueDepth.name)
+
+      return queueDepth.messageCount > 0
+
     prefix = self._modelInputQueueNamePrefix
     return tuple(
-      self._getModelIDFromInputQName(mq)
-      for mq in self._bus.getAllMessageQueues()
-      if mq.startswith(prefix) and safeIsInputPending(mq))
+      self._getModelIDFromInputQName(queueDepth.name)
+      for queueDepth in self._bus.iterMessageQueueDepths(namePrefix=prefix)
+      if isInputPending(queueDepth))
 
 
   def submitRequests(self, modelID, requests):
@@ -863,15 +1729,24 @@ class ModelSwapperInterface(object):
     The results will be delivered asynchronously, along with the corresponding
     requestIDs, to the process that is consuming ModelSwapper results.
 
+    With input shards, ModelNotFound is raised only if the model's shard
+    queue doesn't exist; the Model Scheduler is notified by the shard's
+    demultiplexer after it spools the batch instead of by this method.
+
     NOTE: This assumes retry logic will be handled by the underlying MQ
     implementation.
     """
     batchID = uuid.uuid1().hex
     msg = RequestMessagePackager.marshal(
       batchID=batchID,
-      batchState=BatchPackager.marshal(batch=requests))
+      batchState=BatchPackager.marshal(batch=requests,
+                                       batchFormat=self._batchFormat))
+
+    if self._numInputShards:
+      msg = ShardRequestMessagePackager.marshal(modelID=modelID,
+                                                requestMsg=msg)
 
-    mqName = self._getModelInputQName(modelID)
+    mqName = self._getRequestQName(modelID)
     try:
       self._bus.publish(mqName, msg, persistent=True)
     except message_bus_connector.MessageQueueNotFound as e:
@@ -888,8 +1763,15 @@ class ModelSwapperInterface(object):
         msg[:32])
       raise
 
+    if self._numInputShards:
+      return batchID
+
     # Send a notification to Model Scheduler so it will schedule the model
     # for processing input
+    if self._notificationCoalescer is not None:
+      self._notificationCoalescer.notify(modelID, self._bus)
+      return batchID
+
     try:
       self._bus.publish(self._schedulerNotificationQueueName,
                         json.dumps(modelID), persistent=False)
@@ -923,6 +1805,9 @@ class ModelSwapperInterface(object):
     :raises: ModelNotFound if model's input endpoint doesn't exist
             TODO: need tests for consumeRequests with ModelNotFound
 
+    With input shards, the batches are read from the model's input spool, and
+    an empty or missing spool simply has no batches.
+
     Example:
       with ModelSwapperInterface() as swapper:
         with swapper.consumeRequests(modelID) as consumer:
@@ -930,6 +1815,16 @@ class ModelSwapperInterface(object):
             processRequests(batchID=batch.batchID, requests=batch.objects)
             batch.ack()
     """
+    if self._numInputShards:
+      consumer = _SpoolConsumer(
+        modelDir=self._inputSpool.getModelDir(modelID),
+        blocking=blocking,
+        swapper=self)
+
+      self._consumers.append(consumer)
+
+      return consumer
+
     mq = self._getModelInputQName(modelID)
 
     def onQueueNotFound():
@@ -951,6 +1846,67 @@ class ModelSwapperInterface(object):
     return consumer
 
 
+  def initInputShards(self):
+    """ Initialize the input shard message queues; for use by the input shard
+    demultiplexer
+    """
+    for shardIndex in xrange(self._numInputShards):
+      self._bus.createMessageQueue(self._getInputShardQName(shardIndex),
+                                   durable=True)
+
+
+  def consumeInputShard(self, shardIndex):
+    """ Create an instance of the _MessageConsumer iterable for reading request
+    messages from an input shard queue. The iterable yields
+    _ConsumedShardMessage instances.
+
+    NOTE: This API is intended for the input shard demultiplexer. Each shard
+    must have a single consumer in order to preserve the order of each model's
+    requests.
+
+    :param shardIndex: index of the input shard; 0 <= shardIndex <
+      num_input_shards
+
+    :returns: an instance of model_swapper_interface._MessageConsumer iterable;
+      IMPORTANT: the caller is responsible for closing it before closing this
+      ModelSwapperInterface instance (hint: use the returned _MessageConsumer
+      instance as Context Manager)
+
+    Example:
+      with ModelSwapperInterface() as swapper:
+        with swapper.consumeInputShard(shardIndex) as consumer:
+          for msg in consumer:
+            swapper.spoolInputShardMessage(msg)
+            msg.ack()
+    """
+    assert 0 <= shardIndex < self._numInputShards, (
+      shardIndex, self._numInputShards)
+
+    mq = self._getInputShardQName(shardIndex)
+
+    consumer = _MessageConsumer(
+      mqName=mq,
+      blocking=True,
+      decode=_ConsumedShardMessage.decodeMessage,
+      swapper=self,
+      bus=self._bus,
+      onQueueNotFound=lambda: self._bus.createMessageQueue(mq, durable=True))
+
+    self._consumers.append(consumer)
+
+    return consumer
+
+
+  def spoolInputShardMessage(self, msg):
+    """ Durably add a request message consumed from an input shard queue to the
+    end of its model's input spool; for use by the input shard demultiplexer,
+    which must ack the message only after this returns
+
+    :param msg: _ConsumedShardMessage instance from consumeInputShard()
+    """
+    self._inputSpool.append(msg.modelID, msg.requestMsg)
+
+
   def _initResultsMessageQueue(self):
     self._bus.createMessageQueue(self._resultsQueueName, durable=True)
 
@@ -970,7 +1926,8 @@ class ModelSwapperInterface(object):
     """
     msg = ResultMessagePackager.marshal(
       modelID=modelID,
-      batchState=BatchPackager.marshal(batch=results))
+      batchState=BatchPackager.marshal(batch=results,
+                                       batchFormat=self._batchFormat))
     try:
       try:
         self._bus.publish(self._resultsQueueName, msg, persistent=True)
@@ -1085,6 +2042,33 @@ class _ConsumedRequestBatch(  # pylint: disable=W0232
 
 
 
+class _ConsumedShardMessage(  # pylint: disable=W0232
+    namedtuple("_ConsumedShardMessageBase", "modelID requestMsg ack")):
+  """ Container for a request message consumed from an input shard queue
+
+  modelID: ID of the model that the request message is for
+  requestMsg: request message as returned by RequestMessagePackager.marshal()
+  ack: function to call to ack the message: NoneType ack(multiple=False)
+  """
+
+
+  @classmethod
+  def decodeMessage(cls, msg):
+    """ Factory method that accepts an instance of
+    message_bus_connector._ConsumedMessage and returns an instance of
+    _ConsumedShardMessage that should be yielded by the _MessageConsumer
+    iterable
+
+    :param msg: instance of message_bus_connector._ConsumedMessage
+
+    :returns: an instance of _ConsumedShardMessage that should be yielded by the
+      _MessageConsumer iterable
+    """
+    r = ShardRequestMessagePackager.unmarshal(msg.body)
+    return cls(modelID=r.modelID, requestMsg=r.requestMsg, ack=msg.ack)
+
+
+
 class _ConsumedResultBatch(  # pylint: disable=W0232
     namedtuple("_ConsumedResultBatchBase", "modelID objects ack")):
   """ Container for a consumed result batch
@@ -1226,3 +2210,141 @@ class _MessageConsumer(object):
       self._mqConsumer.close()
     finally:
       self._mqConsumer = None
+
+
+
+class _SpoolConsumer(object):
+  """ An instance of this class is an iterable that reads request batches from
+  a model's input spool and yields _ConsumedRequestBatch instances.
+
+  It follows the acking semantics of the message queue consumers: a batch is
+  removed from the spool when it's acked, and batches that weren't acked by the
+  time the consumer is closed are yielded again by the next consumer. Batches
+  yielded by an open consumer in this process are skipped by other consumers of
+  the same spool, just like a message queue doesn't deliver unacked messages to
+  other consumers.
+  """
+
+  # Interval for polling an empty spool in blocking mode
+  _POLL_INTERVAL_SEC = 0.1
+
+  # Map of model spool directories to the sets of names of message files
+  # yielded by open consumers of this process; guarded by _claimsLock
+  _claimsMap = dict()
+
+  _claimsLock = threading.Lock()
+
+
+  def __init__(self, modelDir, blocking, swapper):
+    """
+    :param modelDir: the model's input spool directory
+    :param blocking: if True, the iterable will block until another batch
+      becomes available; if False, the iterable will terminate iteration when no
+      more batches are available in the spool.
+    :param swapper: the host ModelSwapperInterface instance
+    """
+    self._logger = _getLogger()
+    self._modelDir = modelDir
+    self._blocking = blocking
+    self._swapper = swapper
+
+    # Sorted names of message files yielded by this consumer and not acked yet
+    self._unackedNames = []
+
+
+  def __enter__(self):
+    return self
+
+
+  def __exit__(self, _excType, _excVal, _excTb):
+    self.close()
+    return False
+
+
+  def __iter__(self):
+    """ yield an instance of _ConsumedRequestBatch when a batch becomes
+    available
+    """
+    while True:
+      numYielded = 0
+
+      for name in _ModelInputSpool.listMessages(self._modelDir):
+        if not self._claim(name):
+          continue
+
+        try:
+          with open(os.path.join(self._modelDir, name), "rb") as fileObj:
+            body = fileObj.read()
+        except IOError as e:
+          self._release(name)
+          if e.errno != errno.ENOENT:
+            raise
+
+          # Acked by another consumer or purged since listing the spool
+          continue
+
+        self._unackedNames.append(name)
+        numYielded += 1
+
+        r = RequestMessagePackager.unmarshal(body)
+        yield _ConsumedRequestBatch(
+          batchID=r.batchID,
+          objects=BatchPackager.unmarshal(r.batchState),
+          ack=lambda multiple=False, name=name: self._ack(name, multiple))
+
+      if numYielded == 0:
+        if not self._blocking:
+          break
+
+        time.sleep(self._POLL_INTERVAL_SEC)
+
+
+  def close(self):
+    """ Clean up; batches that weren't acked stay in the spool """
+    if self._swapper is None:
+      return
+
+    self._swapper._onConsumerClosed(self)  # pylint: disable=W0212
+    self._swapper = None
+
+    for name in self._unackedNames:
+      self._release(name)
+
+    self._unackedNames = []
+
+
+  def _ack(self, name, multiple):
+    """ Remove an acked batch and, if multiple is True, the unacked batches
+    yielded before it from the spool
+    """
+    if multiple:
+      names = [n for n in self._unackedNames if n <= name]
+    else:
+      names = [name]
+
+    for n in names:
+      _ModelInputSpool.removeMessage(os.path.join(self._modelDir, n))
+      self._unackedNames.remove(n)
+      self._release(n)
+
+
+  def _claim(self, name):
+    """
+    :returns: True if claimed the message file; False if another consumer of
+      this process has it
+    """
+    with self._claimsLock:
+      claims = self._claimsMap.setdefault(self._modelDir, set())
+      if name in claims:
+        return False
+
+      claims.add(name)
+      return True
+
+
+  def _release(self, name):
+    with self._claimsLock:
+      claims = self._claimsMap[self._modelDir]
+      claims.discard(name)
+      if not claims:
+        del self._claimsMap[self._modelDir]
@@ -0,0 +1,222 @@
+# ----------------------------------------------------------------------
+# Numenta Platform for Intelligent Computing (NuPIC)
+# Copyright (C) 2015, Numenta, Inc.  Unless you have purchased from
+# Numenta, Inc. a separate commercial license for this software code, the
+# following terms and conditions apply:
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero Public License for more details.
+#
+# You should have received a copy of the GNU Affero Public License
+# along with this program.  If not, see http://www.gnu.org/licenses.
+#
+# http://numenta.org/licenses/
+# ----------------------------------------------------------------------
+
+"""
+This module implements ModelTemplateCache, which ModelRunner uses for creating
+new models from params. Params generated by
+scalar_metric_utils.generateSwarmParams differ between scalar metrics only in
+the bounds of the value encoder, so constructing the network of each new model
+from scratch repeats the same costly initialization of its spatial and temporal
+poolers. Instead, the cache saves a freshly created model per distinct params
+(ignoring the encoder bounds) as a template, and creates subsequent models by
+loading the template and replacing its encoders with ones built from the
+model's own params.
+"""
+
+import copy
+import errno
+import hashlib
+import json
+import os
+import shutil
+import uuid
+
+from nupic.encoders.multi import MultiEncoder
+from nupic.frameworks.opf.modelfactory import ModelFactory
+import pkg_resources
+
+from htmengine import htmengine_logging
+
+
+
+_MODULE_NAME = "htmengine.model_swapper.model_template_cache"
+
+
+
+def _getLogger():
+  return htmengine_logging.getExtendedLogger(_MODULE_NAME)
+
+
+
+class ModelTemplateCache(object):
+  """ Creates OPF models from model params via templates saved in the cache
+  directory. The model returned by createModel is equivalent to one from
+  ModelFactory.create with the same params: the template is saved before it
+  sees any input, and the spatial and temporal poolers are seeded by the params
+  that are part of the template key.
+
+  Templates are keyed by a hash of the model config without the encoder bounds
+  and by the nupic version, so a nupic upgrade never loads a stale template.
+  Multiple processes may share the cache directory: templates are published
+  atomically, and a process that loses the race discards its copy.
+  """
+
+  # Encoder params that vary from metric to metric and are excluded from the
+  # template key; the template's encoders are rebuilt from the model's own
+  # params
+  _PER_MODEL_ENCODER_PARAMS = frozenset(("minval", "maxval", "resolution"))
+
+  _TEMPLATE_MODEL_DIR_NAME = "model"
+
+
+  def __init__(self, cacheDir):
+    """
+    :param cacheDir: directory of the templates; created as needed. May use
+      environment variables.
+    """
+    self._logger = _getLogger()
+
+    self._cacheDir = os.path.expanduser(os.path.expandvars(cacheDir))
+
+
+  def createModel(self, modelConfig):
+    """ Create a new OPF model, from a template when possible
+
+    :param modelConfig: the "modelConfig" value from model params; suitable for
+      ModelFactory.create
+
+    :returns: a new OPF model instance
+    """
+    templateKey = self.getTemplateKey(modelConfig)
+    templateModelDir = os.path.join(self._cacheDir, templateKey,
+                                    self._TEMPLATE_MODEL_DIR_NAME)
+
+    if os.path.isdir(templateModelDir):
+      try:
+        model = ModelFactory.loadFromCheckpoint(templateModelDir)
+      except Exception:  # pylint: disable=W0703
+        self._logger.exception("Failed to load model template=%s; creating "
+                               "model from params", templateKey)
+      else:
+        if self._replaceEncoders(model, modelConfig):
+          return model
+
+        self._logger.warn("Encoders of model template=%s can't be replaced; "
+                          "creating model from params", templateKey)
+        return ModelFactory.create(modelConfig=modelConfig)
+
+    model = ModelFactory.create(modelConfig=modelConfig)
+    self._saveTemplate(model, templateKey)
+    return model
+
+
+  @classmethod
+  def getTemplateKey(cls, modelConfig):
+    """ Compute the template key of the given model config
+
+    :param modelConfig: the "modelConfig" value from model params
+
+    :returns: hex digest string
+    """
+    modelConfig = copy.deepcopy(modelConfig)
+
+    encoders = cls._getEncoderParams(modelConfig)
+    if encoders:
+      for encoderParams in encoders.itervalues():
+        if encoderParams is not None:
+          for name in cls._PER_MODEL_ENCODER_PARAMS:
+            encoderParams.pop(name, None)
+
+    return hashlib.sha1(
+      json.dumps(modelConfig, sort_keys=True, default=repr) +
+      pkg_resources.get_distribution("nupic").version).hexdigest()
+
+
+  @classmethod
+  def _getEncoderParams(cls, modelConfig):
+    """
+    :returns: the dict of encoder params from the model config's sensor params;
+      None if not present
+    """
+    return (modelConfig.get("modelParams", {}).get("sensorParams", {})
+            .get("encoders"))
+
+
+  def _replaceEncoders(self, model, modelConfig):
+    """ Replace the encoders of a model loaded from a template with ones built
+    from the given model config. This mirrors how CLAModel sets up the encoders
+    of its sensor region on creation.
+
+    :returns: True if replaced; False if the model doesn't support it or the
+      new encoders would change the width of the sensor's output
+    """
+    getSensorRegion = getattr(model, "_getSensorRegion", None)
+    encoders = self._getEncoderParams(modelConfig)
+    if getSensorRegion is None or encoders is None:
+      return False
+
+    enabledEncoders = dict()
+    disabledEncoders = dict()
+    for name, params in copy.deepcopy(encoders).iteritems():
+      if params is None:
+        continue
+
+      if params.pop("classifierOnly", False):
+        disabledEncoders[name] = params
+      else:
+        enabledEncoders[name] = params
+
+    sensor = getSensorRegion().getSelf()
+
+    encoder = MultiEncoder(enabledEncoders)
+    if encoder.getWidth() != sensor.encoder.getWidth():
+      return False
+
+    sensor.encoder = encoder
+    sensor.disabledEncoder = MultiEncoder(disabledEncoders)
+
+    # CLAModel caches the encoder of the predicted field on first use
+    if hasattr(model, "_classifierInputEncoder"):
+      model._classifierInputEncoder = None  # pylint: disable=W0212
+
+    return True
+
+
+  def _saveTemplate(self, model, templateKey):
+    """ Save a freshly created model as the template for the given key, unless
+    another process already did
+    """
+    templateDir = os.path.join(self._cacheDir, templateKey)
+    if os.path.isdir(templateDir):
+      return
+
+    tempDir = os.path.join(self._cacheDir,
+                           "%s.tmp-%s" % (templateKey, uuid.uuid1().hex))
+    try:
+      os.makedirs(tempDir)
+      model.save(saveModelDir=os.path.join(tempDir,
+                                           self._TEMPLATE_MODEL_DIR_NAME))
+
+      try:
+        os.rename(tempDir, templateDir)
+      except OSError as e:
+        if e.errno not in (errno.EEXIST, errno.ENOTEMPTY):
+          raise
+        # Another process published the template first
+        return
+
+      self._logger.info("Saved model template=%s", templateKey)
+    except Exception:  # pylint: disable=W0703
+      # The template is an optimization; the model is still good
+      self._logger.exception("Failed to save model template=%s", templateKey)
+    finally:
+      if os.path.exists(tempDir):
+        shutil.rmtree(tempDir, ignore_errors=True)
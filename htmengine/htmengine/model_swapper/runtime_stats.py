@@ -0,0 +1,404 @@
+# ----------------------------------------------------------------------
+# Numenta Platform for Intelligent Computing (NuPIC)
+# Copyright (C) 2015, Numenta, Inc.  Unless you have purchased from
+# Numenta, Inc. a separate commercial license for this software code, the
+# following terms and conditions apply:
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero Public License for more details.
+#
+# You should have received a copy of the GNU Affero Public License
+# along with this program.  If not, see http://www.gnu.org/licenses.
+#
+# http://numenta.org/licenses/
+# ----------------------------------------------------------------------
+
+"""
+This module implements the per-model runtime statistics of the model swapper.
+
+ModelRunner measures each run of a model in a ModelRunStats instance and
+reports it to SlotAgent on its control stream at the end of the run.
+SwapController aggregates these reports, along with the queue waits and
+preemptions that it observes, in a RuntimeStatsAggregator, which periodically
+writes a snapshot to the stats file configured by
+swap_controller.runtime_stats_file.
+
+The stats file is a JSON object that is replaced atomically on each export:
+
+  {
+    "version": 1,
+    "timestamp": <time of the snapshot; seconds since the epoch>,
+    "startTime": <time the aggregator was created; seconds since the epoch>,
+    "totals": {<field>: <value>, ...},
+    "models": {<modelID>: {<field>: <value>, ...}, ...}
+  }
+
+The fields of "totals" and of each model are the ones in
+ModelRuntimeStats.FIELDS plus the derived "rowsPerSec". Fields are never removed
+or renamed within a version; new fields may be added.
+
+Components outside of the model swapper, such as the model data feeder, read
+the stats file via RuntimeStatsReader.
+"""
+
+import json
+import os
+import time
+
+from htmengine import htmengine_logging
+
+
+
+_MODULE_NAME = "htmengine.model_swapper.runtime_stats"
+
+
+
+def _getLogger():
+  return htmengine_logging.getExtendedLogger(_MODULE_NAME)
+
+
+
+class ModelRunStats(object):
+  """ Statistics of a single run of a model in ModelRunner, from start until
+  the ModelRunner is done with the model
+  """
+
+  # Fields of the report; all are numbers
+  FIELDS = (
+    # Number of times the model was loaded from its checkpoint or params
+    "numLoads",
+    # Seconds spent loading the model, including replay
+    "loadSec",
+    # Seconds spent replaying input samples of incremental checkpoints
+    "replaySec",
+    # Number of input samples replayed
+    "numReplayedSamples",
+    # Number of input rows processed
+    "numRowsProcessed",
+    # Seconds spent processing input batches, excluding model load
+    "processSec",
+    # Number of checkpoints saved
+    "numCheckpoints",
+    # Seconds spent saving checkpoints, including waits for background saves
+    "checkpointSec",
+    # Bytes of the full checkpoints saved synchronously
+    "checkpointBytes",
+    # Number of times the model was deleted
+    "numDeletions",
+  )
+
+  __slots__ = FIELDS
+
+
+  def __init__(self):
+    for name in self.FIELDS:
+      setattr(self, name, 0)
+
+
+  def __repr__(self):
+    return "%s<%s>" % (
+      self.__class__.__name__,
+      ", ".join("%s=%s" % (name, getattr(self, name)) for name in self.FIELDS))
+
+
+  def toReport(self):
+    """
+    :returns: JSONifiable dict of the fields
+    """
+    return dict((name, getattr(self, name)) for name in self.FIELDS)
+
+
+
+class ModelRuntimeStats(object):
+  """ Cumulative runtime statistics of a model """
+
+  # Fields from SwapController's observations of the model
+  _CONTROLLER_FIELDS = (
+    # Number of times the model was started in a slot
+    "numRuns",
+    # Number of runs whose ModelRunner exited with non-zero status
+    "numFailedRuns",
+    # Seconds from the start of the model in a slot until the slot was done
+    "runSec",
+    # Number of times the model waited for a slot and the seconds it waited
+    "numWaits",
+    "waitSec",
+    "maxWaitSec",
+    # Number of times SwapController requested preemption of the model
+    "numPreemptions",
+  )
+
+  FIELDS = _CONTROLLER_FIELDS + ModelRunStats.FIELDS
+
+  __slots__ = FIELDS
+
+
+  def __init__(self):
+    for name in self.FIELDS:
+      setattr(self, name, 0)
+
+
+  def addRunReport(self, report):
+    """ Accumulate a ModelRunner's report of a run of the model
+
+    :param report: dict from ModelRunStats.toReport(); unknown fields are
+      ignored, so that a newer ModelRunner may report more
+    """
+    for name in ModelRunStats.FIELDS:
+      setattr(self, name, getattr(self, name) + report.get(name, 0))
+
+
+  def addWait(self, waitSec):
+    self.numWaits += 1
+    self.waitSec += waitSec
+    self.maxWaitSec = max(self.maxWaitSec, waitSec)
+
+
+  def add(self, other):
+    """ Accumulate another ModelRuntimeStats instance into this one """
+    for name in self.FIELDS:
+      if name == "maxWaitSec":
+        self.maxWaitSec = max(self.maxWaitSec, other.maxWaitSec)
+      else:
+        setattr(self, name, getattr(self, name) + getattr(other, name))
+
+
+  @property
+  def rowsPerSec(self):
+    """ Input rows processed per second of input batch processing """
+    if not self.processSec:
+      return 0.0
+
+    return float(self.numRowsProcessed) / self.processSec
+
+
+  def toDict(self):
+    """
+    :returns: JSONifiable dict of the fields and derived fields
+    """
+    result = dict((name, getattr(self, name)) for name in self.FIELDS)
+    result["rowsPerSec"] = self.rowsPerSec
+    return result
+
+
+
+class RuntimeStatsAggregator(object):
+  """ Aggregates the runtime statistics of models on behalf of SwapController
+  and exports them to the stats file. Not thread-safe.
+  """
+
+  FORMAT_VERSION = 1
+
+
+  def __init__(self, statsFilePath=None, exportIntervalSec=60):
+    """
+    :param statsFilePath: path of the stats file; may use environment
+      variables. None or empty disables export.
+    :param exportIntervalSec: minimum number of seconds between exports by
+      exportIfDue()
+    """
+    self._logger = _getLogger()
+
+    self._statsFilePath = (
+      os.path.expanduser(os.path.expandvars(statsFilePath)) if statsFilePath
+      else None)
+
+    self._exportIntervalSec = exportIntervalSec
+
+    self._startTime = time.time()
+
+    self._lastExportTime = None
+
+    # modelID -> ModelRuntimeStats
+    self._modelStatsMap = dict()
+
+
+  def _getModelStats(self, modelID):
+    modelStats = self._modelStatsMap.get(modelID)
+    if modelStats is None:
+      modelStats = self._modelStatsMap[modelID] = ModelRuntimeStats()
+
+    return modelStats
+
+
+  def getModelStats(self, modelID):
+    """
+    :returns: the model's ModelRuntimeStats instance; None if nothing was
+      recorded for the model
+    """
+    return self._modelStatsMap.get(modelID)
+
+
+  def noteModelStarted(self, modelID):
+    self._getModelStats(modelID).numRuns += 1
+
+
+  def noteModelDone(self, modelID, exitStatus, runSec):
+    """
+    :param exitStatus: exit status of the model's ModelRunner per
+      os.WEXITSTATUS
+    :param runSec: seconds from the start of the model in the slot until done
+    """
+    modelStats = self._getModelStats(modelID)
+    modelStats.runSec += runSec
+    if exitStatus != 0:
+      modelStats.numFailedRuns += 1
+
+
+  def noteRunReport(self, modelID, report):
+    """
+    :param report: dict from ModelRunStats.toReport() as reported by the
+      model's ModelRunner
+    """
+    self._getModelStats(modelID).addRunReport(report)
+
+
+  def noteWait(self, modelID, waitSec):
+    self._getModelStats(modelID).addWait(waitSec)
+
+
+  def notePreemption(self, modelID):
+    self._getModelStats(modelID).numPreemptions += 1
+
+
+  def getSnapshot(self, now=None):
+    """
+    :param now: time of the snapshot; defaults to time.time()
+
+    :returns: JSONifiable dict in the stats file format
+    """
+    totals = ModelRuntimeStats()
+    for modelStats in self._modelStatsMap.itervalues():
+      totals.add(modelStats)
+
+    return {
+      "version": self.FORMAT_VERSION,
+      "timestamp": time.time() if now is None else now,
+      "startTime": self._startTime,
+      "totals": totals.toDict(),
+      "models": dict((modelID, modelStats.toDict())
+                     for modelID, modelStats in self._modelStatsMap.iteritems())
+    }
+
+
+  def exportIfDue(self, now):
+    """ Export to the stats file, if enabled and the export interval has
+    elapsed since the last export
+
+    :param now: current time; seconds since the epoch
+    """
+    if self._statsFilePath is None:
+      return
+
+    if (self._lastExportTime is not None and
+        now - self._lastExportTime < self._exportIntervalSec):
+      return
+
+    self.export(now)
+
+
+  def export(self, now=None):
+    """ Write a snapshot to the stats file, if enabled, replacing it
+    atomically. Failures are logged, since statistics are not worth disrupting
+    the model swapper for.
+
+    :param now: time of the snapshot; defaults to time.time()
+    """
+    if self._statsFilePath is None:
+      return
+
+    now = time.time() if now is None else now
+    self._lastExportTime = now
+
+    tempFilePath = "%s.tmp-%s" % (self._statsFilePath, os.getpid())
+    try:
+      with open(tempFilePath, "w") as fileObj:
+        json.dump(self.getSnapshot(now), fileObj, sort_keys=True)
+
+      os.rename(tempFilePath, self._statsFilePath)
+    except EnvironmentError:
+      self._logger.exception("Failed to export runtime stats to %s",
+                             self._statsFilePath)
+      if os.path.exists(tempFilePath):
+        os.remove(tempFilePath)
+
+
+
+class RuntimeStatsReader(object):
+  """ Reads the stats file exported by RuntimeStatsAggregator on behalf of
+  components outside of the model swapper, re-reading it when it changes. Not
+  thread-safe.
+  """
+
+  def __init__(self, statsFilePath):
+    """
+    :param statsFilePath: path of the stats file; may use environment
+      variables. None or empty yields no statistics.
+    """
+    self._logger = _getLogger()
+
+    self._statsFilePath = (
+      os.path.expanduser(os.path.expandvars(statsFilePath)) if statsFilePath
+      else None)
+
+    # Modification time of the stats file when it was last read
+    self._statsFileMTime = None
+
+    # The last stats file snapshot that was read; None if none
+    self._snapshot = None
+
+
+  def getSnapshot(self):
+    """
+    :returns: the most recent snapshot in the stats file format; None if the
+      stats file doesn't exist or has an unexpected version
+    """
+    if self._statsFilePath is None:
+      return None
+
+    try:
+      mtime = os.path.getmtime(self._statsFilePath)
+    except EnvironmentError:
+      # Not exported yet
+      return self._snapshot
+
+    if mtime != self._statsFileMTime:
+      try:
+        with open(self._statsFilePath) as fileObj:
+          snapshot = json.load(fileObj)
+      except (EnvironmentError, ValueError):
+        self._logger.exception("Failed to read runtime stats from %s",
+                               self._statsFilePath)
+      else:
+        self._statsFileMTime = mtime
+        if snapshot.get("version") == RuntimeStatsAggregator.FORMAT_VERSION:
+          self._snapshot = snapshot
+        else:
+          self._logger.warning("Ignoring runtime stats version=%r in %s",
+                               snapshot.get("version"), self._statsFilePath)
+          self._snapshot = None
+
+    return self._snapshot
+
+
+  def getRowsPerSec(self, modelID):
+    """
+    :returns: the observed number of input rows that the model processes per
+      second; the rate of all models if the model's rate wasn't measured yet;
+      None if no rate was measured
+    """
+    snapshot = self.getSnapshot()
+    if snapshot is None:
+      return None
+
+    for stats in (snapshot["models"].get(modelID), snapshot["totals"]):
+      if stats and stats.get("rowsPerSec"):
+        return stats["rowsPerSec"]
+
+    return None
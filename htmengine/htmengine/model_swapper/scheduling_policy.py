@@ -0,0 +1,475 @@
+# ----------------------------------------------------------------------
+# Numenta Platform for Intelligent Computing (NuPIC)
+# Copyright (C) 2015, Numenta, Inc.  Unless you have purchased from
+# Numenta, Inc. a separate commercial license for this software code, the
+# following terms and conditions apply:
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero Public License for more details.
+#
+# You should have received a copy of the GNU Affero Public License
+# along with this program.  If not, see http://www.gnu.org/licenses.
+#
+# http://numenta.org/licenses/
+# ----------------------------------------------------------------------
+
+"""
+This module implements the scheduling policies that SwapController uses to pick
+the next waiting model to run and the running model to preempt.
+"""
+
+import abc
+from collections import deque
+import heapq
+import itertools
+
+
+
+class ModelWaitTimeStats(object):
+  """ Wait-time statistics of a model: how long the model waited to be
+  scheduled after SwapController learned of its pending input
+  """
+
+  __slots__ = ("numWaits", "totalWaitSec", "maxWaitSec")
+
+
+  def __init__(self):
+    self.numWaits = 0
+    self.totalWaitSec = 0.0
+    self.maxWaitSec = 0.0
+
+
+  def __repr__(self):
+    return ("%s<numWaits=%s, meanWaitSec=%.3f, maxWaitSec=%.3f>" % (
+      self.__class__.__name__, self.numWaits, self.meanWaitSec,
+      self.maxWaitSec))
+
+
+  @property
+  def meanWaitSec(self):
+    return self.totalWaitSec / self.numWaits if self.numWaits else 0.0
+
+
+  def addWait(self, waitSec):
+    self.numWaits += 1
+    self.totalWaitSec += waitSec
+    self.maxWaitSec = max(self.maxWaitSec, waitSec)
+
+
+
+class SchedulingPolicyBase(object):
+  """ Baseline interface definition for SwapController's scheduling policies;
+  also acts as factory for derived policies.
+
+  A policy orders the models that are waiting for a slot and ranks running
+  models as preemption candidates; it also maintains per-model wait-time
+  statistics. It's used only from SwapController's event loop thread, so it
+  needn't be thread-safe.
+
+  NOTE: Derived policy classes must register themselves via our class decorator
+    SchedulingPolicyBase.registerSchedulingPolicy
+  """
+
+  __metaclass__ = abc.ABCMeta
+
+
+  # Registry of scheduling policies populated by our registerSchedulingPolicy
+  # decorator
+  # key: policy name (e.g., "fifo")
+  # value: policy class
+  _policyRegistry = dict()
+
+
+  # True if the policy orders waiting models by their input backlog, in which
+  # case SwapController passes the backlog to addWaitingModel and noteNewInput
+  usesInputBacklog = False
+
+
+  @classmethod
+  def registerSchedulingPolicy(cls, name):
+    """ Decorator for registering derived scheduling policy classes with the
+    factory
+
+    :param name: policy name used in the "scheduling_policy" option of the
+      swap_controller section of model-swapper.conf
+    """
+    def decorator(policyClass):
+      assert name not in cls._policyRegistry, (
+        name, cls._policyRegistry[name], policyClass)
+      cls._policyRegistry[name] = policyClass
+      return policyClass
+
+    return decorator
+
+
+  @classmethod
+  def createSchedulingPolicy(cls, config):
+    """ Factory for scheduling policies
+
+    :param config: ModelSwapperConfig instance
+
+    :returns: SchedulingPolicyBase-based policy object corresponding to the
+      configured "scheduling_policy" option of the swap_controller section
+    """
+    name = config.get("swap_controller", "scheduling_policy")
+    return cls._policyRegistry[name].createFromConfig(config)
+
+
+  @classmethod
+  @abc.abstractmethod
+  def createFromConfig(cls, config):
+    """ Create an instance of the policy from configuration
+
+    :param config: ModelSwapperConfig instance
+    """
+
+
+  def __init__(self):
+    # Map of modelIDs of waiting models to the time when they started waiting
+    self._waitStartTimeMap = dict()
+
+    # Map of modelIDs to ModelWaitTimeStats instances
+    self._waitTimeStatsMap = dict()
+
+
+  def __len__(self):
+    """ Number of waiting models """
+    return len(self._waitStartTimeMap)
+
+
+  def __contains__(self, modelID):
+    """ Check whether the given model is waiting """
+    return modelID in self._waitStartTimeMap
+
+
+  def __iter__(self):
+    """ Iterate over modelIDs of waiting models in scheduling order """
+    return iter(self._getWaitingModelsInOrder())
+
+
+  @property
+  def waitTimeStats(self):
+    """ Map of modelIDs to ModelWaitTimeStats instances of models that have
+    waited at least once
+    """
+    return self._waitTimeStatsMap
+
+
+  def addWaitingModel(self, modelID, now, backlog=None):
+    """ Add a model that has pending input to the waiting models
+
+    :param modelID: model ID of a model that isn't already waiting
+    :param now: the current time (time.time())
+    :param backlog: number of the model's pending input batches (see
+      usesInputBacklog); None if unknown
+    """
+    assert modelID not in self._waitStartTimeMap, modelID
+    self._waitStartTimeMap[modelID] = now
+    self._addWaitingModel(modelID, now, backlog)
+
+
+  def noteNewInput(self, modelID, now,
+                   backlog=None):  # pylint: disable=W0613
+    """ Account for another input batch of a model that is already waiting
+
+    :param modelID: model ID of a waiting model
+    :param now: the current time (time.time())
+    :param backlog: number of the model's pending input batches (see
+      usesInputBacklog); None if unknown
+    """
+    assert modelID in self._waitStartTimeMap, modelID
+
+
+  def peekNextModel(self):
+    """
+    :returns: model ID of the waiting model that should run next; None if there
+      are no waiting models
+    """
+    if not self._waitStartTimeMap:
+      return None
+
+    return self._peekNextModel()
+
+
+  def peekNextModels(self, count):
+    """
+    :param count: maximum number of models to return
+
+    :returns: sequence of model IDs of up to the given number of waiting models
+      that should run next, in scheduling order
+    """
+    return tuple(itertools.islice(self, count))
+
+
+  def popNextModel(self, now):
+    """ Remove the waiting model that should run next and account for its wait
+    time
+
+    :param now: the current time (time.time())
+
+    :returns: a two-tuple: the model ID and the number of seconds it waited
+    """
+    modelID = self._popNextModel()
+
+    waitSec = now - self._waitStartTimeMap.pop(modelID)
+
+    stats = self._waitTimeStatsMap.get(modelID)
+    if stats is None:
+      stats = self._waitTimeStatsMap[modelID] = ModelWaitTimeStats()
+    stats.addWait(waitSec)
+
+    return modelID, waitSec
+
+
+  @abc.abstractmethod
+  def rankPreemptionCandidates(self, runningModels, now):
+    """ Rank running models as preemption candidates
+
+    :param runningModels: sequence of _RunningModelInfo-like objects with
+      slotIndex, startTime, and timestamp (input activity) attributes of
+      running models that aren't pending preemption
+    :param now: the current time (time.time())
+
+    :returns: a list of the eligible candidates from runningModels, most
+      preferred first; may be empty
+    """
+
+
+  def getPreemptionDeferralSec(self, runningModels,  # pylint: disable=W0613
+                               now):  # pylint: disable=W0613
+    """ When rankPreemptionCandidates returns no candidates, return the number of
+    seconds after which one of the given running models would become eligible
+    for preemption; None if that won't happen by the mere passage of time.
+
+    :param runningModels: see rankPreemptionCandidates
+    :param now: the current time (time.time())
+    """
+    return None
+
+
+  @abc.abstractmethod
+  def _addWaitingModel(self, modelID, now, backlog):
+    """ Add a model to the policy's waiting-models structure
+
+    :param backlog: see addWaitingModel
+    """
+
+
+  @abc.abstractmethod
+  def _peekNextModel(self):
+    """ Return model ID of the next model in a non-empty waiting-models
+    structure
+    """
+
+
+  @abc.abstractmethod
+  def _popNextModel(self):
+    """ Remove and return model ID of the next model from a non-empty
+    waiting-models structure
+    """
+
+
+  @abc.abstractmethod
+  def _getWaitingModelsInOrder(self):
+    """ Return a sequence of modelIDs of waiting models in scheduling order """
+
+
+
+@SchedulingPolicyBase.registerSchedulingPolicy("fifo")
+class FIFOSchedulingPolicy(SchedulingPolicyBase):
+  """ Runs waiting models in first-come first-served order and preempts the
+  running model with the least-recent input activity
+  """
+
+
+  @classmethod
+  def createFromConfig(cls, config):  # pylint: disable=W0613
+    return cls()
+
+
+  def __init__(self):
+    super(FIFOSchedulingPolicy, self).__init__()
+
+    self._fifo = deque()
+
+
+  def rankPreemptionCandidates(self, runningModels, now):  # pylint: disable=W0613
+    return sorted(runningModels, key=lambda info: info.timestamp)
+
+
+  def _addWaitingModel(self, modelID, now,
+                       backlog):  # pylint: disable=W0613
+    self._fifo.append(modelID)
+
+
+  def _peekNextModel(self):
+    return self._fifo[0]
+
+
+  def _popNextModel(self):
+    return self._fifo.popleft()
+
+
+  def _getWaitingModelsInOrder(self):
+    return tuple(self._fifo)
+
+
+
+@SchedulingPolicyBase.registerSchedulingPolicy("heap")
+class HeapSchedulingPolicy(SchedulingPolicyBase):
+  """ Weighs input backlog and age of pending input so that a model with a large
+  backlog doesn't hold up models with a few fresh samples:
+
+  Waiting models are kept in a heap keyed by the time when their oldest pending
+  input arrived plus a penalty for each additional pending input batch, up to a
+  maximum penalty; the model with the earliest key runs next. Since the keys
+  don't change with the passage of time and the penalty is bounded, a model with
+  a large or steadily growing backlog still runs once the models with fresher
+  input that arrived after its key are served.
+
+  The running model that has been running longest is preempted first, but only
+  after it has had at least the minimum run quantum, so that the cost of a swap
+  is amortized over a useful amount of work.
+
+  The backlog is the depth of the model's input queue that SwapController
+  reports when the model starts waiting and on each of its input notifications
+  while it waits, so it accounts for input that a preempted model left behind
+  and for batches whose notifications the producers coalesced. When the depth
+  is unknown, each notification counts as one more pending batch.
+  """
+
+
+  usesInputBacklog = True
+
+
+  # Rebuild the heap when stale entries exceed this multiple of live entries
+  _MAX_STALE_ENTRIES_RATIO = 2
+
+
+  @classmethod
+  def createFromConfig(cls, config):
+    return cls(
+      backlogPenaltySec=config.getfloat("swap_controller",
+                                        "backlog_penalty_sec"),
+      maxBacklogPenaltySec=config.getfloat("swap_controller",
+                                           "max_backlog_penalty_sec"),
+      minRunQuantumSec=config.getfloat("swap_controller",
+                                       "min_run_quantum_sec"))
+
+
+  def __init__(self, backlogPenaltySec, maxBacklogPenaltySec, minRunQuantumSec):
+    """
+    :param backlogPenaltySec: number of seconds by which each pending input
+      batch beyond the first delays a waiting model
+    :param maxBacklogPenaltySec: maximum number of seconds by which the backlog
+      delays a waiting model, so that a model that keeps receiving input isn't
+      starved by models with fresher input
+    :param minRunQuantumSec: minimum number of seconds that a model runs before
+      it may be preempted
+    """
+    super(HeapSchedulingPolicy, self).__init__()
+
+    self._backlogPenaltySec = backlogPenaltySec
+    self._maxBacklogPenaltySec = maxBacklogPenaltySec
+    self._minRunQuantumSec = minRunQuantumSec
+
+    # Heap of [key, sequence, modelID] entries; entries superseded by a later
+    # entry of the same model have modelID set to None
+    self._heap = []
+
+    # Map of modelIDs of waiting models to their live heap entries
+    self._entryMap = dict()
+
+    # Map of modelIDs of waiting models to number of pending input batches
+    self._backlogMap = dict()
+
+    # Tie-breaker that keeps models with equal keys in FIFO order
+    self._sequence = itertools.count()
+
+
+  def noteNewInput(self, modelID, now, backlog=None):
+    super(HeapSchedulingPolicy, self).noteNewInput(modelID, now, backlog)
+
+    if backlog is None:
+      backlog = self._backlogMap[modelID] + 1
+
+    # NOTE: the notification implies at least one pending batch, even if the
+    # batch hasn't reached the queue whose depth was reported yet
+    self._backlogMap[modelID] = max(backlog, 1)
+
+    # Supersede the model's heap entry with one reflecting the new backlog
+    self._entryMap[modelID][2] = None
+    self._pushEntry(modelID, self._getKey(modelID))
+
+    if len(self._heap) > (self._MAX_STALE_ENTRIES_RATIO + 1) * len(self):
+      self._heap = [entry for entry in self._heap if entry[2] is not None]
+      heapq.heapify(self._heap)
+
+
+  def rankPreemptionCandidates(self, runningModels, now):
+    return sorted(
+      (info for info in runningModels
+       if now - info.startTime >= self._minRunQuantumSec),
+      key=lambda info: info.startTime)
+
+
+  def getPreemptionDeferralSec(self, runningModels, now):
+    if not runningModels:
+      return None
+
+    earliestStartTime = min(info.startTime for info in runningModels)
+    return max(earliestStartTime + self._minRunQuantumSec - now, 0)
+
+
+  def _addWaitingModel(self, modelID, now, backlog):
+    self._backlogMap[modelID] = max(backlog, 1) if backlog is not None else 1
+    self._pushEntry(modelID, self._getKey(modelID))
+
+
+  def _peekNextModel(self):
+    self._discardStaleEntries()
+    return self._heap[0][2]
+
+
+  def _popNextModel(self):
+    self._discardStaleEntries()
+    modelID = heapq.heappop(self._heap)[2]
+    del self._entryMap[modelID]
+    del self._backlogMap[modelID]
+    return modelID
+
+
+  def peekNextModels(self, count):
+    return tuple(entry[2]
+                 for entry in heapq.nsmallest(count,
+                                              self._entryMap.itervalues()))
+
+
+  def _getWaitingModelsInOrder(self):
+    return tuple(entry[2] for entry in sorted(self._entryMap.itervalues()))
+
+
+  def _getKey(self, modelID):
+    """ Return the heap key of a waiting model per its wait start time and
+    backlog
+    """
+    return (self._waitStartTimeMap[modelID] +
+            min(self._backlogPenaltySec * (self._backlogMap[modelID] - 1),
+                self._maxBacklogPenaltySec))
+
+
+  def _pushEntry(self, modelID, key):
+    entry = [key, next(self._sequence), modelID]
+    self._entryMap[modelID] = entry
+    heapq.heappush(self._heap, entry)
+
+
+  def _discardStaleEntries(self):
+    while self._heap[0][2] is None:
+      heapq.heappop(self._heap)
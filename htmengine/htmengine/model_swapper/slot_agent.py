@@ -25,19 +25,25 @@ execution slot within a Model Scheduler service instance.
 """
 
 import errno
+import json
 import os
 import Queue
 import signal
 import subprocess
 import sys
 import threading
+import time
 
 
+import psutil
+
 from nta.utils.error_handling import abortProgramOnAnyException
 from nta.utils.error_handling import logExceptions
 
 
 from htmengine import htmengine_logging
+from htmengine.model_swapper import ModelSwapperConfig
+from htmengine.model_swapper.model_runner_pool import ModelRunnerPool
 
 
 
@@ -46,12 +52,32 @@ _MODULE_NAME = "htmengine.model_swapper.slot_agent"
 
 _EXIT_CODE_ON_UNHANDLED_EXCEPTION_IN_THREAD = 1
 
+# Preemption request line for the resident ModelRunner; NOTE: must match
+# model_runner.ResidentModelRunner.STOP_MODEL_COMMAND
+_RESIDENT_STOP_MODEL_COMMAND = "stop"
+
 
 def _getLogger():
   return htmengine_logging.getExtendedLogger(_MODULE_NAME)
 
 
 
+def _pinProcessToCpu(pid, cpu, logger):
+  """ Restrict the process to the given CPU via sched_setaffinity. Failure is
+  logged and otherwise ignored, since pinning is only an optimization (e.g.,
+  the process may have exited already, or the platform may not support it).
+
+  :param pid: process ID
+  :param cpu: index of the CPU
+  :param logger: logger for reporting failure
+  """
+  try:
+    psutil.Process(pid).set_cpu_affinity([cpu])
+  except (psutil.Error, AttributeError, EnvironmentError):
+    logger.warn("Failed to pin pid=%s to cpu=%s", pid, cpu, exc_info=True)
+
+
+
 class ModelRunnerProxy(object):
   """ Proxy for creating, controlling, and monitoring a ModelRunner process """
 
@@ -65,26 +91,43 @@ class ModelRunnerProxy(object):
     pass
 
 
-  def __init__(self, modelID, onTermination, logger):
+  def __init__(self, modelID, onTermination, logger, onMemoryReport=None,
+               cpu=None, onRuntimeStatsReport=None):
     """
     :param onTermination: thread-safe callback that will be called on
       termination of the ModelRunner process
+    :param onMemoryReport: optional thread-safe callback that will be called
+      with the ModelRunner's memory footprint in bytes when ModelRunner reports
+      it after loading the model
+    :param cpu: optional index of the CPU to pin the ModelRunner process to
+    :param onRuntimeStatsReport: optional thread-safe callback that will be
+      called with the statistics of the run (see
+      runtime_stats.ModelRunStats.toReport) when ModelRunner reports them at
+      the end of the run
     """
     self._logger = logger
     self._modelID = modelID
     self._onTermination = onTermination
+    self._onMemoryReport = onMemoryReport
+    self._onRuntimeStatsReport = onRuntimeStatsReport
 
-    self._process = subprocess.Popen(
-      args=[sys.executable,
-            "-m", "htmengine.model_swapper.model_runner",
-            "--modelID=" + str(modelID)],
-      stdin=subprocess.PIPE,
-      close_fds=True)
+    # NOTE: this uses a warm ModelRunner process from the pool, if available
+    self._process = ModelRunnerPool.startModelRunner(modelID)
 
     self._pid = self._process.pid
 
+    if cpu is not None:
+      _pinProcessToCpu(self._pid, cpu, self._logger)
+
     self._logger.debug("%r: Started ModelRunner", self)
 
+    # Start thread that reads reports from the process
+    self._readerThread = threading.Thread(
+      target=self._runReportReaderThread,
+      name="%s-reader-%s" % (self.__class__.__name__, self._pid,))
+    self._readerThread.setDaemon(True)
+    self._readerThread.start()
+
     # Start thread that notifies our client when the process terminates
     self._monitorThread = threading.Thread(
       target=self._runProcessMonitorThread,
@@ -160,6 +203,22 @@ class ModelRunnerProxy(object):
                                     "stdin: %r" % (self, e))
 
 
+  @abortProgramOnAnyException(
+    _EXIT_CODE_ON_UNHANDLED_EXCEPTION_IN_THREAD,
+    logger=_getLogger())
+  @logExceptions(_getLogger())
+  def _runReportReaderThread(self):
+    for line in iter(self._process.stdout.readline, ""):
+      report = json.loads(line)
+
+      if "memoryFootprint" in report and self._onMemoryReport is not None:
+        self._onMemoryReport(report["memoryFootprint"])
+
+      if ("runtimeStats" in report and
+          self._onRuntimeStatsReport is not None):
+        self._onRuntimeStatsReport(report["runtimeStats"])
+
+
   @abortProgramOnAnyException(
     _EXIT_CODE_ON_UNHANDLED_EXCEPTION_IN_THREAD,
     logger=_getLogger())
@@ -167,11 +226,302 @@ class ModelRunnerProxy(object):
   def _runProcessMonitorThread(self):
     self._logger.debug("%s: _runProcessMonitorThread is running", self)
     self._process.wait()
+
+    # Make sure that reports are delivered before termination
+    self._readerThread.join()
+
     self._logger.debug("%s: ModelRunner subprocess terminated", self)
     self._onTermination()
 
 
 
+class ResidentModelRunnerProxy(object):
+  """ Proxy for creating, controlling, and monitoring a resident ModelRunner
+  process (see model_runner.ResidentModelRunner) that runs the models assigned
+  to a SlotAgent one at a time.
+
+  The model-related methods provide the same interface as ModelRunnerProxy for
+  use by SlotAgent's event loop.
+  """
+
+
+  _MAX_WAIT_FOR_GRACEFUL_STOP_SEC = 60*4
+  _MAX_WAIT_AFTER_SIGKILL_SEC = 10
+
+  # Return code reported for a model when the resident ModelRunner process
+  # exited without completing the model, but with exit status 0
+  _MODEL_INCOMPLETE_RETURN_CODE = 1
+
+
+  def __init__(self, logger, cpu=None):
+    """
+    :param cpu: optional index of the CPU to pin the resident ModelRunner
+      process to
+    """
+    self._logger = logger
+
+    self._process = subprocess.Popen(
+      args=[sys.executable,
+            "-m", "htmengine.model_swapper.model_runner",
+            "--resident"],
+      stdin=subprocess.PIPE,
+      stdout=subprocess.PIPE,
+      close_fds=True)
+
+    self._pid = self._process.pid
+
+    if cpu is not None:
+      _pinProcessToCpu(self._pid, cpu, self._logger)
+
+    self._condition = threading.Condition()
+
+    # ID of the model currently running in the resident ModelRunner; None if
+    # idle
+    self._modelID = None
+
+    # True when the resident ModelRunner reported completion of the current
+    # model
+    self._modelDone = False
+
+    # Callback for termination of the current model
+    self._onModelTermination = None
+
+    # Optional callbacks for the current model's memory footprint, runtime
+    # statistics, and cache eviction reports
+    self._onMemoryReport = None
+    self._onRuntimeStatsReport = None
+    self._onEvictionReport = None
+
+    # True after the resident ModelRunner process exits
+    self._exited = False
+
+    self._logger.debug("%r: Started resident ModelRunner", self)
+
+    # Start thread that reads model completion reports from the process
+    self._readerThread = threading.Thread(
+      target=self._runControlReaderThread,
+      name="%s-reader-%s" % (self.__class__.__name__, self._pid,))
+    self._readerThread.setDaemon(True)
+    self._readerThread.start()
+
+    # Start thread that notifies our client when the process terminates
+    self._monitorThread = threading.Thread(
+      target=self._runProcessMonitorThread,
+      name="%s-waitPID-%s" % (self.__class__.__name__, self._pid,))
+    self._monitorThread.setDaemon(True)
+    self._monitorThread.start()
+
+
+  def __repr__(self):
+    return "%s<model=%s, pid=%s, returnCode=%s>" % (
+      self.__class__.__name__, self._modelID,
+      self._pid, self._process.returncode)
+
+
+  @property
+  def isAlive(self):
+    """ True if the resident ModelRunner process hasn't exited yet """
+    with self._condition:
+      return not self._exited
+
+
+  def startModel(self, modelID, onTermination, onMemoryReport=None,
+                 onRuntimeStatsReport=None, onEvictionReport=None):
+    """ Request the resident ModelRunner to run the given model
+
+    :param modelID: model ID
+    :param onTermination: thread-safe callback that will be called when the
+      model completes or the resident ModelRunner process terminates while
+      running the model
+    :param onMemoryReport: optional thread-safe callback that will be called
+      with the resident ModelRunner's memory footprint in bytes when it reports
+      it after loading the model or finding it in memory
+    :param onRuntimeStatsReport: optional thread-safe callback that will be
+      called with the statistics of the model's run when the resident
+      ModelRunner reports them at the end of the run
+    :param onEvictionReport: optional thread-safe callback that will be called
+      before onTermination with the sequence of IDs of the models that the
+      resident ModelRunner no longer holds in memory when it completes the model
+
+    :returns: self, for use as the ModelRunnerProxy-like model runner of the
+      model
+    """
+    with self._condition:
+      assert self._modelID is None, repr(self)
+      self._modelID = modelID
+      self._modelDone = False
+      self._onModelTermination = onTermination
+      self._onMemoryReport = onMemoryReport
+      self._onRuntimeStatsReport = onRuntimeStatsReport
+      self._onEvictionReport = onEvictionReport
+
+      if self._exited:
+        # NOTE: the monitor thread has already finished, so it's up to us to
+        # report termination
+        self._logger.error("%r: resident ModelRunner exited before model "
+                           "start", self)
+        onTermination()
+        return self
+
+    try:
+      self._process.stdin.write(str(modelID) + "\n")
+      self._process.stdin.flush()
+    except IOError:
+      # NOTE: the monitor thread will report termination of the model
+      self._logger.exception("%r: IO error starting model in resident "
+                             "ModelRunner", self)
+
+    return self
+
+
+  def stopGracefully(self):
+    """ Gracefully Stop the current model; blocking.
+
+    :returns: 0 if the resident ModelRunner completed the model; non-zero
+      return code if the resident ModelRunner process exited instead
+    """
+    self._logger.debug("%r: Stopping model in resident ModelRunner", self)
+
+    with self._condition:
+      stopRequired = not self._modelDone and not self._exited
+
+    if stopRequired:
+      try:
+        self._process.stdin.write(
+          _RESIDENT_STOP_MODEL_COMMAND + "\n")
+        self._process.stdin.flush()
+      except IOError:
+        self._logger.exception("%r: IO error requesting model stop", self)
+
+    with self._condition:
+      deadline = time.time() + self._MAX_WAIT_FOR_GRACEFUL_STOP_SEC
+      while not self._modelDone and not self._exited:
+        remaining = deadline - time.time()
+        if remaining <= 0:
+          break
+        self._condition.wait(remaining)
+
+      timedOut = not self._modelDone and not self._exited
+
+    if timedOut:
+      self._logger.error("%r: Graceful stop of model timed out; sending "
+                         "resident ModelRunner SIGKILL", self)
+      self._kill()
+
+    with self._condition:
+      modelDone = self._modelDone
+      self._modelID = None
+      self._onModelTermination = None
+      self._onMemoryReport = None
+      self._onRuntimeStatsReport = None
+      self._onEvictionReport = None
+
+    if modelDone:
+      self._logger.debug("%r: model stopped", self)
+      return 0
+
+    return self._process.returncode or self._MODEL_INCOMPLETE_RETURN_CODE
+
+
+  def close(self):
+    """ Stop the resident ModelRunner process; blocking. Expects no model to be
+    running.
+    """
+    self._logger.debug("%r: Closing resident ModelRunner", self)
+    try:
+      self._process.stdin.close()
+    except IOError:
+      pass
+
+    self._monitorThread.join(timeout=self._MAX_WAIT_FOR_GRACEFUL_STOP_SEC)
+    if self._monitorThread.isAlive():
+      self._logger.error("%r: Graceful shutdown of resident ModelRunner timed "
+                         "out; sending it SIGKILL", self)
+      self._kill()
+
+    self._logger.debug("%r: resident ModelRunner closed", self)
+
+
+  def _kill(self):
+    """ Force-kill the resident ModelRunner process and wait for it to be
+    reaped
+    """
+    try:
+      os.kill(self._pid, signal.SIGKILL)
+    except OSError as e:
+      if e.errno != errno.ESRCH:
+        raise
+
+      # "no such process" - our thread must have already reaped it
+
+    self._monitorThread.join(timeout=self._MAX_WAIT_AFTER_SIGKILL_SEC)
+    assert not self._monitorThread.isAlive()
+
+
+  def _reportModelTermination(self):
+    """ Invoke the current model's termination callback, if any; the caller
+    MUST hold self._condition
+    """
+    if self._onModelTermination is not None:
+      onTermination = self._onModelTermination
+      self._onModelTermination = None
+      onTermination()
+
+
+  @abortProgramOnAnyException(
+    _EXIT_CODE_ON_UNHANDLED_EXCEPTION_IN_THREAD,
+    logger=_getLogger())
+  @logExceptions(_getLogger())
+  def _runControlReaderThread(self):
+    for line in iter(self._process.stdout.readline, ""):
+      report = json.loads(line)
+
+      with self._condition:
+        if report["modelID"] != self._modelID:
+          self._logger.error("%r: Unexpected model report=%r", self, report)
+          continue
+
+        if "memoryFootprint" in report:
+          if self._onMemoryReport is not None:
+            self._onMemoryReport(report["memoryFootprint"])
+          continue
+
+        if "runtimeStats" in report:
+          if self._onRuntimeStatsReport is not None:
+            self._onRuntimeStatsReport(report["runtimeStats"])
+          continue
+
+        assert report["done"], report
+
+        if self._onEvictionReport is not None:
+          self._onEvictionReport(report.get("evictedModelIDs", []))
+
+        self._logger.debug("%r: resident ModelRunner completed model", self)
+        self._modelDone = True
+        self._condition.notifyAll()
+        self._reportModelTermination()
+
+
+  @abortProgramOnAnyException(
+    _EXIT_CODE_ON_UNHANDLED_EXCEPTION_IN_THREAD,
+    logger=_getLogger())
+  @logExceptions(_getLogger())
+  def _runProcessMonitorThread(self):
+    self._logger.debug("%s: _runProcessMonitorThread is running", self)
+    self._process.wait()
+
+    # Make sure that completion reports are delivered before termination
+    self._readerThread.join()
+
+    with self._condition:
+      self._logger.debug("%s: resident ModelRunner subprocess terminated",
+                         self)
+      self._exited = True
+      self._condition.notifyAll()
+      self._reportModelTermination()
+
+
+
 class SlotAgent(object):
   """ Manage a single ModelRunner execution slot within a Model Scheduler
   service instance """
@@ -194,6 +544,25 @@ class SlotAgent(object):
 
     self._slotID = slotID
 
+    # When True, this SlotAgent runs its models in a long-lived resident
+    # ModelRunner process that keeps recently-run models in memory
+    config = ModelSwapperConfig()
+
+    self._residentMode = config.getboolean("resident_model_runner", "enabled")
+
+    # Index of the CPU that this slot's ModelRunner processes are pinned to, so
+    # that a model that runs again in the same slot (see slot affinity in
+    # SwapController) finds its working set in that CPU's caches; None if not
+    # pinned
+    if config.getboolean("swap_controller", "pin_slot_cpus"):
+      self._cpu = slotID % psutil.NUM_CPUS
+    else:
+      self._cpu = None
+
+    # ResidentModelRunnerProxy instance in resident mode; created on demand by
+    # the event loop thread and replaced if the process dies
+    self._residentRunner = None
+
     # ID of the model, if any, currently associated with this SlotAgent
     # instance; used for logging and error-checking at the interface only.
     # WARNING: not synchronized with the event loop thread!
@@ -231,7 +600,9 @@ class SlotAgent(object):
     self._logger.debug("%r: {TAG:SWAP.SA.CLOSE.JOIN.DONE}", self)
 
 
-  def startModel(self, modelID, modelFinishedCallback):
+  def startModel(self, modelID, modelFinishedCallback,
+                 memoryReportCallback=None, runtimeStatsCallback=None,
+                 evictionReportCallback=None):
     """ Submit a request to start the requested model with the given modelID
     and feed it input records and commands from the given input queue.
 
@@ -239,6 +610,17 @@ class SlotAgent(object):
     :param modelFinishedCallback: callback to inform of completion; takes one
       arg: ModelRunner process exit status number per os.WEXITSTATUS (0 when
       successful).
+    :param memoryReportCallback: optional thread-safe callback to inform of
+      the memory footprint that ModelRunner reports after loading the model;
+      takes one arg: memory footprint in bytes.
+    :param runtimeStatsCallback: optional thread-safe callback to inform of
+      the statistics of the run that ModelRunner reports at the end of the run,
+      before modelFinishedCallback; takes one arg: the report dict (see
+      runtime_stats.ModelRunStats.toReport).
+    :param evictionReportCallback: optional thread-safe callback to inform of
+      the models that a resident ModelRunner no longer holds in memory when it
+      completes the model, before modelFinishedCallback; takes one arg: sequence
+      of model IDs. Called only in resident mode.
     """
     self._logger.debug("%r: {TAG:SWAP.SA.MODEL.START.REQ} model=%s",
                        self, modelID)
@@ -247,7 +629,10 @@ class SlotAgent(object):
     self._modelID = modelID
     self._eventQ.put({"method" : self._START_MODEL_METHOD,
                       "modelID" : modelID,
-                      "modelFinishedCallback" : modelFinishedCallback})
+                      "modelFinishedCallback" : modelFinishedCallback,
+                      "memoryReportCallback" : memoryReportCallback,
+                      "runtimeStatsCallback" : runtimeStatsCallback,
+                      "evictionReportCallback" : evictionReportCallback})
 
 
   def stopModel(self):
@@ -302,11 +687,27 @@ class SlotAgent(object):
         modelID = evt["modelID"]
         self._logger.debug("%r: {TAG:SWAP.SA.MODEL.STARTING} model=%s", self,
                            modelID)
-        modelRunner = ModelRunnerProxy(
-          modelID=modelID,
-          onTermination=lambda: self._eventQ.put(
-            {"method" : self._MODEL_RUNNER_EXITED}),
-          logger=self._logger)
+        onTermination = lambda: self._eventQ.put(
+          {"method" : self._MODEL_RUNNER_EXITED})
+
+        if self._residentMode:
+          if self._residentRunner is None or not self._residentRunner.isAlive:
+            self._residentRunner = ResidentModelRunnerProxy(
+              logger=self._logger, cpu=self._cpu)
+
+          modelRunner = self._residentRunner.startModel(
+            modelID=modelID, onTermination=onTermination,
+            onMemoryReport=evt["memoryReportCallback"],
+            onRuntimeStatsReport=evt["runtimeStatsCallback"],
+            onEvictionReport=evt["evictionReportCallback"])
+        else:
+          modelRunner = ModelRunnerProxy(
+            modelID=modelID,
+            onTermination=onTermination,
+            logger=self._logger,
+            onMemoryReport=evt["memoryReportCallback"],
+            cpu=self._cpu,
+            onRuntimeStatsReport=evt["runtimeStatsCallback"])
         modelState = _CurrentModelState(
           modelID=evt["modelID"], modelRunner=modelRunner,
           modelFinishedCallback=evt["modelFinishedCallback"])
@@ -378,6 +779,10 @@ class SlotAgent(object):
               "already pending; modelState=%r", self, modelState)
 
         if doClose:
+          if self._residentRunner is not None:
+            self._residentRunner.close()
+            self._residentRunner = None
+
           # Model is stopped, we're done!
           break
 
@@ -37,8 +37,13 @@ from nta.utils.error_handling import abortProgramOnAnyException
 from nta.utils.error_handling import logExceptions
 
 from htmengine.model_swapper import ModelSwapperConfig
+from htmengine.model_swapper.checkpoint_prefetcher import CheckpointPrefetcher
+from htmengine.model_swapper.input_shard_demultiplexer import (
+    InputShardDemultiplexer)
 from htmengine.model_swapper.model_swapper_interface import (
     ModelSwapperInterface)
+from htmengine.model_swapper.runtime_stats import RuntimeStatsAggregator
+from htmengine.model_swapper.scheduling_policy import SchedulingPolicyBase
 from htmengine.model_swapper.slot_agent import SlotAgent
 from htmengine import htmengine_logging
 
@@ -63,6 +68,10 @@ class SwapController(object):
   # "_handle" + method + "Event" (e.g., _handleStopEventLoopRequestEvent)
   _NEW_INPUT_NOTIFY_METHOD = "NewInputNotify"
   _MODEL_DONE_NOTIFY_METHOD = "ModelDoneNotify"
+  _MODEL_MEMORY_REPORT_METHOD = "ModelMemoryReport"
+  _MODEL_RUNTIME_STATS_REPORT_METHOD = "ModelRuntimeStatsReport"
+  _MODEL_EVICTION_REPORT_METHOD = "ModelEvictionReport"
+  _PREEMPTION_RETRY_METHOD = "PreemptionRetry"
   _STOP_EVENT_LOOP_REQUEST_METHOD = "StopEventLoopRequest"
 
 
@@ -77,10 +86,62 @@ class SwapController(object):
     """
     self._logger = _getLogger()
 
+    config = ModelSwapperConfig()
+
     self._profiling = (
-      ModelSwapperConfig().getboolean("debugging", "profiling") or
+      config.getboolean("debugging", "profiling") or
       self._logger.isEnabledFor(logging.DEBUG))
 
+    # When slot affinity is configured, or SlotAgents use resident ModelRunners
+    # that keep recently-run models in memory, we try to assign a model to the
+    # slot that ran it last
+    self._slotAffinityEnabled = (
+      config.getboolean("swap_controller", "slot_affinity") or
+      config.getboolean("resident_model_runner", "enabled"))
+
+    # (non-thread-safe) A map of modelIDs to the index of the slot that ran
+    # the model most recently. Maintained only when slot affinity is enabled;
+    # entries are dropped when the model is deleted or when the slot's
+    # resident ModelRunner reports that it evicted the model from its cache.
+    self._modelSlotAffinityMap = dict()
+
+    # Slot affinity statistics: number of model starts in the slot that ran the
+    # model most recently, in another slot because that one was busy, and of
+    # models that had no slot yet
+    self._numSlotAffinityHits = 0
+    self._numSlotAffinityMisses = 0
+    self._numSlotAffinityFirstRuns = 0
+
+    # Total memory budget in bytes for running models; 0 disables
+    # memory-budgeted admission, leaving only the slot count to limit the
+    # number of running models
+    self._memoryBudget = (
+      config.getint("swap_controller", "memory_budget_mb") * 1024 * 1024)
+
+    if (self._memoryBudget and
+        config.getboolean("resident_model_runner", "enabled")):
+      # A resident ModelRunner reports the RSS of its whole process, including
+      # the other models in its cache, and keeps that memory while its slot is
+      # idle, so per-model admission can't account for it
+      raise ValueError("Model swapper memory_budget_mb can't be combined with "
+                       "resident_model_runner")
+
+    # Memory footprint in bytes that we assume for a model until its
+    # ModelRunner reports the actual footprint
+    self._defaultModelMemory = (
+      config.getint("swap_controller", "default_model_memory_mb") * 1024 * 1024)
+
+    # (non-thread-safe) A map of modelIDs to the most recent memory footprint
+    # in bytes reported by the model's ModelRunner
+    self._modelMemoryFootprintMap = dict()
+
+    # Per-model runtime statistics, exported periodically to the stats file,
+    # if one is configured
+    self._runtimeStats = RuntimeStatsAggregator(
+      statsFilePath=config.get("swap_controller", "runtime_stats_file"),
+      exportIntervalSec=config.getint("swap_controller",
+                                      "runtime_stats_interval_sec"))
+
     # Allowed number of model slots
     self._concurrency = concurrency
 
@@ -111,9 +172,33 @@ class SwapController(object):
     # threads because ModelSwapperInterface
     self._mainSwapper = ModelSwapperInterface()
 
-    # A (non-thread-safe) FIFO of models that are waiting to be scheduled for
-    # running; there is incoming data for them that needs to be processed
-    self._waitingModelsFIFO = []
+    # InputShardDemultiplexer that moves request batches from the shared input
+    # shard queues into the models' input spools; None when each model has its
+    # own input queue
+    numInputShards = config.getint("interface_bus", "num_input_shards")
+    if numInputShards > 0:
+      self._inputShardDemux = InputShardDemultiplexer(
+        numShards=numInputShards,
+        onNewInputTS=self._spooledInputNotifyTS)
+    else:
+      self._inputShardDemux = None
+
+    # A (non-thread-safe) scheduling policy that orders the models that are
+    # waiting to be scheduled for running (there is incoming data for them that
+    # needs to be processed) and ranks running models for preemption
+    self._waitingModels = SchedulingPolicyBase.createSchedulingPolicy(config)
+
+    # threading.Timer that enqueues a preemption retry event when the
+    # scheduling policy defers preemption; None when not armed
+    self._preemptionRetryTimer = None
+
+    # Number of models at the head of the waiting models whose checkpoints we
+    # prefetch; 0 disables prefetch
+    self._prefetchDepth = config.getint("swap_controller", "prefetch_depth")
+
+    # CheckpointPrefetcher instance; None when prefetch is disabled
+    self._checkpointPrefetcher = (
+      CheckpointPrefetcher() if self._prefetchDepth > 0 else None)
 
     # A (non-thread-safe) map of modelIDs to _RunningModelInfo instances
     self._runningModelsMap = dict()
@@ -144,21 +229,34 @@ class SwapController(object):
     assert self._notificationReaderStartedEvent.is_set(), \
       "Notification-reader thread failed to start in time"
 
+    if self._inputShardDemux is not None:
+      self._inputShardDemux.start()
+
     self._logger.info("Notification Reader started, now entering Event Loop")
 
     requestedStopOfRemainingModels = False
 
     while True:
       if self._eventLoopStopPending:
-        if not self._runningModelsMap and not self._waitingModelsFIFO:
+        if not self._runningModelsMap and not self._waitingModels:
           # All models are idle now, so close Slot Agents and bail out
           for sa in self._slotAgents:
             sa.close()
 
+          if self._preemptionRetryTimer is not None:
+            self._preemptionRetryTimer.cancel()
+
+          if self._checkpointPrefetcher is not None:
+            self._checkpointPrefetcher.close()
+
+          self._logWaitTimeStats()
+          self._logSlotAffinityStats()
+          self._runtimeStats.export()
+
           self._logger.info("Closed all Slot Agents; leaving event loop")
           break
 
-        elif not self._waitingModelsFIFO and not requestedStopOfRemainingModels:
+        elif not self._waitingModels and not requestedStopOfRemainingModels:
           # Only running models remain, so request to stop them gracefully
           assert self._runningModelsMap
 
@@ -177,6 +275,8 @@ class SwapController(object):
       handler = getattr(self, "_handle" + method + "Event")
       handler(**evt)
 
+      self._runtimeStats.exportIfDue(time.time())
+
 
   def requestStopTS(self):
     """ [thread-safe; non-blocking] Enqueue a request to stop the
@@ -199,6 +299,18 @@ class SwapController(object):
     self._eventQ.put({"method" : self._STOP_EVENT_LOOP_REQUEST_METHOD})
 
 
+  def _spooledInputNotifyTS(self, modelID):
+    """ [thread-safe] Called by the input shard demultiplexer when it spooled
+    new input data for the given model. Once stop is requested, the spooled
+    input is left for discovery on the next start.
+
+    :param modelID: ID of the model for which new data was spooled
+    """
+    with self._notificationMutex:
+      if not self._stopNotificationReader:
+        self._newInputNotifyTS(modelID)
+
+
   def _newInputNotifyTS(self, modelID):
     """ [thread-safe] Notify Model Swapper that new input data arrived for the
     given model
@@ -223,6 +335,53 @@ class SwapController(object):
                       "endTime" : time.time()})
 
 
+  def _modelMemoryReportTS(self, modelID, memoryFootprint):
+    """ [thread-safe] Notify Model Swapper of the memory footprint of a running
+    model. This method is passed as a callback to the SlotAgent that runs the
+    model.
+
+    :param modelID: model ID of the running model
+    :param memoryFootprint: memory footprint of the model's ModelRunner process
+      in bytes
+    """
+    self._eventQ.put({"method" : self._MODEL_MEMORY_REPORT_METHOD,
+                      "modelID" : modelID, "memoryFootprint" : memoryFootprint})
+
+
+  def _modelRuntimeStatsReportTS(self, modelID, report):
+    """ [thread-safe] Notify Model Swapper of the statistics of a model's run
+    as reported by its ModelRunner at the end of the run. This method is passed
+    as a callback to the SlotAgent that runs the model.
+
+    :param modelID: model ID of the model
+    :param report: dict from runtime_stats.ModelRunStats.toReport()
+    """
+    self._eventQ.put({"method" : self._MODEL_RUNTIME_STATS_REPORT_METHOD,
+                      "modelID" : modelID, "report" : report})
+
+
+  def _modelEvictionReportTS(self, modelID, slotIndex, evictedModelIDs):
+    """ [thread-safe] Notify Model Swapper of the models that a slot's resident
+    ModelRunner no longer holds in memory at the end of a model's run. This
+    method is passed as a callback to the SlotAgent that runs the model.
+
+    :param modelID: model ID of the model whose run ended
+    :param slotIndex: index of the slot that ran the model
+    :param evictedModelIDs: sequence of IDs of models that the ModelRunner
+      evicted from its cache or didn't cache
+    """
+    self._eventQ.put({"method" : self._MODEL_EVICTION_REPORT_METHOD,
+                      "modelID" : modelID, "slotIndex" : slotIndex,
+                      "evictedModelIDs" : evictedModelIDs})
+
+
+  def _preemptionRetryTS(self):
+    """ [thread-safe] Request re-evaluation of preemption after the scheduling
+    policy deferred it
+    """
+    self._eventQ.put({"method" : self._PREEMPTION_RETRY_METHOD})
+
+
   def _handleStopEventLoopRequestEvent(self, method):  # pylint: disable=W0613
     """ Set a flag to signal our event loop that it's time for graceful shutdown
     of the event loop. The event is enqueued by the "stop request" hander after
@@ -240,13 +399,14 @@ class SwapController(object):
       # This model is already running
       runningModelInfo.updateTimestamp()
 
-    elif modelID not in self._waitingModelsFIFO:
-      # This model was not running and is not awaiting execution
+    elif modelID in self._waitingModels:
+      # This model is already awaiting execution; let the scheduling policy
+      # account for its growing backlog
+      self._waitingModels.noteNewInput(
+        modelID, time.time(), backlog=self._getInputBacklogIfNeeded(modelID))
 
-      # TODO: for a large _waitingModelsFIFO, the membership check may be slow.
-      #  Consider employing a map of all models of interest with current state
-      #  (waiting/pending/running/idle) reflected in the items for O(1) lookups,
-      #  but profile first to see if it's a problem!
+    else:
+      # This model was not running and is not awaiting execution
 
       # NOTE: it's possible that the model has already processed all its input
       #  and we're handling this notification belatedly, and this may result in
@@ -255,21 +415,21 @@ class SwapController(object):
       #  However, if necessary, we can mitigate this by checking the model's
       #  input queue *just before* starting the model.
 
-      if self._freeSlots:
-        # No models should be waiting if we have a free slot
-        assert not self._waitingModelsFIFO, repr(self._waitingModelsFIFO)
-
+      if not self._waitingModels and self._canStartModel(modelID):
         # Assign the model to a free slot
         self._assignModelToFreeSlot(modelID)
 
       else:
         # This model needs to wait until resources become available
-        self._waitingModelsFIFO.append(modelID)
+        self._waitingModels.addWaitingModel(
+          modelID, time.time(),
+          backlog=self._getInputBacklogIfNeeded(modelID))
+        self._prefetchWaitingModels()
 
         if self._profiling:
           self._logger.info("{TAG:SWAP.SC.MODEL.WAIT} model=%s; "
                             "numWaitingModels=%s; numPendingPreemptSlots=%s",
-                            modelID, len(self._waitingModelsFIFO),
+                            modelID, len(self._waitingModels),
                             len(self._pendingPreemptSlotsSet))
 
         self._requestPreemptionOfRunningSlotIfNeededAndPossible()
@@ -284,13 +444,15 @@ class SwapController(object):
     """
     doneModelInfo = self._runningModelsMap.pop(modelID)
 
+    self._runtimeStats.noteModelDone(modelID, exitStatus,
+                                     endTime - doneModelInfo.startTime)
 
     if self._profiling:
       self._logger.info(
         "{TAG:SWAP.SC.MODEL.DONE} model=%s; slot=%d; exitStatus=%d; "
         "duration=%s; numRunningModels=%s; numWaitingModels=%s", modelID,
         doneModelInfo.slotIndex, exitStatus, endTime - doneModelInfo.startTime,
-        len(self._runningModelsMap), len(self._waitingModelsFIFO))
+        len(self._runningModelsMap), len(self._waitingModels))
 
     assert doneModelInfo.slotIndex not in self._freeSlots
     assert 0 <= doneModelInfo.slotIndex < len(self._slotAgents)
@@ -310,26 +472,195 @@ class SwapController(object):
       # so notify ourselves asynchronously to schedule this model
       self._newInputNotifyTS(modelID)
 
-    if self._waitingModelsFIFO:
-      # Start a waiting model, now that we know there is a free slot
-      newModelID = self._waitingModelsFIFO.pop(0)
-      self._assignModelToFreeSlot(newModelID)
+    # Start waiting model(s), now that we know there is a free slot
+    self._startWaitingModels()
+
+    if self._waitingModels:
+      self._requestPreemptionOfRunningSlotIfNeededAndPossible()
+
+
+  def _handleModelMemoryReportEvent(self, method,  # pylint: disable=W0613
+                                    modelID, memoryFootprint):
+    """ Notification of a running model's memory footprint as reported by its
+    ModelRunner after loading the model
+    """
+    self._modelMemoryFootprintMap[modelID] = memoryFootprint
+
+    runningModelInfo = self._runningModelsMap.get(modelID)
+    if runningModelInfo is not None:
+      runningModelInfo.memoryFootprint = memoryFootprint
+
+    if self._profiling:
+      self._logger.info(
+        "{TAG:SWAP.SC.MODEL.MEMORY} model=%s; memoryFootprint=%s; "
+        "memoryInUse=%s; memoryBudget=%s", modelID, memoryFootprint,
+        self._getMemoryInUse(), self._memoryBudget)
+
+    if self._memoryBudget and self._waitingModels:
+      # The actual footprint may differ from our estimate, so re-evaluate
+      # admission and eviction of waiting models
+      self._startWaitingModels()
+
+      if self._waitingModels:
+        self._requestPreemptionOfRunningSlotIfNeededAndPossible()
+
+
+  def _handleModelRuntimeStatsReportEvent(self, method,  # pylint: disable=W0613
+                                          modelID, report):
+    """ Statistics of a model's run as reported by its ModelRunner at the end
+    of the run
+    """
+    self._runtimeStats.noteRunReport(modelID, report)
+
+    if report.get("numDeletions"):
+      self._forgetSlotAffinity(modelID)
+      self._modelMemoryFootprintMap.pop(modelID, None)
+
 
+  def _handleModelEvictionReportEvent(self, method,  # pylint: disable=W0613
+                                      modelID, slotIndex, evictedModelIDs):
+    """ Models that a slot's resident ModelRunner no longer holds in memory as
+    reported at the end of a model's run
+    """
+    for evictedModelID in evictedModelIDs:
+      # The model may have run in another slot since
+      if self._modelSlotAffinityMap.get(evictedModelID) == slotIndex:
+        del self._modelSlotAffinityMap[evictedModelID]
+
+    if self._profiling:
+      self._logger.info(
+        "{TAG:SWAP.SC.SLOT.EVICT} model=%s; slot=%s; evictedModels=%s; "
+        "numAffinityModels=%s", modelID, slotIndex, evictedModelIDs,
+        len(self._modelSlotAffinityMap))
+
+
+  def _handlePreemptionRetryEvent(self, method):  # pylint: disable=W0613
+    """ The minimum run quantum of a running model expired after the scheduling
+    policy deferred preemption
+    """
+    self._preemptionRetryTimer = None
+
+    if self._waitingModels:
       self._requestPreemptionOfRunningSlotIfNeededAndPossible()
 
 
+  def _getInputBacklogIfNeeded(self, modelID):
+    """ Return the number of the given waiting model's pending input batches
+    if the scheduling policy orders waiting models by their backlog; None
+    otherwise, sparing the message bus round-trip
+    """
+    if not self._waitingModels.usesInputBacklog:
+      return None
+
+    return self._mainSwapper.getModelInputBacklog(modelID)
+
+
+  def _getModelMemoryEstimate(self, modelID):
+    """ Return the expected memory footprint of the given model in bytes: the
+    most recent footprint reported for the model, if any; otherwise, the
+    default
+    """
+    return self._modelMemoryFootprintMap.get(modelID, self._defaultModelMemory)
+
+
+  def _getMemoryInUse(self, excludeSlots=()):
+    """ Return the total memory footprint of running models in bytes
+
+    :param excludeSlots: container of indexes of slots whose models to exclude
+    """
+    return sum(info.memoryFootprint
+               for info in self._runningModelsMap.itervalues()
+               if info.slotIndex not in excludeSlots)
+
+
+  def _canStartModel(self, modelID):
+    """ Check whether there are resources to start the given model now: a free
+    slot and, when memory-budgeted admission is enabled, enough memory in the
+    budget. A model is always admitted when no other models are running, so
+    that a model that exceeds the budget by itself may still run.
+    """
+    if not self._freeSlots:
+      return False
+
+    if not self._memoryBudget or not self._runningModelsMap:
+      return True
+
+    return (self._getMemoryInUse() + self._getModelMemoryEstimate(modelID) <=
+            self._memoryBudget)
+
+
+  def _startWaitingModels(self):
+    """ Start waiting models in the scheduling policy's order while there are
+    resources for the next one
+    """
+    while (self._waitingModels and
+           self._canStartModel(self._waitingModels.peekNextModel())):
+      modelID, waitSec = self._waitingModels.popNextModel(time.time())
+
+      self._runtimeStats.noteWait(modelID, waitSec)
+
+      if self._checkpointPrefetcher is not None:
+        prefetch = self._checkpointPrefetcher.noteModelStarted(modelID)
+      else:
+        prefetch = None
+
+      if self._profiling:
+        self._logger.info(
+          "{TAG:SWAP.SC.MODEL.WAIT.END} model=%s; waitSec=%.3f; prefetch=%s; "
+          "numWaitingModels=%s", modelID, waitSec, prefetch,
+          len(self._waitingModels))
+
+      self._assignModelToFreeSlot(modelID)
+
+    self._prefetchWaitingModels()
+
+
+  def _prefetchWaitingModels(self):
+    """ Request prefetch of the checkpoints of the models at the head of the
+    waiting models, so that the page cache is warm by the time they start
+    """
+    if self._checkpointPrefetcher is None:
+      return
+
+    for modelID in self._waitingModels.peekNextModels(self._prefetchDepth):
+      self._checkpointPrefetcher.requestPrefetch(modelID)
+
+
+  def _getMemoryDeficitOfNextWaitingModel(self):
+    """ Return the number of bytes that need to be freed, beyond the memory of
+    models in slots that are already pending preemption, before the next
+    waiting model fits in the memory budget; 0 or negative if
+    memory-budgeted admission is disabled or the model fits already
+    """
+    if not self._memoryBudget or not self._waitingModels:
+      return 0
+
+    return (
+      self._getMemoryInUse(excludeSlots=self._pendingPreemptSlotsSet) +
+      self._getModelMemoryEstimate(self._waitingModels.peekNextModel()) -
+      self._memoryBudget)
+
+
   def _assignModelToFreeSlot(self, modelID):
     """ Assign the given model to a free slot """
     assert modelID not in self._runningModelsMap
-    assert modelID not in self._waitingModelsFIFO
+    assert modelID not in self._waitingModels
 
-    freeSlotIndex = self._freeSlots.pop()
+    freeSlotIndex = self._popFreeSlot(modelID)
 
     self._slotAgents[freeSlotIndex].startModel(
       modelID=modelID,
-      modelFinishedCallback=partial(self._modelDoneNotifyTS, modelID))
+      modelFinishedCallback=partial(self._modelDoneNotifyTS, modelID),
+      memoryReportCallback=partial(self._modelMemoryReportTS, modelID),
+      runtimeStatsCallback=partial(self._modelRuntimeStatsReportTS, modelID),
+      evictionReportCallback=partial(self._modelEvictionReportTS, modelID,
+                                     freeSlotIndex))
 
-    self._runningModelsMap[modelID] = _RunningModelInfo(freeSlotIndex)
+    self._runtimeStats.noteModelStarted(modelID)
+
+    self._runningModelsMap[modelID] = _RunningModelInfo(
+      freeSlotIndex,
+      memoryFootprint=self._getModelMemoryEstimate(modelID))
 
     assert ((len(self._runningModelsMap) + len(self._freeSlots)) ==
             len(self._slotAgents)), (
@@ -339,41 +670,178 @@ class SwapController(object):
       "{TAG:SWAP.SC.MODEL.ASSIGN} model=%s; slot=%s; numRunningModels=%s; "
       "numFreeSlots=%s; numWaitingModels=%s; numPendingPreemptSlots=%s",
       modelID, freeSlotIndex, len(self._runningModelsMap), len(self._freeSlots),
-      len(self._waitingModelsFIFO), len(self._pendingPreemptSlotsSet))
+      len(self._waitingModels), len(self._pendingPreemptSlotsSet))
+
+
+  def _popFreeSlot(self, modelID):
+    """ Remove a free slot from the free slots list for assignment to the given
+    model, preferring the slot that ran the model most recently when slot
+    affinity is enabled
+
+    :returns: index of the slot
+    """
+    if not self._slotAffinityEnabled:
+      return self._freeSlots.pop()
+
+    slotIndex = self._modelSlotAffinityMap.get(modelID)
+    if slotIndex is not None and slotIndex in self._freeSlots:
+      self._freeSlots.remove(slotIndex)
+      affinityHit = True
+      self._numSlotAffinityHits += 1
+    else:
+      if slotIndex is None:
+        self._numSlotAffinityFirstRuns += 1
+      else:
+        self._numSlotAffinityMisses += 1
+
+      slotIndex = self._popUnclaimedFreeSlot()
+      self._modelSlotAffinityMap[modelID] = slotIndex
+      affinityHit = False
+
+    if self._profiling:
+      self._logger.info("{TAG:SWAP.SC.SLOT.AFFINITY} model=%s; slot=%s; "
+                        "hit=%s", modelID, slotIndex, affinityHit)
+
+    return slotIndex
+
+
+  def _forgetSlotAffinity(self, modelID):
+    """ Discard the model's affinity slot, if any; e.g., when it's deleted """
+    self._modelSlotAffinityMap.pop(modelID, None)
+
+
+  def _popUnclaimedFreeSlot(self):
+    """ Remove a free slot from the free slots list for a model whose affinity
+    slot is busy or unknown, preferring a slot that isn't the affinity slot of
+    a waiting model, so that the waiting model may still get its own slot
+
+    :returns: index of the slot
+    """
+    claimedSlots = set(
+      self._modelSlotAffinityMap.get(modelID)
+      for modelID in self._waitingModels.peekNextModels(len(self._freeSlots)))
+
+    for i in xrange(len(self._freeSlots) - 1, -1, -1):
+      if self._freeSlots[i] not in claimedSlots:
+        return self._freeSlots.pop(i)
+
+    return self._freeSlots.pop()
 
 
   def _requestPreemptionOfRunningSlotIfNeededAndPossible(self):
     """ Schedule a single slot for preemption if needed and possible """
-    # There shouldn't be any free slots when we're asked to preempt
-    assert not self._freeSlots, repr(self._freeSlots)
+    memoryDeficit = self._getMemoryDeficitOfNextWaitingModel()
+
+    if self._freeSlots:
+      # There shouldn't be any free slots when we're asked to preempt, unless
+      # the memory budget holds back the waiting models
+      assert self._memoryBudget, repr(self._freeSlots)
 
-    if (len(self._waitingModelsFIFO) <= len(self._pendingPreemptSlotsSet) or
-        len(self._pendingPreemptSlotsSet) >= len(self._slotAgents)):
-      # Not needed or no preemptable slots
+      if memoryDeficit <= 0:
+        # Not needed: freeing the slots pending preemption will suffice
+        return
+
+    elif len(self._waitingModels) <= len(self._pendingPreemptSlotsSet):
+      # Not needed
       return
 
-    # Find an LRU non-pending-preempt busy slot agent, and request to
-    # preempt it
-    lru = sorted(
-      ((i.slotIndex, i.timestamp)
-        for i in self._runningModelsMap.itervalues()
-        if i.slotIndex not in self._pendingPreemptSlotsSet),
-      key=lambda element: element[1])
+    if len(self._pendingPreemptSlotsSet) >= len(self._runningModelsMap):
+      # No preemptable slots
+      return
 
-    slotIndex, timestamp = lru.pop(0)
+    # Find the non-pending-preempt busy slot agent preferred by the scheduling
+    # policy, and request to preempt it
+    now = time.time()
+    preemptable = [i for i in self._runningModelsMap.itervalues()
+                   if i.slotIndex not in self._pendingPreemptSlotsSet]
+    candidates = self._waitingModels.rankPreemptionCandidates(preemptable, now)
+
+    if not candidates:
+      self._deferPreemption(
+        self._waitingModels.getPreemptionDeferralSec(preemptable, now))
+      return
+
+    if memoryDeficit > 0:
+      # Prefer the highest-ranked slot whose model frees enough memory for the
+      # waiting model; otherwise, the slot whose model frees the most memory
+      sufficient = [i for i in candidates if i.memoryFootprint >= memoryDeficit]
+      victim = (sufficient[0] if sufficient
+                else max(candidates, key=lambda i: i.memoryFootprint))
+    else:
+      victim = candidates[0]
+
+    slotIndex = victim.slotIndex
+    timestamp = victim.timestamp
 
     # Request preemption of the LRU slot
     self._slotAgents[slotIndex].stopModel()
     self._pendingPreemptSlotsSet.add(slotIndex)
 
+    self._runtimeStats.notePreemption(
+      next(modelID for modelID, info in self._runningModelsMap.iteritems()
+           if info is victim))
+
     if self._profiling:
       self._logger.info(
         "{TAG:SWAP.SC.SLOT.PREEMPT.REQ} slot=%d with timestamp=%s; "
         "numWaitingModels=%s; numPendingPreemptSlots=%s",
-        slotIndex, timestamp, len(self._waitingModelsFIFO),
+        slotIndex, timestamp, len(self._waitingModels),
         len(self._pendingPreemptSlotsSet))
 
 
+  def _deferPreemption(self, delaySec):
+    """ Arm the preemption retry timer, unless already armed
+
+    :param delaySec: number of seconds after which to re-evaluate preemption;
+      None if waiting won't help
+    """
+    if delaySec is None or self._preemptionRetryTimer is not None:
+      return
+
+    self._preemptionRetryTimer = threading.Timer(delaySec,
+                                                 self._preemptionRetryTS)
+    # Allow process to exit even if timer thread is still running
+    self._preemptionRetryTimer.setDaemon(True)
+    self._preemptionRetryTimer.start()
+
+    if self._profiling:
+      self._logger.info(
+        "{TAG:SWAP.SC.SLOT.PREEMPT.DEFER} delaySec=%.3f; numWaitingModels=%s",
+        delaySec, len(self._waitingModels))
+
+
+  def _logWaitTimeStats(self):
+    """ Log a summary of per-model wait-time statistics """
+    statsMap = self._waitingModels.waitTimeStats
+    if not statsMap:
+      return
+
+    numWaits = sum(stats.numWaits for stats in statsMap.itervalues())
+    totalWaitSec = sum(stats.totalWaitSec for stats in statsMap.itervalues())
+    worstModelID, worstStats = max(statsMap.iteritems(),
+                                   key=lambda item: item[1].maxWaitSec)
+
+    self._logger.info(
+      "{TAG:SWAP.SC.WAIT.STATS} numModels=%s; numWaits=%s; meanWaitSec=%.3f; "
+      "maxWaitSec=%.3f (model=%s)", len(statsMap), numWaits,
+      totalWaitSec / numWaits, worstStats.maxWaitSec, worstModelID)
+
+
+  def _logSlotAffinityStats(self):
+    """ Log a summary of slot affinity statistics """
+    if not self._slotAffinityEnabled:
+      return
+
+    numRepeatRuns = self._numSlotAffinityHits + self._numSlotAffinityMisses
+
+    self._logger.info(
+      "{TAG:SWAP.SC.SLOT.AFFINITY.STATS} numHits=%s; numMisses=%s; "
+      "numFirstRuns=%s; hitRate=%.3f", self._numSlotAffinityHits,
+      self._numSlotAffinityMisses, self._numSlotAffinityFirstRuns,
+      (float(self._numSlotAffinityHits) / numRepeatRuns if numRepeatRuns
+       else 0.0))
+
+
   @abortProgramOnAnyException(
     _EXIT_CODE_ON_FAILURE_OF_NOTIFICATION_READER_THREAD,
     logger=_getLogger())
@@ -436,8 +904,14 @@ class _RunningModelInfo(object):
   """ Information about a running model """
 
 
-  def __init__(self, slotIndex):
+  def __init__(self, slotIndex, memoryFootprint):
+    """
+    :param slotIndex: index of the slot that runs the model
+    :param memoryFootprint: memory footprint of the model in bytes; an estimate
+      until the model's ModelRunner reports the actual footprint
+    """
     self._slotIndex = slotIndex
+    self.memoryFootprint = memoryFootprint
     now = time.time()
     self._startTime = now
     self._activityTimestamp = now
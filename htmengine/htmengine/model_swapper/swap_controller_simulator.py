@@ -0,0 +1,685 @@
+# ----------------------------------------------------------------------
+# Numenta Platform for Intelligent Computing (NuPIC)
+# Copyright (C) 2015, Numenta, Inc.  Unless you have purchased from
+# Numenta, Inc. a separate commercial license for this software code, the
+# following terms and conditions apply:
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero Public License for more details.
+#
+# You should have received a copy of the GNU Affero Public License
+# along with this program.  If not, see http://www.gnu.org/licenses.
+#
+# http://numenta.org/licenses/
+# ----------------------------------------------------------------------
+
+"""
+This module implements SwapControllerSimulator, a deterministic discrete-event
+simulator for evaluating SwapController's scheduling, preemption and admission
+logic without a message bus or real models.
+
+The simulator runs the real SwapController event handlers on a virtual clock.
+It replaces the SlotAgents with simulated ones whose model runners take
+configurable load, run and checkpoint times. It also replaces the model input
+queues with an in-process stand-in for ModelSwapperInterface, and the
+preemption retry timer and checkpoint prefetcher with simulated ones. A
+workload trace of input batch arrivals drives the simulation. The resulting
+SimulationReport has per-model latency percentiles, slot utilization and swap
+counts.
+"""
+
+from collections import defaultdict, deque, namedtuple
+from functools import partial
+import heapq
+import itertools
+import math
+import Queue
+import threading
+import time
+
+from mock import patch
+
+from htmengine.model_swapper import swap_controller
+from htmengine.model_swapper.checkpoint_prefetcher import CheckpointPrefetcher
+from htmengine.model_swapper.runtime_stats import ModelRunStats
+
+
+
+# Disable warning: Access to a protected member
+# pylint: disable=W0212
+
+
+
+# Arrival of input batches for a model in a workload trace
+#
+# timestamp: simulation time of the arrival in seconds
+# modelID: ID of the model
+# numBatches: number of input batches that arrive at once
+WorkloadEvent = namedtuple("WorkloadEvent", "timestamp modelID numBatches")
+
+
+
+class ModelCosts(namedtuple("ModelCostsBase",
+                            "loadSec runSecPerBatch saveSec memoryFootprint "
+                            "prefetchedLoadSec warmLoadSec")):
+  """ Simulated costs of running a model
+
+  loadSec: seconds to start ModelRunner and load the model
+  runSecPerBatch: seconds to process one input batch
+  saveSec: seconds to checkpoint the model
+  memoryFootprint: memory footprint in bytes that the model's ModelRunner
+    reports after loading the model; None to report nothing
+  prefetchedLoadSec: seconds to start ModelRunner and load the model when its
+    checkpoint was prefetched; None to use loadSec
+  warmLoadSec: seconds to start ModelRunner and load the model when the model
+    ran most recently in the same slot, so that its data is still warm in that
+    slot's caches; None to use loadSec or prefetchedLoadSec
+  """
+
+  __slots__ = ()
+
+
+  def __new__(cls, loadSec, runSecPerBatch, saveSec, memoryFootprint=None,
+              prefetchedLoadSec=None, warmLoadSec=None):
+    return super(ModelCosts, cls).__new__(
+      cls, loadSec, runSecPerBatch, saveSec, memoryFootprint,
+      prefetchedLoadSec, warmLoadSec)
+
+
+
+class SimulationReport(object):
+  """ Results of a simulation run """
+
+
+  def __init__(self, concurrency, durationSec, latenciesByModel, slotBusySec,
+               swapInsByModel, numPreemptions, numPrefetchHits,
+               swapInLatencies, numWarmStarts, runtimeStats):
+    """
+    :param concurrency: number of slots
+    :param durationSec: simulation time from start until all models finished
+    :param latenciesByModel: dict of model IDs to lists of seconds from the
+      arrival of each of the model's input batches until its processing
+      completed
+    :param slotBusySec: sequence of seconds that each slot was assigned a model
+    :param swapInsByModel: dict of model IDs to the number of times that the
+      model was started in a slot
+    :param numPreemptions: number of model stops requested by SwapController
+    :param numPrefetchHits: number of model starts with a prefetched checkpoint
+    :param swapInLatencies: sequence of seconds from the start of a model in a
+      slot until the model was loaded, for each model start
+    :param numWarmStarts: number of model starts in the slot that ran the model
+      most recently
+    :param runtimeStats: SwapController's snapshot of per-model runtime
+      statistics at the end of the simulation in the stats file format (see
+      runtime_stats); times are simulation seconds
+    """
+    self.concurrency = concurrency
+    self.durationSec = durationSec
+    self.latenciesByModel = latenciesByModel
+    self.slotBusySec = tuple(slotBusySec)
+    self.swapInsByModel = swapInsByModel
+    self.numPreemptions = numPreemptions
+    self.numPrefetchHits = numPrefetchHits
+    self.swapInLatencies = tuple(swapInLatencies)
+    self.numWarmStarts = numWarmStarts
+    self.runtimeStats = runtimeStats
+
+
+  def __repr__(self):
+    return ("%s<concurrency=%s, durationSec=%.3f, numSwapIns=%s, "
+            "numPreemptions=%s, slotUtilization=%.3f>" % (
+              self.__class__.__name__, self.concurrency, self.durationSec,
+              self.numSwapIns, self.numPreemptions, self.slotUtilization))
+
+
+  @property
+  def numSwapIns(self):
+    return sum(self.swapInsByModel.itervalues())
+
+
+  @property
+  def warmStartRate(self):
+    """ Fraction of the starts of models that ran before that were in the slot
+    that ran the model most recently
+    """
+    numRepeatStarts = self.numSwapIns - len(self.swapInsByModel)
+    if not numRepeatStarts:
+      return 0.0
+
+    return float(self.numWarmStarts) / numRepeatStarts
+
+
+  @property
+  def meanSwapInSec(self):
+    """ Mean seconds from the start of a model in a slot until it was loaded """
+    if not self.swapInLatencies:
+      return 0.0
+
+    return sum(self.swapInLatencies) / len(self.swapInLatencies)
+
+
+  @property
+  def slotUtilization(self):
+    """ Fraction of the slots' time during the simulation that they were
+    assigned a model
+    """
+    if not self.durationSec:
+      return 0.0
+
+    return sum(self.slotBusySec) / (self.concurrency * self.durationSec)
+
+
+  def getLatencyPercentiles(self, percentiles=(50, 90, 99), modelID=None):
+    """ Compute nearest-rank percentiles of input batch latencies
+
+    :param percentiles: sequence of percentiles in the range (0, 100]
+    :param modelID: model ID to restrict the latencies to that model; None for
+      latencies of all models
+
+    :returns: tuple of latencies in seconds corresponding to the requested
+      percentiles; None values if there are no latencies
+    """
+    if modelID is None:
+      latencies = sorted(itertools.chain.from_iterable(
+        self.latenciesByModel.itervalues()))
+    else:
+      latencies = sorted(self.latenciesByModel.get(modelID, ()))
+
+    if not latencies:
+      return (None,) * len(percentiles)
+
+    count = len(latencies)
+    return tuple(
+      latencies[max(0, min(count - 1, int(math.ceil(p / 100.0 * count)) - 1))]
+      for p in percentiles)
+
+
+
+class SwapControllerSimulator(object):
+  """ Deterministic discrete-event simulator that drives the real SwapController
+  with simulated slots, model runners and input queues. See module docstring.
+
+  SwapController is configured from model-swapper.conf as usual (e.g.,
+  scheduling policy, memory budget, prefetch depth), except for the input
+  shards, which don't apply to the simulated input queues.
+  """
+
+  def __init__(self, concurrency, defaultCosts, modelCosts=None,
+               batchesPerCheckpoint=1):
+    """
+    :param concurrency: number of SwapController slots
+    :param defaultCosts: ModelCosts of models missing from modelCosts
+    :param modelCosts: optional dict of model IDs to ModelCosts
+    :param batchesPerCheckpoint: number of input batches that a simulated model
+      runner processes before checkpointing the model and checking for a stop
+      request, like ModelRunner's target_requests_per_checkpoint
+    """
+    self._concurrency = concurrency
+    self._defaultCosts = defaultCosts
+    self._modelCosts = dict(modelCosts or ())
+    self._batchesPerCheckpoint = batchesPerCheckpoint
+
+    self._reset()
+
+
+  def _reset(self):
+    """ Initialize the simulation state """
+    # Current simulation time
+    self._now = 0.0
+
+    # Heap of scheduled simulation steps: (time, sequence number, callable)
+    self._timeline = []
+    self._sequence = itertools.count()
+
+    # Simulated model input queues: dict of model IDs to deques of the arrival
+    # times of the model's pending input batches
+    self._inputQueues = defaultdict(deque)
+
+    # The SwapController instance under simulation
+    self._controller = None
+
+    # Model IDs whose checkpoints were prefetched by the time they started
+    self._prefetchedModels = set()
+
+    # Map of model IDs to the index of the slot that ran the model most recently
+    self._lastSlotByModel = dict()
+
+    # Measurements
+    self._latenciesByModel = defaultdict(list)
+    self._slotBusySec = [0.0] * self._concurrency
+    self._swapInsByModel = defaultdict(int)
+    self._numPreemptions = 0
+    self._numPrefetchHits = 0
+    self._swapInLatencies = []
+    self._numWarmStarts = 0
+
+
+  @property
+  def now(self):
+    """ Current simulation time in seconds """
+    return self._now
+
+
+  def run(self, trace):
+    """ Run the simulation until all input batches of the trace are processed
+
+    :param trace: iterable of WorkloadEvent instances
+
+    :returns: SimulationReport instance
+    """
+    self._reset()
+
+    swapper = _SimulatedModelSwapperInterface(self)
+    prefetcher = _SimulatedCheckpointPrefetcher(self)
+
+    patchers = [
+      patch.object(swap_controller, "SlotAgent",
+                   lambda slotID: _SimulatedSlotAgent(self, slotID)),
+      patch.object(swap_controller, "ModelSwapperInterface", lambda: swapper),
+      patch.object(swap_controller, "CheckpointPrefetcher", lambda: prefetcher),
+      patch.object(swap_controller, "InputShardDemultiplexer",
+                   lambda **_kwargs: None),
+      patch.object(swap_controller, "time", _SimulatedTimeModule(self)),
+      patch.object(swap_controller, "threading",
+                   _SimulatedThreadingModule(self)),
+    ]
+
+    for patcher in patchers:
+      patcher.start()
+
+    try:
+      self._controller = swap_controller.SwapController(
+        concurrency=self._concurrency)
+
+      for event in trace:
+        self._scheduleAt(event.timestamp, partial(self._deliverInput, event))
+
+      while self._timeline:
+        self._now, _sequence, step = heapq.heappop(self._timeline)
+        step()
+        self._dispatchControllerEvents()
+    finally:
+      for patcher in reversed(patchers):
+        patcher.stop()
+
+    assert not self._controller._runningModelsMap, (
+      self._controller._runningModelsMap)
+    assert not self._controller._waitingModels
+
+    return SimulationReport(
+      concurrency=self._concurrency,
+      durationSec=self._now,
+      latenciesByModel=dict(self._latenciesByModel),
+      slotBusySec=self._slotBusySec,
+      swapInsByModel=dict(self._swapInsByModel),
+      numPreemptions=self._numPreemptions,
+      numPrefetchHits=self._numPrefetchHits,
+      swapInLatencies=self._swapInLatencies,
+      numWarmStarts=self._numWarmStarts,
+      runtimeStats=self._controller._runtimeStats.getSnapshot(now=self._now))
+
+
+  def schedule(self, delaySec, step):
+    """ Schedule a simulation step
+
+    :param delaySec: simulation seconds from now
+    :param step: callable to invoke at that time
+    """
+    self._scheduleAt(self._now + delaySec, step)
+
+
+  def _scheduleAt(self, when, step):
+    heapq.heappush(self._timeline, (when, next(self._sequence), step))
+
+
+  def _dispatchControllerEvents(self):
+    """ Handle the events queued in SwapController's event queue, as its event
+    loop would
+    """
+    eventQ = self._controller._eventQ
+    while True:
+      try:
+        evt = eventQ.get_nowait()
+      except Queue.Empty:
+        break
+
+      handler = getattr(self._controller, "_handle" + evt["method"] + "Event")
+      handler(**evt)
+
+
+  def _deliverInput(self, event):
+    """ Queue the input batches of a workload event and notify SwapController,
+    like ModelSwapperInterface.submitRequests and the notification reader
+    """
+    self._inputQueues[event.modelID].extend([self._now] * event.numBatches)
+    self._controller._newInputNotifyTS(event.modelID)
+
+
+  def getModelCosts(self, modelID):
+    return self._modelCosts.get(modelID, self._defaultCosts)
+
+
+  @property
+  def batchesPerCheckpoint(self):
+    return self._batchesPerCheckpoint
+
+
+  def modelInputPending(self, modelID):
+    return bool(self._inputQueues.get(modelID))
+
+
+  def getModelInputBacklog(self, modelID):
+    return len(self._inputQueues.get(modelID, ()))
+
+
+  def takeInputBatch(self, modelID):
+    """ Remove the next input batch of the model
+
+    :returns: arrival time of the batch; None if the model has no pending input
+    """
+    inputQueue = self._inputQueues.get(modelID)
+    return inputQueue.popleft() if inputQueue else None
+
+
+  def notePrefetchHit(self, modelID):
+    self._prefetchedModels.add(modelID)
+    self._numPrefetchHits += 1
+
+
+  def takePrefetched(self, modelID):
+    """ :returns: True if the model's checkpoint was prefetched for this start
+    """
+    prefetched = modelID in self._prefetchedModels
+    self._prefetchedModels.discard(modelID)
+    return prefetched
+
+
+  def noteSwapIn(self, modelID, slotID):
+    """
+    :returns: True if the model ran most recently in the given slot
+    """
+    self._swapInsByModel[modelID] += 1
+
+    warm = self._lastSlotByModel.get(modelID) == slotID
+    self._lastSlotByModel[modelID] = slotID
+    if warm:
+      self._numWarmStarts += 1
+
+    return warm
+
+
+  def noteModelLoaded(self, loadSec):
+    self._swapInLatencies.append(loadSec)
+
+
+  def notePreemption(self):
+    self._numPreemptions += 1
+
+
+  def noteBatchProcessed(self, modelID, arrivalTime):
+    self._latenciesByModel[modelID].append(self._now - arrivalTime)
+
+
+  def noteSlotBusy(self, slotID, busySec):
+    self._slotBusySec[slotID] += busySec
+
+
+
+class _SimulatedSlotAgent(object):
+  """ Stands in for SlotAgent: simulates a ModelRunner that loads the model,
+  processes its input batches in runs of the simulator's batchesPerCheckpoint,
+  checkpoints the model after each run, and exits after a run when stop was
+  requested or it's out of input
+  """
+
+  def __init__(self, simulator, slotID):
+    self._simulator = simulator
+    self._slotID = slotID
+
+    self._modelID = None
+    self._costs = None
+    self._modelFinishedCallback = None
+    self._memoryReportCallback = None
+    self._runtimeStatsCallback = None
+    self._runStats = None
+    self._stopRequested = False
+    self._exited = False
+    self._startTime = None
+    self._numBatchesSinceCheckpoint = 0
+
+
+  def __repr__(self):
+    return "%s<slotID=%s, modelID=%s>" % (self.__class__.__name__,
+                                          self._slotID, self._modelID)
+
+
+  def startModel(self, modelID, modelFinishedCallback,
+                 memoryReportCallback=None, runtimeStatsCallback=None,
+                 evictionReportCallback=None):  # pylint: disable=W0613
+    # NOTE: simulated slots don't model a resident model cache, so they never
+    # report evictions
+    assert self._modelID is None, repr(self)
+
+    self._modelID = modelID
+    self._costs = self._simulator.getModelCosts(modelID)
+    self._modelFinishedCallback = modelFinishedCallback
+    self._memoryReportCallback = memoryReportCallback
+    self._runtimeStatsCallback = runtimeStatsCallback
+    self._runStats = ModelRunStats()
+    self._stopRequested = False
+    self._exited = False
+    self._startTime = self._simulator.now
+    self._numBatchesSinceCheckpoint = 0
+
+    warm = self._simulator.noteSwapIn(modelID, self._slotID)
+
+    loadSec = self._costs.loadSec
+    if (self._simulator.takePrefetched(modelID) and
+        self._costs.prefetchedLoadSec is not None):
+      loadSec = self._costs.prefetchedLoadSec
+    if warm and self._costs.warmLoadSec is not None:
+      loadSec = self._costs.warmLoadSec
+
+    self._simulator.schedule(loadSec, self._onModelLoaded)
+
+
+  def stopModel(self):
+    assert self._modelID is not None, repr(self)
+    self._simulator.notePreemption()
+    self._stopRequested = True
+
+
+  def releaseSlot(self):
+    assert self._exited, repr(self)
+    self._modelID = None
+
+
+  def close(self):
+    pass
+
+
+  def _onModelLoaded(self):
+    loadSec = self._simulator.now - self._startTime
+    self._simulator.noteModelLoaded(loadSec)
+
+    self._runStats.numLoads += 1
+    self._runStats.loadSec += loadSec
+
+    if (self._costs.memoryFootprint is not None and
+        self._memoryReportCallback is not None):
+      self._memoryReportCallback(self._costs.memoryFootprint)
+
+    self._processNextBatch()
+
+
+  def _processNextBatch(self):
+    if self._numBatchesSinceCheckpoint < self._simulator.batchesPerCheckpoint:
+      arrivalTime = self._simulator.takeInputBatch(self._modelID)
+      if arrivalTime is not None:
+        self._simulator.schedule(self._costs.runSecPerBatch,
+                                 partial(self._onBatchProcessed, arrivalTime))
+        return
+
+    if self._numBatchesSinceCheckpoint:
+      self._simulator.schedule(self._costs.saveSec, self._onCheckpointSaved)
+    else:
+      self._exit()
+
+
+  def _onBatchProcessed(self, arrivalTime):
+    self._numBatchesSinceCheckpoint += 1
+    self._runStats.processSec += self._costs.runSecPerBatch
+    self._simulator.noteBatchProcessed(self._modelID, arrivalTime)
+    self._processNextBatch()
+
+
+  def _onCheckpointSaved(self):
+    self._numBatchesSinceCheckpoint = 0
+    self._runStats.numCheckpoints += 1
+    self._runStats.checkpointSec += self._costs.saveSec
+
+    if (self._stopRequested or
+        not self._simulator.modelInputPending(self._modelID)):
+      self._exit()
+    else:
+      self._processNextBatch()
+
+
+  def _exit(self):
+    self._exited = True
+    self._simulator.noteSlotBusy(self._slotID,
+                                 self._simulator.now - self._startTime)
+
+    if self._runtimeStatsCallback is not None:
+      self._runtimeStatsCallback(self._runStats.toReport())
+
+    self._modelFinishedCallback(0)
+
+
+
+class _SimulatedModelSwapperInterface(object):
+  """ Stands in for the ModelSwapperInterface of SwapController's event loop """
+
+  def __init__(self, simulator):
+    self._simulator = simulator
+
+
+  def __enter__(self):
+    return self
+
+
+  def __exit__(self, *args):
+    return False
+
+
+  def close(self):
+    pass
+
+
+  def modelInputPending(self, modelID):
+    return self._simulator.modelInputPending(modelID)
+
+
+  def getModelInputBacklog(self, modelID):
+    return self._simulator.getModelInputBacklog(modelID)
+
+
+
+class _SimulatedCheckpointPrefetcher(object):
+  """ Stands in for CheckpointPrefetcher: a prefetch completes as soon as it's
+  requested
+  """
+
+  def __init__(self, simulator):
+    self._simulator = simulator
+
+    # Model IDs of models whose checkpoints were prefetched since they last
+    # started
+    self._prefetched = set()
+
+
+  def close(self):
+    pass
+
+
+  def requestPrefetch(self, modelID):
+    self._prefetched.add(modelID)
+
+
+  def noteModelStarted(self, modelID):
+    if modelID in self._prefetched:
+      self._prefetched.remove(modelID)
+      self._simulator.notePrefetchHit(modelID)
+      return CheckpointPrefetcher.HIT
+
+    return CheckpointPrefetcher.MISS
+
+
+
+class _SimulatedTimer(object):
+  """ Stands in for threading.Timer on the simulator's clock """
+
+  def __init__(self, simulator, interval, function):
+    self._simulator = simulator
+    self._interval = interval
+    self._function = function
+    self._cancelled = False
+
+
+  def setDaemon(self, daemonic):  # pylint: disable=C0103,W0613
+    pass
+
+
+  def start(self):
+    self._simulator.schedule(self._interval, self._fire)
+
+
+  def cancel(self):
+    self._cancelled = True
+
+
+  def _fire(self):
+    if not self._cancelled:
+      self._function()
+
+
+
+class _SimulatedTimeModule(object):
+  """ Stands in for the time module in swap_controller: time() returns the
+  simulator's clock
+  """
+
+  def __init__(self, simulator):
+    self._simulator = simulator
+
+
+  def __getattr__(self, name):
+    return getattr(time, name)
+
+
+  def time(self):
+    return self._simulator.now
+
+
+
+class _SimulatedThreadingModule(object):
+  """ Stands in for the threading module in swap_controller: Timer runs on the
+  simulator's clock
+  """
+
+  def __init__(self, simulator):
+    self._simulator = simulator
+
+
+  def __getattr__(self, name):
+    return getattr(threading, name)
+
+
+  def Timer(self, interval, function):  # pylint: disable=C0103
+    return _SimulatedTimer(self._simulator, interval, function)
@@ -30,6 +30,7 @@ from nta.utils import sqlalchemy_utils
 from htmengine.repository.queries import (
   addMetric,
   addMetricData,
+  deleteAnomalyLikelihoodParams,
   deleteMetric,
   deleteModel,
   getCustomMetricByName,
@@ -39,6 +40,7 @@ from htmengine.repository.queries import (
   getAllMetrics,
   getAllMetricsForServer,
   getAllModels,
+  getAnomalyLikelihoodParams,
   getMetric,
   getMetricWithSharedLock,
   getMetricWithUpdateLock,
@@ -51,6 +53,7 @@ from htmengine.repository.queries import (
   getMetricStats,
   getUnprocessedModelDataCount,
   listMetricIDsForInstance,
+  saveAnomalyLikelihoodParams,
   saveMetricInstanceStatus,
   setMetricCollectorError,
   setMetricLastTimestamp,
@@ -58,6 +61,7 @@ from htmengine.repository.queries import (
   updateMetricColumns,
   updateMetricColumnsForRefStatus,
   updateMetricDataColumns,
+  updateMetricDataResults,
   lockOperationExclusive,
   OperationLock)
 
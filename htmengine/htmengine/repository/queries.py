@@ -20,11 +20,14 @@
 # ----------------------------------------------------------------------
 from datetime import datetime
 
-from sqlalchemy import func
-from sqlalchemy.sql import select
+from sqlalchemy import Column, func, INTEGER, MetaData, Table, TEXT
+from sqlalchemy.dialects.mysql import DOUBLE
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.sql import select, text
 from sqlalchemy.engine.base import Connection
 
-from htmengine.exceptions import (MetricStatisticsNotReadyError,
+from htmengine.exceptions import (AnomalyLikelihoodParamsChangedError,
+                                  MetricStatisticsNotReadyError,
                                   ObjectNotFoundError)
 import htmengine.utils
 from htmengine.utils import jsonDecode
@@ -61,6 +64,39 @@ class MetricStatus(object):
 
 
 
+# Temporary table of model results that updateMetricDataResults joins with
+# metric_data. MySQL temporary tables are private to the connection. It's not
+# part of schema.metadata, since it's not part of the database schema.
+_metricDataResultsTemp = Table(  # pylint: disable=C0103
+    "metric_data_results_temp",
+    MetaData(),
+    Column("rowid",
+           INTEGER(),
+           primary_key=True,
+           autoincrement=False,
+           nullable=False),
+    Column("raw_anomaly_score",
+           DOUBLE(asdecimal=False)),
+    Column("anomaly_score",
+           DOUBLE(asdecimal=False)),
+    Column("display_value",
+           INTEGER(),
+           autoincrement=False),
+    Column("multi_step_best_predictions",
+           TEXT()),
+    prefixes=["TEMPORARY"])
+
+
+# updateMetricDataResults updates fewer rows than this one statement per row,
+# since the temporary table costs a fixed number of statements
+_BULK_RESULTS_UPDATE_MIN_ROWS = 5
+
+# Max number of rows per multi-row INSERT into the temporary table by
+# updateMetricDataResults; keeps the statement well within max_allowed_packet
+_BULK_RESULTS_INSERT_MAX_ROWS = 1000
+
+
+
 class OperationLock(object):
   """ Operation-level locks for use with lockOperationExclusive
 
@@ -135,6 +171,8 @@ def deleteModel(conn, metricId):
 
     conn.execute(update)
 
+    deleteAnomalyLikelihoodParams(conn, metricId)
+
 
 
 def addMetric(conn, # pylint: disable=C0103
@@ -764,6 +802,145 @@ def updateMetricDataColumns(conn, metricDataObj, fields):
 
 
 
+def updateMetricDataResults(conn, metricId, results):
+  """Update the model result columns of a batch of MetricData rows of a metric.
+
+  The rows are updated by a single UPDATE that joins metric_data with a
+  temporary table of the results, instead of one UPDATE per row. The row
+  semantics are the same as those of calling updateMetricDataColumns for each
+  row: only existing rows are updated, and rows that don't exist (e.g., purged
+  by the metric data garbage collector or deleted along with the metric) are
+  skipped.
+
+  NOTE: the temporary table's DDL doesn't commit the current transaction, so
+  this may be called in a transaction.
+
+  :param conn: SQLAlchemy connection object
+  :type conn: sqlalchemy.engine.base.Connection
+  :param metricId: Metric uid
+  :param results: sequence of dicts with unique "rowid" values; each has the
+    keys "rowid", "raw_anomaly_score", "anomaly_score", "display_value" and
+    "multi_step_best_predictions"
+  """
+  if len(results) < _BULK_RESULTS_UPDATE_MIN_ROWS:
+    for result in results:
+      update = (schema.metric_data.update() # pylint: disable=E1120
+                .where(schema.metric_data.c.uid == metricId)
+                .where(schema.metric_data.c.rowid == result["rowid"]))
+      conn.execute(update.values(
+        raw_anomaly_score=result["raw_anomaly_score"],
+        anomaly_score=result["anomaly_score"],
+        display_value=result["display_value"],
+        multi_step_best_predictions=result["multi_step_best_predictions"]))
+
+    return
+
+  temp = _metricDataResultsTemp
+
+  # The table may be left over on this pooled connection by a failed call
+  conn.execute(text("DROP TEMPORARY TABLE IF EXISTS %s" % (temp.name,)))
+  temp.create(conn)
+  try:
+    # The MySQL driver inserts each chunk with a single multi-row INSERT
+    for i in xrange(0, len(results), _BULK_RESULTS_INSERT_MAX_ROWS):
+      conn.execute(temp.insert(), # pylint: disable=E1120
+                   list(results[i:i + _BULK_RESULTS_INSERT_MAX_ROWS]))
+
+    update = (schema.metric_data.update() # pylint: disable=E1120
+              .where(schema.metric_data.c.uid == metricId)
+              .where(schema.metric_data.c.rowid == temp.c.rowid))
+    conn.execute(update.values(
+      raw_anomaly_score=temp.c.raw_anomaly_score,
+      anomaly_score=temp.c.anomaly_score,
+      display_value=temp.c.display_value,
+      multi_step_best_predictions=temp.c.multi_step_best_predictions))
+  finally:
+    conn.execute(text("DROP TEMPORARY TABLE IF EXISTS %s" % (temp.name,)))
+
+
+
+def getAnomalyLikelihoodParams(conn, metricId):
+  """Get the saved anomaly likelihood params of a metric's model
+
+  :param conn: SQLAlchemy connection object
+  :type conn: sqlalchemy.engine.base.Connection
+  :param metricId: Metric uid
+  :returns: row with "params" (JSON) and "version" columns; None if the
+    metric has no saved anomaly likelihood params
+  :rtype: sqlalchemy.engine.RowProxy
+  """
+  sel = (select([schema.anomaly_likelihood_params.c.params,
+                 schema.anomaly_likelihood_params.c.version])
+         .where(schema.anomaly_likelihood_params.c.uid == metricId))
+
+  return conn.execute(sel).first()
+
+
+
+def saveAnomalyLikelihoodParams(conn, metricId, params, refVersion):
+  """Save the anomaly likelihood params of a metric's model, provided they
+  weren't saved or deleted by someone else since the given version was loaded.
+
+  This is a conditional update of the params row on its version (or an insert
+  of the first version), so it doesn't lock the metric row.
+
+  :param conn: SQLAlchemy connection object
+  :type conn: sqlalchemy.engine.base.Connection
+  :param metricId: Metric uid
+  :param params: anomaly likelihood params JSON
+  :param refVersion: version of the params that the new ones are based on, as
+    returned by getAnomalyLikelihoodParams; None if there were no saved params
+  :returns: version of the saved params
+  :rtype: int
+
+  :raises AnomalyLikelihoodParamsChangedError: if the params were saved or
+    deleted by someone else since refVersion, or the metric doesn't exist
+  """
+  table = schema.anomaly_likelihood_params
+
+  if refVersion is None:
+    version = 1
+
+    ins = table.insert().values( # pylint: disable=E1120
+      uid=metricId, version=version, params=params)
+    try:
+      rowcount = conn.execute(ins).rowcount
+    except IntegrityError:
+      # Duplicate key or missing metric
+      rowcount = 0
+  else:
+    version = refVersion + 1
+
+    update = (table.update() # pylint: disable=E1120
+              .where(table.c.uid == metricId)
+              .where(table.c.version == refVersion))
+    rowcount = conn.execute(update.values(version=version,
+                                          params=params)).rowcount
+
+  if rowcount == 0:
+    raise AnomalyLikelihoodParamsChangedError(
+      "Anomaly likelihood params of metric=%s changed since version=%s" %
+      (metricId, refVersion))
+
+  return version
+
+
+
+def deleteAnomalyLikelihoodParams(conn, metricId):
+  """Delete the saved anomaly likelihood params of a metric's model, so that
+  the metric's next model starts afresh
+
+  :param conn: SQLAlchemy connection object
+  :type conn: sqlalchemy.engine.base.Connection
+  :param metricId: Metric uid
+  """
+  delete = (schema.anomaly_likelihood_params.delete() # pylint: disable=E1120
+            .where(schema.anomaly_likelihood_params.c.uid == metricId))
+
+  conn.execute(delete)
+
+
+
 def getMetricStats(conn, metricId):
   """
   :param conn: SQLAlchemy connection object
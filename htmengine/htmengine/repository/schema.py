@@ -145,6 +145,31 @@ Index("anomaly_score_idx", metric_data.c.anomaly_score)
 
 
 
+# Anomaly likelihood params of a metric's model, kept out of the metric row so
+# that saving them per result batch neither locks nor rewrites the metric row.
+# "version" is incremented by each save.
+anomaly_likelihood_params = Table(  # pylint: disable=C0103
+    "anomaly_likelihood_params",
+    metadata,
+    Column("uid",
+           VARCHAR(length=40),
+           ForeignKey(metric.c.uid,
+                      name="anomaly_likelihood_params_to_metric_fk",
+                      onupdate="CASCADE", ondelete="CASCADE"),
+           primary_key=True,
+           nullable=False),
+    Column("version",
+           INTEGER(),
+           autoincrement=False,
+           nullable=False),
+    Column("params",
+           TEXT(),
+           nullable=False),
+    schema=None,
+)
+
+
+
 lock = Table("lock",
              metadata,
              Column("name",
@@ -20,6 +20,7 @@
 # http://numenta.org/licenses/
 # ----------------------------------------------------------------------
 
+from collections import OrderedDict
 import itertools
 import json
 import logging
@@ -39,7 +40,8 @@ from nta.utils.message_bus_connector import MessageProperties
 
 from htmengine.anomaly_likelihood_helper import AnomalyLikelihoodHelper
 from htmengine import htmengineerrno
-from htmengine.exceptions import (ObjectNotFoundError,
+from htmengine.exceptions import (AnomalyLikelihoodParamsChangedError,
+                                  ObjectNotFoundError,
                                   MetricNotActiveError,
                                   MetricNotMonitoredError)
 from htmengine import (raiseExceptionOnMissingRequiredApplicationConfigPath,
@@ -53,6 +55,7 @@ from htmengine.model_swapper.model_swapper_interface import (
 from htmengine.htmengine_logging import (getExtendedLogger,
                                          getStandardLogPrefix,
                                          getMetricLogPrefix)
+from htmengine.utils import jsonDecode
 
 
 
@@ -154,6 +157,29 @@ class RejectedInferenceResultBatch(Exception):
 
 
 
+class _CachedMetric(object):
+  """ A metric's state kept in memory by AnomalyService between result batches
+  """
+
+  __slots__ = ("metricObj", "likelihoodParams", "likelihoodParamsVersion",
+               "sampleTail")
+
+
+  def __init__(self, metricObj, likelihoodParams, likelihoodParamsVersion,
+               sampleTail):
+    # Metric RowProxy instance as loaded by repository.getMetric
+    self.metricObj = metricObj
+
+    # The metric's anomaly likelihood params as last loaded or saved by us, and
+    # their version; None if there were none
+    self.likelihoodParams = likelihoodParams
+    self.likelihoodParamsVersion = likelihoodParamsVersion
+
+    # StatisticsSampleTail instance with the metric's recent raw anomaly scores
+    self.sampleTail = sampleTail
+
+
+
 class AnomalyService(object):
   """ Anomaly Service for processing CLA model results, calculating Anomaly
   Likelihood scores, and updating the associated metric data records
@@ -191,6 +217,16 @@ class AnomalyService(object):
 
     self.likelihoodHelper = AnomalyLikelihoodHelper(self._log, config)
 
+    # Max number of metrics in self._metricCache; 0 disables the cache
+    self._metricCacheSize = config.getint("anomaly_likelihood",
+                                          "metric_cache_size")
+
+    # LRU cache of ACTIVE metrics whose result batches were processed:
+    # metricID -> _CachedMetric; most-recently-used last. An entry is removed
+    # while its metric's batch is processed, and put back only if the batch is
+    # saved.
+    self._metricCache = OrderedDict()
+
 
   def _processModelCommandResult(self, metricID, result):
     """
@@ -198,6 +234,9 @@ class AnomalyService(object):
     """
     engine = repository.engineFactory(config)
 
+    # Model commands change the metric's status
+    self._metricCache.pop(metricID, None)
+
     # Check if deleting model
     if result.method == "deleteModel":
       self._log.info("Model=%s was deleted", metricID)
@@ -258,7 +297,8 @@ class AnomalyService(object):
     self._log.error("Unexpected model result=%r", result)
 
 
-  def _processModelInferenceResults(self, inferenceResults, metricID):
+  def _processModelInferenceResults(self, inferenceResults, metricID,
+                                    isRetry=False):
     """
     Process a batch of model inference results
 
@@ -275,6 +315,10 @@ class AnomalyService(object):
 
     :param metricID: metric/model ID of the model that emitted the results
 
+    :param isRetry: True if the batch is being reprocessed after its anomaly
+      likelihood params were changed concurrently; it's rejected if that happens
+      again
+
     :returns: None if the batch was rejected; otherwise a pair:
       (metric, metricDataRows)
         metric: Metric RowProxy instance corresponding to the given metricID
@@ -295,38 +339,74 @@ class AnomalyService(object):
     """
     engine = repository.engineFactory(config)
 
-    # Validate model ID
-    try:
-      with engine.connect() as conn:
-        metricObj = repository.getMetric(conn, metricID)
-    except ObjectNotFoundError:
-      # Ignore inferences for unknown models. Typically, this is is the result
-      # of a deleted model. Another scenario where this might occur is when a
-      # developer resets the db while there are result messages still on the
-      # message bus. It would be an error if this were to occur in production
-      # environment.
-      self._log.warning("Received inference results for unknown model=%s; "
-                        "(model deleted?)", metricID, exc_info=True)
-      return None
-
-    # Reject the results if model is in non-ACTIVE state (e.g., if HTM Metric
-    # was unmonitored after the results were generated)
-    if metricObj.status != MetricStatus.ACTIVE:
-      self._log.warning("Received inference results for a non-ACTIVE "
-                        "model=%s; metric=<%s>; (metric unmonitored?)",
-                        metricID, getMetricLogPrefix(metricObj))
-      return None
+    # The metric's cached state, if any; it's validated by the versioned save of
+    # the anomaly likelihood params
+    cachedMetric = self._metricCache.pop(metricID, None)
 
-    # Load the MetricData instances corresponding to the results
-    with engine.connect() as conn:
-      metricDataRows = repository.getMetricData(conn,
-                                                metricID,
-                                                start=inferenceResults[0].rowID,
-                                                stop=inferenceResults[-1].rowID)
+    if cachedMetric is not None:
+      metricObj = cachedMetric.metricObj
+      likelihoodParams = cachedMetric.likelihoodParams
+      likelihoodParamsVersion = cachedMetric.likelihoodParamsVersion
+    else:
+      # Validate model ID
+      try:
+        with engine.connect() as conn:
+          metricObj = repository.getMetric(conn, metricID)
+          likelihoodParamsRow = repository.getAnomalyLikelihoodParams(conn,
+                                                                      metricID)
+      except ObjectNotFoundError:
+        # Ignore inferences for unknown models. Typically, this is is the result
+        # of a deleted model. Another scenario where this might occur is when a
+        # developer resets the db while there are result messages still on the
+        # message bus. It would be an error if this were to occur in production
+        # environment.
+        self._log.warning("Received inference results for unknown model=%s; "
+                          "(model deleted?)", metricID, exc_info=True)
+        return None
+
+      # Reject the results if model is in non-ACTIVE state (e.g., if HTM Metric
+      # was unmonitored after the results were generated)
+      if metricObj.status != MetricStatus.ACTIVE:
+        self._log.warning("Received inference results for a non-ACTIVE "
+                          "model=%s; metric=<%s>; (metric unmonitored?)",
+                          metricID, getMetricLogPrefix(metricObj))
+        return None
+
+      if likelihoodParamsRow is not None:
+        likelihoodParams = jsonDecode(likelihoodParamsRow.params)
+        likelihoodParamsVersion = likelihoodParamsRow.version
+      else:
+        likelihoodParams = None
+        likelihoodParamsVersion = None
+
+      if self._metricCacheSize > 0:
+        cachedMetric = _CachedMetric(
+          metricObj,
+          likelihoodParams=likelihoodParams,
+          likelihoodParamsVersion=likelihoodParamsVersion,
+          sampleTail=self.likelihoodHelper.createStatisticsSampleTail())
+
+    if all(result.timestamp is not None and result.value is not None and
+           result.timestamp.microsecond == 0
+           for result in inferenceResults):
+      # The results carry the input timestamps and values, so there is no need
+      # to load the corresponding MetricData instances. NOTE: metric_data
+      # stores whole seconds, so a timestamp with a fractional part differs
+      # from the stored one; the rows are loaded in that case instead.
+      metricDataRows = self._createMetricDataRowsFromInferenceResults(
+        inferenceResults, metricID)
+    else:
+      # Load the MetricData instances corresponding to the results
+      with engine.connect() as conn:
+        metricDataRows = repository.getMetricData(
+          conn,
+          metricID,
+          start=inferenceResults[0].rowID,
+          stop=inferenceResults[-1].rowID)
 
-    # metricDataRows must be mutable, as the data is massaged in
-    # _scrubInferenceResultsAndInitMetricData()
-    metricDataRows = list(metricDataRows)
+      # metricDataRows must be mutable, as the data is massaged in
+      # _scrubInferenceResultsAndInitMetricData()
+      metricDataRows = list(metricDataRows)
 
     if not metricDataRows:
       self._log.error("Rejected inference result batch=[%s..%s] of model=%s "
@@ -355,7 +435,10 @@ class AnomalyService(object):
       self.likelihoodHelper.updateModelAnomalyScores(
         engine=engine,
         metricObj=metricObj,
-        metricDataRows=metricDataRows))
+        metricDataRows=metricDataRows,
+        anomalyLikelihoodParams=likelihoodParams,
+        sampleTail=(cachedMetric.sampleTail if cachedMetric is not None
+                    else None)))
 
     # Update metric data rows with rescaled display values
     # NOTE: doing this outside the updateColumns loop to avoid holding row locks
@@ -371,26 +454,53 @@ class AnomalyService(object):
       @retryOnTransientErrors
       def runSQL(engine):
         with engine.begin() as conn:
-          for metricData in metricDataRows:
-            fields = {"raw_anomaly_score": metricData.raw_anomaly_score,
-                      "anomaly_score": metricData.anomaly_score,
-                      "display_value": metricData.display_value,
-                      "multi_step_best_predictions":
-                        json.dumps(metricData.multi_step_best_predictions)}
-            repository.updateMetricDataColumns(conn, metricData, fields)
-
-          self._updateAnomalyLikelihoodParams(
+          repository.updateMetricDataResults(
+            conn,
+            metricObj.uid,
+            [{"rowid": metricData.rowid,
+              "raw_anomaly_score": metricData.raw_anomaly_score,
+              "anomaly_score": metricData.anomaly_score,
+              "display_value": metricData.display_value,
+              "multi_step_best_predictions":
+                json.dumps(metricData.multi_step_best_predictions)}
+             for metricData in metricDataRows])
+
+          return self._updateAnomalyLikelihoodParams(
             conn,
             metricObj.uid,
-            metricObj.model_params,
-            anomalyLikelihoodParams)
+            anomalyLikelihoodParams,
+            refVersion=likelihoodParamsVersion)
 
-      runSQL(engine)
+      savedVersion = runSQL(engine)
     except (ObjectNotFoundError, MetricNotActiveError):
       self._log.warning("Rejected inference result batch=[%s..%s] of model=%s",
                         inferenceResults[0].rowID, inferenceResults[-1].rowID,
                         metricID, exc_info=True)
       return None
+    except AnomalyLikelihoodParamsChangedError:
+      if isRetry:
+        self._log.warning(
+          "Rejected inference result batch=[%s..%s] of model=%s due to "
+          "repeatedly changed anomaly likelihood params",
+          inferenceResults[0].rowID, inferenceResults[-1].rowID, metricID,
+          exc_info=True)
+        return None
+
+      # The batch was processed with outdated metric state (e.g., cached before
+      # the model was deleted), so process it again with the current state,
+      # which is no longer cached
+      self._log.info("Reprocessing inference result batch=[%s..%s] of model=%s "
+                     "due to changed anomaly likelihood params",
+                     inferenceResults[0].rowID, inferenceResults[-1].rowID,
+                     metricID, exc_info=True)
+      return self._processModelInferenceResults(inferenceResults, metricID,
+                                                isRetry=True)
+
+    if cachedMetric is not None:
+      cachedMetric.likelihoodParams = anomalyLikelihoodParams
+      cachedMetric.likelihoodParamsVersion = savedVersion
+      cachedMetric.sampleTail.append(metricDataRows)
+      self._cacheMetric(metricID, cachedMetric)
 
     self._log.debug("Updated HTM metric_data rows=[%s..%s] "
                     "of model=%s: duration=%ss",
@@ -400,38 +510,54 @@ class AnomalyService(object):
     return (metricObj, metricDataRows,)
 
 
+  def _cacheMetric(self, metricID, cachedMetric):
+    """ Put the metric's state in self._metricCache as its most-recently-used
+    entry, evicting the least-recently-used entries beyond the cache size
+    """
+    self._metricCache[metricID] = cachedMetric
+
+    while len(self._metricCache) > self._metricCacheSize:
+      self._metricCache.popitem(last=False)
+
+
   @classmethod
-  def _updateAnomalyLikelihoodParams(cls, conn, metricId, modelParamsJson,
-                                     likelihoodParams):
-    """Update and save anomaly_params with the given likelihoodParams if the
-       metric is ACTIVE.
+  def _updateAnomalyLikelihoodParams(cls, conn, metricId, likelihoodParams,
+                                     refVersion):
+    """Save the given likelihoodParams if the metric is ACTIVE and its anomaly
+       likelihood params weren't changed since refVersion.
+
+    The metric row isn't locked: deleting the metric's model (e.g., when it's
+    unmonitored) also deletes its anomaly likelihood params, which the
+    versioned save detects.
 
     :param conn: Transactional SQLAlchemy connection object
     :type conn: sqlalchemy.engine.base.Connection
     :param metricId: Metric uid
-    :param modelParamsJson: Model params JSON object (from model_params metric
-      column)
     :param likelihoodParams: anomaly likelihood params dict
+    :param refVersion: version of the metric's anomaly likelihood params that
+      likelihoodParams are based on; None if there were none
+
+    :returns: version of the saved anomaly likelihood params
 
     :raises: htmengine.exceptions.MetricNotActiveError if metric's status is not
       MetricStatus.ACTIVE
+    :raises: htmengine.exceptions.AnomalyLikelihoodParamsChangedError if the
+      metric's anomaly likelihood params were changed since refVersion
     """
-    lockedRow = repository.getMetricWithUpdateLock(
-      conn,
-      metricId,
-      fields=[schema.metric.c.status])
+    metricObj = repository.getMetric(conn,
+                                     metricId,
+                                     fields=[schema.metric.c.status])
 
-    if lockedRow.status != MetricStatus.ACTIVE:
+    if metricObj.status != MetricStatus.ACTIVE:
       raise MetricNotActiveError(
         "_updateAnomalyLikelihoodParams failed because metric=%s is not "
-        "ACTIVE; status=%s" % (metricId, lockedRow.status,))
+        "ACTIVE; status=%s" % (metricId, metricObj.status,))
 
-    modelParams = json.loads(modelParamsJson)
-    modelParams["anomalyLikelihoodParams"] = likelihoodParams
-
-    repository.updateMetricColumns(conn,
-                                   metricId,
-                                   {"model_params": json.dumps(modelParams)})
+    return repository.saveAnomalyLikelihoodParams(
+      conn,
+      metricId,
+      json.dumps(likelihoodParams),
+      refVersion)
 
 
   @classmethod
@@ -545,8 +671,9 @@ class AnomalyService(object):
     :param inferenceResults: a sequence of ModelInferenceResult instances
       representing the inference result batch ordered by row id
 
-    :param metricDataRows: a mutable list of MetricData instances with row ids
-      in the range of inferenceResults[0].rowID to inferenceResults[-1].rowID
+    :param metricDataRows: a mutable list of MetricData or MutableMetricDataRow
+      instances with row ids in the range of inferenceResults[0].rowID to
+      inferenceResults[-1].rowID
 
     :param metricObj: a Metric instance associated with the given
       inferenceResults
@@ -609,7 +736,10 @@ class AnomalyService(object):
       #               calendar.timegm(metricData.timestamp.timetuple()),
       #               metricData.metric_value)
 
-      mutableMetricData = MutableMetricDataRow(**dict(metricData.items()))
+      if isinstance(metricData, MutableMetricDataRow):
+        mutableMetricData = metricData
+      else:
+        mutableMetricData = MutableMetricDataRow(**dict(metricData.items()))
       mutableMetricData.raw_anomaly_score = result.anomalyScore
       mutableMetricData.anomaly_score = 0
       mutableMetricData.multi_step_best_predictions = (
@@ -617,6 +747,32 @@ class AnomalyService(object):
       metricDataRows[index] = mutableMetricData
 
 
+  @staticmethod
+  def _createMetricDataRowsFromInferenceResults(inferenceResults, metricID):
+    """ Create MutableMetricDataRow instances from the input timestamps and
+    values carried by the given inference results, in lieu of loading the
+    corresponding metric_data rows
+
+    :param inferenceResults: a sequence of ModelInferenceResult instances whose
+      timestamp and value attributes are set
+
+    :param metricID: metric/model ID of the model that emitted the results
+
+    :returns: a list of MutableMetricDataRow instances ordered by row id, with
+      the result columns not yet populated
+    """
+    return [
+      MutableMetricDataRow(multi_step_best_predictions=None,
+                           anomaly_score=None,
+                           display_value=None,
+                           metric_value=result.value,
+                           raw_anomaly_score=None,
+                           rowid=result.rowID,
+                           timestamp=result.timestamp,
+                           uid=metricID)
+      for result in inferenceResults]
+
+
   @staticmethod
   def _serializeModelResult(modelResults):
     """ Serializes a model result into a message suitable for delivery
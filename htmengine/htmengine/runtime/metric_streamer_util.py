@@ -66,6 +66,12 @@ class MetricStreamer(object):
     self._metricDataOutputChunkSize = config.getint(
       "metric_streamer", "chunk_size")
 
+    # Sizes input batches from the models' observed processing rates; None to
+    # send batches of self._metricDataOutputChunkSize rows
+    self._batchSizer = (
+      model_data_feeder.AdaptiveBatchSizer.createFromConfig(config)
+      if config.getboolean("metric_streamer", "adaptive_batching") else None)
+
     # Cache of latest metric_data timestamps for each metric; used for filtering
     # out duplicate/re-delivered input metric data so it won't be saved again
     # in the metric_data table. Each key is a metric id and the corresponding
@@ -177,7 +183,8 @@ class MetricStreamer(object):
       batchSize=self._metricDataOutputChunkSize,
       modelSwapper=modelSwapper,
       logger=self._log,
-      profiling=self._profiling)
+      profiling=self._profiling,
+      batchSizer=self._batchSizer)
 
 
   def _getTailMetricRowTimestamp(self, conn, metricID, lastDataRowID):
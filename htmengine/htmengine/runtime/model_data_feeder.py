@@ -23,21 +23,104 @@
 Utilities for feeding metric data to models
 """
 
+import math
 import time
 
+from htmengine.model_swapper import ModelSwapperConfig
 from htmengine.model_swapper import model_swapper_interface
+from htmengine.model_swapper.runtime_stats import RuntimeStatsReader
+
+
+
+class AdaptiveBatchSizer(object):
+  """ Sizes the input batches of a model from the model's observed processing
+  rate in the model swapper's runtime statistics, so that each batch takes
+  about the target number of seconds to process: a backlog is sent in few large
+  messages instead of many small ones, while a batch of a slow model doesn't
+  hold up its checkpoints and results. The batch size is also limited by the
+  estimated size of the batch message.
+  """
+
+  # Max number of rows marshalled for estimating the size of a row's message
+  _NUM_SAMPLE_ROWS = 100
+
+
+  def __init__(self, defaultBatchSize, maxBatchSize, targetBatchSec,
+               maxBatchBytes, statsReader, batchFormat):
+    """
+    :param defaultBatchSize: number of rows per batch until the model's
+      processing rate is observed
+    :param maxBatchSize: max number of rows per batch
+    :param targetBatchSec: target number of seconds of processing per batch
+    :param maxBatchBytes: max estimated size of a batch message
+    :param statsReader: runtime_stats.RuntimeStatsReader instance
+    :param batchFormat: format of batch messages; one of the
+      model_swapper_interface.BatchPackager.FORMAT_* values
+    """
+    self._defaultBatchSize = defaultBatchSize
+    self._maxBatchSize = maxBatchSize
+    self._targetBatchSec = targetBatchSec
+    self._maxBatchBytes = maxBatchBytes
+    self._statsReader = statsReader
+    self._batchFormat = batchFormat
+
+
+  @classmethod
+  def createFromConfig(cls, config):
+    """
+    :param config: application Config instance
+    """
+    modelSwapperConfig = ModelSwapperConfig()
+    return cls(
+      defaultBatchSize=config.getint("metric_streamer", "chunk_size"),
+      maxBatchSize=config.getint("metric_streamer", "max_chunk_size"),
+      targetBatchSec=config.getfloat("metric_streamer", "target_batch_sec"),
+      maxBatchBytes=config.getint("metric_streamer", "max_batch_bytes"),
+      statsReader=RuntimeStatsReader(
+        modelSwapperConfig.get("swap_controller", "runtime_stats_file")),
+      batchFormat=modelSwapperConfig.get("interface_bus", "batch_format"))
+
+
+  def getBatchSize(self, modelId, inputRows):
+    """
+    :param modelId: unique identifier of the model
+    :param inputRows: non-empty sequence of
+      model_swapper_interface.ModelInputRow objects to be sent to the model
+
+    :returns: number of rows per batch for sending inputRows; the rows are
+      spread evenly across the batches, so that the last one isn't tiny
+    """
+    rowsPerSec = self._statsReader.getRowsPerSec(modelId)
+    if rowsPerSec:
+      batchSize = int(rowsPerSec * self._targetBatchSec)
+    else:
+      batchSize = self._defaultBatchSize
+
+    sampleRows = inputRows[:self._NUM_SAMPLE_ROWS]
+    bytesPerRow = (
+      float(len(model_swapper_interface.BatchPackager.marshal(
+        sampleRows, batchFormat=self._batchFormat))) /
+      len(sampleRows))
+
+    batchSize = max(1, min(batchSize,
+                           self._maxBatchSize,
+                           int(self._maxBatchBytes / bytesPerRow)))
+
+    numBatches = int(math.ceil(float(len(inputRows)) / batchSize))
+    return int(math.ceil(float(len(inputRows)) / numBatches))
 
 
 
 def sendInputRowsToModel(modelId, inputRows, batchSize,
-                         modelSwapper, logger, profiling):
+                         modelSwapper, logger, profiling, batchSizer=None):
   """ Send input rows to CLA model for processing
 
   :param modelId: unique identifier of the model
 
   :param inputRows: sequence of model_swapper_interface.ModelInputRow objects
 
-  :param batchSize: max number of data records per input batch
+  :param batchSize: max number of data records per input batch; ignored if
+    batchSizer is given
 
   :param modelSwapper: model_swapper_interface.ModelSwapperInterface object
 
@@ -45,9 +128,14 @@ def sendInputRowsToModel(modelId, inputRows, batchSize,
 
   :param profiling: True if profiling is enabled
 
-  TODO: unit-test
+  :param batchSizer: optional AdaptiveBatchSizer instance for sizing the input
+    batches
   """
-  logger.debug("Streaming numRecords=%d to model=%s", len(inputRows), modelId)
+  if batchSizer is not None and inputRows:
+    batchSize = batchSizer.getBatchSize(modelId, inputRows)
+
+  logger.debug("Streaming numRecords=%d to model=%s; batchSize=%d",
+               len(inputRows), modelId, batchSize)
 
   # Stream data to HTM model in batches
   for batch in (inputRows[i:i+batchSize] for i in
@@ -314,7 +314,11 @@ def sendBacklogDataToModel(conn, metricId, logger):
         modelSwapper=modelSwapper,
         logger=logger,
         profiling=(config.getboolean("debugging", "profiling") or
-                   logger.isEnabledFor(logging.DEBUG)))
+                   logger.isEnabledFor(logging.DEBUG)),
+        batchSizer=(
+          model_data_feeder.AdaptiveBatchSizer.createFromConfig(config)
+          if config.getboolean("metric_streamer", "adaptive_batching")
+          else None))
 
   logger.info("sendBacklogDataToModel: sent %d backlog data rows to model=%s",
               len(backlogData), metricId)
@@ -372,6 +376,9 @@ def _startModelHelper(conn, metricObj, swarmParams, logger):
     {"status": MetricStatus.CREATE_PENDING,
      "model_params": htmengine.utils.jsonEncode(swarmParams)})
 
+  # The new model's anomaly likelihood params start afresh
+  repository.deleteAnomalyLikelihoodParams(conn, metricObj.uid)
+
   metricObj = repository.getMetric(conn,
                                    metricObj.uid,
                                    fields=[schema.metric.c.uid,
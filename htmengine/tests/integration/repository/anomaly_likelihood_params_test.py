@@ -0,0 +1,123 @@
+# ----------------------------------------------------------------------
+# Numenta Platform for Intelligent Computing (NuPIC)
+# Copyright (C) 2015, Numenta, Inc.  Unless you have purchased from
+# Numenta, Inc. a separate commercial license for this software code, the
+# following terms and conditions apply:
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero Public License for more details.
+#
+# You should have received a copy of the GNU Affero Public License
+# along with this program.  If not, see http://www.gnu.org/licenses.
+#
+# http://numenta.org/licenses/
+# ----------------------------------------------------------------------
+
+
+
+"""Integration test for the anomaly likelihood params functions of
+htmengine.repository.queries
+"""
+
+import unittest
+import uuid
+
+from nta.utils.logging_support_raw import LoggingSupport
+
+import htmengine
+from htmengine.exceptions import AnomalyLikelihoodParamsChangedError
+from htmengine.test_utils import repository_test_utils
+import htmengine.repository
+
+
+
+def setUpModule():
+  LoggingSupport.initTestApp()
+
+
+
+class AnomalyLikelihoodParamsTestCase(unittest.TestCase):
+
+
+  def testVersionedSaves(self):
+    uid = uuid.uuid1().hex
+
+    with repository_test_utils.HtmengineManagedTempRepository(
+        "anomaly_likelihood_params"):
+      engine = htmengine.repository.engineFactory(config=htmengine.APP_CONFIG)
+
+      with engine.connect() as conn:  # pylint: disable=E1101
+        htmengine.repository.addMetric(conn, uid=uid, model_params="{}")
+
+        self.assertIsNone(
+          htmengine.repository.getAnomalyLikelihoodParams(conn, uid))
+
+        version = htmengine.repository.saveAnomalyLikelihoodParams(
+          conn, uid, '"a"', refVersion=None)
+        self.assertEqual(version, 1)
+
+        # Another first version
+        with self.assertRaises(AnomalyLikelihoodParamsChangedError):
+          htmengine.repository.saveAnomalyLikelihoodParams(
+            conn, uid, '"b"', refVersion=None)
+
+        version = htmengine.repository.saveAnomalyLikelihoodParams(
+          conn, uid, '"b"', refVersion=version)
+        self.assertEqual(version, 2)
+
+        # A save based on an outdated version
+        with self.assertRaises(AnomalyLikelihoodParamsChangedError):
+          htmengine.repository.saveAnomalyLikelihoodParams(
+            conn, uid, '"c"', refVersion=1)
+
+        row = htmengine.repository.getAnomalyLikelihoodParams(conn, uid)
+        self.assertEqual((row.params, row.version), ('"b"', 2))
+
+        # The metric row isn't touched
+        self.assertEqual(
+          htmengine.repository.getMetric(conn, uid).model_params, "{}")
+
+
+  def testParamsAreDeletedWithModel(self):
+    uid = uuid.uuid1().hex
+
+    with repository_test_utils.HtmengineManagedTempRepository(
+        "anomaly_likelihood_params"):
+      engine = htmengine.repository.engineFactory(config=htmengine.APP_CONFIG)
+
+      with engine.connect() as conn:  # pylint: disable=E1101
+        htmengine.repository.addMetric(conn, uid=uid)
+        version = htmengine.repository.saveAnomalyLikelihoodParams(
+          conn, uid, '"a"', refVersion=None)
+
+        htmengine.repository.deleteModel(conn, uid)
+
+        self.assertIsNone(
+          htmengine.repository.getAnomalyLikelihoodParams(conn, uid))
+
+        # A save based on the deleted model's params
+        with self.assertRaises(AnomalyLikelihoodParamsChangedError):
+          htmengine.repository.saveAnomalyLikelihoodParams(
+            conn, uid, '"b"', refVersion=version)
+
+
+  def testSaveForMissingMetric(self):
+    with repository_test_utils.HtmengineManagedTempRepository(
+        "anomaly_likelihood_params"):
+      engine = htmengine.repository.engineFactory(config=htmengine.APP_CONFIG)
+
+      with engine.connect() as conn:  # pylint: disable=E1101
+        with self.assertRaises(AnomalyLikelihoodParamsChangedError):
+          htmengine.repository.saveAnomalyLikelihoodParams(
+            conn, uuid.uuid1().hex, '"a"', refVersion=None)
+
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,147 @@
+# ----------------------------------------------------------------------
+# Numenta Platform for Intelligent Computing (NuPIC)
+# Copyright (C) 2015, Numenta, Inc.  Unless you have purchased from
+# Numenta, Inc. a separate commercial license for this software code, the
+# following terms and conditions apply:
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero Public License for more details.
+#
+# You should have received a copy of the GNU Affero Public License
+# along with this program.  If not, see http://www.gnu.org/licenses.
+#
+# http://numenta.org/licenses/
+# ----------------------------------------------------------------------
+
+
+"""Integration test for htmengine.repository.queries.updateMetricDataResults
+"""
+
+from datetime import datetime, timedelta
+import json
+import unittest
+import uuid
+
+from nta.utils.logging_support_raw import LoggingSupport
+
+import htmengine
+from htmengine.test_utils import repository_test_utils
+import htmengine.repository
+from htmengine.repository import queries
+
+
+
+def setUpModule():
+  LoggingSupport.initTestApp()
+
+
+
+class UpdateMetricDataResultsTestCase(unittest.TestCase):
+
+
+  def _checkUpdateMetricDataResults(self, numRows):
+    now = datetime.utcnow().replace(microsecond=0)
+    data = [(float(i), now - timedelta(minutes=5 * (numRows - i)))
+            for i in xrange(numRows)]
+
+    uid1 = uuid.uuid1().hex
+    uid2 = uuid.uuid1().hex
+
+    with repository_test_utils.HtmengineManagedTempRepository(
+        "metric_data_results"):
+      engine = htmengine.repository.engineFactory(config=htmengine.APP_CONFIG)
+
+      with engine.connect() as conn:  # pylint: disable=E1101
+        htmengine.repository.addMetric(conn, uid=uid1)
+        htmengine.repository.addMetric(conn, uid=uid2)
+        rows = htmengine.repository.addMetricData(conn, metricId=uid1,
+                                                  data=data)
+        htmengine.repository.addMetricData(conn, metricId=uid2, data=data)
+
+      # Results for all rows of the first metric, plus one for a row that
+      # doesn't exist
+      results = [
+        dict(rowid=row["rowid"],
+             raw_anomaly_score=row["rowid"] / 1024.0,
+             anomaly_score=0.25,
+             display_value=row["rowid"],
+             multi_step_best_predictions=json.dumps({"1": row["rowid"]}))
+        for row in rows]
+      results.append(dict(rowid=rows[-1]["rowid"] + 1,
+                          raw_anomaly_score=1.0,
+                          anomaly_score=1.0,
+                          display_value=1,
+                          multi_step_best_predictions=None))
+
+      with engine.begin() as conn:  # pylint: disable=E1101
+        htmengine.repository.updateMetricDataResults(conn, uid1, results)
+
+      with engine.connect() as conn:  # pylint: disable=E1101
+        updatedRows = htmengine.repository.getMetricData(
+          conn, metricId=uid1).fetchall()
+        otherRows = htmengine.repository.getMetricData(
+          conn, metricId=uid2).fetchall()
+
+    # Only the existing rows of the metric were updated
+    self.assertEqual(len(updatedRows), numRows)
+    for result, row in zip(results, updatedRows):
+      self.assertEqual(row.rowid, result["rowid"])
+      self.assertEqual(row.raw_anomaly_score, result["raw_anomaly_score"])
+      self.assertEqual(row.anomaly_score, result["anomaly_score"])
+      self.assertEqual(row.display_value, result["display_value"])
+      self.assertEqual(row.multi_step_best_predictions,
+                       result["multi_step_best_predictions"])
+
+    self.assertEqual(len(otherRows), numRows)
+    for row in otherRows:
+      self.assertIsNone(row.raw_anomaly_score)
+      self.assertIsNone(row.anomaly_score)
+
+
+  def testUpdateFewRows(self):
+    self._checkUpdateMetricDataResults(
+      numRows=queries._BULK_RESULTS_UPDATE_MIN_ROWS - 2)
+
+
+  def testUpdateManyRows(self):
+    self._checkUpdateMetricDataResults(numRows=1000)
+
+
+  def testUpdateInTransactionIsRolledBack(self):
+    uid = uuid.uuid1().hex
+
+    with repository_test_utils.HtmengineManagedTempRepository(
+        "metric_data_results"):
+      engine = htmengine.repository.engineFactory(config=htmengine.APP_CONFIG)
+
+      with engine.connect() as conn:  # pylint: disable=E1101
+        htmengine.repository.addMetric(conn, uid=uid)
+        rows = htmengine.repository.addMetricData(
+          conn, metricId=uid,
+          data=[(float(i), datetime(2015, 1, 1) + timedelta(minutes=i))
+                for i in xrange(10)])
+
+      with engine.connect() as conn:  # pylint: disable=E1101
+        with conn.begin() as trans:
+          htmengine.repository.updateMetricDataResults(
+            conn, uid,
+            [dict(rowid=row["rowid"], raw_anomaly_score=0.5,
+                  anomaly_score=0.5, display_value=0,
+                  multi_step_best_predictions=None)
+             for row in rows])
+          # The temporary table's DDL must not have committed the update
+          trans.rollback()
+
+        self.assertEqual(
+          htmengine.repository.getProcessedMetricDataCount(conn, uid), 0)
+
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,146 @@
+# ----------------------------------------------------------------------
+# Numenta Platform for Intelligent Computing (NuPIC)
+# Copyright (C) 2015, Numenta, Inc.  Unless you have purchased from
+# Numenta, Inc. a separate commercial license for this software code, the
+# following terms and conditions apply:
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero Public License for more details.
+#
+# You should have received a copy of the GNU Affero Public License
+# along with this program.  If not, see http://www.gnu.org/licenses.
+#
+# http://numenta.org/licenses/
+# ----------------------------------------------------------------------
+
+
+"""
+Microbenchmark of anomaly likelihood updates of an inference result batch:
+rows/sec of calling algorithms.updateAnomalyLikelihoods once per row, as
+AnomalyLikelihoodHelper did, and of the batch computation that it uses now,
+for each of the given batch sizes. Also verifies that both produce the same
+anomaly scores and params.
+
+Example:
+  python -m tests.performance.anomaly_likelihood_batch_benchmark \
+    --batch-sizes=1,10,100,1440
+"""
+
+import copy
+import datetime
+from optparse import OptionParser
+import random
+import sys
+import time
+
+from nupic.algorithms import anomaly_likelihood as algorithms
+
+from nta.utils.logging_support_raw import LoggingSupport
+
+from htmengine import anomaly_likelihood_helper
+
+
+
+def _estimateParams(rand, numRecords):
+  startTime = datetime.datetime(2015, 1, 1)
+  scores = [
+    (startTime + datetime.timedelta(minutes=5 * i), rand.uniform(0, 100),
+     rand.choice([0.0, 0.025, 0.05, rand.random()]))
+    for i in xrange(numRecords)]
+
+  _, _, params = algorithms.estimateAnomalyLikelihoods(
+    anomalyScores=scores,
+    skipRecords=anomaly_likelihood_helper.NUM_SKIP_RECORDS)
+
+  return params
+
+
+
+def _updatePerRow(rawAnomalyScores, params):
+  anomalyScores = []
+  for rawAnomalyScore in rawAnomalyScores:
+    (likelihood,), _, params = algorithms.updateAnomalyLikelihoods(
+      ((None, None, rawAnomalyScore),), params)
+    anomalyScores.append(float(1.0 - likelihood))
+
+  return anomalyScores, params
+
+
+
+def _updateBatch(rawAnomalyScores, params):
+  batch = anomaly_likelihood_helper._AnomalyLikelihoodBatch(
+    rawAnomalyScores=rawAnomalyScores, params=params)
+  return batch.anomalyScores.tolist(), batch.getParams(len(rawAnomalyScores))
+
+
+
+def _rowsPerSec(func, rawAnomalyScores, params, iterations):
+  """
+  :returns: rows/sec of the fastest of the iterations
+  """
+  best = None
+  for _ in xrange(iterations):
+    # updateAnomalyLikelihoods modifies the params' moving average in place
+    paramsCopy = copy.deepcopy(params)
+    startTime = time.time()
+    func(rawAnomalyScores, paramsCopy)
+    elapsed = time.time() - startTime
+    if best is None or elapsed < best:
+      best = elapsed
+
+  return len(rawAnomalyScores) / max(best, 1e-9)
+
+
+
+def main(argv):
+  parser = OptionParser(
+    "%prog [options]\n"
+    "Compare rows/sec of per-row and batch anomaly likelihood updates.")
+
+  parser.add_option("--batch-sizes", action="store", type="string",
+                    default="1,10,100,1440,10000", dest="batchSizes",
+                    help="Comma-separated numbers of rows per batch "
+                         "[default: %default]")
+  parser.add_option("--stats-rows", action="store", type="int", default=1000,
+                    dest="statsRows",
+                    help="Number of rows for estimating the params "
+                         "[default: %default]")
+  parser.add_option("--iterations", action="store", type="int", default=5,
+                    help="Number of timed iterations per measurement; the "
+                         "fastest is reported [default: %default]")
+
+  options, args = parser.parse_args(argv[1:])
+  if args:
+    parser.error("Didn't expect any positional args (%r)." % (args,))
+
+  rand = random.Random(42)
+  params = _estimateParams(rand, options.statsRows)
+
+  for batchSize in (int(size) for size in options.batchSizes.split(",")):
+    rawAnomalyScores = [rand.choice([0.0, 0.025, rand.random(), 1.0])
+                        for _ in xrange(batchSize)]
+
+    if (_updatePerRow(rawAnomalyScores, copy.deepcopy(params)) !=
+        _updateBatch(rawAnomalyScores, copy.deepcopy(params))):
+      raise AssertionError("Batch results differ from per-row results for "
+                           "batchSize=%d" % (batchSize,))
+
+    perRowRate = _rowsPerSec(_updatePerRow, rawAnomalyScores, params,
+                             options.iterations)
+    batchRate = _rowsPerSec(_updateBatch, rawAnomalyScores, params,
+                            options.iterations)
+
+    print "batchSize=%-6d per-row=%.0f rows/s; batch=%.0f rows/s; x%.1f" % (
+      batchSize, perRowRate, batchRate, batchRate / perRowRate)
+
+
+
+if __name__ == "__main__":
+  LoggingSupport.initTool()
+  main(sys.argv)
@@ -0,0 +1,270 @@
+# ----------------------------------------------------------------------
+# Numenta Platform for Intelligent Computing (NuPIC)
+# Copyright (C) 2015, Numenta, Inc.  Unless you have purchased from
+# Numenta, Inc. a separate commercial license for this software code, the
+# following terms and conditions apply:
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero Public License for more details.
+#
+# You should have received a copy of the GNU Affero Public License
+# along with this program.  If not, see http://www.gnu.org/licenses.
+#
+# http://numenta.org/licenses/
+# ----------------------------------------------------------------------
+
+
+
+"""
+Benchmark of lock waits between AnomalyService's saves of anomaly likelihood
+params and concurrent ingest of metric data by MetricStreamer, against MySQL.
+
+For each save mode, one thread saves anomaly likelihood params of a metric in
+a loop while other threads add metric data to the same metric, the way
+MetricStreamer does (i.e., under the metric row's update lock), for the given
+duration. The modes are:
+  model_params - legacy: lock the metric row via SELECT ... FOR UPDATE and
+    rewrite its whole model_params JSON with the params
+  versioned - conditional versioned update of the anomaly_likelihood_params
+    row after a plain read of the metric's status
+
+Reports save and ingest rates and latencies, and the InnoDB row lock waits and
+wait time accrued during the run.
+
+Runs in a temporary database of the repository configured in
+application.conf, so requires APPLICATION_CONFIG_PATH and a MySQL server, same
+as the integration tests.
+
+Example:
+  python -m tests.performance.anomaly_likelihood_params_lock_benchmark \
+    --duration=10 --ingest-threads=2
+"""
+
+from datetime import datetime, timedelta
+import json
+from optparse import OptionParser
+import random
+import sys
+import threading
+import time
+import uuid
+
+import numpy
+from sqlalchemy.sql import text
+
+from nta.utils.logging_support_raw import LoggingSupport
+
+import htmengine
+import htmengine.repository
+from htmengine.repository import schema
+from htmengine.repository.queries import MetricStatus
+from htmengine.test_utils import repository_test_utils
+
+
+
+_MODE_MODEL_PARAMS = "model_params"
+_MODE_VERSIONED = "versioned"
+
+
+
+def _createLikelihoodParams(rand):
+  """ Anomaly likelihood params of typical size """
+  return {
+    "last_rowid_for_stats": 8640,
+    "params": {
+      "distribution": {"name": "normal", "mean": 0.05, "variance": 0.01,
+                       "stdev": 0.1},
+      "movingAverage": {"windowSize": 10, "total": 0.5,
+                        "historicalValues": [rand.random()
+                                             for _ in xrange(10)]},
+      "historicalLikelihoods": [rand.random() for _ in xrange(10)]
+    }
+  }
+
+
+
+def _createModelParams(modelParamsBytes, likelihoodParams):
+  """ Model params JSON padded to about the given size with the anomaly
+  likelihood params
+  """
+  modelParams = dict(modelConfig=dict(padding="x" * modelParamsBytes),
+                     anomalyLikelihoodParams=likelihoodParams)
+  return json.dumps(modelParams)
+
+
+
+def _getRowLockStatus(engine):
+  """
+  :returns: (Innodb_row_lock_waits, Innodb_row_lock_time in ms)
+  """
+  with engine.connect() as conn:
+    status = dict(conn.execute(
+      text("SHOW GLOBAL STATUS LIKE 'Innodb_row_lock_%'")).fetchall())
+
+  return (int(status["Innodb_row_lock_waits"]),
+          int(status["Innodb_row_lock_time"]))
+
+
+
+class _Worker(threading.Thread):
+  """ Runs the given operation in a loop until stopped, timing each call """
+
+  def __init__(self, operation):
+    super(_Worker, self).__init__()
+    self.daemon = True
+    self.latencies = []
+    self._operation = operation
+    self._stopEvent = threading.Event()
+
+
+  def stop(self):
+    self._stopEvent.set()
+
+
+  def run(self):
+    while not self._stopEvent.is_set():
+      startTime = time.time()
+      self._operation()
+      self.latencies.append(time.time() - startTime)
+
+
+
+def _runMode(engine, mode, options):
+  """
+  :returns: dict of the mode's measurements
+  """
+  rand = random.Random(42)
+  metricId = uuid.uuid1().hex
+  likelihoodParams = _createLikelihoodParams(rand)
+
+  with engine.connect() as conn:
+    htmengine.repository.addMetric(
+      conn, uid=metricId, status=MetricStatus.ACTIVE,
+      model_params=_createModelParams(options.modelParamsBytes,
+                                      likelihoodParams))
+    if mode == _MODE_VERSIONED:
+      htmengine.repository.saveAnomalyLikelihoodParams(
+        conn, metricId, json.dumps(likelihoodParams), refVersion=None)
+
+  saveState = dict(version=1)
+
+  def saveLegacy():
+    with engine.begin() as conn:
+      metricObj = htmengine.repository.getMetricWithUpdateLock(
+        conn, metricId,
+        fields=[schema.metric.c.status, schema.metric.c.model_params])
+      assert metricObj.status == MetricStatus.ACTIVE, metricObj.status
+      modelParams = json.loads(metricObj.model_params)
+      modelParams["anomalyLikelihoodParams"] = likelihoodParams
+      htmengine.repository.updateMetricColumns(
+        conn, metricId, {"model_params": json.dumps(modelParams)})
+
+  def saveVersioned():
+    with engine.begin() as conn:
+      metricObj = htmengine.repository.getMetric(
+        conn, metricId, fields=[schema.metric.c.status])
+      assert metricObj.status == MetricStatus.ACTIVE, metricObj.status
+      saveState["version"] = htmengine.repository.saveAnomalyLikelihoodParams(
+        conn, metricId, json.dumps(likelihoodParams),
+        refVersion=saveState["version"])
+
+  timestamps = dict(next=datetime(2015, 1, 1))
+  timestampsLock = threading.Lock()
+
+  def ingest():
+    with timestampsLock:
+      startTime = timestamps["next"]
+      timestamps["next"] += timedelta(minutes=5 * options.ingestBatchSize)
+
+    with engine.connect() as conn:
+      with conn.begin():
+        # Synchronize with adapter's monitorMetric, as MetricStreamer does
+        htmengine.repository.getMetricWithUpdateLock(
+          conn, metricId, fields=[schema.metric.c.status])
+        htmengine.repository.addMetricData(
+          conn, metricId,
+          [(rand.random(), startTime + timedelta(minutes=5 * i))
+           for i in xrange(options.ingestBatchSize)])
+
+  saver = _Worker(saveLegacy if mode == _MODE_MODEL_PARAMS else saveVersioned)
+  ingesters = [_Worker(ingest) for _ in xrange(options.ingestThreads)]
+
+  lockWaits, lockTimeMs = _getRowLockStatus(engine)
+
+  for worker in [saver] + ingesters:
+    worker.start()
+
+  time.sleep(options.duration)
+
+  for worker in [saver] + ingesters:
+    worker.stop()
+  for worker in [saver] + ingesters:
+    worker.join()
+
+  endLockWaits, endLockTimeMs = _getRowLockStatus(engine)
+
+  ingestLatencies = sum((worker.latencies for worker in ingesters), [])
+
+  return dict(
+    savesPerSec=len(saver.latencies) / options.duration,
+    saveP50Ms=numpy.percentile(saver.latencies, 50) * 1000,
+    saveP99Ms=numpy.percentile(saver.latencies, 99) * 1000,
+    ingestRowsPerSec=(len(ingestLatencies) * options.ingestBatchSize /
+                      options.duration),
+    ingestP99Ms=numpy.percentile(ingestLatencies, 99) * 1000,
+    rowLockWaits=endLockWaits - lockWaits,
+    rowLockTimeMs=endLockTimeMs - lockTimeMs)
+
+
+
+def main(argv):
+  parser = OptionParser(
+    "%prog [options]\n"
+    "Measure lock waits between saves of anomaly likelihood params and "
+    "concurrent ingest of metric data for each save mode.")
+
+  parser.add_option("--duration", action="store", type="float", default=10.0,
+                    help="Seconds to run each mode [default: %default]")
+  parser.add_option("--ingest-threads", action="store", type="int", default=2,
+                    dest="ingestThreads",
+                    help="Number of concurrent ingest threads "
+                         "[default: %default]")
+  parser.add_option("--ingest-batch-size", action="store", type="int",
+                    default=1, dest="ingestBatchSize",
+                    help="Metric data rows per ingest transaction "
+                         "[default: %default]")
+  parser.add_option("--model-params-bytes", action="store", type="int",
+                    default=16384, dest="modelParamsBytes",
+                    help="Approximate size of the model_params JSON of the "
+                         "metric [default: %default]")
+
+  options, args = parser.parse_args(argv[1:])
+  if args:
+    parser.error("Didn't expect any positional args (%r)." % (args,))
+
+  with repository_test_utils.HtmengineManagedTempRepository(
+      "anomaly_likelihood_params_lock_benchmark"):
+    engine = htmengine.repository.engineFactory(config=htmengine.APP_CONFIG)
+
+    for mode in (_MODE_MODEL_PARAMS, _MODE_VERSIONED):
+      stats = _runMode(engine, mode, options)
+
+      print ("mode=%-12s saves=%.0f/s (p50=%.2fms p99=%.2fms); "
+             "ingest=%.0f rows/s (p99=%.2fms); "
+             "row lock waits=%d (%dms)") % (
+               mode, stats["savesPerSec"], stats["saveP50Ms"],
+               stats["saveP99Ms"], stats["ingestRowsPerSec"],
+               stats["ingestP99Ms"], stats["rowLockWaits"],
+               stats["rowLockTimeMs"])
+
+
+
+if __name__ == "__main__":
+  LoggingSupport.initTool()
+  main(sys.argv)
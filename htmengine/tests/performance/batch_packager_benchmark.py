@@ -0,0 +1,126 @@
+# ----------------------------------------------------------------------
+# Numenta Platform for Intelligent Computing (NuPIC)
+# Copyright (C) 2015, Numenta, Inc.  Unless you have purchased from
+# Numenta, Inc. a separate commercial license for this software code, the
+# following terms and conditions apply:
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero Public License for more details.
+#
+# You should have received a copy of the GNU Affero Public License
+# along with this program.  If not, see http://www.gnu.org/licenses.
+#
+# http://numenta.org/licenses/
+# ----------------------------------------------------------------------
+
+"""
+Microbenchmark of BatchPackager batch formats: per-row cost of marshalling and
+unmarshalling batches of ModelInputRow and ModelInferenceResult items, and the
+size of the batch state, in the json and msgpack formats.
+
+Example:
+  python -m tests.performance.batch_packager_benchmark --rows=200
+"""
+
+import datetime
+from optparse import OptionParser
+import random
+import sys
+import time
+
+from nta.utils.logging_support_raw import LoggingSupport
+
+from htmengine.model_swapper.model_swapper_interface import (
+  BatchPackager,
+  ModelInferenceResult,
+  ModelInputRow)
+
+
+
+def _createInputRowBatch(numRows):
+  """ Input rows like those submitted by AnomalyService and the model data
+  feeder: timestamp and metric value
+  """
+  rand = random.Random(42)
+  startTime = datetime.datetime(2015, 1, 1)
+  return [
+    ModelInputRow(rowID=i,
+                  data=[startTime + datetime.timedelta(minutes=5 * i),
+                        rand.uniform(0, 1000)])
+    for i in xrange(numRows)]
+
+
+
+def _createInferenceResultBatch(numRows):
+  """ Inference results like those submitted by ModelRunner """
+  rand = random.Random(42)
+  return [
+    ModelInferenceResult(rowID=i, status=0, anomalyScore=rand.random(),
+                         multiStepBestPredictions={1: rand.uniform(0, 1000)})
+    for i in xrange(numRows)]
+
+
+
+def _timePerRow(func, numRows, iterations):
+  """
+  :returns: minimum over the iterations of the time per row in microseconds
+  """
+  best = None
+  for _ in xrange(iterations):
+    startTime = time.time()
+    func()
+    elapsed = time.time() - startTime
+    if best is None or elapsed < best:
+      best = elapsed
+
+  return best * 1e6 / numRows
+
+
+
+def main(argv):
+  parser = OptionParser(
+    "%prog [options]\n"
+    "Compare per-row encode/decode cost of BatchPackager batch formats.")
+
+  parser.add_option("--rows", action="store", type="int", default=200,
+                    help="Number of rows per batch [default: %default]")
+  parser.add_option("--iterations", action="store", type="int", default=200,
+                    help="Number of timed iterations per measurement; the "
+                         "fastest is reported [default: %default]")
+
+  options, args = parser.parse_args(argv[1:])
+  if args:
+    parser.error("Didn't expect any positional args (%r)." % (args,))
+
+  batches = (("input rows", _createInputRowBatch(options.rows)),
+             ("inference results", _createInferenceResultBatch(options.rows)))
+
+  for label, batch in batches:
+    print "%s (%d per batch):" % (label, options.rows)
+
+    for batchFormat in (BatchPackager.FORMAT_JSON,
+                        BatchPackager.FORMAT_MSGPACK):
+      batchState = BatchPackager.marshal(batch, batchFormat=batchFormat)
+
+      encodeUsec = _timePerRow(
+        lambda: BatchPackager.marshal(batch, batchFormat=batchFormat),
+        options.rows, options.iterations)
+      decodeUsec = _timePerRow(
+        lambda: BatchPackager.unmarshal(batchState),
+        options.rows, options.iterations)
+
+      print "  %-8s encode=%.2fus/row; decode=%.2fus/row; bytes/row=%.1f" % (
+        batchFormat, encodeUsec, decodeUsec,
+        float(len(batchState)) / options.rows)
+
+
+
+if __name__ == "__main__":
+  LoggingSupport.initTool()
+  main(sys.argv)
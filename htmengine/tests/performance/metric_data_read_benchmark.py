@@ -0,0 +1,177 @@
+# ----------------------------------------------------------------------
+# Numenta Platform for Intelligent Computing (NuPIC)
+# Copyright (C) 2015, Numenta, Inc.  Unless you have purchased from
+# Numenta, Inc. a separate commercial license for this software code, the
+# following terms and conditions apply:
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero Public License for more details.
+#
+# You should have received a copy of the GNU Affero Public License
+# along with this program.  If not, see http://www.gnu.org/licenses.
+#
+# http://numenta.org/licenses/
+# ----------------------------------------------------------------------
+
+
+"""
+Benchmark of how AnomalyService obtains the metric_data rows of an inference
+result batch against MySQL: rows/sec of loading them via getMetricData and
+wrapping them in MutableMetricDataRow instances vs. creating them from the
+input timestamps and values carried by the results, for each of the given
+batch sizes. Also reports the number of bytes per result that carrying the
+input timestamps and values adds to result batches in each batch format.
+
+Runs in a temporary database of the repository configured in
+application.conf, so requires APPLICATION_CONFIG_PATH and a MySQL server, same
+as the integration tests.
+
+Example:
+  python -m tests.performance.metric_data_read_benchmark \
+    --batch-sizes=1,10,100,1000,10000
+"""
+
+from datetime import datetime, timedelta
+from optparse import OptionParser
+import sys
+import time
+import uuid
+
+from nta.utils.logging_support_raw import LoggingSupport
+
+import htmengine
+import htmengine.repository
+from htmengine.model_swapper.model_swapper_interface import (
+  BatchPackager,
+  ModelInferenceResult)
+from htmengine.runtime.anomaly_service import (
+  AnomalyService,
+  MutableMetricDataRow)
+from htmengine.test_utils import repository_test_utils
+
+
+
+def _createResults(rows, withInputValues):
+  return [
+    ModelInferenceResult(
+      rowID=row["rowid"], status=0, anomalyScore=(i % 100) / 100.0,
+      multiStepBestPredictions={1: row["metric_value"]},
+      timestamp=row["timestamp"] if withInputValues else None,
+      value=row["metric_value"] if withInputValues else None)
+    for i, row in enumerate(rows)]
+
+
+
+def _loadMetricDataRows(engine, metricId, results):
+  """ AnomalyService's handling of results without input values """
+  with engine.connect() as conn:
+    metricDataRows = htmengine.repository.getMetricData(
+      conn,
+      metricId,
+      start=results[0].rowID,
+      stop=results[-1].rowID)
+
+  return [MutableMetricDataRow(**dict(metricData.items()))
+          for metricData in metricDataRows]
+
+
+
+def _createMetricDataRows(_engine, metricId, results):
+  """ AnomalyService's handling of results with input values """
+  # pylint: disable=W0212
+  return AnomalyService._createMetricDataRowsFromInferenceResults(results,
+                                                                  metricId)
+
+
+
+def _rowsPerSec(func, engine, metricId, results, iterations):
+  """
+  :returns: rows/sec of the fastest of the iterations
+  """
+  best = None
+  for _ in xrange(iterations):
+    startTime = time.time()
+    metricDataRows = func(engine, metricId, results)
+    elapsed = time.time() - startTime
+    assert len(metricDataRows) == len(results), (len(metricDataRows),
+                                                 len(results))
+    if best is None or elapsed < best:
+      best = elapsed
+
+  return len(results) / max(best, 1e-9)
+
+
+
+def _bytesPerResultOfInputValues(rows, batchFormat):
+  """
+  :returns: number of bytes per result that carrying the input timestamps and
+    values adds to a marshaled result batch
+  """
+  sizes = [
+    len(BatchPackager.marshal(_createResults(rows, withInputValues),
+                              batchFormat=batchFormat))
+    for withInputValues in (False, True)]
+
+  return float(sizes[1] - sizes[0]) / len(rows)
+
+
+
+def main(argv):
+  parser = OptionParser(
+    "%prog [options]\n"
+    "Compare rows/sec of loading the metric_data rows of inference results "
+    "and of creating them from the input values carried by the results.")
+
+  parser.add_option("--batch-sizes", action="store", type="string",
+                    default="1,10,100,1000,10000", dest="batchSizes",
+                    help="Comma-separated numbers of results per batch "
+                         "[default: %default]")
+  parser.add_option("--iterations", action="store", type="int", default=5,
+                    help="Number of timed iterations per measurement; the "
+                         "fastest is reported [default: %default]")
+
+  options, args = parser.parse_args(argv[1:])
+  if args:
+    parser.error("Didn't expect any positional args (%r)." % (args,))
+
+  batchSizes = [int(size) for size in options.batchSizes.split(",")]
+
+  with repository_test_utils.HtmengineManagedTempRepository(
+      "metric_data_read_benchmark"):
+    engine = htmengine.repository.engineFactory(config=htmengine.APP_CONFIG)
+
+    for batchSize in batchSizes:
+      metricId = uuid.uuid1().hex
+      startTime = datetime(2015, 1, 1)
+      with engine.connect() as conn:
+        htmengine.repository.addMetric(conn, uid=metricId)
+        rows = htmengine.repository.addMetricData(
+          conn, metricId=metricId,
+          data=[(float(i), startTime + timedelta(minutes=5 * i))
+                for i in xrange(batchSize)])
+
+      loadRate = _rowsPerSec(_loadMetricDataRows, engine, metricId,
+                             _createResults(rows, withInputValues=False),
+                             options.iterations)
+      createRate = _rowsPerSec(_createMetricDataRows, engine, metricId,
+                               _createResults(rows, withInputValues=True),
+                               options.iterations)
+
+      print ("batchSize=%-6d load=%.0f rows/s; from results=%.0f rows/s; "
+             "x%.1f; extra bytes/result: json=%.1f msgpack=%.1f") % (
+               batchSize, loadRate, createRate, createRate / loadRate,
+               _bytesPerResultOfInputValues(rows, BatchPackager.FORMAT_JSON),
+               _bytesPerResultOfInputValues(rows,
+                                            BatchPackager.FORMAT_MSGPACK))
+
+
+
+if __name__ == "__main__":
+  LoggingSupport.initTool()
+  main(sys.argv)
@@ -0,0 +1,153 @@
+# ----------------------------------------------------------------------
+# Numenta Platform for Intelligent Computing (NuPIC)
+# Copyright (C) 2015, Numenta, Inc.  Unless you have purchased from
+# Numenta, Inc. a separate commercial license for this software code, the
+# following terms and conditions apply:
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero Public License for more details.
+#
+# You should have received a copy of the GNU Affero Public License
+# along with this program.  If not, see http://www.gnu.org/licenses.
+#
+# http://numenta.org/licenses/
+# ----------------------------------------------------------------------
+
+
+"""
+Benchmark of writing model results to metric_data against MySQL: rows/sec of
+AnomalyService's former one UPDATE per row via updateMetricDataColumns vs. the
+bulk updateMetricDataResults, each in a transaction, for each of the given
+batch sizes.
+
+Runs in a temporary database of the repository configured in
+application.conf, so requires APPLICATION_CONFIG_PATH and a MySQL server, same
+as the integration tests.
+
+Example:
+  python -m tests.performance.metric_data_results_benchmark \
+    --batch-sizes=1,10,100,1000,10000
+"""
+
+from datetime import datetime, timedelta
+import json
+from optparse import OptionParser
+import sys
+import time
+import uuid
+
+from nta.utils.logging_support_raw import LoggingSupport
+
+import htmengine
+import htmengine.repository
+from htmengine.test_utils import repository_test_utils
+
+
+
+def _createResults(rows, iteration):
+  """ Results that differ between iterations, so that MySQL doesn't skip the
+  updates of unchanged rows
+  """
+  return [
+    dict(rowid=row["rowid"],
+         raw_anomaly_score=(iteration + i % 100) / 1000.0,
+         anomaly_score=(iteration + i % 10) / 100.0,
+         display_value=iteration,
+         multi_step_best_predictions=json.dumps({"1": iteration + i}))
+    for i, row in enumerate(rows)]
+
+
+
+class _MetricDataKey(object):
+  """ The attributes of MetricData that updateMetricDataColumns uses """
+  def __init__(self, uid, rowid):
+    self.uid = uid
+    self.rowid = rowid
+
+
+
+def _updatePerRow(conn, metricId, results):
+  for result in results:
+    fields = dict(result)
+    rowid = fields.pop("rowid")
+    htmengine.repository.updateMetricDataColumns(
+      conn, _MetricDataKey(uid=metricId, rowid=rowid), fields)
+
+
+
+def _updateBulk(conn, metricId, results):
+  htmengine.repository.updateMetricDataResults(conn, metricId, results)
+
+
+
+def _rowsPerSec(engine, func, metricId, rows, iterations, firstIteration):
+  """
+  :returns: rows/sec of the fastest of the iterations
+  """
+  best = None
+  for iteration in xrange(firstIteration, firstIteration + iterations):
+    results = _createResults(rows, iteration)
+    startTime = time.time()
+    with engine.begin() as conn:
+      func(conn, metricId, results)
+    elapsed = time.time() - startTime
+    if best is None or elapsed < best:
+      best = elapsed
+
+  return len(rows) / best
+
+
+
+def main(argv):
+  parser = OptionParser(
+    "%prog [options]\n"
+    "Compare rows/sec of per-row and bulk metric_data result writes.")
+
+  parser.add_option("--batch-sizes", action="store", type="string",
+                    default="1,2,5,10,100,1000,10000", dest="batchSizes",
+                    help="Comma-separated numbers of rows per batch "
+                         "[default: %default]")
+  parser.add_option("--iterations", action="store", type="int", default=5,
+                    help="Number of timed iterations per measurement; the "
+                         "fastest is reported [default: %default]")
+
+  options, args = parser.parse_args(argv[1:])
+  if args:
+    parser.error("Didn't expect any positional args (%r)." % (args,))
+
+  batchSizes = [int(size) for size in options.batchSizes.split(",")]
+
+  with repository_test_utils.HtmengineManagedTempRepository(
+      "metric_data_results_benchmark"):
+    engine = htmengine.repository.engineFactory(config=htmengine.APP_CONFIG)
+
+    for batchSize in batchSizes:
+      metricId = uuid.uuid1().hex
+      startTime = datetime(2015, 1, 1)
+      with engine.connect() as conn:
+        htmengine.repository.addMetric(conn, uid=metricId)
+        rows = htmengine.repository.addMetricData(
+          conn, metricId=metricId,
+          data=[(float(i), startTime + timedelta(minutes=5 * i))
+                for i in xrange(batchSize)])
+
+      perRowRate = _rowsPerSec(engine, _updatePerRow, metricId, rows,
+                               options.iterations, firstIteration=0)
+      bulkRate = _rowsPerSec(engine, _updateBulk, metricId, rows,
+                             options.iterations,
+                             firstIteration=options.iterations)
+
+      print "batchSize=%-6d per-row=%.0f rows/s; bulk=%.0f rows/s; x%.1f" % (
+        batchSize, perRowRate, bulkRate, bulkRate / perRowRate)
+
+
+
+if __name__ == "__main__":
+  LoggingSupport.initTool()
+  main(sys.argv)
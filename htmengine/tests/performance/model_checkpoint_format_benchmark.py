@@ -0,0 +1,217 @@
+# ----------------------------------------------------------------------
+# Numenta Platform for Intelligent Computing (NuPIC)
+# Copyright (C) 2015, Numenta, Inc.  Unless you have purchased from
+# Numenta, Inc. a separate commercial license for this software code, the
+# following terms and conditions apply:
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero Public License for more details.
+#
+# You should have received a copy of the GNU Affero Public License
+# along with this program.  If not, see http://www.gnu.org/licenses.
+#
+# http://numenta.org/licenses/
+# ----------------------------------------------------------------------
+
+"""
+Benchmark of ModelCheckpointMgr model instance formats: the legacy "directory"
+format vs. the compressed "archive" format.
+
+Measures checkpoint save time, bytes stored per checkpoint and the time to make
+the saved model instance available to ModelFactory.loadFromCheckpoint() (i.e.,
+load time excluding model deserialization, which is the same for both formats).
+
+The synthetic model instance mimics the layout of a CLA model's: a small
+model.pkl and a few large, sparse network region files.
+
+Requires APPLICATION_CONFIG_PATH, same as the unit tests. Checkpoints are
+written to a temporary storage root, which defaults to the system's temp
+directory; use --tempdir to benchmark a specific filesystem.
+
+Example:
+  python -m tests.performance.model_checkpoint_format_benchmark --size-mb=20
+"""
+
+from optparse import OptionParser
+import os
+import random
+import sys
+import tempfile
+import time
+import uuid
+
+from nta.utils.logging_support_raw import LoggingSupport
+from nta.utils.test_utils.config_test_utils import ConfigAttributePatch
+
+from htmengine.model_checkpoint_mgr.model_checkpoint_mgr import (
+  ModelCheckpointConfig,
+  ModelCheckpointMgr)
+from htmengine.model_checkpoint_mgr.model_checkpoint_test_utils import (
+  ModelCheckpointStoragePatch)
+
+
+
+# Disable warning: Access to a protected member
+# pylint: disable=W0212
+
+
+
+class _SyntheticModel(object):
+  """ Stands in for an OPF model: save() writes a CLA-like model instance
+  directory
+  """
+
+  _NUM_REGIONS = 4
+
+
+  def __init__(self, sizeMB, density):
+    regionSize = sizeMB * 1024 * 1024 // self._NUM_REGIONS
+    rand = random.Random(42)
+
+    # Mostly-zero permanences with random non-zero values, like the synapse
+    # state of HTM network regions
+    self._regions = []
+    for _ in xrange(self._NUM_REGIONS):
+      region = bytearray(regionSize)
+      for i in rand.sample(xrange(regionSize), int(regionSize * density)):
+        region[i] = rand.randint(1, 255)
+      self._regions.append(str(region))
+
+
+  def save(self, saveModelDir):
+    extraDataDir = os.path.join(saveModelDir, "modelextradata",
+                                "TemporalAnomaly-network.nta")
+    os.makedirs(extraDataDir)
+
+    with open(os.path.join(saveModelDir, "model.pkl"), "wb") as fileObj:
+      fileObj.write("x" * 4096)
+
+    for i, region in enumerate(self._regions):
+      with open(os.path.join(extraDataDir, "R%d-pkl" % (i,)),
+                "wb") as fileObj:
+        fileObj.write(region)
+
+
+
+def _getTreeSize(rootPath):
+  return sum(os.path.getsize(os.path.join(parentPath, fileName))
+             for parentPath, _dirNames, fileNames in os.walk(rootPath)
+             for fileName in fileNames)
+
+
+
+def _readTree(rootPath):
+  """ Read all files in the tree, as ModelFactory.loadFromCheckpoint would """
+  for parentPath, _dirNames, fileNames in os.walk(rootPath):
+    for fileName in fileNames:
+      with open(os.path.join(parentPath, fileName), "rb") as fileObj:
+        fileObj.read()
+
+
+
+def _benchmarkFormat(instanceFormat, compressionLevel, model, iterations):
+  """
+  :returns: a three-tuple: list of save times, list of load times and number of
+    bytes stored per checkpoint
+  """
+  with ConfigAttributePatch(
+      ModelCheckpointConfig.CONFIG_NAME,
+      os.environ.get("APPLICATION_CONFIG_PATH"),
+      (("storage", "instance_format", instanceFormat),
+       ("storage", "archive_compression_level", str(compressionLevel)))):
+    checkpointMgr = ModelCheckpointMgr()
+
+  modelID = "benchmark-" + uuid.uuid1().hex
+  checkpointMgr.define(modelID, definition=dict())
+
+  saveTimes = []
+  loadTimes = []
+  try:
+    for _ in xrange(iterations):
+      startTime = time.time()
+      checkpointMgr.save(modelID, model, attributes=None)
+      saveTimes.append(time.time() - startTime)
+
+      checkpointStoreDirPath = checkpointMgr._getCurrentCheckpointRealPath(
+        modelID)
+
+      startTime = time.time()
+      with checkpointMgr._openModelInstanceDir(checkpointStoreDirPath) as (
+          modelInstanceDirPath):
+        _readTree(modelInstanceDirPath)
+      loadTimes.append(time.time() - startTime)
+
+    storedBytes = _getTreeSize(checkpointStoreDirPath)
+  finally:
+    checkpointMgr.remove(modelID)
+
+  return saveTimes, loadTimes, storedBytes
+
+
+
+def _summarize(label, latencies):
+  latencies = sorted(latencies)
+  count = len(latencies)
+  return "%s: min=%.4fs; median=%.4fs; max=%.4fs" % (
+    label, latencies[0], latencies[count // 2], latencies[-1])
+
+
+
+def main(argv):
+  parser = OptionParser(
+    "%prog [options]\n"
+    "Compare ModelCheckpointMgr model instance formats.")
+
+  parser.add_option("--iterations", action="store", type="int", default=10,
+                    help="Number of checkpoints per format [default: %default]")
+  parser.add_option("--size-mb", action="store", type="int", default=10,
+                    dest="sizeMB",
+                    help="Size of the synthetic model instance in MB "
+                         "[default: %default]")
+  parser.add_option("--density", action="store", type="float", default=0.05,
+                    help="Fraction of non-zero bytes in the synthetic model "
+                         "instance [default: %default]")
+  parser.add_option("--compression-levels", action="store", default="1,6",
+                    dest="compressionLevels",
+                    help="Comma-separated archive compression levels "
+                         "[default: %default]")
+  parser.add_option("--tempdir", action="store", default=None,
+                    help="Parent directory of the temporary checkpoint "
+                         "storage root [default: system temp directory]")
+
+  options, args = parser.parse_args(argv[1:])
+  if args:
+    parser.error("Didn't expect any positional args (%r)." % (args,))
+
+  if options.tempdir is not None:
+    tempfile.tempdir = options.tempdir
+
+  model = _SyntheticModel(sizeMB=options.sizeMB, density=options.density)
+
+  variants = [("directory", 0)] + [
+    ("archive", int(level)) for level in options.compressionLevels.split(",")]
+
+  with ModelCheckpointStoragePatch():
+    for instanceFormat, compressionLevel in variants:
+      saveTimes, loadTimes, storedBytes = _benchmarkFormat(
+        instanceFormat, compressionLevel, model, options.iterations)
+
+      label = instanceFormat
+      if instanceFormat == "archive":
+        label += "(level=%d)" % (compressionLevel,)
+
+      print "%-17s bytes=%d; %s; %s" % (
+        label, storedBytes, _summarize("save", saveTimes),
+        _summarize("load", loadTimes))
+
+
+
+if __name__ == "__main__":
+  LoggingSupport.initTool()
+  main(sys.argv)
@@ -0,0 +1,180 @@
+# ----------------------------------------------------------------------
+# Numenta Platform for Intelligent Computing (NuPIC)
+# Copyright (C) 2015, Numenta, Inc.  Unless you have purchased from
+# Numenta, Inc. a separate commercial license for this software code, the
+# following terms and conditions apply:
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero Public License for more details.
+#
+# You should have received a copy of the GNU Affero Public License
+# along with this program.  If not, see http://www.gnu.org/licenses.
+#
+# http://numenta.org/licenses/
+# ----------------------------------------------------------------------
+
+"""
+Benchmark of ModelCheckpointMgr checkpoint throughput per sync_mode: fsync of
+each checkpoint file vs. syncfs group commit.
+
+Runs the given number of concurrent processes, each saving checkpoints of its
+own model back to back, like ModelRunners of concurrently checkpointing slots,
+and reports the aggregate number of checkpoints per second.
+
+Requires APPLICATION_CONFIG_PATH, same as the unit tests. Checkpoints are
+written to a temporary storage root, which defaults to the system's temp
+directory; since the cost of syncing depends on the storage device, use
+--tempdir to benchmark the filesystem that holds the model checkpoints.
+
+Example:
+  python -m tests.performance.model_checkpoint_sync_benchmark --processes=8
+"""
+
+import multiprocessing
+from optparse import OptionParser
+import os
+import sys
+import tempfile
+import time
+import uuid
+
+from nta.utils.logging_support_raw import LoggingSupport
+from nta.utils.test_utils.config_test_utils import ConfigAttributePatch
+
+from htmengine.model_checkpoint_mgr.model_checkpoint_mgr import (
+  ModelCheckpointConfig,
+  ModelCheckpointMgr)
+from htmengine.model_checkpoint_mgr.model_checkpoint_test_utils import (
+  ModelCheckpointStoragePatch)
+
+
+
+class _SyntheticModel(object):
+  """ Stands in for an OPF model: save() writes the given number of files """
+
+
+  def __init__(self, numFiles, fileSize):
+    self._numFiles = numFiles
+    self._content = os.urandom(fileSize)
+
+
+  def save(self, saveModelDir):
+    os.makedirs(saveModelDir)
+    for i in xrange(self._numFiles):
+      with open(os.path.join(saveModelDir, "R%d-pkl" % (i,)),
+                "wb") as fileObj:
+        fileObj.write(self._content)
+
+
+
+def _runCheckpoints(model, numCheckpoints):
+  """ Save checkpoints of a new model back to back """
+  checkpointMgr = ModelCheckpointMgr()
+
+  modelID = "benchmark-" + uuid.uuid1().hex
+  checkpointMgr.define(modelID, definition=dict())
+
+  for _ in xrange(numCheckpoints):
+    checkpointMgr.save(modelID, model, attributes=None)
+
+
+
+def _benchmarkSyncMode(syncMode, instanceFormat, groupCommitWindowSec, model,
+                       numProcesses, numCheckpoints):
+  """
+  :returns: aggregate checkpoints per second
+  """
+  with ConfigAttributePatch(
+      ModelCheckpointConfig.CONFIG_NAME,
+      os.environ.get("APPLICATION_CONFIG_PATH"),
+      (("storage", "sync_mode", syncMode),
+       ("storage", "instance_format", instanceFormat),
+       ("storage", "group_commit_window_sec", str(groupCommitWindowSec)))):
+    processes = [
+      multiprocessing.Process(target=_runCheckpoints,
+                              args=(model, numCheckpoints))
+      for _ in xrange(numProcesses)]
+
+    startTime = time.time()
+    for process in processes:
+      process.start()
+
+    for process in processes:
+      process.join()
+    elapsed = time.time() - startTime
+
+  for process in processes:
+    if process.exitcode != 0:
+      raise RuntimeError("Checkpoint process failed with exitcode=%s" %
+                         (process.exitcode,))
+
+  ModelCheckpointMgr.removeAll()
+
+  return numProcesses * numCheckpoints / elapsed
+
+
+
+def main(argv):
+  parser = OptionParser(
+    "%prog [options]\n"
+    "Compare ModelCheckpointMgr checkpoint throughput per sync_mode.")
+
+  parser.add_option("--processes", action="store", type="int", default=4,
+                    help="Number of concurrently checkpointing processes "
+                         "[default: %default]")
+  parser.add_option("--checkpoints", action="store", type="int", default=20,
+                    help="Number of checkpoints per process "
+                         "[default: %default]")
+  parser.add_option("--files", action="store", type="int", default=20,
+                    help="Number of files in the synthetic model instance "
+                         "[default: %default]")
+  parser.add_option("--file-kb", action="store", type="int", default=64,
+                    dest="fileKB",
+                    help="Size of each synthetic model instance file in KB "
+                         "[default: %default]")
+  parser.add_option("--instance-format", action="store", default="directory",
+                    dest="instanceFormat",
+                    help="Model instance format: directory or archive "
+                         "[default: %default]")
+  parser.add_option("--window-sec", action="store", type="float",
+                    default=0.0, dest="windowSec",
+                    help="Group commit window for syncfs mode "
+                         "[default: %default]")
+  parser.add_option("--tempdir", action="store", default=None,
+                    help="Parent directory of the temporary checkpoint "
+                         "storage root [default: system temp directory]")
+
+  options, args = parser.parse_args(argv[1:])
+  if args:
+    parser.error("Didn't expect any positional args (%r)." % (args,))
+
+  if options.tempdir is not None:
+    tempfile.tempdir = options.tempdir
+
+  model = _SyntheticModel(numFiles=options.files,
+                          fileSize=options.fileKB * 1024)
+
+  with ModelCheckpointStoragePatch():
+    for syncMode in ("fsync", "syncfs"):
+      checkpointsPerSec = _benchmarkSyncMode(
+        syncMode,
+        instanceFormat=options.instanceFormat,
+        groupCommitWindowSec=options.windowSec,
+        model=model,
+        numProcesses=options.processes,
+        numCheckpoints=options.checkpoints)
+
+      print "%-6s processes=%d; checkpoints/sec=%.1f" % (
+        syncMode, options.processes, checkpointsPerSec)
+
+
+
+if __name__ == "__main__":
+  LoggingSupport.initTool()
+  main(sys.argv)
@@ -0,0 +1,245 @@
+# ----------------------------------------------------------------------
+# Numenta Platform for Intelligent Computing (NuPIC)
+# Copyright (C) 2015, Numenta, Inc.  Unless you have purchased from
+# Numenta, Inc. a separate commercial license for this software code, the
+# following terms and conditions apply:
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero Public License for more details.
+#
+# You should have received a copy of the GNU Affero Public License
+# along with this program.  If not, see http://www.gnu.org/licenses.
+#
+# http://numenta.org/licenses/
+# ----------------------------------------------------------------------
+
+
+"""
+Benchmark of fixed vs. adaptive input batch sizing: simulates the pipeline of
+one model, from the model data feeder through ModelRunner, and reports the
+throughput of a backlog and the latency of live input rows that arrive while
+the backlog is processed.
+
+Each input batch message costs --msg-overhead-sec (publish, consume and decode)
+plus --row-sec per row; a run of batches ends with a checkpoint that costs
+--checkpoint-sec. With fixed sizing, the backlog is sent in batches of
+--chunk-size rows and ModelRunner checkpoints after
+--requests-per-checkpoint rows. With adaptive sizing, AdaptiveBatchSizer sizes
+the batches from the model's processing rate in a runtime stats file, and
+ModelRunner checkpoints after --checkpoint-interval-sec of estimated
+processing, like the adaptive_batching and adaptive_checkpoint_interval
+options.
+
+Time is simulated, so the results are deterministic; only AdaptiveBatchSizer
+runs for real.
+
+Example:
+  python -m tests.performance.model_data_feeder_benchmark --backlog=100000
+"""
+
+import datetime
+from optparse import OptionParser
+import os
+import shutil
+import sys
+import tempfile
+
+from nta.utils.logging_support_raw import LoggingSupport
+
+from htmengine.model_swapper.model_swapper_interface import (
+  BatchPackager,
+  ModelInputRow)
+from htmengine.model_swapper.runtime_stats import (
+  RuntimeStatsAggregator,
+  RuntimeStatsReader)
+from htmengine.runtime.model_data_feeder import AdaptiveBatchSizer
+
+
+
+_MODEL_ID = "benchmark"
+
+
+
+def _createInputRows(numRows):
+  startTime = datetime.datetime(2015, 1, 1)
+  return [
+    ModelInputRow(rowID=i,
+                  data=[startTime + datetime.timedelta(minutes=5 * i),
+                        float(i % 1000)])
+    for i in xrange(numRows)]
+
+
+
+def _percentile(values, percentile):
+  values = sorted(values)
+  index = min(len(values) - 1, int(len(values) * percentile / 100.0))
+  return values[index]
+
+
+
+def _simulate(messages, options, adaptive):
+  """ Process the messages in order of arrival
+
+  :param messages: sequence of (arrivalTime, numRows, isLive) tuples, sorted by
+    arrivalTime
+  :param adaptive: True to end runs by estimated processing time
+
+  :returns: (time the backlog was done, latencies of the live rows)
+  """
+  now = 0.0
+  runNumRows = 0
+  backlogDoneTime = 0.0
+  liveLatencies = []
+
+  for arrivalTime, numRows, isLive in messages:
+    now = max(now, arrivalTime)
+    now += options.msgOverheadSec + numRows * options.rowSec
+    runNumRows += numRows
+
+    # Results of the batch are submitted after it's processed
+    if isLive:
+      liveLatencies.append(now - arrivalTime)
+    else:
+      backlogDoneTime = now
+
+    if adaptive:
+      runComplete = (runNumRows * options.rowSec >=
+                     options.checkpointIntervalSec)
+    else:
+      runComplete = runNumRows >= options.requestsPerCheckpoint
+
+    if runComplete:
+      now += options.checkpointSec
+      runNumRows = 0
+
+  return backlogDoneTime, liveLatencies
+
+
+
+def _createMessages(backlogBatchSizes, options):
+  """
+  :returns: sequence of (arrivalTime, numRows, isLive) tuples of the backlog
+    batches sent at time 0 followed by the live rows, sorted by arrivalTime
+  """
+  messages = [(0.0, numRows, False) for numRows in backlogBatchSizes]
+  messages.extend(
+    (i * options.liveIntervalSec, 1, True)
+    for i in xrange(1, options.liveRows + 1))
+  messages.sort(key=lambda message: message[0])
+  return messages
+
+
+
+def _splitBatches(numRows, batchSize):
+  return [min(batchSize, numRows - i) for i in xrange(0, numRows, batchSize)]
+
+
+
+def main(argv):
+  parser = OptionParser(
+    "%prog [options]\n"
+    "Compare backlog throughput and live latency of fixed and adaptive input "
+    "batch sizing.")
+
+  parser.add_option("--backlog", action="store", type="int", default=50000,
+                    help="Number of backlog rows [default: %default]")
+  parser.add_option("--live-rows", action="store", type="int", default=200,
+                    dest="liveRows",
+                    help="Number of live rows [default: %default]")
+  parser.add_option("--live-interval-sec", action="store", type="float",
+                    default=1.0, dest="liveIntervalSec",
+                    help="Seconds between live rows [default: %default]")
+  parser.add_option("--row-sec", action="store", type="float", default=0.002,
+                    dest="rowSec",
+                    help="Model processing seconds per row [default: %default]")
+  parser.add_option("--msg-overhead-sec", action="store", type="float",
+                    default=0.05, dest="msgOverheadSec",
+                    help="Seconds of overhead per batch message "
+                         "[default: %default]")
+  parser.add_option("--checkpoint-sec", action="store", type="float",
+                    default=1.0, dest="checkpointSec",
+                    help="Seconds per checkpoint [default: %default]")
+  parser.add_option("--chunk-size", action="store", type="int", default=1440,
+                    dest="chunkSize",
+                    help="Fixed batch size, and adaptive batch size until the "
+                         "rate is observed [default: %default]")
+  parser.add_option("--requests-per-checkpoint", action="store", type="int",
+                    default=500, dest="requestsPerCheckpoint",
+                    help="Fixed rows per checkpoint [default: %default]")
+  parser.add_option("--target-batch-sec", action="store", type="float",
+                    default=5.0, dest="targetBatchSec",
+                    help="Adaptive target seconds per batch "
+                         "[default: %default]")
+  parser.add_option("--max-chunk-size", action="store", type="int",
+                    default=10000, dest="maxChunkSize",
+                    help="Adaptive max batch size [default: %default]")
+  parser.add_option("--max-batch-bytes", action="store", type="int",
+                    default=1048576, dest="maxBatchBytes",
+                    help="Adaptive max batch message size "
+                         "[default: %default]")
+  parser.add_option("--checkpoint-interval-sec", action="store", type="float",
+                    default=30.0, dest="checkpointIntervalSec",
+                    help="Adaptive seconds of processing per checkpoint "
+                         "[default: %default]")
+
+  options, args = parser.parse_args(argv[1:])
+  if args:
+    parser.error("Didn't expect any positional args (%r)." % (args,))
+  if options.backlog < 1 or options.liveRows < 1:
+    parser.error("Expected at least one backlog row and one live row.")
+
+  backlogRows = _createInputRows(options.backlog)
+
+  tempDir = tempfile.mkdtemp()
+  try:
+    # The runtime stats that the model swapper would have exported for the
+    # model
+    statsFilePath = os.path.join(tempDir, "stats.json")
+    aggregator = RuntimeStatsAggregator(statsFilePath=statsFilePath)
+    aggregator.noteRunReport(
+      _MODEL_ID,
+      dict(numRowsProcessed=options.backlog,
+           processSec=options.backlog * options.rowSec))
+    aggregator.export()
+
+    sizer = AdaptiveBatchSizer(
+      defaultBatchSize=options.chunkSize,
+      maxBatchSize=options.maxChunkSize,
+      targetBatchSec=options.targetBatchSec,
+      maxBatchBytes=options.maxBatchBytes,
+      statsReader=RuntimeStatsReader(statsFilePath),
+      batchFormat=BatchPackager.FORMAT_JSON)
+
+    adaptiveBatchSize = sizer.getBatchSize(_MODEL_ID, backlogRows)
+  finally:
+    shutil.rmtree(tempDir)
+
+  print ("backlog=%d rows; live=%d rows every %.2fs; row=%.4fs; "
+         "msgOverhead=%.4fs; checkpoint=%.2fs" % (
+           options.backlog, options.liveRows, options.liveIntervalSec,
+           options.rowSec, options.msgOverheadSec, options.checkpointSec))
+
+  for label, batchSize, adaptive in (
+      ("fixed", options.chunkSize, False),
+      ("adaptive", adaptiveBatchSize, True)):
+    batchSizes = _splitBatches(options.backlog, batchSize)
+    backlogDoneTime, liveLatencies = _simulate(
+      _createMessages(batchSizes, options), options, adaptive)
+
+    print ("  %-8s batchSize=%d; numBatches=%d; backlog=%.1fs (%.0f rows/s); "
+           "live latency p50=%.2fs p99=%.2fs" % (
+             label, batchSize, len(batchSizes), backlogDoneTime,
+             options.backlog / backlogDoneTime,
+             _percentile(liveLatencies, 50), _percentile(liveLatencies, 99)))
+
+
+
+if __name__ == "__main__":
+  LoggingSupport.initTool()
+  main(sys.argv)
@@ -0,0 +1,143 @@
+# ----------------------------------------------------------------------
+# Numenta Platform for Intelligent Computing (NuPIC)
+# Copyright (C) 2015, Numenta, Inc.  Unless you have purchased from
+# Numenta, Inc. a separate commercial license for this software code, the
+# following terms and conditions apply:
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero Public License for more details.
+#
+# You should have received a copy of the GNU Affero Public License
+# along with this program.  If not, see http://www.gnu.org/licenses.
+#
+# http://numenta.org/licenses/
+# ----------------------------------------------------------------------
+
+"""
+Benchmark of model swap latency: starting a new ModelRunner process per swap vs.
+handing the model to a warm ModelRunner process from ModelRunnerPool.
+
+Each iteration runs a ModelRunner against an empty model input queue, so the
+measured time is dominated by process start-up, imports and connecting to the
+message bus, which is exactly the overhead that the pool hides.
+
+Requires a running RabbitMQ broker and APPLICATION_CONFIG_PATH, same as the
+integration tests.
+
+Example:
+  python -m tests.performance.model_runner_pool_benchmark --iterations=20
+"""
+
+from optparse import OptionParser
+import sys
+import time
+import uuid
+
+from nta.utils.logging_support_raw import LoggingSupport
+from nta.utils.message_bus_connector import MessageBusConnector
+
+from htmengine.model_swapper import model_runner_pool
+from htmengine.model_swapper.model_runner_pool import ModelRunnerPool
+from htmengine.model_swapper.model_swapper_interface import (
+  ModelSwapperInterface)
+
+
+
+def _runModel(startModelRunner, inputQueueName, modelID, bus):
+  """ Run a ModelRunner for an empty model until it exits
+
+  :returns: elapsed seconds from the swap request until ModelRunner exit
+  """
+  bus.createMessageQueue(inputQueueName, durable=True)
+  try:
+    startTime = time.time()
+    process = startModelRunner(modelID)
+    returnCode = process.wait()
+    elapsed = time.time() - startTime
+  finally:
+    bus.deleteMessageQueue(inputQueueName)
+
+  if returnCode != 0:
+    raise RuntimeError("ModelRunner failed with returnCode=%s" % (returnCode,))
+
+  return elapsed
+
+
+
+def _waitForWarmPool(poolSize):
+  pool = ModelRunnerPool._singleton  # pylint: disable=W0212
+  while True:
+    with pool._mutex:  # pylint: disable=W0212
+      if len(pool._idleProcesses) >= poolSize:  # pylint: disable=W0212
+        return
+    time.sleep(0.05)
+
+
+
+def _summarize(label, latencies):
+  latencies = sorted(latencies)
+  count = len(latencies)
+  print ("%-6s n=%d; min=%.4fs; median=%.4fs; p90=%.4fs; max=%.4fs; "
+         "mean=%.4fs" % (
+           label, count, latencies[0], latencies[count // 2],
+           latencies[min(count - 1, int(count * 0.9))], latencies[-1],
+           sum(latencies) / count))
+
+
+
+def main(argv):
+  parser = OptionParser(
+    "%prog [options]\n"
+    "Compare ModelRunner swap latency with and without ModelRunnerPool.")
+
+  parser.add_option("--iterations", action="store", type="int", default=10,
+                    help="Number of model swaps per mode [default: %default]")
+  parser.add_option("--pool-size", action="store", type="int", default=2,
+                    dest="poolSize",
+                    help="Warm ModelRunner pool size [default: %default]")
+
+  options, args = parser.parse_args(argv[1:])
+  if args:
+    parser.error("Didn't expect any positional args (%r)." % (args,))
+
+  coldLatencies = []
+  warmLatencies = []
+
+  with ModelSwapperInterface() as swapper, MessageBusConnector() as bus:
+    def runIteration(startModelRunner):
+      modelID = "benchmark-" + uuid.uuid1().hex
+      return _runModel(
+        startModelRunner,
+        inputQueueName=swapper._getModelInputQName(  # pylint: disable=W0212
+          modelID=modelID),
+        modelID=modelID,
+        bus=bus)
+
+    for _ in xrange(options.iterations):
+      coldLatencies.append(runIteration(
+        lambda modelID: model_runner_pool._startModelRunnerProcess(
+          ["--modelID=" + modelID])))
+
+    ModelRunnerPool.init(poolSize=options.poolSize)
+    try:
+      for _ in xrange(options.iterations):
+        # Measure steady state: a warm process is available for each swap
+        _waitForWarmPool(options.poolSize)
+        warmLatencies.append(runIteration(ModelRunnerPool.startModelRunner))
+    finally:
+      ModelRunnerPool.close()
+
+  _summarize("cold", coldLatencies)
+  _summarize("warm", warmLatencies)
+
+
+
+if __name__ == "__main__":
+  LoggingSupport.initTool()
+  main(sys.argv)
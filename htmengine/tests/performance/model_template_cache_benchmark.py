@@ -0,0 +1,145 @@
+# ----------------------------------------------------------------------
+# Numenta Platform for Intelligent Computing (NuPIC)
+# Copyright (C) 2015, Numenta, Inc.  Unless you have purchased from
+# Numenta, Inc. a separate commercial license for this software code, the
+# following terms and conditions apply:
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero Public License for more details.
+#
+# You should have received a copy of the GNU Affero Public License
+# along with this program.  If not, see http://www.gnu.org/licenses.
+#
+# http://numenta.org/licenses/
+# ----------------------------------------------------------------------
+
+"""
+Benchmark of time-to-first-result of new models during mass model creation:
+creating each model's network via ModelFactory.create vs. via
+ModelTemplateCache.
+
+Each iteration creates a model from params generated by
+scalar_metric_utils.generateSwarmParams for a metric with random bounds, as
+createModels does for scalar metrics, and runs it on its first input row. With
+the template cache, the first model pays for saving the template and the rest
+load it.
+
+Requires APPLICATION_CONFIG_PATH, same as the unit tests. Templates are written
+to a temporary directory, which defaults to the system's temp directory; use
+--tempdir to benchmark a specific filesystem.
+
+Example:
+  python -m tests.performance.model_template_cache_benchmark --models=50
+"""
+
+from datetime import datetime
+from optparse import OptionParser
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+from nupic.frameworks.opf.modelfactory import ModelFactory
+
+from nta.utils.logging_support_raw import LoggingSupport
+
+from htmengine.model_swapper.model_template_cache import ModelTemplateCache
+from htmengine.runtime import scalar_metric_utils
+
+
+
+def _generateModelParams(numModels):
+  """
+  :returns: a list of two-tuples: model params of a scalar metric with random
+    bounds and the metric's first value
+  """
+  rand = random.Random(42)
+  paramsList = []
+  for _ in xrange(numModels):
+    minVal = rand.uniform(-1000, 1000)
+    maxVal = minVal + rand.uniform(1, 10000)
+    paramsList.append((
+      scalar_metric_utils.generateSwarmParams(dict(min=minVal, max=maxVal)),
+      rand.uniform(minVal, maxVal)))
+
+  return paramsList
+
+
+
+def _timeToFirstResult(createModel, params, value):
+  """
+  :returns: elapsed seconds from model creation until the result of its first
+    input row
+  """
+  startTime = time.time()
+
+  model = createModel(params["modelConfig"])
+  model.enableLearning()
+  model.enableInference(params["inferenceArgs"])
+  model.run(dict(c0=datetime.utcnow(), c1=value))
+
+  return time.time() - startTime
+
+
+
+def _summarize(label, latencies):
+  total = sum(latencies)
+  latencies = sorted(latencies)
+  count = len(latencies)
+  return ("%-9s n=%d; min=%.4fs; median=%.4fs; p90=%.4fs; max=%.4fs; "
+          "total=%.2fs" % (
+            label, count, latencies[0], latencies[count // 2],
+            latencies[min(count - 1, int(count * 0.9))], latencies[-1],
+            total))
+
+
+
+def main(argv):
+  parser = OptionParser(
+    "%prog [options]\n"
+    "Compare time-to-first-result of new models with and without "
+    "ModelTemplateCache.")
+
+  parser.add_option("--models", action="store", type="int", default=20,
+                    help="Number of models to create per mode "
+                         "[default: %default]")
+  parser.add_option("--tempdir", action="store", default=None,
+                    help="Parent directory of the temporary template "
+                         "directory [default: system temp directory]")
+
+  options, args = parser.parse_args(argv[1:])
+  if args:
+    parser.error("Didn't expect any positional args (%r)." % (args,))
+
+  paramsList = _generateModelParams(options.models)
+
+  factoryLatencies = [
+    _timeToFirstResult(
+      lambda modelConfig: ModelFactory.create(modelConfig=modelConfig),
+      params, value)
+    for params, value in paramsList]
+
+  templateDir = tempfile.mkdtemp(dir=options.tempdir)
+  try:
+    templateCache = ModelTemplateCache(templateDir)
+    templateLatencies = [
+      _timeToFirstResult(templateCache.createModel, params, value)
+      for params, value in paramsList]
+  finally:
+    shutil.rmtree(templateDir)
+
+  print _summarize("factory", factoryLatencies)
+  print _summarize("template", templateLatencies)
+
+
+
+if __name__ == "__main__":
+  LoggingSupport.initTool()
+  main(sys.argv)
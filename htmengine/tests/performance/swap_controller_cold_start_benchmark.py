@@ -0,0 +1,196 @@
+# ----------------------------------------------------------------------
+# Numenta Platform for Intelligent Computing (NuPIC)
+# Copyright (C) 2015, Numenta, Inc.  Unless you have purchased from
+# Numenta, Inc. a separate commercial license for this software code, the
+# following terms and conditions apply:
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero Public License for more details.
+#
+# You should have received a copy of the GNU Affero Public License
+# along with this program.  If not, see http://www.gnu.org/licenses.
+#
+# http://numenta.org/licenses/
+# ----------------------------------------------------------------------
+
+"""
+Benchmark of the pending-input discovery that SwapController performs when it
+starts: ModelSwapperInterface.getModelsWithInputPending() with the bulk queue
+depth query vs. the per-queue passive declares that it used to issue.
+
+Runs against a local broker stand-in: an HTTP server that implements the
+RabbitMQ management API's queue listing (with pagination) for the given number
+of model input queues, and a passive declare that takes the given AMQP round
+trip time.
+
+Requires APPLICATION_CONFIG_PATH, same as the unit tests.
+
+Example:
+  python -m tests.performance.swap_controller_cold_start_benchmark \
+    --models=5000 --rtt-ms=0.5
+"""
+
+import BaseHTTPServer
+import json
+from optparse import OptionParser
+import sys
+import threading
+import time
+import urlparse
+
+from mock import Mock, patch
+
+from nta.utils import message_bus_connector
+from nta.utils.logging_support_raw import LoggingSupport
+from nta.utils.message_bus_connector import MessageBusConnector
+
+from htmengine.model_swapper.model_swapper_interface import (
+  ModelSwapperInterface)
+
+
+
+class _ManagementRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+  """ Serves GET /api/queues/<vhost> like the RabbitMQ management plugin """
+
+  # Set by _startManagementServer: list of dicts with name and messages_ready
+  queues = None
+
+
+  def do_GET(self):  # pylint: disable=C0103
+    params = dict(urlparse.parse_qsl(urlparse.urlparse(self.path).query))
+
+    queues = self.queues
+    if "name" in params:
+      prefix = params["name"].lstrip("^").replace("\\", "")
+      queues = [q for q in queues if q["name"].startswith(prefix)]
+
+    if "page" in params:
+      page = int(params["page"])
+      pageSize = int(params["page_size"])
+      body = dict(
+        page=page,
+        page_size=pageSize,
+        page_count=max(1, (len(queues) + pageSize - 1) // pageSize),
+        items=queues[(page - 1) * pageSize:page * pageSize])
+    else:
+      body = queues
+
+    payload = json.dumps(body)
+    self.send_response(200)
+    self.send_header("Content-Type", "application/json")
+    self.send_header("Content-Length", str(len(payload)))
+    self.end_headers()
+    self.wfile.write(payload)
+
+
+  def log_message(self, *_args):
+    pass
+
+
+
+def _startManagementServer(queues):
+  _ManagementRequestHandler.queues = queues
+  server = BaseHTTPServer.HTTPServer(("127.0.0.1", 0),
+                                     _ManagementRequestHandler)
+  thread = threading.Thread(target=server.serve_forever)
+  thread.setDaemon(True)
+  thread.start()
+  return server
+
+
+
+def _getModelsWithInputPendingPerQueue(interface):
+  """ The former implementation: list all queues, then a passive declare per
+  model input queue
+  """
+  prefix = interface._modelInputQueueNamePrefix  # pylint: disable=W0212
+  bus = interface._bus  # pylint: disable=W0212
+  return tuple(
+    mq[len(prefix):]
+    for mq in bus.getAllMessageQueues()
+    if mq.startswith(prefix) and not bus.isEmpty(mq))
+
+
+
+def main(argv):
+  parser = OptionParser(
+    "%prog [options]\n"
+    "Compare pending-input discovery at SwapController start-up.")
+
+  parser.add_option("--models", action="store", type="int", default=2000,
+                    help="Number of model input queues [default: %default]")
+  parser.add_option("--pending-ratio", action="store", type="float",
+                    default=0.1, dest="pendingRatio",
+                    help="Fraction of model input queues with pending input "
+                         "[default: %default]")
+  parser.add_option("--rtt-ms", action="store", type="float", default=0.5,
+                    dest="rttMS",
+                    help="Simulated AMQP round trip time of a passive declare "
+                         "in milliseconds [default: %default]")
+  parser.add_option("--page-size", action="store", type="int", default=500,
+                    dest="pageSize",
+                    help="Queues per management query page "
+                         "[default: %default]")
+
+  options, args = parser.parse_args(argv[1:])
+  if args:
+    parser.error("Didn't expect any positional args (%r)." % (args,))
+
+  # pylint: disable=W0212
+  prefix = ModelSwapperInterface()._modelInputQueueNamePrefix
+  pendingEvery = max(1, int(round(1 / options.pendingRatio)))
+  messageCountMap = dict(
+    (prefix + "model%06d" % (i,), 1 if i % pendingEvery == 0 else 0)
+    for i in xrange(options.models))
+
+  queues = [dict(name=name, messages_ready=count)
+            for name, count in sorted(messageCountMap.iteritems())]
+  queues.append(dict(name="other.queue", messages_ready=0))
+
+  server = _startManagementServer(queues)
+
+  def isEmpty(_bus, mqName):
+    time.sleep(options.rttMS / 1000.0)
+    return messageCountMap[mqName] == 0
+
+  origIterMessageQueueDepths = MessageBusConnector.iterMessageQueueDepths
+
+  def iterMessageQueueDepths(bus, namePrefix=None):
+    return origIterMessageQueueDepths(bus, namePrefix=namePrefix,
+                                      pageSize=options.pageSize)
+
+  managementParams = Mock(host="127.0.0.1", port=server.server_address[1],
+                          vhost="/", username="guest", password="guest")
+
+  with patch.object(message_bus_connector, "_ChannelManager",
+                    autospec=True), \
+      patch.object(message_bus_connector.amqp.connection,
+                   "RabbitmqManagementConnectionParams",
+                   return_value=managementParams), \
+      patch.object(MessageBusConnector, "isEmpty", isEmpty), \
+      patch.object(MessageBusConnector, "iterMessageQueueDepths",
+                   iterMessageQueueDepths):
+    with ModelSwapperInterface() as interface:
+      for label, discover in (
+          ("per-queue", _getModelsWithInputPendingPerQueue),
+          ("bulk", lambda interface: interface.getModelsWithInputPending())):
+        startTime = time.time()
+        modelIDs = discover(interface)
+        elapsed = time.time() - startTime
+
+        print "%-10s models=%d; pending=%d; duration=%.3fs" % (
+          label, options.models, len(modelIDs), elapsed)
+
+  server.shutdown()
+
+
+
+if __name__ == "__main__":
+  LoggingSupport.initTool()
+  main(sys.argv)
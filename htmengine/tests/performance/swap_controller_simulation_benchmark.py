@@ -0,0 +1,227 @@
+# ----------------------------------------------------------------------
+# Numenta Platform for Intelligent Computing (NuPIC)
+# Copyright (C) 2015, Numenta, Inc.  Unless you have purchased from
+# Numenta, Inc. a separate commercial license for this software code, the
+# following terms and conditions apply:
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero Public License for more details.
+#
+# You should have received a copy of the GNU Affero Public License
+# along with this program.  If not, see http://www.gnu.org/licenses.
+#
+# http://numenta.org/licenses/
+# ----------------------------------------------------------------------
+
+"""
+Benchmark of SwapController scheduling for a metric mix: replays a workload
+trace through SwapControllerSimulator at each of the given concurrency levels
+and reports input batch latency percentiles, slot utilization and swap counts.
+Each concurrency level runs with slot affinity off and on, and reports the
+mean swap-in latency and the rate of warm starts, i.e., starts of a model in
+the slot that ran it most recently, whose load takes --warm-load-sec.
+
+The workload is either a trace file or synthetic: each model receives one input
+batch per interval, at a random phase, like a metric reported every few
+minutes.
+
+Trace file: CSV lines of "timestamp,modelID,numBatches", with timestamp in
+seconds from the start of the simulation.
+
+Costs file (optional): CSV lines of
+"modelID,loadSec,runSecPerBatch,saveSec[,memoryMB]" for models whose costs
+differ from the defaults given by the options.
+
+Requires APPLICATION_CONFIG_PATH, same as the unit tests. SwapController is
+configured from its model-swapper.conf as usual; use --policy to override the
+scheduling policy.
+
+Example:
+  python -m tests.performance.swap_controller_simulation_benchmark \
+    --models=500 --concurrency=4,8,16
+"""
+
+import csv
+from optparse import OptionParser
+import os
+import random
+import sys
+
+from nta.utils.logging_support_raw import LoggingSupport
+from nta.utils.test_utils.config_test_utils import ConfigAttributePatch
+
+from htmengine.model_swapper import ModelSwapperConfig
+from htmengine.model_swapper.swap_controller_simulator import (
+  ModelCosts,
+  SwapControllerSimulator,
+  WorkloadEvent)
+
+
+
+def _loadTrace(path):
+  with open(path, "rb") as fileObj:
+    return sorted(
+      WorkloadEvent(timestamp=float(row[0]), modelID=row[1],
+                    numBatches=int(row[2]))
+      for row in csv.reader(fileObj) if row)
+
+
+
+def _loadCosts(path):
+  modelCosts = dict()
+  with open(path, "rb") as fileObj:
+    for row in csv.reader(fileObj):
+      if not row:
+        continue
+
+      memoryFootprint = (int(float(row[4]) * 1024 * 1024) if len(row) > 4
+                         else None)
+      modelCosts[row[0]] = ModelCosts(loadSec=float(row[1]),
+                                      runSecPerBatch=float(row[2]),
+                                      saveSec=float(row[3]),
+                                      memoryFootprint=memoryFootprint)
+
+  return modelCosts
+
+
+
+def _generateTrace(numModels, durationSec, intervalSec):
+  rand = random.Random(42)
+  trace = []
+  for i in xrange(numModels):
+    modelID = "model-%d" % (i,)
+    timestamp = rand.uniform(0, intervalSec)
+    while timestamp < durationSec:
+      trace.append(WorkloadEvent(timestamp=timestamp, modelID=modelID,
+                                 numBatches=1))
+      timestamp += intervalSec
+
+  trace.sort()
+  return trace
+
+
+
+def _formatSec(value):
+  return "n/a" if value is None else "%.3fs" % (value,)
+
+
+
+def main(argv):
+  parser = OptionParser(
+    "%prog [options]\n"
+    "Simulate SwapController on a workload at several concurrency levels.")
+
+  parser.add_option("--trace", action="store", default=None,
+                    help="Workload trace file [default: synthetic workload]")
+  parser.add_option("--costs", action="store", default=None,
+                    help="Per-model costs file [default: none]")
+  parser.add_option("--models", action="store", type="int", default=100,
+                    help="Number of models of the synthetic workload "
+                         "[default: %default]")
+  parser.add_option("--duration-sec", action="store", type="float",
+                    default=3600, dest="durationSec",
+                    help="Duration of the synthetic workload "
+                         "[default: %default]")
+  parser.add_option("--interval-sec", action="store", type="float",
+                    default=300, dest="intervalSec",
+                    help="Interval between input batches of each model of the "
+                         "synthetic workload [default: %default]")
+  parser.add_option("--load-sec", action="store", type="float", default=1.0,
+                    dest="loadSec",
+                    help="Default model load time [default: %default]")
+  parser.add_option("--run-sec", action="store", type="float", default=0.05,
+                    dest="runSec",
+                    help="Default time to process one input batch "
+                         "[default: %default]")
+  parser.add_option("--warm-load-sec", action="store", type="float",
+                    default=0.2, dest="warmLoadSec",
+                    help="Default model load time in the slot that ran the "
+                         "model most recently [default: %default]")
+  parser.add_option("--save-sec", action="store", type="float", default=0.5,
+                    dest="saveSec",
+                    help="Default model checkpoint time [default: %default]")
+  parser.add_option("--batches-per-checkpoint", action="store", type="int",
+                    default=1, dest="batchesPerCheckpoint",
+                    help="Input batches processed per checkpoint "
+                         "[default: %default]")
+  parser.add_option("--concurrency", action="store", default="2,4,8",
+                    help="Comma-separated numbers of slots "
+                         "[default: %default]")
+  parser.add_option("--policy", action="store", default=None,
+                    help="SwapController scheduling policy [default: as "
+                         "configured]")
+
+  options, args = parser.parse_args(argv[1:])
+  if args:
+    parser.error("Didn't expect any positional args (%r)." % (args,))
+
+  if options.trace is not None:
+    trace = _loadTrace(options.trace)
+  else:
+    trace = _generateTrace(options.models, options.durationSec,
+                           options.intervalSec)
+
+  modelCosts = _loadCosts(options.costs) if options.costs is not None else None
+
+  defaultCosts = ModelCosts(loadSec=options.loadSec,
+                            runSecPerBatch=options.runSec,
+                            saveSec=options.saveSec,
+                            warmLoadSec=options.warmLoadSec)
+
+  configOverrides = []
+  if options.policy is not None:
+    configOverrides.append(
+      ("swap_controller", "scheduling_policy", options.policy))
+
+  print "events=%d; models=%d; batches=%d" % (
+    len(trace), len(set(event.modelID for event in trace)),
+    sum(event.numBatches for event in trace))
+
+  variants = [
+    (concurrency, slotAffinity)
+    for concurrency in (int(c) for c in options.concurrency.split(","))
+    for slotAffinity in ("false", "true")]
+
+  for concurrency, slotAffinity in variants:
+    with ConfigAttributePatch(
+        ModelSwapperConfig.CONFIG_NAME,
+        os.environ.get("APPLICATION_CONFIG_PATH"),
+        configOverrides + [
+          ("swap_controller", "slot_affinity", slotAffinity)]):
+      simulator = SwapControllerSimulator(
+        concurrency=concurrency,
+        defaultCosts=defaultCosts,
+        modelCosts=modelCosts,
+        batchesPerCheckpoint=options.batchesPerCheckpoint)
+
+      report = simulator.run(trace)
+
+      p50, p90, p99 = report.getLatencyPercentiles((50, 90, 99))
+      worstModelID = max(
+        report.latenciesByModel,
+        key=lambda modelID: report.getLatencyPercentiles((99,), modelID)[0])
+
+      print ("concurrency=%-3d affinity=%-5s p50=%s; p90=%s; p99=%s; "
+             "worstModelP99=%s (%s); utilization=%.3f; swapIns=%d; "
+             "preemptions=%d; prefetchHits=%d; meanSwapIn=%s; "
+             "warmStartRate=%.3f; durationSec=%.1f" % (
+               concurrency, slotAffinity, _formatSec(p50), _formatSec(p90),
+               _formatSec(p99),
+               _formatSec(
+                 report.getLatencyPercentiles((99,), worstModelID)[0]),
+               worstModelID, report.slotUtilization, report.numSwapIns,
+               report.numPreemptions, report.numPrefetchHits,
+               _formatSec(report.meanSwapInSec), report.warmStartRate,
+               report.durationSec))
+
+
+
+if __name__ == "__main__":
+  LoggingSupport.initTool()
+  main(sys.argv)
@@ -0,0 +1,256 @@
+#!/usr/bin/env python
+# ----------------------------------------------------------------------
+# Numenta Platform for Intelligent Computing (NuPIC)
+# Copyright (C) 2015, Numenta, Inc.  Unless you have purchased from
+# Numenta, Inc. a separate commercial license for this software code, the
+# following terms and conditions apply:
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero Public License for more details.
+#
+# You should have received a copy of the GNU Affero Public License
+# along with this program.  If not, see http://www.gnu.org/licenses.
+#
+# http://numenta.org/licenses/
+# ----------------------------------------------------------------------
+
+"""
+Unit tests for htmengine.anomaly_likelihood_helper
+"""
+
+# Disable: Access to a protected member
+# pylint: disable=W0212
+
+import copy
+import datetime
+import logging
+import random
+import unittest
+
+from mock import Mock
+
+from nupic.algorithms import anomaly_likelihood as algorithms
+
+from htmengine import anomaly_likelihood_helper
+
+
+
+def _estimateParams(rand, numRecords=400):
+  """ Anomaly likelihood params estimated from random raw anomaly scores, the
+  way AnomalyLikelihoodHelper does
+  """
+  startTime = datetime.datetime(2015, 1, 1)
+  scores = [
+    (startTime + datetime.timedelta(minutes=5 * i), rand.random(),
+     rand.choice([0.0, 0.025, 0.05, rand.random()]))
+    for i in xrange(numRecords)]
+
+  _, _, params = algorithms.estimateAnomalyLikelihoods(
+    anomalyScores=scores,
+    skipRecords=anomaly_likelihood_helper.NUM_SKIP_RECORDS)
+
+  return params
+
+
+
+class AnomalyLikelihoodBatchTestCase(unittest.TestCase):
+  """ _AnomalyLikelihoodBatch must be bit-for-bit equivalent to calling
+  algorithms.updateAnomalyLikelihoods once per row
+  """
+
+  def _assertEquivalentToPerRowUpdates(self, rawAnomalyScores, params):
+    batch = anomaly_likelihood_helper._AnomalyLikelihoodBatch(
+      rawAnomalyScores=rawAnomalyScores,
+      params=copy.deepcopy(params))
+
+    anomalyScores = batch.anomalyScores.tolist()
+
+    params = copy.deepcopy(params)
+    for i, rawAnomalyScore in enumerate(rawAnomalyScores):
+      (likelihood,), _, params = algorithms.updateAnomalyLikelihoods(
+        ((None, None, rawAnomalyScore),), params)
+
+      self.assertEqual(anomalyScores[i], float(1.0 - likelihood))
+      self.assertEqual(batch.getParams(i + 1), params)
+
+
+  def testRandomScores(self):
+    rand = random.Random(42)
+    params = _estimateParams(rand)
+
+    self._assertEquivalentToPerRowUpdates(
+      [rand.random() for _ in xrange(500)], params)
+
+
+  def testRunsOfHighScoresAreFiltered(self):
+    # Consecutive likelihoods in the red zone exercise the likelihood filter,
+    # and anomaly scores above the forced refresh threshold
+    rand = random.Random(42)
+    params = _estimateParams(rand)
+
+    self._assertEquivalentToPerRowUpdates(
+      [0.0] * 20 + [1.0] * 30 + [0.0] * 20 + [1.0, 0.0] * 10, params)
+
+
+  def testParamsWithoutHistoricalLikelihoods(self):
+    rand = random.Random(42)
+    params = _estimateParams(rand)
+    params.pop("historicalLikelihoods", None)
+
+    self._assertEquivalentToPerRowUpdates([1.0] * 5, params)
+
+
+  def testSingleScore(self):
+    rand = random.Random(42)
+    self._assertEquivalentToPerRowUpdates([0.5], _estimateParams(rand))
+
+
+  def testInvalidParams(self):
+    with self.assertRaises(ValueError):
+      anomaly_likelihood_helper._AnomalyLikelihoodBatch(
+        rawAnomalyScores=[0.5], params=dict(windowSize=10))
+
+
+
+class ProcessAnomalyRunTestCase(unittest.TestCase):
+  """ AnomalyLikelihoodHelper._processAnomalyRun unit tests """
+
+  def setUp(self):
+    config = Mock(getint=Mock(return_value=10))
+    self._helper = anomaly_likelihood_helper.AnomalyLikelihoodHelper(
+      logging.getLogger(__name__), config)
+
+
+  @staticmethod
+  def _createRows(rawAnomalyScores, firstRowID):
+    return [Mock(rowid=firstRowID + i, raw_anomaly_score=rawAnomalyScore,
+                 anomaly_score=0)
+            for i, rawAnomalyScore in enumerate(rawAnomalyScores)]
+
+
+  def testRunStopsAfterFirstRowThatForcesRefresh(self):
+    rand = random.Random(42)
+    params = _estimateParams(rand)
+    rawAnomalyScores = [1.0] * 10 + [0.0] * 10
+
+    # Per-row reference
+    perRowScores = []
+    perRowParamsList = []
+    perRowParams = copy.deepcopy(params)
+    for rawAnomalyScore in rawAnomalyScores:
+      (likelihood,), _, perRowParams = algorithms.updateAnomalyLikelihoods(
+        ((None, None, rawAnomalyScore),), perRowParams)
+      perRowScores.append(float(1.0 - likelihood))
+      perRowParamsList.append(copy.deepcopy(perRowParams))
+
+    # Rows at most 3 rows past the last refresh don't force a refresh
+    rows = self._createRows(rawAnomalyScores, firstRowID=101)
+    numConsumed = 1 + next(i for i, score in enumerate(perRowScores)
+                           if score > 0.99 and rows[i].rowid > 103)
+    self.assertLess(numConsumed, len(rows))
+
+    anomalyParams = dict(last_rowid_for_stats=100,
+                         params=copy.deepcopy(params))
+
+    consumed = self._helper._processAnomalyRun(
+      metricObj=Mock(uid="abc"),
+      runRows=rows,
+      anomalyParams=anomalyParams,
+      statsSampleCache=None)
+
+    self.assertEqual(consumed, rows[:numConsumed])
+    self.assertEqual([md.anomaly_score for md in rows],
+                     perRowScores[:numConsumed] +
+                     [0] * (len(rows) - numConsumed))
+    self.assertEqual(anomalyParams["last_rowid_for_stats"], 100)
+    self.assertEqual(anomalyParams["params"],
+                     perRowParamsList[numConsumed - 1])
+
+
+  def testTooFewCachedSamplesDeferForcedRefresh(self):
+    rand = random.Random(42)
+    params = _estimateParams(rand)
+    rows = self._createRows([1.0] * 5, firstRowID=1001)
+
+    # With 2 cached samples, 10 are needed for a refresh
+    consumed = self._helper._processAnomalyRun(
+      metricObj=Mock(uid="abc"),
+      runRows=rows,
+      anomalyParams=dict(last_rowid_for_stats=100, params=params),
+      statsSampleCache=[Mock(), Mock()])
+
+    self.assertEqual(consumed, rows)
+
+
+  def testEmptyRun(self):
+    anomalyParams = dict(last_rowid_for_stats=100, params=Mock())
+
+    self.assertEqual(
+      self._helper._processAnomalyRun(metricObj=Mock(uid="abc"), runRows=[],
+                                      anomalyParams=anomalyParams,
+                                      statsSampleCache=None),
+      [])
+    self.assertIsInstance(anomalyParams["params"], Mock)
+
+
+
+if __name__ == "__main__":
+  unittest.main()
+
+
+
+class StatisticsSampleTailTestCase(unittest.TestCase):
+  """ StatisticsSampleTail unit tests """
+
+  @staticmethod
+  def _createRows(firstRowID, numRows):
+    startTime = datetime.datetime(2015, 1, 1)
+    return [Mock(rowid=rowid,
+                 timestamp=startTime + datetime.timedelta(minutes=5 * rowid),
+                 metric_value=float(rowid),
+                 raw_anomaly_score=rowid / 100.0)
+            for rowid in xrange(firstRowID, firstRowID + numRows)]
+
+
+  def testAppendedRowsAreBoundedBySize(self):
+    tail = anomaly_likelihood_helper.StatisticsSampleTail(size=5)
+    tail.load(self._createRows(1, 3))
+    tail.append(self._createRows(4, 4))
+
+    self.assertTrue(tail.isLoaded)
+    self.assertEqual([sample.rowid for sample in tail.getSamples(10)],
+                     [3, 4, 5, 6, 7])
+    self.assertEqual([sample.rowid for sample in tail.getSamples(2)], [6, 7])
+    self.assertEqual(tail.getSamples(0), [])
+
+    sample = tail.getSamples(1)[0]
+    self.assertEqual(sample.timestamp, datetime.datetime(2015, 1, 1, 0, 35))
+    self.assertEqual(sample.metric_value, 7.0)
+    self.assertEqual(sample.raw_anomaly_score, 0.07)
+
+
+  def testAppendBeforeLoadIsIgnored(self):
+    tail = anomaly_likelihood_helper.StatisticsSampleTail(size=5)
+    tail.append(self._createRows(1, 3))
+
+    self.assertFalse(tail.isLoaded)
+    self.assertEqual(tail.getSamples(5), [])
+
+
+  def testRedeliveredRowsInvalidateTail(self):
+    tail = anomaly_likelihood_helper.StatisticsSampleTail(size=5)
+    tail.load(self._createRows(1, 3))
+    tail.append(self._createRows(3, 2))
+
+    self.assertFalse(tail.isLoaded)
+    self.assertEqual(tail.getSamples(5), [])
+
+    tail.load(self._createRows(1, 4))
+    self.assertEqual([sample.rowid for sample in tail.getSamples(5)],
+                     [1, 2, 3, 4])
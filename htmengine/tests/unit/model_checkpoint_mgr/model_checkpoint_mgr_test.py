@@ -20,14 +20,23 @@
 # http://numenta.org/licenses/
 # ----------------------------------------------------------------------
 
+import errno
+import os
+import shutil
+import tempfile
 import uuid
 
 import unittest
 
+from mock import patch
+
+from htmengine.model_checkpoint_mgr import model_checkpoint_mgr
 from htmengine.model_checkpoint_mgr.model_checkpoint_mgr import (
-    ModelCheckpointMgr, ModelNotFound, ModelAlreadyExists)
+    ModelCheckpointConfig, ModelCheckpointCorrupted, ModelCheckpointMgr,
+    ModelNotFound, ModelAlreadyExists)
 from htmengine.model_checkpoint_mgr.model_checkpoint_test_utils import (
     ModelCheckpointStoragePatch)
+from nta.utils.test_utils.config_test_utils import ConfigAttributePatch
 from nupic.frameworks.opf.modelfactory import ModelFactory
 
 
@@ -464,5 +473,419 @@ class TestModelCheckpointMgr(unittest.TestCase):
 
 
 
+class _FakeModel(object):
+  """ Model whose save() generates a model instance directory tree like the
+  CLA model's
+  """
+
+  def __init__(self, content):
+    self.content = content
+
+
+  def save(self, saveModelDir):
+    os.makedirs(os.path.join(saveModelDir, "modelextradata"))
+    with open(os.path.join(saveModelDir, "model.pkl"), "wb") as fileObj:
+      fileObj.write(self.content)
+    with open(os.path.join(saveModelDir, "modelextradata", "R0-pkl"),
+              "wb") as fileObj:
+      fileObj.write(self.content * 100)
+
+
+
+def _loadFakeModelFromCheckpoint(savedModelDir):
+  with open(os.path.join(savedModelDir, "model.pkl"), "rb") as fileObj:
+    content = fileObj.read()
+  with open(os.path.join(savedModelDir, "modelextradata", "R0-pkl"),
+            "rb") as fileObj:
+    assert fileObj.read() == content * 100
+  return _FakeModel(content)
+
+
+
+@ModelCheckpointStoragePatch()
+@patch.object(ModelFactory, "loadFromCheckpoint",
+              side_effect=_loadFakeModelFromCheckpoint)
+class ModelInstanceFormatTestCase(unittest.TestCase):
+  """ Tests of the model instance archive and directory formats """
+
+
+  def _getStoreFileNames(self, checkpointMgr, modelID):
+    return sorted(os.listdir(
+      checkpointMgr._getCurrentCheckpointRealPath(modelID)))
+
+
+  def _getEntryVersion(self, checkpointMgr, modelID):
+    with open(os.path.join(
+        checkpointMgr._getModelDir(modelID, mustExist=True),
+        checkpointMgr._MODEL_ENTRY_VERSION_FILE_NAME)) as fileObj:
+      return fileObj.read()
+
+
+  def testArchiveFormatSaveAndLoad(self, _loadFromCheckpointMock):
+    checkpointMgr = ModelCheckpointMgr()
+
+    modelID = uuid.uuid1().hex
+    checkpointMgr.define(modelID, definition=dict(a=1))
+    self.assertEqual(self._getEntryVersion(checkpointMgr, modelID), "3.0")
+
+    checkpointMgr.save(modelID, _FakeModel("abc"), attributes="attributes1")
+    self.assertEqual(self._getStoreFileNames(checkpointMgr, modelID),
+                     ["attributes.data", "model_instance.tar.gz"])
+
+    checkpointMgr.save(modelID, _FakeModel("def"), attributes="attributes2")
+    self.assertEqual(checkpointMgr.load(modelID).content, "def")
+    self.assertEqual(checkpointMgr.loadCheckpointAttributes(modelID),
+                     "attributes2")
+
+    # The extracted model instance is cleaned up after loading
+    self.assertEqual(os.listdir(checkpointMgr._scratchDir), [])
+
+    # Clones of archive checkpoints load, too
+    destModelID = uuid.uuid1().hex
+    checkpointMgr.clone(modelID, destModelID)
+    self.assertEqual(checkpointMgr.load(destModelID).content, "def")
+
+
+  def testDirectoryFormatCheckpointLoadsWithArchiveFormat(
+      self, _loadFromCheckpointMock):
+    modelID = uuid.uuid1().hex
+
+    with ConfigAttributePatch(
+        ModelCheckpointConfig.CONFIG_NAME,
+        os.environ.get("APPLICATION_CONFIG_PATH"),
+        (("storage", "instance_format", "directory"),)):
+      checkpointMgr = ModelCheckpointMgr()
+      checkpointMgr.define(modelID, definition=dict(a=1))
+      checkpointMgr.save(modelID, _FakeModel("abc"), attributes="attributes1")
+
+    self.assertEqual(self._getEntryVersion(checkpointMgr, modelID), "2.0")
+    self.assertEqual(self._getStoreFileNames(checkpointMgr, modelID),
+                     ["attributes.data", "model_instance"])
+
+    # Load the legacy checkpoint with the archive format configured
+    checkpointMgr = ModelCheckpointMgr()
+    self.assertEqual(checkpointMgr.load(modelID).content, "abc")
+
+    # The next checkpoint of the model is saved in archive format
+    checkpointMgr.save(modelID, _FakeModel("def"), attributes="attributes2")
+    self.assertEqual(self._getStoreFileNames(checkpointMgr, modelID),
+                     ["attributes.data", "model_instance.tar.gz"])
+    self.assertEqual(checkpointMgr.load(modelID).content, "def")
+
+
+  def testPrefetch(self, _loadFromCheckpointMock):
+    checkpointMgr = ModelCheckpointMgr()
+
+    modelID = uuid.uuid1().hex
+    checkpointMgr.define(modelID, definition=dict(a=1))
+
+    with self.assertRaises(ModelNotFound):
+      checkpointMgr.prefetch(modelID)
+
+    checkpointMgr.save(modelID, _FakeModel("abc"), attributes="attributes1")
+
+    checkpointStoreDirPath = checkpointMgr._getCurrentCheckpointRealPath(
+      modelID)
+    expectedNumBytes = sum(
+      os.path.getsize(os.path.join(checkpointStoreDirPath, fileName))
+      for fileName in os.listdir(checkpointStoreDirPath))
+
+    with patch.object(model_checkpoint_mgr, "_fadviseWillNeed",
+                      autospec=True) as fadviseMock:
+      self.assertEqual(checkpointMgr.prefetch(modelID), expectedNumBytes)
+
+    self.assertEqual(fadviseMock.call_count, 2)
+
+    # And with the real posix_fadvise
+    self.assertEqual(checkpointMgr.prefetch(modelID), expectedNumBytes)
+
+
+  def testSaveReturnsCheckpointSize(self, _loadFromCheckpointMock):
+    checkpointMgr = ModelCheckpointMgr()
+
+    modelID = uuid.uuid1().hex
+    checkpointMgr.define(modelID, definition=dict(a=1))
+
+    numBytes = checkpointMgr.save(modelID, _FakeModel("abc"),
+                                  attributes="attributes1")
+
+    checkpointStoreDirPath = checkpointMgr._getCurrentCheckpointRealPath(
+      modelID)
+    self.assertEqual(
+      numBytes,
+      sum(os.path.getsize(os.path.join(checkpointStoreDirPath, fileName))
+          for fileName in os.listdir(checkpointStoreDirPath)))
+    self.assertGreater(numBytes, 0)
+
+
+  def testCorruptedArchiveRaisesModelCheckpointCorrupted(
+      self, _loadFromCheckpointMock):
+    checkpointMgr = ModelCheckpointMgr()
+
+    modelID = uuid.uuid1().hex
+    checkpointMgr.define(modelID, definition=dict(a=1))
+    checkpointMgr.save(modelID, _FakeModel("abc" * 1000),
+                       attributes="attributes1")
+
+    archiveFilePath = os.path.join(
+      checkpointMgr._getCurrentCheckpointRealPath(modelID),
+      checkpointMgr._CHECKPOINT_INSTANCE_ARCHIVE_NAME)
+    with open(archiveFilePath, "rb") as fileObj:
+      archive = fileObj.read()
+
+    # Flip a bit in the CRC-32 trailer, so that decompression succeeds and only
+    # the checksum verification detects the damage
+    for damagedArchive in (archive[:-8] + chr(ord(archive[-8]) ^ 1) +
+                           archive[-7:],
+                           archive[:len(archive) // 2]):
+      with open(archiveFilePath, "wb") as fileObj:
+        fileObj.write(damagedArchive)
+
+      with self.assertRaises(ModelCheckpointCorrupted):
+        checkpointMgr.load(modelID)
+
+      self.assertEqual(os.listdir(checkpointMgr._scratchDir), [])
+
+
+
+@patch.object(model_checkpoint_mgr, "_syncfs", autospec=True)
+class GroupCommitTestCase(unittest.TestCase):
+  """ _GroupCommit unit tests """
+
+
+  def setUp(self):
+    self._scratchDir = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, self._scratchDir)
+
+
+  def _createGroupCommit(self):
+    return model_checkpoint_mgr._GroupCommit(self._scratchDir, windowSec=0)
+
+
+  def testEachSequentialRequestCommits(self, syncfsMock):
+    groupCommit = self._createGroupCommit()
+
+    self.assertTrue(groupCommit.sync())
+    self.assertTrue(groupCommit.sync())
+
+    self.assertEqual(syncfsMock.call_count, 2)
+    self.assertEqual(groupCommit._readState(), (2, 2))
+
+
+  def testRequestCoveredByConcurrentCommit(self, syncfsMock):
+    groupCommit1 = self._createGroupCommit()
+    groupCommit2 = self._createGroupCommit()
+
+    # Request 1 completes its writes, but request 2 gets the lock first
+    generation = groupCommit1._readState()[0]
+    self.assertTrue(groupCommit2.sync())
+
+    self.assertFalse(groupCommit1._syncAfter(generation))
+    self.assertEqual(syncfsMock.call_count, 1)
+
+
+  def testRequestAfterCommitStartedIsNotCovered(self, syncfsMock):
+    groupCommit1 = self._createGroupCommit()
+    groupCommit2 = self._createGroupCommit()
+
+    # Request 1 completes its writes while request 2's commit is in progress,
+    # so the commit might not include them
+    generations = []
+    syncfsMock.side_effect = (
+      lambda fd: generations.append(groupCommit1._readState()[0]))
+    self.assertTrue(groupCommit2.sync())
+
+    syncfsMock.side_effect = None
+    self.assertTrue(groupCommit1._syncAfter(generations[0]))
+    self.assertEqual(syncfsMock.call_count, 2)
+
+
+  def testFailedCommitIsNotCompleted(self, syncfsMock):
+    groupCommit = self._createGroupCommit()
+
+    syncfsMock.side_effect = OSError("sync failed")
+    with self.assertRaises(OSError):
+      groupCommit.sync()
+
+    self.assertEqual(groupCommit._readState(), (1, 0))
+
+    syncfsMock.side_effect = None
+    self.assertTrue(groupCommit.sync())
+    self.assertEqual(groupCommit._readState(), (2, 2))
+
+
+
+@ModelCheckpointStoragePatch()
+@patch.object(ModelFactory, "loadFromCheckpoint",
+              side_effect=_loadFakeModelFromCheckpoint)
+class SyncModeTestCase(unittest.TestCase):
+  """ Tests of ModelCheckpointMgr's sync modes """
+
+
+  def _createCheckpointMgr(self, syncMode):
+    with ConfigAttributePatch(
+        ModelCheckpointConfig.CONFIG_NAME,
+        os.environ.get("APPLICATION_CONFIG_PATH"),
+        (("storage", "sync_mode", syncMode),)):
+      return ModelCheckpointMgr()
+
+
+  def testFsyncModeSyncsEachFile(self, _loadFromCheckpointMock):
+    checkpointMgr = self._createCheckpointMgr("fsync")
+    self.assertIsNone(checkpointMgr._groupCommit)
+
+    modelID = uuid.uuid1().hex
+    checkpointMgr.define(modelID, definition=dict(a=1))
+
+    with patch.object(model_checkpoint_mgr, "_syncfs",
+                      autospec=True) as syncfsMock, \
+        patch.object(ModelCheckpointMgr, "_fsyncFile",
+                     autospec=True) as fsyncFileMock:
+      checkpointMgr.save(modelID, _FakeModel("abc"), attributes="attributes1")
+
+    self.assertEqual(syncfsMock.call_count, 0)
+    self.assertEqual(fsyncFileMock.call_count, 2)
+
+
+  def testSyncfsModeUsesGroupCommit(self, _loadFromCheckpointMock):
+    checkpointMgr = self._createCheckpointMgr("syncfs")
+
+    modelID = uuid.uuid1().hex
+    checkpointMgr.define(modelID, definition=dict(a=1))
+
+    with patch.object(model_checkpoint_mgr, "_syncfs",
+                      autospec=True) as syncfsMock, \
+        patch.object(ModelCheckpointMgr, "_fsyncFile",
+                     autospec=True) as fsyncFileMock:
+      checkpointMgr.save(modelID, _FakeModel("abc"), attributes="attributes1")
+
+    self.assertEqual(syncfsMock.call_count, 1)
+    self.assertEqual(fsyncFileMock.call_count, 0)
+
+    # And with the real syncfs
+    checkpointMgr.save(modelID, _FakeModel("def"), attributes="attributes2")
+    self.assertEqual(checkpointMgr.load(modelID).content, "def")
+    self.assertEqual(checkpointMgr._groupCommit._readState(), (3, 3))
+
+
+  def testInvalidSyncModeRaisesValueError(self, _loadFromCheckpointMock):
+    with self.assertRaises(ValueError):
+      self._createCheckpointMgr("none")
+
+
+
+@ModelCheckpointStoragePatch()
+@patch.object(ModelFactory, "loadFromCheckpoint",
+              side_effect=_loadFakeModelFromCheckpoint)
+class CloneModeTestCase(unittest.TestCase):
+  """ Tests of ModelCheckpointMgr's clone modes """
+
+
+  def _createCheckpointMgr(self, cloneMode):
+    with ConfigAttributePatch(
+        ModelCheckpointConfig.CONFIG_NAME,
+        os.environ.get("APPLICATION_CONFIG_PATH"),
+        (("storage", "clone_mode", cloneMode),)):
+      return ModelCheckpointMgr()
+
+
+  def _getArchiveStat(self, checkpointMgr, modelID):
+    return os.stat(os.path.join(
+      checkpointMgr._getCurrentCheckpointRealPath(modelID),
+      checkpointMgr._CHECKPOINT_INSTANCE_ARCHIVE_NAME))
+
+
+  def _defineAndClone(self, checkpointMgr):
+    modelID = uuid.uuid1().hex
+    checkpointMgr.define(modelID, definition=dict(a=1))
+    checkpointMgr.save(modelID, _FakeModel("abc"), attributes="attributes1")
+
+    destModelID = uuid.uuid1().hex
+    checkpointMgr.clone(modelID, destModelID)
+
+    return modelID, destModelID
+
+
+  def testLinkModeSharesFilesUntilCloneIsSaved(self, _loadFromCheckpointMock):
+    checkpointMgr = self._createCheckpointMgr("link")
+
+    with patch.object(ModelCheckpointMgr, "_fsyncFile",
+                      autospec=True) as fsyncFileMock:
+      modelID, destModelID = self._defineAndClone(checkpointMgr)
+
+    # Only the files of the source's define and save were fsync'ed
+    self.assertEqual(fsyncFileMock.call_count, 4)
+
+    self.assertEqual(self._getArchiveStat(checkpointMgr, destModelID).st_ino,
+                     self._getArchiveStat(checkpointMgr, modelID).st_ino)
+    self.assertEqual(
+      self._getArchiveStat(checkpointMgr, destModelID).st_nlink, 2)
+    self.assertEqual(checkpointMgr.load(destModelID).content, "abc")
+
+    # Updates of the clone don't affect the source
+    checkpointMgr.updateCheckpointAttributes(destModelID, "attributes2")
+    checkpointMgr.save(destModelID, _FakeModel("def"), attributes="attributes3")
+
+    self.assertEqual(checkpointMgr.loadCheckpointAttributes(modelID),
+                     "attributes1")
+    self.assertEqual(checkpointMgr.load(modelID).content, "abc")
+    self.assertEqual(self._getArchiveStat(checkpointMgr, modelID).st_nlink, 1)
+    self.assertEqual(checkpointMgr.load(destModelID).content, "def")
+
+    # And removal of the source doesn't affect the clone
+    checkpointMgr.clone(destModelID, modelID + "2")
+    checkpointMgr.remove(destModelID)
+    self.assertEqual(checkpointMgr.load(modelID + "2").content, "def")
+
+
+  def testLinkModeFallsBackToCopy(self, _loadFromCheckpointMock):
+    checkpointMgr = self._createCheckpointMgr("link")
+
+    with patch.object(os, "link", autospec=True,
+                      side_effect=OSError(errno.EXDEV, "Cross-device link")), \
+        patch.object(model_checkpoint_mgr, "_reflinkFile", autospec=True,
+                     side_effect=IOError(errno.EOPNOTSUPP, "Not supported")):
+      modelID, destModelID = self._defineAndClone(checkpointMgr)
+
+    self.assertNotEqual(
+      self._getArchiveStat(checkpointMgr, destModelID).st_ino,
+      self._getArchiveStat(checkpointMgr, modelID).st_ino)
+    self.assertEqual(checkpointMgr.load(destModelID).content, "abc")
+    self.assertEqual(checkpointMgr.loadCheckpointAttributes(destModelID),
+                     "attributes1")
+
+
+  def testLinkModeDoesNotMaskOtherLinkErrors(self, _loadFromCheckpointMock):
+    checkpointMgr = self._createCheckpointMgr("link")
+
+    with patch.object(os, "link", autospec=True,
+                      side_effect=OSError(errno.ENOSPC, "No space")):
+      with self.assertRaises(OSError):
+        self._defineAndClone(checkpointMgr)
+
+    # The failed clone didn't leave anything behind
+    self.assertEqual(len(checkpointMgr.getModelIDs()), 1)
+    self.assertEqual(os.listdir(checkpointMgr._scratchDir), [])
+
+
+  def testCopyMode(self, _loadFromCheckpointMock):
+    checkpointMgr = self._createCheckpointMgr("copy")
+
+    with patch.object(os, "link", autospec=True) as linkMock:
+      modelID, destModelID = self._defineAndClone(checkpointMgr)
+
+    self.assertEqual(linkMock.call_count, 0)
+    self.assertNotEqual(
+      self._getArchiveStat(checkpointMgr, destModelID).st_ino,
+      self._getArchiveStat(checkpointMgr, modelID).st_ino)
+    self.assertEqual(checkpointMgr.load(destModelID).content, "abc")
+
+
+  def testInvalidCloneModeRaisesValueError(self, _loadFromCheckpointMock):
+    with self.assertRaises(ValueError):
+      self._createCheckpointMgr("symlink")
+
+
+
 if __name__ == '__main__':
   unittest.main()
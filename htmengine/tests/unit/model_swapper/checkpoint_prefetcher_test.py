@@ -0,0 +1,134 @@
+# ----------------------------------------------------------------------
+# Numenta Platform for Intelligent Computing (NuPIC)
+# Copyright (C) 2015, Numenta, Inc.  Unless you have purchased from
+# Numenta, Inc. a separate commercial license for this software code, the
+# following terms and conditions apply:
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero Public License for more details.
+#
+# You should have received a copy of the GNU Affero Public License
+# along with this program.  If not, see http://www.gnu.org/licenses.
+#
+# http://numenta.org/licenses/
+# ----------------------------------------------------------------------
+
+"""
+Unit tests for the Model Swapper's CheckpointPrefetcher class
+"""
+
+import threading
+import unittest
+
+
+from mock import patch
+
+
+from htmengine.model_checkpoint_mgr.model_checkpoint_mgr import ModelNotFound
+from htmengine.model_swapper import checkpoint_prefetcher
+from htmengine.model_swapper.checkpoint_prefetcher import CheckpointPrefetcher
+
+from nta.utils.logging_support_raw import LoggingSupport
+
+
+
+# Disable warning: Access to a protected member
+# pylint: disable=W0212
+
+
+
+def setUpModule():
+  LoggingSupport.initTestApp()
+
+
+
+@patch.object(checkpoint_prefetcher, "ModelCheckpointMgr", autospec=True)
+class CheckpointPrefetcherTestCase(unittest.TestCase):
+  """ ModelSwapper's CheckpointPrefetcher unit tests """
+
+
+  def testHitLateAndMiss(self, checkpointMgrClassMock):
+    prefetchMock = checkpointMgrClassMock.return_value.prefetch
+
+    # Hold up prefetch of "late" until it starts
+    latePrefetchStarted = threading.Event()
+    lateModelStarted = threading.Event()
+    prefetchedModels = []
+    def prefetch(modelID):
+      if modelID == "late":
+        latePrefetchStarted.set()
+        lateModelStarted.wait(5)
+      prefetchedModels.append(modelID)
+      return 100
+
+    prefetchMock.side_effect = prefetch
+
+    prefetcher = CheckpointPrefetcher()
+    try:
+      prefetcher.requestPrefetch("hit")
+      prefetcher.requestPrefetch("late")
+      # Redundant request
+      prefetcher.requestPrefetch("hit")
+
+      prefetcher.requestPrefetch("never")
+
+      self.assertTrue(latePrefetchStarted.wait(5))
+      self.assertEqual(prefetcher.noteModelStarted("late"),
+                       CheckpointPrefetcher.LATE)
+    finally:
+      lateModelStarted.set()
+      prefetcher.close()
+
+    self.assertEqual(prefetcher.noteModelStarted("hit"),
+                     CheckpointPrefetcher.HIT)
+    self.assertEqual(prefetcher.noteModelStarted("miss"),
+                     CheckpointPrefetcher.MISS)
+
+    self.assertEqual(prefetchedModels, ["hit", "late", "never"])
+    self.assertEqual(prefetcher._numHits, 1)
+    self.assertEqual(prefetcher._numLate, 1)
+    self.assertEqual(prefetcher._numMisses, 1)
+    self.assertEqual(prefetcher._numBytesPrefetched, 300)
+
+
+  def testStartedModelIsNotPrefetched(self, checkpointMgrClassMock):
+    prefetchMock = checkpointMgrClassMock.return_value.prefetch
+
+    # Hold up the prefetch thread until "a" starts
+    modelStarted = threading.Event()
+    prefetchMock.side_effect = lambda modelID: modelStarted.wait(5) and 0
+
+    prefetcher = CheckpointPrefetcher()
+    try:
+      prefetcher.requestPrefetch("blocker")
+      prefetcher.requestPrefetch("a")
+      self.assertEqual(prefetcher.noteModelStarted("a"),
+                       CheckpointPrefetcher.LATE)
+    finally:
+      modelStarted.set()
+      prefetcher.close()
+
+    prefetchMock.assert_called_once_with("blocker")
+
+
+  def testModelWithoutCheckpoint(self, checkpointMgrClassMock):
+    checkpointMgrClassMock.return_value.prefetch.side_effect = ModelNotFound
+
+    prefetcher = CheckpointPrefetcher()
+    prefetcher.requestPrefetch("a")
+    prefetcher.close()
+
+    self.assertEqual(prefetcher.noteModelStarted("a"),
+                     CheckpointPrefetcher.HIT)
+    self.assertEqual(prefetcher._numBytesPrefetched, 0)
+
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,136 @@
+# ----------------------------------------------------------------------
+# Numenta Platform for Intelligent Computing (NuPIC)
+# Copyright (C) 2015, Numenta, Inc.  Unless you have purchased from
+# Numenta, Inc. a separate commercial license for this software code, the
+# following terms and conditions apply:
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero Public License for more details.
+#
+# You should have received a copy of the GNU Affero Public License
+# along with this program.  If not, see http://www.gnu.org/licenses.
+#
+# http://numenta.org/licenses/
+# ----------------------------------------------------------------------
+
+
+"""
+Unit tests for the Model Swapper's InputShardDemultiplexer class
+"""
+
+import threading
+import unittest
+
+
+from mock import patch, MagicMock, Mock
+
+
+from htmengine.model_swapper import input_shard_demultiplexer
+from htmengine.model_swapper.input_shard_demultiplexer import (
+  InputShardDemultiplexer)
+from htmengine.model_swapper import model_swapper_interface
+
+from nta.utils.logging_support_raw import LoggingSupport
+
+
+
+# Disable warning: Access to a protected member
+# pylint: disable=W0212
+
+
+
+def setUpModule():
+  LoggingSupport.initTestApp()
+
+
+
+class InputShardDemultiplexerTestCase(unittest.TestCase):
+  """ ModelSwapper's InputShardDemultiplexer unit tests """
+
+
+  def testSpoolAckAndNotifyInShardOrder(self):
+    # Messages of each shard
+    shardMessages = dict()
+
+    # Log of (action, modelID, batch) per shard in the order of the actions
+    shardLogs = dict((shardIndex, []) for shardIndex in xrange(2))
+
+    for shardIndex in xrange(2):
+      shardMessages[shardIndex] = [
+        model_swapper_interface._ConsumedShardMessage(
+          modelID=modelID,
+          requestMsg="%s-%s" % (modelID, i),
+          ack=Mock(side_effect=lambda log=shardLogs[shardIndex],
+                   modelID=modelID, i=i: log.append(("ack", modelID, i))))
+        for i, modelID in enumerate(["a%s" % (shardIndex,),
+                                     "b%s" % (shardIndex,),
+                                     "a%s" % (shardIndex,)])]
+
+    # Keeps the consumers blocked after their messages, like a blocking
+    # consumer of an empty queue
+    consumerBlock = threading.Event()
+
+    def consumeInputShard(shardIndex):
+      def iterMessages():
+        for msg in shardMessages[shardIndex]:
+          yield msg
+        consumerBlock.wait()
+
+      consumer = MagicMock(spec_set=model_swapper_interface._MessageConsumer)
+      consumer.__enter__.return_value = consumer
+      consumer.__iter__.side_effect = iterMessages
+      return consumer
+
+    def spoolInputShardMessage(msg):
+      shardIndex = int(msg.modelID[1:])
+      i = shardMessages[shardIndex].index(msg)
+      shardLogs[shardIndex].append(("spool", msg.modelID, i))
+
+    swapperMock = MagicMock(
+      spec_set=model_swapper_interface.ModelSwapperInterface,
+      __enter__=Mock(
+        spec_set=model_swapper_interface.ModelSwapperInterface.__enter__))
+    swapperMock.__enter__.return_value = swapperMock
+    swapperMock.consumeInputShard.side_effect = consumeInputShard
+    swapperMock.spoolInputShardMessage.side_effect = spoolInputShardMessage
+
+    numNotifications = [0]
+    allNotified = threading.Event()
+
+    def onNewInputTS(modelID):
+      shardIndex = int(modelID[1:])
+      i = sum(1 for action, _, _ in shardLogs[shardIndex] if action == "notify")
+      shardLogs[shardIndex].append(("notify", modelID, i))
+
+      numNotifications[0] += 1
+      if numNotifications[0] == 6:
+        allNotified.set()
+
+    with patch.object(input_shard_demultiplexer, "ModelSwapperInterface",
+                      autospec=True, return_value=swapperMock):
+      demux = InputShardDemultiplexer(numShards=2, onNewInputTS=onNewInputTS)
+      demux.start()
+
+      self.assertTrue(allNotified.wait(5))
+
+    swapperMock.initInputShards.assert_called_once_with()
+
+    for shardIndex in xrange(2):
+      a = "a%s" % (shardIndex,)
+      b = "b%s" % (shardIndex,)
+      self.assertEqual(
+        shardLogs[shardIndex],
+        [("spool", a, 0), ("ack", a, 0), ("notify", a, 0),
+         ("spool", b, 1), ("ack", b, 1), ("notify", b, 1),
+         ("spool", a, 2), ("ack", a, 2), ("notify", a, 2)])
+
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,161 @@
+# ----------------------------------------------------------------------
+# Numenta Platform for Intelligent Computing (NuPIC)
+# Copyright (C) 2015, Numenta, Inc.  Unless you have purchased from
+# Numenta, Inc. a separate commercial license for this software code, the
+# following terms and conditions apply:
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero Public License for more details.
+#
+# You should have received a copy of the GNU Affero Public License
+# along with this program.  If not, see http://www.gnu.org/licenses.
+#
+# http://numenta.org/licenses/
+# ----------------------------------------------------------------------
+
+"""
+Unit tests for the Model Swapper's ModelRunnerPool class
+"""
+
+import time
+import unittest
+
+
+from mock import Mock, patch
+
+
+from htmengine.model_swapper import model_runner_pool
+from htmengine.model_swapper.model_runner_pool import ModelRunnerPool
+
+from nta.utils.logging_support_raw import LoggingSupport
+
+
+
+# Disable warning: Access to a protected member
+# pylint: disable=W0212
+
+
+
+def setUpModule():
+  LoggingSupport.initTestApp()
+
+
+
+def _createProcessMock(returncode=None):
+  processMock = Mock(name="Popen", returncode=returncode)
+  processMock.poll.return_value = returncode
+  return processMock
+
+
+
+def _waitForIdleProcesses(numProcesses, timeout=5):
+  pool = ModelRunnerPool._singleton
+  deadline = time.time() + timeout
+  while time.time() < deadline:
+    with pool._mutex:
+      if len(pool._idleProcesses) >= numProcesses:
+        return
+    time.sleep(0.01)
+
+  raise AssertionError("Timed out waiting for %s idle processes" %
+                       (numProcesses,))
+
+
+
+@patch.object(model_runner_pool, "_startModelRunnerProcess", autospec=True)
+class ModelRunnerPoolTestCase(unittest.TestCase):
+  """ ModelSwapper's ModelRunnerPool unit tests """
+
+
+  def tearDown(self):
+    ModelRunnerPool.close()
+
+
+  def testColdStartWhenPoolNotInitialized(self, startProcessMock):
+    process = ModelRunnerPool.startModelRunner("abc")
+
+    self.assertIs(process, startProcessMock.return_value)
+    startProcessMock.assert_called_once_with(["--modelID=abc"])
+
+
+  def testInitWithZeroPoolSizeDisablesPool(self, startProcessMock):
+    ModelRunnerPool.init(poolSize=0)
+    self.assertIsNone(ModelRunnerPool._singleton)
+
+    ModelRunnerPool.startModelRunner("abc")
+    startProcessMock.assert_called_once_with(["--modelID=abc"])
+
+
+  def testWarmStartHandsModelIDToIdleProcess(self, startProcessMock):
+    warmProcesses = [_createProcessMock() for _ in xrange(3)]
+    startProcessMock.side_effect = iter(warmProcesses)
+
+    ModelRunnerPool.init(poolSize=2)
+    _waitForIdleProcesses(2)
+
+    process = ModelRunnerPool.startModelRunner("abc")
+
+    self.assertIs(process, warmProcesses[0])
+    process.stdin.write.assert_called_once_with("abc\n")
+    process.stdin.flush.assert_called_once_with()
+
+    # The pool should have replenished itself with another warm process
+    _waitForIdleProcesses(2)
+    self.assertEqual(startProcessMock.call_count, 3)
+    for call in startProcessMock.call_args_list:
+      self.assertEqual(call[0], (["--warm"],))
+
+    ModelRunnerPool.close()
+
+    # Idle warm processes are released by closing their stdin
+    warmProcesses[1].stdin.close.assert_called_once_with()
+    warmProcesses[1].wait.assert_called_once_with()
+    warmProcesses[2].stdin.close.assert_called_once_with()
+    self.assertEqual(warmProcesses[0].stdin.close.call_count, 0)
+
+
+  def testDeadWarmProcessIsSkipped(self, startProcessMock):
+    deadProcess = _createProcessMock(returncode=1)
+    healthyProcess = _createProcessMock()
+    startProcessMock.side_effect = iter([deadProcess, healthyProcess])
+
+    ModelRunnerPool.init(poolSize=2)
+    _waitForIdleProcesses(2)
+
+    # Prevent replenishment from interfering with the test
+    ModelRunnerPool._singleton._poolSize = 0
+
+    process = ModelRunnerPool.startModelRunner("abc")
+
+    self.assertIs(process, healthyProcess)
+    self.assertEqual(deadProcess.stdin.write.call_count, 0)
+
+
+  def testFallBackToColdStartWhenPoolIsEmpty(self, startProcessMock):
+    warmProcess = _createProcessMock()
+    coldProcess = _createProcessMock()
+    startProcessMock.side_effect = iter([warmProcess, coldProcess])
+
+    ModelRunnerPool.init(poolSize=1)
+    _waitForIdleProcesses(1)
+
+    # Prevent replenishment from interfering with the test
+    ModelRunnerPool._singleton._poolSize = 0
+
+    self.assertIs(ModelRunnerPool.startModelRunner("abc"), warmProcess)
+    self.assertIs(ModelRunnerPool.startModelRunner("def"), coldProcess)
+    startProcessMock.assert_called_with(["--modelID=def"])
+
+    self.assertEqual(ModelRunnerPool._singleton._numWarmStarts, 1)
+    self.assertEqual(ModelRunnerPool._singleton._numColdStarts, 1)
+
+
+
+if __name__ == '__main__':
+  unittest.main()
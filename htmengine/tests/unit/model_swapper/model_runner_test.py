@@ -27,13 +27,16 @@ Unit tests for Model Swapper's ModelRunner class
 import base64
 import cPickle
 import datetime
+import json
 import logging
+import os
 import select
+import StringIO
 import threading
 import unittest
 
 
-from mock import Mock, patch
+from mock import call, Mock, patch
 
 
 from nupic.data.fieldmeta import FieldMetaInfo
@@ -81,6 +84,9 @@ class _FakeConsumer(object):
   def __exit__(self, *args, **kwargs):
     return False
 
+  def close(self):
+    pass
+
   def __iter__(self):
     for value in self._requests:
       yield value
@@ -283,6 +289,9 @@ class TestModelRunner(unittest.TestCase):
     self.assertEqual(outputResults[0].status, htmengineerrno.SUCCESS)
     self.assertIsNone(outputResults[0].errorMessage)
 
+    # The deletion is reported to SwapController with the run's stats
+    self.assertEqual(mr._runStats.numDeletions, 1)
+
 
   def testDefineModelWithSameCreationMetaInfo(
       self, modelCheckpointMgrClassMock, modelSwapperInterfaceClassMock):
@@ -644,6 +653,7 @@ class TestModelRunner(unittest.TestCase):
 
     # Configure ModelCheckpointMgr mock
     checkpointMgrInstanceMock = modelCheckpointMgrClassMock.return_value
+    checkpointMgrInstanceMock.save.return_value = 1024
     checkpointMgrInstanceMock.loadCheckpointAttributes.side_effect = (
       model_checkpoint_mgr.ModelNotFound)
     checkpointMgrInstanceMock.loadModelDefinition.return_value = dict(
@@ -844,6 +854,7 @@ class TestModelRunner(unittest.TestCase):
     )
 
     checkpointMgrInstanceMock = modelCheckpointMgrClassMock.return_value
+    checkpointMgrInstanceMock.save.return_value = 1024
     checkpointMgrInstanceMock.loadCheckpointAttributes. \
       return_value = (
         {
@@ -1070,6 +1081,7 @@ class TestModelRunner(unittest.TestCase):
     )
 
     checkpointMgrInstanceMock = modelCheckpointMgrClassMock.return_value
+    checkpointMgrInstanceMock.save.return_value = 1024
     initialIncrementalSamples = [
       [datetime.datetime.utcnow(), -1.0],
       [datetime.datetime.utcnow(), -2.0]
@@ -1184,6 +1196,7 @@ class TestModelRunner(unittest.TestCase):
 
       # Configure ModelCheckpointMgr mock
       checkpointMgrInstanceMock = modelCheckpointMgrClassMock.return_value
+      checkpointMgrInstanceMock.save.return_value = 1024
       checkpointMgrInstanceMock.loadModelDefinition.return_value = dict(
         inputSchema=inputRecordSchema, modelParams=dummyModelParams)
       checkpointMgrInstanceMock.load.side_effect = (
@@ -1281,7 +1294,7 @@ class TestModelRunner(unittest.TestCase):
         side_effect = model_checkpoint_mgr.ModelNotFound
       checkpointMgrInstanceMock.save.side_effect = (
         lambda modelID, model, attributes: (
-          checkpointAttributes.__setitem__("attributes", attributes)))
+          checkpointAttributes.__setitem__("attributes", attributes) or 1024))
 
       # Configure ModelFactory mock
       modelInstanceMock = Mock(run=Mock(
@@ -1338,6 +1351,128 @@ class TestModelRunner(unittest.TestCase):
       self.assertEqual(swapperMock.submitResults.call_count, len(requests) // 2)
 
 
+  @patch.object(
+    model_runner, "ModelFactory", autospec=True,
+    create=Mock(spec_set=model_runner.ModelFactory.create))
+  @patch.object(select, "select", autospec=True, return_value=((), (), ()))
+  def testPipelinedProcessingAcksAfterResultsAreSubmitted(
+      self, selectMock, modelFactoryClassMock, modelCheckpointMgrClassMock,
+      modelSwapperInterfaceClassMock):
+    requestsPerCheckpoint = 10
+
+    # Configure ModelCheckpointMgr mock
+    checkpointMgrInstanceMock = modelCheckpointMgrClassMock.return_value
+    checkpointMgrInstanceMock.save.return_value = 1024
+    checkpointMgrInstanceMock.loadCheckpointAttributes.side_effect = (
+      model_checkpoint_mgr.ModelNotFound)
+    checkpointMgrInstanceMock.loadModelDefinition.return_value = dict(
+      inputSchema=[FieldMetaInfo("c1", "float", "")],
+      modelParams=dict(modelConfig="a", inferenceArgs="b"))
+    checkpointMgrInstanceMock.load.side_effect = (
+      model_checkpoint_mgr.ModelNotFound)
+
+    # Configure ModelFactory mock
+    modelFactoryClassMock.create.return_value = Mock(run=Mock(
+      return_value=Mock(inferences=dict(anomalyScore=1.0))))
+
+    # Prepare input requests for two runs, with duplicates
+    requests = [
+      _ConsumedRequestBatch(
+        batchID="foobar_%s" % (i,),
+        ack=Mock(),
+        objects=[ModelInputRow(rowID=i,
+                               data=[datetime.datetime.utcnow(), 1.0])])
+      for i in xrange(requestsPerCheckpoint + requestsPerCheckpoint // 2)
+      for _j in xrange(2)
+    ]
+
+    swapperMock = modelSwapperInterfaceClassMock.return_value
+    swapperMock.consumeRequests.return_value = _FakeConsumer(requests)
+
+    submittedRowIDs = []
+    swapperMock.submitResults.side_effect = (
+      lambda modelID, results: submittedRowIDs.extend(
+        r.rowID for r in results))
+
+    def makeAckSideEffect(rowID):
+      def ackSideEffect(multiple=False):
+        if multiple:
+          # The results of the acked batches must be submitted by now
+          self.assertIn(rowID, submittedRowIDs)
+      return ackSideEffect
+
+    for request in requests:
+      request.ack.side_effect = makeAckSideEffect(request.objects[0].rowID)
+
+    with ConfigAttributePatch(
+        modelSwapperConfig.CONFIG_NAME,
+        modelSwapperConfig.baseConfigDir,
+        (("model_runner", "target_requests_per_checkpoint",
+          str(requestsPerCheckpoint)),
+         ("model_runner", "pipelined", "true"))):
+      with model_runner.ModelRunner(modelID="abc") as mr:
+        mr.run()
+
+    # Each unique input row was processed and its result submitted once, in
+    # order
+    self.assertEqual(submittedRowIDs,
+                     range(requestsPerCheckpoint + requestsPerCheckpoint // 2))
+
+    self.assertEqual(checkpointMgrInstanceMock.save.call_count, 1)
+    self.assertEqual(
+      checkpointMgrInstanceMock.updateCheckpointAttributes.call_count, 1)
+
+    # The last unique batch of each run was acked with its predecessors
+    requests[requestsPerCheckpoint * 2 - 2].ack.assert_any_call(multiple=True)
+    requests[-2].ack.assert_any_call(multiple=True)
+
+
+  @patch.object(model_runner._BatchPrefetcher, "prefetchNext", autospec=True,
+                side_effect=model_runner._BatchPrefetcher.prefetchNext)
+  def testPipelinedProcessingDoesNotPrefetchAheadOfCommands(
+      self, prefetchNextMock, modelCheckpointMgrClassMock,
+      modelSwapperInterfaceClassMock):
+    modelID = "abc"
+
+    modelCheckpointMgrClassMock.return_value.loadCheckpointAttributes. \
+      side_effect = model_checkpoint_mgr.ModelNotFound
+
+    # A batch with a defineModel command, followed by one with a deleteModel
+    # command, which ends the run
+    requests = [
+      _ConsumedRequestBatch(
+        batchID="foobar_0",
+        ack=Mock(),
+        objects=[ModelCommand(commandID=1, method="defineModel",
+                              args=dict(modelConfig="a", inferenceArgs="b",
+                                        inputRecordSchema=[]))]),
+      _ConsumedRequestBatch(
+        batchID="foobar_1",
+        ack=Mock(),
+        objects=[ModelCommand(commandID=2, method="deleteModel", args=None)]),
+    ]
+
+    swapperMock = modelSwapperInterfaceClassMock.return_value
+    swapperMock.consumeRequests.return_value = _FakeConsumer(requests)
+
+    def cleanUpSideEffect(modelID):  # pylint: disable=W0613
+      # No background read may be using the connection at this time
+      self.assertEqual(prefetchNextMock.call_count, 0)
+
+    swapperMock.cleanUpAfterModelDeletion.side_effect = cleanUpSideEffect
+
+    with ConfigAttributePatch(
+        modelSwapperConfig.CONFIG_NAME,
+        modelSwapperConfig.baseConfigDir,
+        (("model_runner", "pipelined", "true"),)):
+      with model_runner.ModelRunner(modelID=modelID) as mr:
+        mr.run()
+
+    self.assertEqual(prefetchNextMock.call_count, 0)
+    swapperMock.cleanUpAfterModelDeletion.assert_called_once_with(modelID)
+    self.assertEqual(swapperMock.submitResults.call_count, 2)
+
+
   def testInferencePathWithModelNotFound(self, modelCheckpointMgrClassMock,
                                          modelSwapperInterfaceClassMock):
     # Test ModelRunner's inference-processing error plumbing by sending input
@@ -1472,6 +1607,583 @@ class TestModelRunner(unittest.TestCase):
                   outputResults[1].errorMessage)
 
 
+  def testCheckpointTokenDetectsSupersededCheckpoint(
+      self, modelCheckpointMgrClassMock, *_args):
+    # Verify that a _ModelArchiver with checkpoint token tracking, as used by
+    # ResidentModelRunner, detects when its in-memory model was superseded by
+    # another checkpoint or the model was deleted
+    checkpointMgrMock = modelCheckpointMgrClassMock.return_value
+    checkpointMgrMock.loadCheckpointAttributes.return_value = {
+      model_runner._ModelArchiver._BATCH_IDS_CHECKPOINT_ATTR_NAME: ["b1"]
+    }
+
+    archiver = model_runner._ModelArchiver("abc", trackCheckpointToken=True)
+    self.assertEqual(archiver.modelCheckpointBatchIDSet, set(["b1"]))
+
+    # The checkpoint doesn't have a token yet
+    self.assertFalse(archiver.isCheckpointCurrent())
+
+    # Simulate a loaded model and perform an incremental checkpoint
+    archiver._model = Mock()
+    archiver._hasCheckpoint = True
+    archiver.saveModel(currentRunBatchIDSet=set(["b2"]),
+                       currentRunInputSamples=[[1]])
+
+    self.assertEqual(checkpointMgrMock.save.call_count, 0)
+    self.assertEqual(
+      checkpointMgrMock.updateCheckpointAttributes.call_count, 1)
+    savedAttributes = (
+      checkpointMgrMock.updateCheckpointAttributes.call_args[0][1])
+    self.assertIn(model_runner._ModelArchiver._CHECKPOINT_TOKEN_ATTR_NAME,
+                  savedAttributes)
+
+    checkpointMgrMock.loadCheckpointAttributes.return_value = savedAttributes
+    self.assertTrue(archiver.isCheckpointCurrent())
+
+    # Simulate a checkpoint by another ModelRunner
+    checkpointMgrMock.loadCheckpointAttributes.return_value = dict(
+      savedAttributes,
+      **{model_runner._ModelArchiver._CHECKPOINT_TOKEN_ATTR_NAME: "other"})
+    self.assertFalse(archiver.isCheckpointCurrent())
+
+    # Simulate deletion of the model
+    checkpointMgrMock.loadCheckpointAttributes.side_effect = (
+      model_checkpoint_mgr.ModelNotFound)
+    self.assertFalse(archiver.isCheckpointCurrent())
+
+
+
+  @patch.object(
+    model_runner, "ModelFactory", autospec=True,
+    create=Mock(spec_set=model_runner.ModelFactory.create))
+  @patch.object(select, "select", autospec=True, return_value=((), (), ()))
+  @patch.object(os, "waitpid", autospec=True)
+  @patch.object(os, "fork", autospec=True, return_value=12345)
+  def testBackgroundCheckpointDefersAckUntilSaved(
+      self, forkMock, waitpidMock, _selectMock, modelFactoryClassMock,
+      modelCheckpointMgrClassMock, modelSwapperInterfaceClassMock):
+    requestsPerCheckpoint = 10
+
+    # Configure ModelCheckpointMgr mock
+    checkpointMgrInstanceMock = modelCheckpointMgrClassMock.return_value
+    checkpointMgrInstanceMock.loadCheckpointAttributes.side_effect = (
+      model_checkpoint_mgr.ModelNotFound)
+    checkpointMgrInstanceMock.loadModelDefinition.return_value = dict(
+      inputSchema=[FieldMetaInfo("c1", "float", "")],
+      modelParams=dict(modelConfig="a", inferenceArgs="b"))
+    checkpointMgrInstanceMock.load.side_effect = (
+      model_checkpoint_mgr.ModelNotFound)
+
+    # Configure ModelFactory mock
+    modelFactoryClassMock.create.return_value = Mock(run=Mock(
+      return_value=Mock(inferences=dict(anomalyScore=1.0))))
+
+    # Prepare input requests for two runs
+    requests = [
+      _ConsumedRequestBatch(
+        batchID="foobar_%s" % (i,),
+        ack=Mock(),
+        objects=[ModelInputRow(rowID=i,
+                               data=[datetime.datetime.utcnow(), 1.0])])
+      for i in xrange(requestsPerCheckpoint + requestsPerCheckpoint // 2)
+    ]
+
+    swapperMock = modelSwapperInterfaceClassMock.return_value
+    swapperMock.consumeRequests.return_value = _FakeConsumer(requests)
+
+    def waitpidSideEffect(pid, _options):
+      # The first run's batches must not be acked before the background
+      # checkpoint completes
+      self.assertNotIn(call(multiple=True),
+                       requests[requestsPerCheckpoint - 1].ack.call_args_list)
+      # The second run's incremental checkpoint must be saved after it
+      self.assertEqual(
+        checkpointMgrInstanceMock.updateCheckpointAttributes.call_count, 0)
+      return pid, 0
+
+    waitpidMock.side_effect = waitpidSideEffect
+
+    with ConfigAttributePatch(
+        modelSwapperConfig.CONFIG_NAME,
+        modelSwapperConfig.baseConfigDir,
+        (("model_runner", "target_requests_per_checkpoint",
+          str(requestsPerCheckpoint)),
+         ("model_runner", "background_checkpoint", "true"))):
+      with model_runner.ModelRunner(modelID="abc") as mr:
+        mr.run()
+
+    # The full checkpoint was saved by the (simulated) child process, which
+    # was reaped before the next checkpoint
+    forkMock.assert_called_once_with()
+    waitpidMock.assert_called_once_with(12345, 0)
+    self.assertEqual(checkpointMgrInstanceMock.save.call_count, 0)
+
+    # The incremental checkpoint of the second run is relative to the full
+    # checkpoint of the first run
+    self.assertEqual(
+      checkpointMgrInstanceMock.updateCheckpointAttributes.call_count, 1)
+    attributes = (
+      checkpointMgrInstanceMock.updateCheckpointAttributes.call_args[0][1])
+    self.assertItemsEqual(
+      attributes[model_runner._ModelArchiver._BATCH_IDS_CHECKPOINT_ATTR_NAME],
+      [r.batchID for r in requests[requestsPerCheckpoint:]])
+    self.assertEqual(
+      len(model_runner._ModelArchiver._decodeDataSamples(
+        attributes[model_runner._ModelArchiver.
+                   _INPUT_SAMPLES_SINCE_CHECKPOINT_ATTR_NAME])),
+      len(requests) - requestsPerCheckpoint)
+
+    requests[requestsPerCheckpoint - 1].ack.assert_any_call(multiple=True)
+    requests[-1].ack.assert_called_once_with(multiple=True)
+
+
+  @patch.object(
+    model_runner, "ModelFactory", autospec=True,
+    create=Mock(spec_set=model_runner.ModelFactory.create))
+  @patch.object(select, "select", autospec=True, return_value=((), (), ()))
+  @patch.object(os, "waitpid", autospec=True, return_value=(12345, 1 << 8))
+  @patch.object(os, "fork", autospec=True, return_value=12345)
+  def testFailedBackgroundCheckpointLeavesBatchesUnacked(
+      self, _forkMock, _waitpidMock, _selectMock, modelFactoryClassMock,
+      modelCheckpointMgrClassMock, modelSwapperInterfaceClassMock):
+    checkpointMgrInstanceMock = modelCheckpointMgrClassMock.return_value
+    checkpointMgrInstanceMock.loadCheckpointAttributes.side_effect = (
+      model_checkpoint_mgr.ModelNotFound)
+    checkpointMgrInstanceMock.loadModelDefinition.return_value = dict(
+      inputSchema=[FieldMetaInfo("c1", "float", "")],
+      modelParams=dict(modelConfig="a", inferenceArgs="b"))
+    checkpointMgrInstanceMock.load.side_effect = (
+      model_checkpoint_mgr.ModelNotFound)
+
+    modelFactoryClassMock.create.return_value = Mock(run=Mock(
+      return_value=Mock(inferences=dict(anomalyScore=1.0))))
+
+    requests = [
+      _ConsumedRequestBatch(
+        batchID="foobar",
+        ack=Mock(),
+        objects=[ModelInputRow(rowID=1,
+                               data=[datetime.datetime.utcnow(), 1.0])])
+    ]
+
+    swapperMock = modelSwapperInterfaceClassMock.return_value
+    swapperMock.consumeRequests.return_value = _FakeConsumer(requests)
+
+    with ConfigAttributePatch(
+        modelSwapperConfig.CONFIG_NAME,
+        modelSwapperConfig.baseConfigDir,
+        (("model_runner", "background_checkpoint", "true"),)):
+      with model_runner.ModelRunner(modelID="abc") as mr:
+        with self.assertRaises(model_runner._ModelRunnerError):
+          mr.run()
+
+    self.assertEqual(requests[0].ack.call_count, 0)
+
+
+  @patch.object(os, "close", autospec=True)
+  @patch.object(os, "_exit", autospec=True, side_effect=SystemExit)
+  @patch.object(os, "fork", autospec=True, return_value=0)
+  def testBackgroundCheckpointChildSavesModelAndExits(
+      self, _forkMock, exitMock, closeMock, modelCheckpointMgrClassMock,
+      *_args):
+    checkpointMgrMock = modelCheckpointMgrClassMock.return_value
+
+    archiver = model_runner._ModelArchiver("abc")
+    archiver._model = Mock()
+    archiver._hasCheckpoint = False
+    archiver._inputSamplesSinceLastFullCheckpoint = []
+
+    controlStream = Mock(fileno=Mock(return_value=99))
+
+    with self.assertRaises(SystemExit):
+      archiver.saveModel(currentRunBatchIDSet=set(["b1"]),
+                         currentRunInputSamples=[[1]],
+                         background=True,
+                         childInheritedFiles=(controlStream,))
+
+    # The child closed the inherited descriptor without flushing the file
+    closeMock.assert_called_once_with(99)
+    self.assertFalse(controlStream.flush.called)
+    self.assertFalse(controlStream.close.called)
+
+    checkpointMgrMock.save.assert_called_once_with(
+      modelID="abc", model=archiver._model,
+      attributes={
+        model_runner._ModelArchiver._BATCH_IDS_CHECKPOINT_ATTR_NAME: ["b1"]})
+    exitMock.assert_called_once_with(0)
+
+
+  def testBackgroundCheckpointWithPipelinedIsRejected(self, *_args):
+    with ConfigAttributePatch(
+        modelSwapperConfig.CONFIG_NAME,
+        modelSwapperConfig.baseConfigDir,
+        (("model_runner", "background_checkpoint", "true"),
+         ("model_runner", "pipelined", "true"))):
+      with self.assertRaises(ValueError):
+        model_runner.ModelRunner(modelID="abc")
+
+
+  def testAdaptiveCheckpointSavesFullWhenReplayCostsMore(
+      self, modelCheckpointMgrClassMock, *_args):
+    checkpointMgrMock = modelCheckpointMgrClassMock.return_value
+
+    with ConfigAttributePatch(
+        modelSwapperConfig.CONFIG_NAME,
+        modelSwapperConfig.baseConfigDir,
+        (("model_runner", "adaptive_checkpoint", "true"),)):
+      archiver = model_runner._ModelArchiver("abc")
+
+    archiver._model = Mock()
+    archiver._hasCheckpoint = True
+    archiver._inputSamplesSinceLastFullCheckpoint = [[0]] * 10
+    archiver._fullSaveSecEstimate = 0.5
+    archiver._replaySecPerSampleEstimate = 0.01
+
+    # Replaying 40 samples is expected to take less time than a full save
+    archiver.saveModel(currentRunBatchIDSet=set(["b1"]),
+                       currentRunInputSamples=[[1]] * 30)
+
+    self.assertFalse(archiver.lastCheckpointWasFull)
+    self.assertEqual(checkpointMgrMock.save.call_count, 0)
+    attributes = checkpointMgrMock.updateCheckpointAttributes.call_args[0][1]
+    self.assertEqual(
+      attributes[model_runner._ModelArchiver._CHECKPOINT_COSTS_ATTR_NAME],
+      dict(fullSaveSec=0.5, replaySecPerSample=0.01,
+           processSecPerRequest=None))
+
+    # But replaying 50 samples isn't
+    archiver.saveModel(currentRunBatchIDSet=set(["b2"]),
+                       currentRunInputSamples=[[2]] * 10)
+
+    self.assertTrue(archiver.lastCheckpointWasFull)
+    checkpointMgrMock.save.assert_called_once_with(
+      modelID="abc", model=archiver._model,
+      attributes={
+        model_runner._ModelArchiver._BATCH_IDS_CHECKPOINT_ATTR_NAME: ["b2"],
+        model_runner._ModelArchiver._CHECKPOINT_COSTS_ATTR_NAME:
+          dict(fullSaveSec=0.5, replaySecPerSample=0.01,
+               processSecPerRequest=None)})
+    self.assertEqual(archiver._inputSamplesSinceLastFullCheckpoint, [])
+
+    # The full save updated the estimate with its measured duration
+    self.assertLess(archiver._fullSaveSecEstimate, 0.5)
+
+
+  def testAdaptiveCheckpointLoadsCostsAndMeasuresReplay(
+      self, modelCheckpointMgrClassMock, *_args):
+    checkpointMgrMock = modelCheckpointMgrClassMock.return_value
+    checkpointMgrMock.loadCheckpointAttributes.return_value = {
+      model_runner._ModelArchiver._BATCH_IDS_CHECKPOINT_ATTR_NAME: ["b1"],
+      model_runner._ModelArchiver._INPUT_SAMPLES_SINCE_CHECKPOINT_ATTR_NAME:
+        model_runner._ModelArchiver._encodeDataSamples(
+          [[datetime.datetime.utcnow(), 1.0],
+           [datetime.datetime.utcnow(), 2.0]]),
+      model_runner._ModelArchiver._CHECKPOINT_COSTS_ATTR_NAME:
+        dict(fullSaveSec=2.0, replaySecPerSample=None)
+    }
+    checkpointMgrMock.loadModelDefinition.return_value = dict(
+      inputSchema=[FieldMetaInfo("c1", "float", "")])
+
+    with ConfigAttributePatch(
+        modelSwapperConfig.CONFIG_NAME,
+        modelSwapperConfig.baseConfigDir,
+        (("model_runner", "adaptive_checkpoint", "true"),)):
+      archiver = model_runner._ModelArchiver("abc")
+
+    archiver.loadModel()
+
+    self.assertEqual(checkpointMgrMock.load.return_value.run.call_count, 2)
+    self.assertEqual(archiver.lastReplayNumSamples, 2)
+    self.assertGreaterEqual(archiver.lastReplaySec, 0)
+    self.assertEqual(archiver._fullSaveSecEstimate, 2.0)
+    self.assertEqual(archiver._replaySecPerSampleEstimate,
+                     archiver.lastReplaySec / 2)
+
+
+  def testAdaptiveCheckpointIntervalCarriesProcessingCostOver(
+      self, modelCheckpointMgrClassMock, *_args):
+    checkpointMgrMock = modelCheckpointMgrClassMock.return_value
+
+    with ConfigAttributePatch(
+        modelSwapperConfig.CONFIG_NAME,
+        modelSwapperConfig.baseConfigDir,
+        (("model_runner", "adaptive_checkpoint_interval", "true"),)):
+      archiver = model_runner._ModelArchiver("abc")
+
+    self.assertIsNone(archiver.processSecPerRequestEstimate)
+
+    archiver.noteRequestsProcessed(numRequests=0, durationSec=1.0)
+    self.assertIsNone(archiver.processSecPerRequestEstimate)
+
+    archiver.noteRequestsProcessed(numRequests=10, durationSec=1.0)
+    self.assertAlmostEqual(archiver.processSecPerRequestEstimate, 0.1)
+
+    archiver._model = Mock()
+    archiver._hasCheckpoint = True
+    archiver._inputSamplesSinceLastFullCheckpoint = []
+    archiver.saveModel(currentRunBatchIDSet=set(["b1"]),
+                       currentRunInputSamples=[[datetime.datetime.utcnow(),
+                                                1.0]])
+
+    attributes = checkpointMgrMock.updateCheckpointAttributes.call_args[0][1]
+    costs = attributes[model_runner._ModelArchiver._CHECKPOINT_COSTS_ATTR_NAME]
+    self.assertAlmostEqual(costs["processSecPerRequest"], 0.1)
+
+    # The next ModelRunner of the model starts with the saved estimate
+    checkpointMgrMock.loadCheckpointAttributes.return_value = attributes
+    checkpointMgrMock.loadModelDefinition.return_value = dict(
+      inputSchema=[FieldMetaInfo("c1", "float", "")])
+
+    with ConfigAttributePatch(
+        modelSwapperConfig.CONFIG_NAME,
+        modelSwapperConfig.baseConfigDir,
+        (("model_runner", "adaptive_checkpoint_interval", "true"),)):
+      archiver = model_runner._ModelArchiver("abc")
+
+    archiver.loadModel()
+
+    self.assertAlmostEqual(archiver.processSecPerRequestEstimate, 0.1)
+
+
+
+class RunLengthPolicyTestCase(unittest.TestCase):
+
+  def testFixedRunLength(self):
+    policy = model_runner._RunLengthPolicy(targetRequests=10)
+
+    self.assertFalse(policy.isRunComplete(numRequests=9,
+                                          secPerRequestEstimate=100.0))
+    self.assertTrue(policy.isRunComplete(numRequests=10,
+                                         secPerRequestEstimate=None))
+
+
+  def testAdaptiveRunLength(self):
+    policy = model_runner._RunLengthPolicy(targetRequests=10, adaptive=True,
+                                           targetIntervalSec=1.0,
+                                           maxRequests=1000)
+
+    # The target number of requests applies until the cost is measured
+    self.assertFalse(policy.isRunComplete(numRequests=9,
+                                          secPerRequestEstimate=None))
+    self.assertTrue(policy.isRunComplete(numRequests=10,
+                                         secPerRequestEstimate=None))
+
+    # Cheap requests make for longer runs, up to the max number of requests
+    self.assertFalse(policy.isRunComplete(numRequests=99,
+                                          secPerRequestEstimate=0.01))
+    self.assertTrue(policy.isRunComplete(numRequests=100,
+                                         secPerRequestEstimate=0.01))
+    self.assertTrue(policy.isRunComplete(numRequests=1000,
+                                         secPerRequestEstimate=0.0))
+
+    # Expensive requests make for shorter runs
+    self.assertTrue(policy.isRunComplete(numRequests=2,
+                                         secPerRequestEstimate=0.5))
+
+
+  def testCreateFromConfig(self):
+    with ConfigAttributePatch(
+        modelSwapperConfig.CONFIG_NAME,
+        modelSwapperConfig.baseConfigDir,
+        (("model_runner", "adaptive_checkpoint_interval", "true"),
+         ("model_runner", "target_checkpoint_interval_sec", "2"),
+         ("model_runner", "max_requests_per_checkpoint", "50"))):
+      policy = model_runner._RunLengthPolicy.createFromConfig(
+        ModelSwapperConfig())
+
+    self.assertFalse(policy.isRunComplete(numRequests=19,
+                                          secPerRequestEstimate=0.1))
+    self.assertTrue(policy.isRunComplete(numRequests=20,
+                                         secPerRequestEstimate=0.1))
+    self.assertTrue(policy.isRunComplete(numRequests=50,
+                                         secPerRequestEstimate=0.001))
+
+
+
+class InputRowEncoderTestCase(unittest.TestCase):
+
+  def testTimestampAndValueOfScalarMetricRows(self):
+    timestamp = datetime.datetime(2015, 1, 2, 3, 4, 5)
+
+    encoder = model_runner._InputRowEncoder(
+      fieldsMeta=(FieldMetaInfo("c0", "datetime", "T"),
+                  FieldMetaInfo("c1", "float", "")))
+    self.assertEqual(encoder.getTimestampAndValue((timestamp, 1.5)),
+                     (timestamp, 1.5))
+
+    # Field order doesn't matter
+    encoder = model_runner._InputRowEncoder(
+      fieldsMeta=(FieldMetaInfo("c0", "int", ""),
+                  FieldMetaInfo("c1", "datetime", "T")))
+    self.assertEqual(encoder.getTimestampAndValue([7, timestamp]),
+                     (timestamp, 7))
+
+
+  def testNoTimestampAndValueOfOtherRows(self):
+    for fieldsMeta in [
+        (FieldMetaInfo("c1", "float", ""),),
+        (FieldMetaInfo("c0", "datetime", "T"),
+         FieldMetaInfo("c1", "string", "")),
+        (FieldMetaInfo("c0", "datetime", ""),
+         FieldMetaInfo("c1", "float", "")),
+        (FieldMetaInfo("c0", "datetime", "T"),
+         FieldMetaInfo("c1", "float", ""),
+         FieldMetaInfo("c2", "float", ""))]:
+      encoder = model_runner._InputRowEncoder(fieldsMeta=fieldsMeta)
+      self.assertEqual(
+        encoder.getTimestampAndValue([None] * len(fieldsMeta)),
+        (None, None))
+
+
+
+class BatchPrefetcherTestCase(unittest.TestCase):
+
+  def testYieldsBatchesInOrderWithAndWithoutPrefetch(self):
+    requests = [
+      _ConsumedRequestBatch(batchID=str(i), ack=Mock(), objects=[i])
+      for i in xrange(5)
+    ]
+
+    prefetcher = model_runner._BatchPrefetcher(_FakeConsumer(requests))
+    try:
+      batchIDs = []
+      for i, batch in enumerate(prefetcher):
+        batchIDs.append(batch.batchID)
+        if i % 2:
+          prefetcher.prefetchNext()
+
+        batch.ack(multiple=True)
+        requests[i].ack.assert_called_once_with(multiple=True)
+    finally:
+      prefetcher.close()
+
+    self.assertEqual(batchIDs, [r.batchID for r in requests])
+
+
+  def testReraisesConsumerErrorFromPrefetchThread(self):
+    def generateRequests():
+      yield _ConsumedRequestBatch(batchID="1", ack=Mock(), objects=[1])
+      raise ValueError("consumer failed")
+
+    prefetcher = model_runner._BatchPrefetcher(
+      _FakeConsumer(generateRequests()))
+    try:
+      batchIter = iter(prefetcher)
+      next(batchIter)
+      prefetcher.prefetchNext()
+      with self.assertRaises(ValueError):
+        next(batchIter)
+    finally:
+      prefetcher.close()
+
+
+
+@patch.object(model_runner, "ModelSwapperInterface", autospec=True)
+class ResultSubmitterTestCase(unittest.TestCase):
+
+  def testFlushWaitsForSubmissionOfQueuedResults(
+      self, modelSwapperInterfaceClassMock):
+    swapperMock = modelSwapperInterfaceClassMock.return_value
+    release = threading.Event()
+    swapperMock.submitResults.side_effect = lambda **_kwargs: release.wait()
+
+    submitter = model_runner._ResultSubmitter()
+    try:
+      submitter.submit(modelID="abc", results=[1])
+      submitter.submit(modelID="abc", results=[2])
+
+      release.set()
+      submitter.flush()
+
+      self.assertEqual(swapperMock.submitResults.call_args_list,
+                       [call(modelID="abc", results=[1]),
+                        call(modelID="abc", results=[2])])
+    finally:
+      submitter.close()
+
+    swapperMock.close.assert_called_once_with()
+
+
+  def testFlushRaisesAfterFailedSubmission(
+      self, modelSwapperInterfaceClassMock):
+    swapperMock = modelSwapperInterfaceClassMock.return_value
+    swapperMock.submitResults.side_effect = Exception("bus failed")
+
+    submitter = model_runner._ResultSubmitter()
+    try:
+      submitter.submit(modelID="abc", results=[1])
+
+      with self.assertRaises(model_runner._ModelRunnerError) as cm:
+        submitter.flush()
+
+      self.assertEqual(cm.exception.errno, htmengineerrno.ERR)
+    finally:
+      submitter.close()
+
+
+
+class _FakeModelRunner(object):
+  """ Stand-in for ModelRunner in ResidentModelRunner tests """
+
+  def __init__(self, modelID, archiver, **_kwargs):
+    self.modelID = modelID
+    self.archiver = archiver
+
+
+  def __enter__(self):
+    return self
+
+
+  def __exit__(self, *_args):
+    return False
+
+
+  def run(self):
+    pass
+
+
+
+@patch.object(model_runner, "ModelSwapperInterface", autospec=True)
+class ResidentModelRunnerTestCase(unittest.TestCase):
+
+  @patch.object(model_runner, "ModelRunner", _FakeModelRunner)
+  @patch.object(model_runner, "_ModelArchiver", autospec=True)
+  @patch.object(model_runner, "_getProcessRSS", autospec=True)
+  @patch.object(model_runner, "_readLineFromStdin", autospec=True)
+  def testDoneReportListsModelsNoLongerCached(
+      self, readLineMock, getProcessRSSMock, modelArchiverClassMock,
+      *_args):
+    modelFootprint = 600 * 1024
+
+    # Models "a" and "b" load and don't fit in the model cache together;
+    # model "c" is deleted during its run
+    readLineMock.side_effect = ["a", "b", "c", None]
+    getProcessRSSMock.side_effect = [0, modelFootprint,
+                                     modelFootprint, 2 * modelFootprint,
+                                     2 * modelFootprint]
+    modelArchiverClassMock.side_effect = (
+      lambda modelID, **_kwargs: Mock(model=None if modelID == "c" else Mock()))
+
+    controlStream = StringIO.StringIO()
+
+    with ConfigAttributePatch(modelSwapperConfig.CONFIG_NAME,
+                              modelSwapperConfig.baseConfigDir,
+                              (("resident_model_runner", "model_cache_mb",
+                                "1"),
+                               ("model_runner", "pipelined", "false"))):
+      with model_runner.ResidentModelRunner(controlStream) as runner:
+        runner.run()
+        self.assertEqual(runner._modelCache.keys(), ["b"])
+
+    reports = [json.loads(line)
+               for line in controlStream.getvalue().splitlines()]
+    self.assertEqual(
+      reports,
+      [dict(modelID="a", done=True, evictedModelIDs=[]),
+       dict(modelID="b", done=True, evictedModelIDs=["a"]),
+       dict(modelID="c", done=True, evictedModelIDs=["c"])])
+
+
 
 if __name__ == '__main__':
   unittest.main()
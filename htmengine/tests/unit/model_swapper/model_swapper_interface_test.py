@@ -28,11 +28,16 @@ import copy
 import datetime
 import json
 import numpy
+import os
+import shutil
+import tempfile
+import time
 import unittest
 import uuid
 
 
-from mock import patch, Mock
+from mock import call, patch, Mock
+import msgpack
 
 from nta.utils.test_utils.config_test_utils import ConfigAttributePatch
 
@@ -42,7 +47,10 @@ from htmengine.model_swapper.model_swapper_interface import \
   MessageBusConnector, message_bus_connector, \
   ModelCommand, ModelCommandResult, ModelInputRow, ModelInferenceResult, \
   BatchPackager, RequestMessagePackager, ResultMessagePackager, \
-  ModelSwapperInterface, _ModelRequestResultBase, ModelInferenceResultLegacyV1
+  ModelSwapperInterface, _ModelRequestResultBase, \
+  ModelInferenceResultLegacyV1, ModelInferenceResultLegacyV2, \
+  _NotificationCoalescer, \
+  ShardRequestMessagePackager, _ModelInputSpool
 
 
 
@@ -516,6 +524,54 @@ class ModelInferenceResultTestCase(unittest.TestCase):
     self.assertIsNone(inferenceResult2.multiStepBestPredictions)
 
 
+  def testModelInferenceResultSerializableStateWithInputValues(self):
+    timestamp = datetime.datetime(2015, 3, 4, 5, 6, 7, 891234)
+    inferenceResult = ModelInferenceResult(rowID=1, status=0,
+                                           anomalyScore=0.5,
+                                           timestamp=timestamp, value=-2.5)
+    self.assertEqual(inferenceResult.timestamp, timestamp)
+    self.assertEqual(inferenceResult.value, -2.5)
+
+    # The state must be JSON-serializable
+    state = json.loads(json.dumps(inferenceResult.__getstate__()))
+
+    inferenceResult2 = _ModelRequestResultBase.__createFromState__(state)
+    self.assertEqual(inferenceResult2.rowID, 1)
+    self.assertEqual(inferenceResult2.anomalyScore, 0.5)
+    self.assertEqual(inferenceResult2.timestamp, timestamp)
+    self.assertEqual(inferenceResult2.value, -2.5)
+    self.assertEqual(inferenceResult2, inferenceResult)
+
+
+  def testModelInferenceResultConstructorInvalidInputValues(self):
+    with self.assertRaises(AssertionError):
+      ModelInferenceResult(rowID=1, status=0, anomalyScore=0.5,
+                           timestamp="2015-03-04 05:06:07")
+
+    with self.assertRaises(AssertionError):
+      ModelInferenceResult(rowID=1, status=0, anomalyScore=0.5, value="1.5")
+
+
+  def testLegacyV2ModelInferenceResultSerializableState(self):
+    # Legacy format of ModelInferenceResult state, lacking the input timestamp
+    # and value
+    legacyState = [ModelInferenceResultLegacyV2.__STATE_SIGNATURE__, 1, 0, 0.5,
+                   None, {"1": 2.5}]
+    inferenceResult = _ModelRequestResultBase.__createFromState__(legacyState)
+
+    self.assertIsInstance(inferenceResult, ModelInferenceResult)
+    self.assertEqual(inferenceResult.__STATE_SIGNATURE__,
+                     ModelInferenceResult.__STATE_SIGNATURE__)
+    self.assertEqual(inferenceResult.rowID, 1)
+    self.assertEqual(inferenceResult.anomalyScore, 0.5)
+    self.assertEqual(inferenceResult.multiStepBestPredictions, {"1": 2.5})
+    self.assertIsNone(inferenceResult.timestamp)
+    self.assertIsNone(inferenceResult.value)
+
+    self.assertEqual(len(inferenceResult.__getstate__()),
+                     len(ModelInferenceResult.__slots__) + 1)
+
+
   def testModelInferenceResultSerializableStateWithErrorMessage(self):
     rowID = 1
     status = 1
@@ -563,6 +619,99 @@ class BatchPackagerTestCase(unittest.TestCase):
     self.assertEqual(requestBatch[2].rowID, inputBatch[2].rowID)
 
 
+  def _createMixedBatch(self):
+    return [
+      ModelCommand(commandID="abc", method="defineModel",
+                   args={"key1": 4098, "key2": 4139}),
+      ModelInputRow(rowID=1,
+                    data=[datetime.datetime(2015, 3, 4, 5, 6, 7, 891234),
+                          1.5]),
+      ModelInputRow(rowID=2,
+                    data=[datetime.datetime(2015, 3, 4, 5, 6, 8), -2]),
+      # Different datetime positions start a new columnar segment
+      ModelInputRow(rowID=3, data=[3.25,
+                                   datetime.datetime(1970, 1, 1, 0, 0, 1)]),
+      ModelCommandResult(commandID="def", method="testMethod", status=1,
+                         errorMessage=u"error \u00e9\n"),
+      ModelInferenceResult(rowID=4, status=0, anomalyScore=0.125,
+                           multiStepBestPredictions={1: 2.5}),
+      ModelInferenceResult(rowID=5, status=1, errorMessage="failed"),
+      ModelInferenceResult(rowID=6, status=0, anomalyScore=1,
+                           multiStepBestPredictions=None),
+      ModelInferenceResult(rowID=7, status=0, anomalyScore=0.5,
+                           timestamp=datetime.datetime(2015, 3, 4, 5, 6, 9,
+                                                       123),
+                           value=3.5),
+    ]
+
+
+  def testMsgpackFormatMatchesJsonFormat(self):
+    batch = self._createMixedBatch()
+
+    jsonBatch = BatchPackager.unmarshal(
+      BatchPackager.marshal(batch, batchFormat=BatchPackager.FORMAT_JSON))
+
+    msgpackState = BatchPackager.marshal(
+      batch, batchFormat=BatchPackager.FORMAT_MSGPACK)
+    self.assertTrue(msgpackState.startswith(BatchPackager._MSGPACK_HEADER))
+    msgpackBatch = BatchPackager.unmarshal(msgpackState)
+
+    self.assertEqual(len(msgpackBatch), len(batch))
+    for expected, jsonItem, msgpackItem in zip(batch, jsonBatch, msgpackBatch):
+      self.assertIs(msgpackItem.__class__, expected.__class__)
+      self.assertEqual(msgpackItem.__getstate__(), jsonItem.__getstate__())
+
+    # Integer keys of multi-step best predictions become strings, as with json
+    self.assertEqual(msgpackBatch[5].multiStepBestPredictions, {"1": 2.5})
+    self.assertEqual(msgpackBatch[1].data[0],
+                     datetime.datetime(2015, 3, 4, 5, 6, 7, 891234))
+    self.assertIsNone(msgpackBatch[5].timestamp)
+    self.assertEqual(msgpackBatch[8].timestamp,
+                     datetime.datetime(2015, 3, 4, 5, 6, 9, 123))
+    self.assertEqual(msgpackBatch[8].value, 3.5)
+
+
+  def testUnmarshalLegacyMsgpackInferenceResultSegment(self):
+    # Segment of results lacking the input timestamps and values
+    batchState = BatchPackager._MSGPACK_HEADER + msgpack.packb([
+      [ModelInferenceResultLegacyV2.__STATE_SIGNATURE__, [1, 2], [0, 1],
+       [0.5, None], [None, "failed"], json.dumps([{1: 2.5}, None])]])
+
+    batch = BatchPackager.unmarshal(batchState)
+
+    self.assertEqual(len(batch), 2)
+    self.assertEqual(batch[0].__getstate__(),
+                     ModelInferenceResult(
+                       rowID=1, status=0, anomalyScore=0.5,
+                       multiStepBestPredictions={"1": 2.5}).__getstate__())
+    self.assertEqual(batch[1].__getstate__(),
+                     ModelInferenceResult(
+                       rowID=2, status=1,
+                       errorMessage="failed").__getstate__())
+
+
+  def testMsgpackFormatEmptyBatch(self):
+    self.assertEqual(
+      BatchPackager.unmarshal(
+        BatchPackager.marshal([], batchFormat=BatchPackager.FORMAT_MSGPACK)),
+      ())
+
+
+  def testUnmarshalUnsupportedMsgpackVersion(self):
+    batchState = BatchPackager.marshal(
+      self._createMixedBatch(), batchFormat=BatchPackager.FORMAT_MSGPACK)
+    batchState = (BatchPackager._MSGPACK_MAGIC + chr(99) +
+                  batchState[len(BatchPackager._MSGPACK_HEADER):])
+
+    with self.assertRaises(ValueError):
+      BatchPackager.unmarshal(batchState)
+
+
+  def testMarshalInvalidFormat(self):
+    with self.assertRaises(ValueError):
+      BatchPackager.marshal(self._createMixedBatch(), batchFormat="xml")
+
+
 
 class RequestMessagePackagerTestCase(unittest.TestCase):
   """
@@ -617,6 +766,255 @@ class ResultMessagePackagerTestCase(unittest.TestCase):
 
 
 
+class ShardRequestMessagePackagerTestCase(unittest.TestCase):
+  """
+  Unit tests for ShardRequestMessagePackager
+  """
+
+  def testMarshalAndUnmarshal(self):
+    requestMsg = RequestMessagePackager.marshal(
+      batchID="foobar",
+      batchState=BatchPackager.marshal(batch=[
+        ModelInputRow(rowID="foo", data=[1, 2, "Sep 21 02:24:21 UTC 2013"])]))
+
+    msg = ShardRequestMessagePackager.marshal(modelID="model_foo",
+                                              requestMsg=requestMsg)
+
+    r = ShardRequestMessagePackager.unmarshal(msg)
+
+    self.assertEqual(r.modelID, "model_foo")
+    self.assertEqual(r.requestMsg, requestMsg)
+
+    # Make sure we aren't forgetting to test any returned fields
+    self.assertEqual(set(["modelID", "requestMsg"]), set(r._fields))
+
+
+
+class ModelInputSpoolTestCase(unittest.TestCase):
+  """ Unit tests for _ModelInputSpool and its _SpoolConsumer """
+
+
+  def setUp(self):
+    self._spoolDir = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, self._spoolDir)
+
+    self._spool = _ModelInputSpool(self._spoolDir)
+
+    swapperMock = Mock(spec_set=ModelSwapperInterface)
+    self._consumers = []
+    swapperMock._onConsumerClosed.side_effect = self._consumers.remove
+    self._swapperMock = swapperMock
+
+
+  def _consume(self, modelID):
+    consumer = model_swapper_interface._SpoolConsumer(
+      modelDir=self._spool.getModelDir(modelID),
+      blocking=False,
+      swapper=self._swapperMock)
+    self._consumers.append(consumer)
+    return consumer
+
+
+  def _spoolBatches(self, modelID, batchIDs):
+    for batchID in batchIDs:
+      self._spool.append(
+        modelID,
+        RequestMessagePackager.marshal(
+          batchID=batchID,
+          batchState=BatchPackager.marshal(batch=[
+            ModelInputRow(rowID=batchID, data=[1])])))
+
+
+  def testConsumeInOrderAndAck(self):
+    batchIDs = ["b%d" % (i,) for i in xrange(12)]
+    self._spoolBatches("foo", batchIDs)
+
+    self.assertTrue(self._spool.hasMessages("foo"))
+    self.assertFalse(self._spool.hasMessages("bar"))
+    self.assertEqual(self._spool.getMessageCount("foo"), len(batchIDs))
+    self.assertEqual(self._spool.getMessageCount("bar"), 0)
+
+    with self._consume("foo") as consumer:
+      batches = list(consumer)
+
+      self.assertEqual([batch.batchID for batch in batches], batchIDs)
+      self.assertEqual(batches[0].objects[0].rowID, "b0")
+
+      batches[0].ack()
+      batches[5].ack(multiple=True)
+
+    # Unacked batches stay in the spool
+    with self._consume("foo") as consumer:
+      self.assertEqual([batch.batchID for batch in consumer], batchIDs[6:])
+
+    self.assertEqual(self._consumers, [])
+
+
+  def testUnackedBatchesAreSkippedByOtherConsumers(self):
+    self._spoolBatches("foo", ["b0", "b1"])
+
+    consumer1 = self._consume("foo")
+    batch = next(iter(consumer1))
+    self.assertEqual(batch.batchID, "b0")
+
+    self._spoolBatches("foo", ["b2"])
+
+    with self._consume("foo") as consumer2:
+      self.assertEqual([b.batchID for b in consumer2], ["b1", "b2"])
+
+    batch.ack(multiple=True)
+    consumer1.close()
+
+    with self._consume("foo") as consumer3:
+      self.assertEqual([b.batchID for b in consumer3], ["b1", "b2"])
+
+
+  def testIterModelsPurgeAndRemove(self):
+    self._spoolBatches("foo", ["b0"])
+    self._spoolBatches("bar", ["b1", "b2"])
+
+    self.assertEqual(set(self._spool.iterModelsWithMessages()),
+                     set(["foo", "bar"]))
+
+    self._spool.purge("bar")
+    self.assertEqual(list(self._spool.iterModelsWithMessages()), ["foo"])
+
+    # Sequence numbers continue in an emptied spool
+    self._spoolBatches("bar", ["b3"])
+    with self._consume("bar") as consumer:
+      self.assertEqual([b.batchID for b in consumer], ["b3"])
+
+    self._spool.remove("foo")
+    self._spool.remove("foo")
+    self.assertFalse(os.path.exists(self._spool.getModelDir("foo")))
+
+
+
+@patch.object(model_swapper_interface, "MessageBusConnector", autospec=True)
+class NotificationCoalescerTestCase(unittest.TestCase):
+  """ Unit tests for _NotificationCoalescer """
+
+
+  def setUp(self):
+    self._stampDir = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, self._stampDir)
+
+
+  def _createCoalescer(self, windowSec):
+    coalescer = _NotificationCoalescer("notification-mq", windowSec,
+                                       self._stampDir)
+    self.addCleanup(coalescer.close)
+    return coalescer
+
+
+  def testTrailingNotificationAfterWindow(self, messageBusConnectorClassMock):
+    coalescer = self._createCoalescer(windowSec=0.5)
+    bus = Mock(spec_set=MessageBusConnector)
+
+    self.assertTrue(coalescer.notify("a", bus))
+    self.assertFalse(coalescer.notify("a", bus))
+    self.assertFalse(coalescer.notify("a", bus))
+    self.assertTrue(coalescer.notify("b", bus))
+
+    self.assertEqual(bus.publish.call_args_list,
+                     [call("notification-mq", json.dumps("a"),
+                           persistent=False),
+                      call("notification-mq", json.dumps("b"),
+                           persistent=False)])
+    self.assertEqual(coalescer.numSuppressed, 2)
+
+    # The flush thread publishes a single trailing notification for "a" via its
+    # own connection
+    flushBus = messageBusConnectorClassMock.return_value
+    deadline = time.time() + 5
+    while not flushBus.publish.called and time.time() < deadline:
+      time.sleep(0.01)
+
+    flushBus.publish.assert_called_once_with("notification-mq",
+                                             json.dumps("a"),
+                                             persistent=False)
+
+    # The window restarted with the trailing notification
+    self.assertFalse(coalescer.notify("a", bus))
+
+
+  def testWindowIsSharedBetweenCoalescers(self, _messageBusConnectorClassMock):
+    # Coalescers that share the stamp directory, like those of two processes
+    coalescer1 = self._createCoalescer(windowSec=60)
+    coalescer2 = self._createCoalescer(windowSec=60)
+    bus = Mock(spec_set=MessageBusConnector)
+
+    self.assertTrue(coalescer1.notify("a", bus))
+    self.assertFalse(coalescer2.notify("a", bus))
+    self.assertEqual(coalescer2.numSuppressed, 1)
+
+    coalescer2.flush(bus)
+    self.assertEqual(bus.publish.call_count, 2)
+
+    # And with nothing pending, flush publishes nothing
+    coalescer2.flush(bus)
+    self.assertEqual(bus.publish.call_count, 2)
+
+
+  def testNoTrailingNotificationAfterLaterNotification(
+      self, _messageBusConnectorClassMock):
+    coalescer1 = self._createCoalescer(windowSec=60)
+    coalescer2 = self._createCoalescer(windowSec=60)
+    bus = Mock(spec_set=MessageBusConnector)
+
+    self.assertTrue(coalescer1.notify("a", bus))
+    self.assertFalse(coalescer2.notify("a", bus))
+
+    # Another process notified the model after the suppressed notification
+    coalescer1._setLastNotifyTime("a", time.time() + 1)
+
+    coalescer2.flush(bus)
+    self.assertEqual(bus.publish.call_count, 1)
+
+
+  def testLastReleaseStopsFlushThread(self, messageBusConnectorClassMock):
+    with patch.object(tempfile, "tempdir", self._stampDir):
+      coalescer1 = _NotificationCoalescer.acquire("notification-mq", 60)
+      coalescer2 = _NotificationCoalescer.acquire("notification-mq", 60)
+
+    self.assertIs(coalescer1, coalescer2)
+
+    bus = Mock(spec_set=MessageBusConnector)
+    self.assertTrue(coalescer1.notify("a", bus))
+    self.assertFalse(coalescer1.notify("a", bus))
+
+    flushThread = coalescer1._flushThread
+    self.assertTrue(flushThread.isAlive())
+
+    coalescer1.release()
+    self.assertTrue(flushThread.isAlive())
+
+    coalescer2.release()
+    self.assertFalse(flushThread.isAlive())
+    messageBusConnectorClassMock.return_value.close.assert_called_once_with()
+
+    # A later acquire gets a new coalescer
+    with patch.object(tempfile, "tempdir", self._stampDir):
+      coalescer3 = _NotificationCoalescer.acquire("notification-mq", 60)
+    self.assertIsNot(coalescer3, coalescer1)
+    coalescer3.release()
+
+
+  def testForget(self, _messageBusConnectorClassMock):
+    coalescer = self._createCoalescer(windowSec=60)
+    bus = Mock(spec_set=MessageBusConnector)
+
+    self.assertTrue(coalescer.notify("a", bus))
+    self.assertFalse(coalescer.notify("a", bus))
+
+    coalescer.forget("a")
+    coalescer.flush(bus)
+    self.assertEqual(bus.publish.call_count, 1)
+
+    self.assertTrue(coalescer.notify("a", bus))
+
+
+
 class ModelSwapperInterfaceTestCase(unittest.TestCase):
   """
   Unit tests for ModelSwapperInterface
@@ -709,6 +1107,47 @@ class ModelSwapperInterfaceTestCase(unittest.TestCase):
       notificationMQName, json.dumps(modelID), persistent=False)
 
 
+  @patch.object(model_swapper_interface, "MessageBusConnector", autospec=True)
+  def testSubmitRequestsCoalescesNotifications(self,
+                                               messageBusConnectorClassMock):
+    tempDir = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, tempDir)
+
+    requests = [
+      ModelInputRow(rowID="foo", data=[1, 2, "Sep 21 02:24:21 UTC 2013"]),
+    ]
+
+    messageBusConnectorMock = messageBusConnectorClassMock.return_value
+
+    with patch.object(tempfile, "tempdir", tempDir), ConfigAttributePatch(
+        modelSwapperConfig.CONFIG_NAME,
+        modelSwapperConfig.baseConfigDir,
+        ((ModelSwapperInterface._CONFIG_SECTION,
+          ModelSwapperInterface._NOTIFICATION_COALESCE_WINDOW_OPTION_NAME,
+          "60"),)):
+      interface = ModelSwapperInterface()
+
+    notificationMQName = interface._schedulerNotificationQueueName
+    expectedCall = call(notificationMQName, json.dumps("foofar"),
+                        persistent=False)
+
+    for _ in xrange(3):
+      interface.submitRequests(modelID="foofar", requests=requests)
+
+    self.assertEqual(messageBusConnectorMock.publish.call_args_list.count(
+      expectedCall), 1)
+    self.assertEqual(interface.numSuppressedNotifications, 2)
+
+    # The trailing notification isn't lost when the interface is closed
+    flushThread = interface._notificationCoalescer._flushThread
+    interface.close()
+    self.assertEqual(messageBusConnectorMock.publish.call_args_list.count(
+      expectedCall), 2)
+
+    # Closing the last interface that shares the coalescer stops its thread
+    self.assertFalse(flushThread.isAlive())
+
+
   @patch.object(model_swapper_interface, "MessageBusConnector", autospec=True,
                 publish=Mock(spec_set=MessageBusConnector.publish))
   def testSubmitRequestsWithModelNotFoundException(
@@ -1054,54 +1493,96 @@ class ModelSwapperInterfaceTestCase(unittest.TestCase):
     self.assertFalse(inputPending)
 
 
+  @patch.object(
+    model_swapper_interface, "MessageBusConnector", autospec=True,
+    getMessageCount=Mock(spec_set=MessageBusConnector.getMessageCount))
+  def testGetModelInputBacklog(self, messageBusConnectorClassMock):
+    messageBusConnectorMock = messageBusConnectorClassMock.return_value
+    messageBusConnectorMock.getMessageCount.return_value = 7
+
+    with ModelSwapperInterface() as interface:
+      backlog = interface.getModelInputBacklog(modelID="model_foo")
+
+    self.assertEqual(backlog, 7)
+    messageBusConnectorMock.getMessageCount.assert_called_once_with(
+      interface._getModelInputQName("model_foo"))
+
+
+  @patch.object(
+    model_swapper_interface, "MessageBusConnector", autospec=True,
+    getMessageCount=Mock(spec_set=MessageBusConnector.getMessageCount))
+  def testGetModelInputBacklogMessageQueueNotFoundInterpretedAsZero(
+      self, messageBusConnectorClassMock):
+    messageBusConnectorMock = messageBusConnectorClassMock.return_value
+    messageBusConnectorMock.getMessageCount.side_effect = (
+      message_bus_connector.MessageQueueNotFound)
+
+    with ModelSwapperInterface() as interface:
+      backlog = interface.getModelInputBacklog(modelID="model_foo")
+
+    self.assertEqual(backlog, 0)
+
+
   @patch.object(
     model_swapper_interface, "MessageBusConnector", autospec=True,
     isEmpty=Mock(spec_set=MessageBusConnector.isEmpty),
-    getAllMessageQueues=Mock(spec_set=MessageBusConnector.getAllMessageQueues))
+    iterMessageQueueDepths=Mock(
+      spec_set=MessageBusConnector.iterMessageQueueDepths))
   def testGetModelsWithInputPending(self, messageBusConnectorClassMock):
-    modelsPendingMap = {
-      "model_one": True,
-      "disappeared_one": None,
-      "model_two": True,
-      "model_three": False,
-      "disappeared_two": None,
-      "model_four": False,
-      "model_five": True
+    # Message counts of model input queues per management statistics; None
+    # if the broker has no statistics for the queue yet
+    modelMessageCountMap = {
+      "model_one": 5,
+      "model_two": 1,
+      "model_three": 0,
+      "model_four": 0,
+      "model_five": 100,
+      "new_model_pending": None,
+      "new_model_empty": None,
+      "new_model_disappeared": None
     }
 
     with ModelSwapperInterface() as interface:
-      allMessageQueues = [interface._getModelInputQName(modelID)
-                          for modelID in modelsPendingMap]
-
-    isEmptyResults = [
-      (not pending if pending is not None
-       else message_bus_connector.MessageQueueNotFound(mq))
-      for mq, pending in modelsPendingMap.iteritems()]
+      queueDepths = [
+        message_bus_connector.MessageQueueDepth(
+          name=interface._getModelInputQName(modelID),
+          messageCount=messageCount)
+        for modelID, messageCount in modelMessageCountMap.iteritems()]
+      prefix = interface._modelInputQueueNamePrefix
+
+    isEmptyResultMap = {
+      interface._getModelInputQName("new_model_pending"): False,
+      interface._getModelInputQName("new_model_empty"): True,
+      interface._getModelInputQName("new_model_disappeared"):
+        message_bus_connector.MessageQueueNotFound("new_model_disappeared")
+    }
 
-    # Add some queue names that don't look like model input queue names
-    allMessageQueues.extend(
-      ("not.model.input.queue1", "not.model.input.queue2"))
-    isEmptyResults.extend((False, False))
+    def isEmpty(mqName):
+      result = isEmptyResultMap[mqName]
+      if isinstance(result, Exception):
+        raise result
+      return result
 
     # Configure message bus connector mock
     messageBusConnectorMock = messageBusConnectorClassMock.return_value
-    messageBusConnectorMock.isEmpty.side_effect = isEmptyResults
-    messageBusConnectorMock.getAllMessageQueues.return_value = (
-      allMessageQueues)
+    messageBusConnectorMock.isEmpty.side_effect = isEmpty
+    messageBusConnectorMock.iterMessageQueueDepths.return_value = iter(
+      queueDepths)
 
     # Go for it!
     with ModelSwapperInterface() as interface:
       actualModelsWithInput = interface.getModelsWithInputPending()
 
-    self.assertEqual(messageBusConnectorMock.isEmpty.call_count,
-                     len(modelsPendingMap))
+    messageBusConnectorMock.iterMessageQueueDepths.assert_called_once_with(
+      namePrefix=prefix)
 
-    self.assertEqual(messageBusConnectorMock.getAllMessageQueues.call_count, 1)
+    # Only queues without statistics are queried individually
+    self.assertEqual(messageBusConnectorMock.isEmpty.call_count, 3)
 
     # Verify results
-    expectedSet = set(modelID for modelID, pending
-                      in modelsPendingMap.iteritems() if pending)
-    self.assertEqual(set(actualModelsWithInput), expectedSet)
+    self.assertEqual(set(actualModelsWithInput),
+                     set(["model_one", "model_two", "model_five",
+                          "new_model_pending"]))
 
 
   @patch.object(model_swapper_interface, "MessageBusConnector", autospec=True)
@@ -1132,6 +1613,48 @@ class ModelSwapperInterfaceTestCase(unittest.TestCase):
                                                             persistent=True)
 
 
+  @patch.object(model_swapper_interface, "MessageBusConnector", autospec=True)
+  def testSubmitResultsInMsgpackFormat(self, messageBusConnectorClassMock):
+    results = [
+      ModelInferenceResult(rowID="foo", status=0, anomalyScore=1),
+      ModelInferenceResult(rowID="bar", status=0, anomalyScore=2)
+    ]
+
+    messageBusConnectorMock = messageBusConnectorClassMock.return_value
+
+    with ConfigAttributePatch(
+        modelSwapperConfig.CONFIG_NAME,
+        modelSwapperConfig.baseConfigDir,
+        ((ModelSwapperInterface._CONFIG_SECTION,
+          ModelSwapperInterface._BATCH_FORMAT_OPTION_NAME,
+          BatchPackager.FORMAT_MSGPACK),)):
+      interface = ModelSwapperInterface()
+
+    interface.submitResults(modelID="foofar", results=results)
+
+    msg = messageBusConnectorMock.publish.call_args[0][1]
+    r = ResultMessagePackager.unmarshal(msg)
+    self.assertEqual(r.modelID, "foofar")
+    self.assertEqual(r.batchState,
+                     BatchPackager.marshal(
+                       batch=results,
+                       batchFormat=BatchPackager.FORMAT_MSGPACK))
+    self.assertEqual(list(BatchPackager.unmarshal(r.batchState)), results)
+
+
+  @patch.object(model_swapper_interface, "MessageBusConnector", autospec=True)
+  def testInvalidBatchFormatRaisesValueError(self,
+                                             _messageBusConnectorClassMock):
+    with ConfigAttributePatch(
+        modelSwapperConfig.CONFIG_NAME,
+        modelSwapperConfig.baseConfigDir,
+        ((ModelSwapperInterface._CONFIG_SECTION,
+          ModelSwapperInterface._BATCH_FORMAT_OPTION_NAME,
+          "xml"),)):
+      with self.assertRaises(ValueError):
+        ModelSwapperInterface()
+
+
   @patch.object(model_swapper_interface, "MessageBusConnector", autospec=True,
                 publish=Mock(spec_set=MessageBusConnector.publish))
   def testSubmitResultsRecoveryFromMessageQueueNotFound(
@@ -1328,6 +1851,105 @@ class ModelSwapperInterfaceTestCase(unittest.TestCase):
     self.assertEqual(messageBusConnectorMock.consume.call_count, 2)
 
 
+  def _createShardedInterface(self, numShards):
+    spoolDir = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, spoolDir)
+
+    with ConfigAttributePatch(
+        modelSwapperConfig.CONFIG_NAME,
+        modelSwapperConfig.baseConfigDir,
+        ((ModelSwapperInterface._CONFIG_SECTION,
+          ModelSwapperInterface._NUM_INPUT_SHARDS_OPTION_NAME,
+          str(numShards)),
+         (ModelSwapperInterface._CONFIG_SECTION,
+          ModelSwapperInterface._INPUT_SPOOL_DIR_OPTION_NAME,
+          spoolDir))):
+      return ModelSwapperInterface()
+
+
+  @patch.object(model_swapper_interface, "MessageBusConnector", autospec=True)
+  def testSubmitRequestsToInputShard(self, messageBusConnectorClassMock):
+    requests = [
+      ModelInputRow(rowID="foo", data=[1, 2, "Sep 21 02:24:21 UTC 2013"]),
+    ]
+
+    messageBusConnectorMock = messageBusConnectorClassMock.return_value
+
+    with self._createShardedInterface(numShards=4) as interface:
+      shardIndex = interface._getInputShardIndex("foofar")
+      self.assertTrue(0 <= shardIndex < 4)
+
+      # The shard of a model is stable
+      self.assertEqual(interface._getInputShardIndex("foofar"), shardIndex)
+
+      batchID = interface.submitRequests(modelID="foofar", requests=requests)
+
+      shardMQName = interface._getInputShardQName(shardIndex)
+
+    msg = ShardRequestMessagePackager.marshal(
+      modelID="foofar",
+      requestMsg=RequestMessagePackager.marshal(
+        batchID=batchID,
+        batchState=BatchPackager.marshal(batch=requests)))
+
+    # The shard's demultiplexer notifies Model Scheduler instead
+    messageBusConnectorMock.publish.assert_called_once_with(
+      shardMQName, msg, persistent=True)
+
+
+  @patch.object(
+    model_swapper_interface, "MessageBusConnector", autospec=True,
+    consume=Mock(spec_set=MessageBusConnector.consume))
+  def testSpoolInputShardMessageAndConsumeRequests(
+      self, messageBusConnectorClassMock):
+    requests = (
+      ModelInputRow(rowID="foo", data=[1, 2, "Sep 21 02:24:21 UTC 2013"]),
+    )
+    requestMsg = RequestMessagePackager.marshal(
+      batchID="batch_foo",
+      batchState=BatchPackager.marshal(batch=requests))
+    msg = ShardRequestMessagePackager.marshal(modelID="model_foo",
+                                              requestMsg=requestMsg)
+
+    messageBusConnectorMock = messageBusConnectorClassMock.return_value
+
+    ackMock = Mock(return_value=None)
+    messageBusConnectorMock.consume.return_value = Mock(
+      spec_set=message_bus_connector._QueueConsumer,
+      __iter__=lambda *args, **kwargs: iter(
+        [message_bus_connector._ConsumedMessage(body=msg, ack=ackMock)]))
+
+    with self._createShardedInterface(numShards=2) as interface:
+      self.assertFalse(interface.modelInputPending("model_foo"))
+
+      with interface.consumeInputShard(1) as consumer:
+        shardMsg = next(iter(consumer))
+
+      messageBusConnectorMock.consume.assert_called_once_with(
+        interface._getInputShardQName(1), blocking=True)
+      self.assertEqual(shardMsg.modelID, "model_foo")
+      self.assertEqual(shardMsg.requestMsg, requestMsg)
+      self.assertIs(shardMsg.ack, ackMock)
+
+      interface.spoolInputShardMessage(shardMsg)
+
+      self.assertTrue(interface.modelInputPending("model_foo"))
+      self.assertEqual(interface.getModelsWithInputPending(), ("model_foo",))
+
+      with interface.consumeRequests("model_foo", blocking=False) as consumer:
+        batches = list(consumer)
+        self.assertEqual(len(batches), 1)
+        self.assertEqual(batches[0].batchID, "batch_foo")
+        self.assertEqual(batches[0].objects, requests)
+        batches[0].ack()
+
+      self.assertFalse(interface.modelInputPending("model_foo"))
+
+      interface.cleanUpAfterModelDeletion("model_foo")
+
+    self.assertFalse(messageBusConnectorMock.deleteMessageQueue.called)
+
+
   @patch.object(model_swapper_interface, "MessageBusConnector", autospec=True)
   def testInitSchedulerNotification(self, messageBusConnectorClassMock):
     with ModelSwapperInterface() as interface:
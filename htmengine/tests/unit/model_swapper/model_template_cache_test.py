@@ -0,0 +1,180 @@
+# ----------------------------------------------------------------------
+# Numenta Platform for Intelligent Computing (NuPIC)
+# Copyright (C) 2015, Numenta, Inc.  Unless you have purchased from
+# Numenta, Inc. a separate commercial license for this software code, the
+# following terms and conditions apply:
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero Public License for more details.
+#
+# You should have received a copy of the GNU Affero Public License
+# along with this program.  If not, see http://www.gnu.org/licenses.
+#
+# http://numenta.org/licenses/
+# ----------------------------------------------------------------------
+
+"""
+Unit tests for the Model Swapper's ModelTemplateCache class
+"""
+
+import copy
+import os
+import shutil
+import tempfile
+import unittest
+
+
+from mock import Mock, patch
+
+
+from htmengine.model_swapper import model_template_cache
+from htmengine.model_swapper.model_template_cache import ModelTemplateCache
+
+from nta.utils.logging_support_raw import LoggingSupport
+
+
+
+# Disable warning: Access to a protected member
+# pylint: disable=W0212
+
+
+
+def setUpModule():
+  LoggingSupport.initTestApp()
+
+
+
+def _makeModelConfig(minVal, maxVal, seed=1956):
+  return dict(
+    model="CLA",
+    modelParams=dict(
+      sensorParams=dict(
+        encoders=dict(
+          c0_timeOfDay=dict(fieldname="c0", name="c0", timeOfDay=(21, 9.49),
+                            type="DateEncoder"),
+          c0_dayOfWeek=None,
+          c1=dict(fieldname="c1", name="c1", minval=minVal, maxval=maxVal,
+                  resolution=(maxVal - minVal) / 130.0, seed=42,
+                  type="RandomDistributedScalarEncoder"))),
+      spParams=dict(seed=seed)))
+
+
+
+@patch.object(model_template_cache, "MultiEncoder", autospec=True)
+@patch.object(model_template_cache, "ModelFactory", autospec=True)
+class ModelTemplateCacheTestCase(unittest.TestCase):
+  """ ModelSwapper's ModelTemplateCache unit tests """
+
+
+  def setUp(self):
+    self.cacheDir = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, self.cacheDir)
+
+
+  def testTemplateKeyIgnoresEncoderBounds(self, *_args):
+    key = ModelTemplateCache.getTemplateKey(_makeModelConfig(0.0, 100.0))
+
+    self.assertEqual(
+      ModelTemplateCache.getTemplateKey(_makeModelConfig(-5.0, 5000.0)),
+      key)
+
+    self.assertNotEqual(
+      ModelTemplateCache.getTemplateKey(_makeModelConfig(0.0, 100.0, seed=1)),
+      key)
+
+
+  def testTemplateKeyDoesNotModifyModelConfig(self, *_args):
+    modelConfig = _makeModelConfig(0.0, 100.0)
+    originalModelConfig = copy.deepcopy(modelConfig)
+
+    ModelTemplateCache.getTemplateKey(modelConfig)
+
+    self.assertEqual(modelConfig, originalModelConfig)
+
+
+  def testMissCreatesModelAndSavesTemplate(self, modelFactoryMock,
+                                           _multiEncoderMock):
+    modelConfig = _makeModelConfig(0.0, 100.0)
+    modelMock = modelFactoryMock.create.return_value
+
+    def saveModel(saveModelDir):
+      os.makedirs(saveModelDir)
+
+    modelMock.save.side_effect = saveModel
+
+    model = ModelTemplateCache(self.cacheDir).createModel(modelConfig)
+
+    self.assertIs(model, modelMock)
+    modelFactoryMock.create.assert_called_once_with(modelConfig=modelConfig)
+    self.assertFalse(modelFactoryMock.loadFromCheckpoint.called)
+
+    # Only the published template remains in the cache directory
+    self.assertEqual(os.listdir(self.cacheDir),
+                     [ModelTemplateCache.getTemplateKey(modelConfig)])
+
+
+  def testHitLoadsTemplateAndReplacesEncoders(self, modelFactoryMock,
+                                              multiEncoderMock):
+    modelConfig = _makeModelConfig(0.0, 100.0)
+    templateModelDir = os.path.join(
+      self.cacheDir,
+      ModelTemplateCache.getTemplateKey(_makeModelConfig(10.0, 20.0)),
+      ModelTemplateCache._TEMPLATE_MODEL_DIR_NAME)
+    os.makedirs(templateModelDir)
+
+    sensorMock = Mock()
+    sensorMock.encoder.getWidth.return_value = 1000
+    multiEncoderMock.return_value.getWidth.return_value = 1000
+
+    templateModelMock = modelFactoryMock.loadFromCheckpoint.return_value
+    templateModelMock._getSensorRegion.return_value.getSelf.return_value = (
+      sensorMock)
+
+    model = ModelTemplateCache(self.cacheDir).createModel(modelConfig)
+
+    self.assertIs(model, templateModelMock)
+    modelFactoryMock.loadFromCheckpoint.assert_called_once_with(
+      templateModelDir)
+    self.assertFalse(modelFactoryMock.create.called)
+
+    # The encoders were rebuilt from this model's own params
+    expectedEncoders = dict(
+      (name, params)
+      for name, params in modelConfig["modelParams"]["sensorParams"][
+        "encoders"].iteritems()
+      if params is not None)
+    multiEncoderMock.assert_any_call(expectedEncoders)
+    self.assertIs(sensorMock.encoder, multiEncoderMock.return_value)
+
+
+  def testHitWithDifferentEncoderWidthCreatesModel(self, modelFactoryMock,
+                                                   multiEncoderMock):
+    modelConfig = _makeModelConfig(0.0, 100.0)
+    os.makedirs(os.path.join(
+      self.cacheDir,
+      ModelTemplateCache.getTemplateKey(modelConfig),
+      ModelTemplateCache._TEMPLATE_MODEL_DIR_NAME))
+
+    sensorMock = Mock()
+    sensorMock.encoder.getWidth.return_value = 1000
+    multiEncoderMock.return_value.getWidth.return_value = 999
+
+    templateModelMock = modelFactoryMock.loadFromCheckpoint.return_value
+    templateModelMock._getSensorRegion.return_value.getSelf.return_value = (
+      sensorMock)
+
+    model = ModelTemplateCache(self.cacheDir).createModel(modelConfig)
+
+    self.assertIs(model, modelFactoryMock.create.return_value)
+    modelFactoryMock.create.assert_called_once_with(modelConfig=modelConfig)
+
+
+
+if __name__ == '__main__':
+  unittest.main()
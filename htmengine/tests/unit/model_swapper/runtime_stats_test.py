@@ -0,0 +1,241 @@
+# ----------------------------------------------------------------------
+# Numenta Platform for Intelligent Computing (NuPIC)
+# Copyright (C) 2015, Numenta, Inc.  Unless you have purchased from
+# Numenta, Inc. a separate commercial license for this software code, the
+# following terms and conditions apply:
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero Public License for more details.
+#
+# You should have received a copy of the GNU Affero Public License
+# along with this program.  If not, see http://www.gnu.org/licenses.
+#
+# http://numenta.org/licenses/
+# ----------------------------------------------------------------------
+
+"""
+Unit tests for the Model Swapper's runtime statistics
+"""
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from htmengine.model_swapper.runtime_stats import (
+  ModelRunStats,
+  ModelRuntimeStats,
+  RuntimeStatsAggregator,
+  RuntimeStatsReader)
+
+from nta.utils.logging_support_raw import LoggingSupport
+
+
+
+def setUpModule():
+  LoggingSupport.initTestApp()
+
+
+
+class ModelRuntimeStatsTestCase(unittest.TestCase):
+  """ ModelRunStats and ModelRuntimeStats unit tests """
+
+
+  def testRunReportsAccumulate(self):
+    runStats = ModelRunStats()
+    runStats.numRowsProcessed = 10
+    runStats.processSec = 2.0
+    runStats.checkpointBytes = 100
+
+    modelStats = ModelRuntimeStats()
+    modelStats.addRunReport(runStats.toReport())
+    modelStats.addRunReport(runStats.toReport())
+
+    self.assertEqual(modelStats.numRowsProcessed, 20)
+    self.assertEqual(modelStats.checkpointBytes, 200)
+    self.assertAlmostEqual(modelStats.rowsPerSec, 5.0)
+
+
+  def testUnknownReportFieldsAreIgnored(self):
+    modelStats = ModelRuntimeStats()
+    modelStats.addRunReport(dict(numLoads=1, someFutureField=5))
+
+    self.assertEqual(modelStats.numLoads, 1)
+    self.assertNotIn("someFutureField", modelStats.toDict())
+
+
+  def testRowsPerSecWithoutProcessing(self):
+    self.assertEqual(ModelRuntimeStats().rowsPerSec, 0.0)
+
+
+
+class RuntimeStatsAggregatorTestCase(unittest.TestCase):
+  """ RuntimeStatsAggregator unit tests """
+
+
+  def setUp(self):
+    self._tempDir = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, self._tempDir)
+    self._statsFilePath = os.path.join(self._tempDir, "stats.json")
+
+
+  def testSnapshotAggregatesModels(self):
+    aggregator = RuntimeStatsAggregator()
+
+    aggregator.noteModelStarted("a")
+    aggregator.noteRunReport("a", dict(numRowsProcessed=6, processSec=3.0))
+    aggregator.noteModelDone("a", exitStatus=0, runSec=4.0)
+    aggregator.notePreemption("a")
+
+    aggregator.noteWait("b", 1.0)
+    aggregator.noteWait("b", 3.0)
+    aggregator.noteModelStarted("b")
+    aggregator.noteModelDone("b", exitStatus=1, runSec=0.5)
+
+    snapshot = aggregator.getSnapshot(now=1000.0)
+
+    self.assertEqual(snapshot["version"], RuntimeStatsAggregator.FORMAT_VERSION)
+    self.assertEqual(snapshot["timestamp"], 1000.0)
+    self.assertEqual(sorted(snapshot["models"]), ["a", "b"])
+
+    statsA = snapshot["models"]["a"]
+    self.assertEqual(statsA["numRuns"], 1)
+    self.assertEqual(statsA["numFailedRuns"], 0)
+    self.assertEqual(statsA["numPreemptions"], 1)
+    self.assertAlmostEqual(statsA["rowsPerSec"], 2.0)
+
+    statsB = snapshot["models"]["b"]
+    self.assertEqual(statsB["numFailedRuns"], 1)
+    self.assertEqual(statsB["numWaits"], 2)
+    self.assertAlmostEqual(statsB["waitSec"], 4.0)
+    self.assertAlmostEqual(statsB["maxWaitSec"], 3.0)
+
+    totals = snapshot["totals"]
+    self.assertEqual(totals["numRuns"], 2)
+    self.assertEqual(totals["numRowsProcessed"], 6)
+    self.assertAlmostEqual(totals["runSec"], 4.5)
+    self.assertAlmostEqual(totals["maxWaitSec"], 3.0)
+    self.assertEqual(set(totals), set(ModelRuntimeStats.FIELDS + ("rowsPerSec",)))
+
+
+  def testExportWritesStatsFile(self):
+    aggregator = RuntimeStatsAggregator(statsFilePath=self._statsFilePath)
+    aggregator.noteModelStarted("a")
+
+    aggregator.export(now=1000.0)
+
+    with open(self._statsFilePath) as fileObj:
+      stats = json.load(fileObj)
+
+    self.assertEqual(stats, aggregator.getSnapshot(now=1000.0))
+    self.assertEqual(os.listdir(self._tempDir), ["stats.json"])
+
+
+  def testExportIfDueHonorsInterval(self):
+    aggregator = RuntimeStatsAggregator(statsFilePath=self._statsFilePath,
+                                        exportIntervalSec=60)
+
+    aggregator.exportIfDue(now=1000.0)
+    self.assertTrue(os.path.exists(self._statsFilePath))
+
+    aggregator.noteModelStarted("a")
+
+    aggregator.exportIfDue(now=1059.0)
+    with open(self._statsFilePath) as fileObj:
+      self.assertEqual(json.load(fileObj)["models"], {})
+
+    aggregator.exportIfDue(now=1060.0)
+    with open(self._statsFilePath) as fileObj:
+      self.assertEqual(sorted(json.load(fileObj)["models"]), ["a"])
+
+
+  def testExportDisabledWithoutStatsFile(self):
+    aggregator = RuntimeStatsAggregator(statsFilePath="")
+    aggregator.noteModelStarted("a")
+
+    aggregator.exportIfDue(now=1000.0)
+    aggregator.export()
+
+    self.assertEqual(os.listdir(self._tempDir), [])
+
+
+  def testExportFailureIsNotRaised(self):
+    aggregator = RuntimeStatsAggregator(
+      statsFilePath=os.path.join(self._tempDir, "missing", "stats.json"))
+
+    aggregator.export()
+
+    self.assertEqual(os.listdir(self._tempDir), [])
+
+
+
+class RuntimeStatsReaderTestCase(unittest.TestCase):
+  """ RuntimeStatsReader unit tests """
+
+
+  def setUp(self):
+    self._tempDir = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, self._tempDir)
+    self._statsFilePath = os.path.join(self._tempDir, "stats.json")
+
+
+  def testRowsPerSecFallsBackToTotals(self):
+    aggregator = RuntimeStatsAggregator(statsFilePath=self._statsFilePath)
+    aggregator.noteRunReport("a", dict(numRowsProcessed=10, processSec=1.0))
+    aggregator.noteRunReport("b", dict(numRowsProcessed=30, processSec=1.0))
+    aggregator.noteModelStarted("c")
+
+    reader = RuntimeStatsReader(self._statsFilePath)
+
+    # Not exported yet
+    self.assertIsNone(reader.getSnapshot())
+    self.assertIsNone(reader.getRowsPerSec("a"))
+
+    aggregator.export(now=1000.0)
+
+    self.assertAlmostEqual(reader.getRowsPerSec("a"), 10.0)
+    self.assertAlmostEqual(reader.getRowsPerSec("b"), 30.0)
+    self.assertAlmostEqual(reader.getRowsPerSec("c"), 20.0)
+    self.assertAlmostEqual(reader.getRowsPerSec("unknown"), 20.0)
+
+
+  def testStatsFileIsReadWhenChanged(self):
+    aggregator = RuntimeStatsAggregator(statsFilePath=self._statsFilePath)
+    aggregator.export(now=1000.0)
+
+    reader = RuntimeStatsReader(self._statsFilePath)
+    self.assertEqual(reader.getSnapshot()["timestamp"], 1000.0)
+    self.assertIsNone(reader.getRowsPerSec("a"))
+
+    aggregator.noteRunReport("a", dict(numRowsProcessed=10, processSec=1.0))
+    aggregator.export(now=1060.0)
+    os.utime(self._statsFilePath, (1060.0, 1060.0))
+
+    self.assertEqual(reader.getSnapshot()["timestamp"], 1060.0)
+    self.assertAlmostEqual(reader.getRowsPerSec("a"), 10.0)
+
+
+  def testUnreadableStatsFileIsIgnored(self):
+    with open(self._statsFilePath, "w") as fileObj:
+      fileObj.write("{")
+
+    self.assertIsNone(RuntimeStatsReader(self._statsFilePath).getSnapshot())
+
+    with open(self._statsFilePath, "w") as fileObj:
+      json.dump(dict(version=RuntimeStatsAggregator.FORMAT_VERSION + 1),
+                fileObj)
+
+    self.assertIsNone(RuntimeStatsReader(self._statsFilePath).getSnapshot())
+    self.assertIsNone(RuntimeStatsReader("").getSnapshot())
+
+
+
+if __name__ == "__main__":
+  unittest.main()
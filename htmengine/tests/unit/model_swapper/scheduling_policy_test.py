@@ -0,0 +1,237 @@
+# ----------------------------------------------------------------------
+# Numenta Platform for Intelligent Computing (NuPIC)
+# Copyright (C) 2015, Numenta, Inc.  Unless you have purchased from
+# Numenta, Inc. a separate commercial license for this software code, the
+# following terms and conditions apply:
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero Public License for more details.
+#
+# You should have received a copy of the GNU Affero Public License
+# along with this program.  If not, see http://www.gnu.org/licenses.
+#
+# http://numenta.org/licenses/
+# ----------------------------------------------------------------------
+
+"""
+Unit tests for the Model Swapper's scheduling policies
+"""
+
+from collections import namedtuple
+import unittest
+
+from nta.utils.test_utils.config_test_utils import ConfigAttributePatch
+
+from htmengine.model_swapper import ModelSwapperConfig
+from htmengine.model_swapper.scheduling_policy import (
+  FIFOSchedulingPolicy,
+  HeapSchedulingPolicy,
+  SchedulingPolicyBase)
+
+
+
+# Disable warning: Access to a protected member
+# pylint: disable=W0212
+
+
+
+_RunningModel = namedtuple("_RunningModel", "slotIndex startTime timestamp")
+
+
+
+class SchedulingPolicyFactoryTestCase(unittest.TestCase):
+  """ SchedulingPolicyBase factory unit tests """
+
+
+  def testCreateDefaultPolicy(self):
+    policy = SchedulingPolicyBase.createSchedulingPolicy(ModelSwapperConfig())
+    self.assertIsInstance(policy, FIFOSchedulingPolicy)
+
+
+  @ConfigAttributePatch(
+    ModelSwapperConfig.CONFIG_NAME,
+    ModelSwapperConfig().baseConfigDir,
+    (("swap_controller", "scheduling_policy", "heap"),
+     ("swap_controller", "backlog_penalty_sec", "2.5"),
+     ("swap_controller", "max_backlog_penalty_sec", "90"),
+     ("swap_controller", "min_run_quantum_sec", "30")))
+  def testCreateHeapPolicy(self):
+    policy = SchedulingPolicyBase.createSchedulingPolicy(ModelSwapperConfig())
+    self.assertIsInstance(policy, HeapSchedulingPolicy)
+    self.assertEqual(policy._backlogPenaltySec, 2.5)
+    self.assertEqual(policy._maxBacklogPenaltySec, 90)
+    self.assertEqual(policy._minRunQuantumSec, 30)
+
+
+
+class FIFOSchedulingPolicyTestCase(unittest.TestCase):
+  """ FIFOSchedulingPolicy unit tests """
+
+
+  def testWaitingModelsRunInArrivalOrder(self):
+    policy = FIFOSchedulingPolicy()
+
+    policy.addWaitingModel("a", now=100)
+    policy.addWaitingModel("b", now=101)
+    policy.noteNewInput("b", now=102)
+    policy.addWaitingModel("c", now=103)
+
+    self.assertEqual(len(policy), 3)
+    self.assertIn("b", policy)
+    self.assertEqual(list(policy), ["a", "b", "c"])
+
+    self.assertEqual(policy.peekNextModel(), "a")
+    self.assertEqual(policy.peekNextModels(2), ("a", "b"))
+    self.assertEqual(policy.popNextModel(now=110), ("a", 10))
+    self.assertEqual(policy.popNextModel(now=110), ("b", 9))
+    self.assertEqual(policy.popNextModel(now=110), ("c", 7))
+    self.assertIsNone(policy.peekNextModel())
+    self.assertFalse(policy)
+
+
+  def testPreemptsLeastRecentlyActiveModel(self):
+    policy = FIFOSchedulingPolicy()
+
+    running = [_RunningModel(slotIndex=0, startTime=100, timestamp=200),
+               _RunningModel(slotIndex=1, startTime=150, timestamp=160)]
+
+    candidates = policy.rankPreemptionCandidates(running, now=201)
+    self.assertEqual([c.slotIndex for c in candidates], [1, 0])
+
+
+
+class HeapSchedulingPolicyTestCase(unittest.TestCase):
+  """ HeapSchedulingPolicy unit tests """
+
+
+  def testBacklogDelaysWaitingModel(self):
+    policy = HeapSchedulingPolicy(backlogPenaltySec=1, maxBacklogPenaltySec=60,
+                                  minRunQuantumSec=10)
+
+    # "big" is the first to arrive, but accumulates a large backlog
+    policy.addWaitingModel("big", now=100)
+    for i in xrange(5):
+      policy.noteNewInput("big", now=100 + i)
+
+    policy.addWaitingModel("small1", now=101)
+    policy.addWaitingModel("small2", now=102)
+    policy.addWaitingModel("late", now=110)
+
+    self.assertEqual(list(policy), ["small1", "small2", "big", "late"])
+    self.assertEqual(policy.peekNextModels(3), ("small1", "small2", "big"))
+
+    self.assertEqual(policy.popNextModel(now=120), ("small1", 19))
+    self.assertEqual(policy.popNextModel(now=120), ("small2", 18))
+    self.assertEqual(policy.popNextModel(now=120), ("big", 20))
+    self.assertEqual(policy.popNextModel(now=120), ("late", 10))
+    self.assertFalse(policy)
+
+    # Heap entries superseded by new input are gone along with the models
+    self.assertFalse(policy._entryMap)
+    self.assertFalse(policy._backlogMap)
+
+
+  def testReportedBacklogReplacesNotificationCount(self):
+    policy = HeapSchedulingPolicy(backlogPenaltySec=1, maxBacklogPenaltySec=60,
+                                  minRunQuantumSec=10)
+
+    # "leftover" was preempted with 10 pending batches; "coalesced" received a
+    # single notification for 5 batches
+    policy.addWaitingModel("leftover", now=100, backlog=10)
+    policy.addWaitingModel("coalesced", now=101)
+    policy.noteNewInput("coalesced", now=102, backlog=5)
+    policy.addWaitingModel("fresh", now=103, backlog=1)
+
+    self.assertEqual(list(policy), ["fresh", "coalesced", "leftover"])
+
+    # A notification implies at least one pending batch
+    policy.noteNewInput("fresh", now=104, backlog=0)
+    self.assertEqual(policy._backlogMap["fresh"], 1)
+
+
+  def testSteadilyFedModelIsNotStarved(self):
+    policy = HeapSchedulingPolicy(backlogPenaltySec=1, maxBacklogPenaltySec=30,
+                                  minRunQuantumSec=10)
+
+    # "busy" keeps receiving two input batches per second while waiting, and a
+    # fresh model arrives and one model runs every second
+    policy.addWaitingModel("busy", now=100)
+
+    for now in xrange(101, 1000):
+      policy.noteNewInput("busy", now=now)
+      policy.noteNewInput("busy", now=now)
+      policy.addWaitingModel("fresh%s" % (now,), now=now)
+
+      modelID, waitSec = policy.popNextModel(now=now)
+      if modelID == "busy":
+        break
+
+    # The backlog delayed "busy" only by the maximum penalty
+    self.assertEqual(modelID, "busy")
+    self.assertEqual(waitSec, 30)
+
+
+  def testEqualKeysRunInArrivalOrder(self):
+    policy = HeapSchedulingPolicy(backlogPenaltySec=1, maxBacklogPenaltySec=60,
+                                  minRunQuantumSec=10)
+
+    for modelID in ("a", "b", "c"):
+      policy.addWaitingModel(modelID, now=100)
+
+    self.assertEqual([policy.popNextModel(now=100)[0] for _ in xrange(3)],
+                     ["a", "b", "c"])
+
+
+  def testStaleEntriesAreCompacted(self):
+    policy = HeapSchedulingPolicy(backlogPenaltySec=1, maxBacklogPenaltySec=60,
+                                  minRunQuantumSec=10)
+
+    policy.addWaitingModel("a", now=100)
+    for i in xrange(100):
+      policy.noteNewInput("a", now=100 + i)
+
+    self.assertLessEqual(len(policy._heap),
+                         policy._MAX_STALE_ENTRIES_RATIO + 1)
+    self.assertEqual(policy.popNextModel(now=200), ("a", 100))
+
+
+  def testPreemptsLongestRunningModelAfterQuantum(self):
+    policy = HeapSchedulingPolicy(backlogPenaltySec=1, maxBacklogPenaltySec=60,
+                                  minRunQuantumSec=10)
+
+    running = [_RunningModel(slotIndex=0, startTime=105, timestamp=200),
+               _RunningModel(slotIndex=1, startTime=100, timestamp=100),
+               _RunningModel(slotIndex=2, startTime=108, timestamp=100)]
+
+    # No model has had its run quantum yet
+    self.assertEqual(policy.rankPreemptionCandidates(running, now=109), [])
+    self.assertEqual(policy.getPreemptionDeferralSec(running, now=109), 1)
+
+    candidates = policy.rankPreemptionCandidates(running, now=116)
+    self.assertEqual([c.slotIndex for c in candidates], [1, 0])
+
+
+  def testWaitTimeStats(self):
+    policy = HeapSchedulingPolicy(backlogPenaltySec=1, maxBacklogPenaltySec=60,
+                                  minRunQuantumSec=10)
+
+    policy.addWaitingModel("a", now=100)
+    policy.popNextModel(now=104)
+    policy.addWaitingModel("a", now=200)
+    policy.popNextModel(now=202)
+
+    stats = policy.waitTimeStats["a"]
+    self.assertEqual(stats.numWaits, 2)
+    self.assertEqual(stats.meanWaitSec, 3)
+    self.assertEqual(stats.maxWaitSec, 4)
+
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -34,9 +34,11 @@ import unittest
 from mock import Mock, patch
 
 
+from htmengine.model_swapper import ModelSwapperConfig
 from htmengine.model_swapper import slot_agent
 
 from nta.utils.logging_support_raw import LoggingSupport
+from nta.utils.test_utils.config_test_utils import ConfigAttributePatch
 
 
 
@@ -106,6 +108,98 @@ class SlotAgentTestCase(unittest.TestCase):
     self.assertEqual(modelRunnerProxyMock.stopGracefully.call_count, 1)
 
 
+  @ConfigAttributePatch(
+    ModelSwapperConfig.CONFIG_NAME,
+    ModelSwapperConfig().baseConfigDir,
+    (("resident_model_runner", "enabled", "false"),
+     ("swap_controller", "pin_slot_cpus", "true")))
+  @patch.object(slot_agent, "psutil", NUM_CPUS=4)
+  @patch.object(
+    slot_agent, "ModelRunnerProxy", autospec=True,
+    stopGracefully=Mock(spec_set=slot_agent.ModelRunnerProxy.stopGracefully))
+  def testModelRunnerIsPinnedToSlotCpu(self, modelRunnerProxyClassMock,
+                                       _psutilMock):
+    modelFinishedQ = Queue.Queue()
+
+    modelRunnerProxyMock = modelRunnerProxyClassMock.return_value
+    modelRunnerProxyMock.stopGracefully.side_effect = lambda: 0
+
+    sa = slot_agent.SlotAgent(slotID=5)
+
+    sa.startModel(
+      modelID="abc",
+      modelFinishedCallback=modelFinishedQ.put)
+    sa.stopModel()
+    self.assertEqual(0, modelFinishedQ.get(timeout=5))
+    sa.releaseSlot()
+
+    t = threading.Thread(target=sa.close)
+    t.setDaemon(True)
+    t.start()
+    t.join(timeout=5)
+    self.assertFalse(t.isAlive())
+
+    self.assertEqual(modelRunnerProxyClassMock.call_count, 1)
+    self.assertEqual(modelRunnerProxyClassMock.call_args[1]["cpu"], 1)
+
+
+  @patch.object(slot_agent, "psutil")
+  def testFailureToPinProcessIsIgnored(self, psutilMock):
+    psutilMock.Error = Exception
+    psutilMock.Process.return_value.set_cpu_affinity.side_effect = (
+      OSError("not permitted"))
+
+    slot_agent._pinProcessToCpu(pid=123, cpu=2, logger=Mock())
+
+    psutilMock.Process.assert_called_once_with(123)
+    psutilMock.Process.return_value.set_cpu_affinity.assert_called_once_with(
+      [2])
+
+
+  @ConfigAttributePatch(
+    ModelSwapperConfig.CONFIG_NAME,
+    ModelSwapperConfig().baseConfigDir,
+    (("resident_model_runner", "enabled", "false"),))
+  @patch.object(
+    slot_agent, "ModelRunnerProxy", autospec=True,
+    stopGracefully=Mock(spec_set=slot_agent.ModelRunnerProxy.stopGracefully))
+  def testRuntimeStatsAreReportedBeforeModelFinished(
+      self, modelRunnerProxyClassMock):
+    eventQ = Queue.Queue()
+
+    modelRunnerProxyMock = modelRunnerProxyClassMock.return_value
+    modelRunnerProxyMock.stopGracefully.side_effect = lambda: 0
+
+    def modelRunnerProxyConstructorMock(modelID, onTermination, logger,
+                                         onMemoryReport=None, cpu=None,
+                                         onRuntimeStatsReport=None):
+      # The proxy delivers the reports of ModelRunner before its termination
+      onRuntimeStatsReport(dict(numRowsProcessed=3, processSec=0.5))
+      onTermination()
+      return modelRunnerProxyMock
+
+    modelRunnerProxyClassMock.side_effect = modelRunnerProxyConstructorMock
+
+    sa = slot_agent.SlotAgent(slotID=1)
+
+    sa.startModel(
+      modelID="abc",
+      modelFinishedCallback=lambda exitStatus: eventQ.put(
+        ("finished", exitStatus)),
+      runtimeStatsCallback=lambda report: eventQ.put(("stats", report)))
+
+    self.assertEqual(eventQ.get(timeout=5),
+                     ("stats", dict(numRowsProcessed=3, processSec=0.5)))
+    self.assertEqual(eventQ.get(timeout=5), ("finished", 0))
+    sa.releaseSlot()
+
+    t = threading.Thread(target=sa.close)
+    t.setDaemon(True)
+    t.start()
+    t.join(timeout=5)
+    self.assertFalse(t.isAlive())
+
+
   @patch.object(
     slot_agent, "ModelRunnerProxy", autospec=True,
     stopGracefully=Mock(spec_set=slot_agent.ModelRunnerProxy.stopGracefully))
@@ -120,7 +214,9 @@ class SlotAgentTestCase(unittest.TestCase):
     modelRunnerProxyMock = modelRunnerProxyClassMock.return_value
     modelRunnerProxyMock.stopGracefully.side_effect = lambda: 99
 
-    def modelRunnerProxyConstructorMock(modelID, onTermination, logger):
+    def modelRunnerProxyConstructorMock(modelID, onTermination, logger,
+                                         onMemoryReport=None, cpu=None,
+                                         onRuntimeStatsReport=None):
       onTermination()
       return modelRunnerProxyMock
 
@@ -150,6 +246,56 @@ class SlotAgentTestCase(unittest.TestCase):
     self.assertEqual(modelRunnerProxyMock.stopGracefully.call_count, 1)
 
 
+  @ConfigAttributePatch(
+    ModelSwapperConfig.CONFIG_NAME,
+    ModelSwapperConfig().baseConfigDir,
+    (("resident_model_runner", "enabled", "true"),))
+  @patch.object(slot_agent, "ModelRunnerProxy", autospec=True,
+                side_effect=RuntimeError(
+                  "ModelRunnerProxy constructor should not have been called"))
+  @patch.object(slot_agent, "ResidentModelRunnerProxy", autospec=True)
+  def testResidentModelRunnerRunsSuccessiveModels(
+      self, residentProxyClassMock, _modelRunnerProxyClassMock):
+    modelFinishedQ = Queue.Queue()
+
+    def modelFinishedCallback(modelID, exitStatus):
+      modelFinishedQ.put((modelID, exitStatus))
+
+    # Configure ResidentModelRunnerProxy instance mock
+    residentProxyMock = residentProxyClassMock.return_value
+    residentProxyMock.isAlive = True
+    residentProxyMock.stopGracefully.side_effect = lambda: 0
+
+    def startModelMock(modelID, onTermination, onMemoryReport=None,
+                       onRuntimeStatsReport=None, onEvictionReport=None):
+      # Complete the model right away as if it ran out of input
+      onTermination()
+      return residentProxyMock
+
+    residentProxyMock.startModel.side_effect = startModelMock
+
+    sa = slot_agent.SlotAgent(slotID=1)
+
+    for modelID in ("abc", "def"):
+      sa.startModel(
+        modelID=modelID,
+        modelFinishedCallback=partial(modelFinishedCallback, modelID))
+      self.assertEqual((modelID, 0), modelFinishedQ.get(timeout=5))
+      sa.releaseSlot()
+
+    t = threading.Thread(target=sa.close)
+    t.setDaemon(True)
+    t.start()
+    t.join(timeout=5)
+    self.assertFalse(t.isAlive())
+
+    # Both models ran in the same resident ModelRunner process
+    self.assertEqual(residentProxyClassMock.call_count, 1)
+    self.assertEqual(residentProxyMock.startModel.call_count, 2)
+    self.assertEqual(residentProxyMock.stopGracefully.call_count, 2)
+    residentProxyMock.close.assert_called_once_with()
+
+
   @patch.object(
     slot_agent, "ModelRunnerProxy", autospec=True,
     stopGracefully=Mock(spec_set=slot_agent.ModelRunnerProxy.stopGracefully))
@@ -192,7 +338,9 @@ class SlotAgentTestCase(unittest.TestCase):
     # Create mock ModelRunnerProxy factory
     modelRunnerProxyMocks = []
     def createModelRunnerProxyMock(
-      modelID, onTermination, logger):  # pylint: disable=W0613
+      modelID, onTermination, logger,
+      onMemoryReport=None, cpu=None,
+      onRuntimeStatsReport=None):  # pylint: disable=W0613
       modelRunnerProxyMock = Mock(
         spec_set=slot_agent.ModelRunnerProxy,
         stopGracefully=Mock(
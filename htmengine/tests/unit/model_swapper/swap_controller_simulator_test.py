@@ -0,0 +1,190 @@
+# ----------------------------------------------------------------------
+# Numenta Platform for Intelligent Computing (NuPIC)
+# Copyright (C) 2015, Numenta, Inc.  Unless you have purchased from
+# Numenta, Inc. a separate commercial license for this software code, the
+# following terms and conditions apply:
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero Public License for more details.
+#
+# You should have received a copy of the GNU Affero Public License
+# along with this program.  If not, see http://www.gnu.org/licenses.
+#
+# http://numenta.org/licenses/
+# ----------------------------------------------------------------------
+
+"""
+Unit tests for the Model Swapper's SwapControllerSimulator
+"""
+
+import unittest
+
+
+from htmengine.model_swapper import ModelSwapperConfig
+from htmengine.model_swapper.swap_controller_simulator import (
+  ModelCosts,
+  SwapControllerSimulator,
+  WorkloadEvent)
+
+from nta.utils.logging_support_raw import LoggingSupport
+from nta.utils.test_utils.config_test_utils import ConfigAttributePatch
+
+
+
+def setUpModule():
+  LoggingSupport.initTestApp()
+
+
+
+@ConfigAttributePatch(
+  ModelSwapperConfig.CONFIG_NAME,
+  ModelSwapperConfig().baseConfigDir,
+  (("swap_controller", "scheduling_policy", "fifo"),
+   ("swap_controller", "memory_budget_mb", "0"),
+   ("swap_controller", "prefetch_depth", "0"),
+   ("resident_model_runner", "enabled", "false")))
+class SwapControllerSimulatorTestCase(unittest.TestCase):
+  """ ModelSwapper's SwapControllerSimulator unit tests """
+
+
+  def testPreemptionLatencyAndUtilization(self):
+    simulator = SwapControllerSimulator(
+      concurrency=1,
+      defaultCosts=ModelCosts(loadSec=1.0, runSecPerBatch=0.1, saveSec=0.5),
+      batchesPerCheckpoint=10)
+
+    report = simulator.run([
+      WorkloadEvent(timestamp=0.0, modelID="a", numBatches=2),
+      WorkloadEvent(timestamp=0.5, modelID="b", numBatches=1),
+    ])
+
+    # "a" is asked to stop as soon as "b" waits, but finishes its run of
+    # batches and checkpoint first
+    self.assertEqual(report.numPreemptions, 1)
+    self.assertEqual(report.swapInsByModel, dict(a=1, b=1))
+
+    latenciesA = report.latenciesByModel["a"]
+    self.assertEqual(len(latenciesA), 2)
+    self.assertAlmostEqual(latenciesA[0], 1.1)
+    self.assertAlmostEqual(latenciesA[1], 1.2)
+
+    # "b" starts after "a" checkpoints at 1.7s
+    latenciesB = report.latenciesByModel["b"]
+    self.assertEqual(len(latenciesB), 1)
+    self.assertAlmostEqual(latenciesB[0], 2.3)
+
+    self.assertAlmostEqual(report.durationSec, 3.3)
+    self.assertAlmostEqual(report.slotUtilization, 1.0)
+
+    p50, p99 = report.getLatencyPercentiles((50, 99))
+    self.assertAlmostEqual(p50, 1.2)
+    self.assertAlmostEqual(p99, 2.3)
+
+    # SwapController's runtime statistics combine the ModelRunner reports with
+    # its own observations
+    statsA = report.runtimeStats["models"]["a"]
+    self.assertEqual(statsA["numRuns"], 1)
+    self.assertEqual(statsA["numPreemptions"], 1)
+    self.assertEqual(statsA["numWaits"], 0)
+    self.assertAlmostEqual(statsA["loadSec"], 1.0)
+    self.assertAlmostEqual(statsA["processSec"], 0.2)
+    self.assertEqual(statsA["numCheckpoints"], 1)
+    self.assertAlmostEqual(statsA["checkpointSec"], 0.5)
+    self.assertAlmostEqual(statsA["runSec"], 1.7)
+
+    statsB = report.runtimeStats["models"]["b"]
+    self.assertEqual(statsB["numPreemptions"], 0)
+    self.assertEqual(statsB["numWaits"], 1)
+    self.assertAlmostEqual(statsB["waitSec"], 1.2)
+    self.assertAlmostEqual(statsB["runSec"], 1.6)
+
+    totals = report.runtimeStats["totals"]
+    self.assertEqual(totals["numRuns"], 2)
+    self.assertAlmostEqual(totals["maxWaitSec"], 1.2)
+
+
+  def testInputForRunningModelDoesNotSwap(self):
+    simulator = SwapControllerSimulator(
+      concurrency=2,
+      defaultCosts=ModelCosts(loadSec=1.0, runSecPerBatch=0.1, saveSec=0.5),
+      modelCosts=dict(slow=ModelCosts(loadSec=1.0, runSecPerBatch=2.0,
+                                      saveSec=0.5)),
+      batchesPerCheckpoint=1)
+
+    report = simulator.run([
+      WorkloadEvent(timestamp=0.0, modelID="slow", numBatches=1),
+      WorkloadEvent(timestamp=1.5, modelID="slow", numBatches=1),
+      WorkloadEvent(timestamp=0.0, modelID="fast", numBatches=1),
+    ])
+
+    self.assertEqual(report.numPreemptions, 0)
+    self.assertEqual(report.swapInsByModel, dict(slow=1, fast=1))
+    self.assertEqual(len(report.latenciesByModel["slow"]), 2)
+
+    # The second batch of "slow" is processed after the first is checkpointed:
+    # 1.0 load + 2.0 run + 0.5 save + 2.0 run
+    self.assertAlmostEqual(report.latenciesByModel["slow"][1], 5.5 - 1.5)
+    self.assertAlmostEqual(report.durationSec, 6.0)
+
+
+  def testSlotAffinityYieldsWarmStarts(self):
+    trace = [
+      WorkloadEvent(timestamp=0.0, modelID="a", numBatches=1),
+      WorkloadEvent(timestamp=0.0, modelID="b", numBatches=1),
+      WorkloadEvent(timestamp=5.0, modelID="a", numBatches=1),
+      WorkloadEvent(timestamp=5.0, modelID="b", numBatches=1),
+    ]
+
+    def simulate():
+      return SwapControllerSimulator(
+        concurrency=2,
+        defaultCosts=ModelCosts(loadSec=1.0, runSecPerBatch=0.1, saveSec=0.1,
+                                warmLoadSec=0.1)).run(trace)
+
+    # Without affinity, each model restarts in the slot freed by the other one
+    report = simulate()
+    self.assertEqual(report.numWarmStarts, 0)
+    self.assertAlmostEqual(report.meanSwapInSec, 1.0)
+
+    with ConfigAttributePatch(
+        ModelSwapperConfig.CONFIG_NAME,
+        ModelSwapperConfig().baseConfigDir,
+        (("swap_controller", "slot_affinity", "true"),)):
+      report = simulate()
+
+    self.assertEqual(report.numWarmStarts, 2)
+    self.assertAlmostEqual(report.warmStartRate, 1.0)
+    self.assertAlmostEqual(report.meanSwapInSec, (1.0 + 1.0 + 0.1 + 0.1) / 4)
+
+
+  def testRunsAreDeterministic(self):
+    trace = [WorkloadEvent(timestamp=i * 0.3, modelID="m%d" % (i % 7,),
+                           numBatches=1 + i % 3)
+             for i in xrange(50)]
+
+    simulator = SwapControllerSimulator(
+      concurrency=3,
+      defaultCosts=ModelCosts(loadSec=0.7, runSecPerBatch=0.05, saveSec=0.2),
+      batchesPerCheckpoint=2)
+
+    report1 = simulator.run(trace)
+    report2 = simulator.run(trace)
+
+    self.assertEqual(report1.latenciesByModel, report2.latenciesByModel)
+    self.assertEqual(report1.swapInsByModel, report2.swapInsByModel)
+    self.assertEqual(report1.numPreemptions, report2.numPreemptions)
+    self.assertEqual(report1.durationSec, report2.durationSec)
+    self.assertEqual(sum(len(latencies)
+                         for latencies in report1.latenciesByModel.values()),
+                     sum(event.numBatches for event in trace))
+
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -37,11 +37,13 @@ import mock
 from mock import Mock, MagicMock, patch
 
 
+from htmengine.model_swapper import ModelSwapperConfig
 from htmengine.model_swapper import model_swapper_interface
 from htmengine.model_swapper import swap_controller
 from htmengine.model_swapper.swap_controller import SwapController
 
 from nta.utils.logging_support_raw import LoggingSupport
+from nta.utils.test_utils.config_test_utils import ConfigAttributePatch
 
 
 
@@ -195,7 +197,10 @@ class _DummySlotAgent(object):
       self._stopModel(doCallback=False)
 
 
-  def startModel(self, modelID, modelFinishedCallback):
+  def startModel(self, modelID, modelFinishedCallback,
+                 memoryReportCallback=None,
+                 runtimeStatsCallback=None,
+                 evictionReportCallback=None):  # pylint: disable=W0613
     self.numStartModelCalls += 1
     assert self.numCloseCalls == 0
     assert self.modelID is None, repr(self.modelID)
@@ -624,6 +629,328 @@ class TestSwapController(unittest.TestCase):
     self.assertIsNone(runResult)
 
 
+  @ConfigAttributePatch(
+    ModelSwapperConfig.CONFIG_NAME,
+    ModelSwapperConfig().baseConfigDir,
+    (("resident_model_runner", "enabled", "true"),))
+  @patch.multiple(swap_controller, autospec=True,
+                  ModelSwapperInterface=mock.DEFAULT,
+                  SlotAgent=mock.DEFAULT)
+  def testModelIsAssignedToSlotThatRanItLast(self, **kwargs):
+    # With resident ModelRunners, a model should be assigned to the slot that
+    # ran it last when that slot is free
+    kwargs["ModelSwapperInterface"].return_value.modelInputPending. \
+      return_value = False
+
+    sc = SwapController(concurrency=3)
+
+    def getModelSlot(modelID):
+      return sc._runningModelsMap[modelID].slotIndex
+
+    def completeModel(modelID):
+      sc._handleModelDoneNotifyEvent(
+        method=SwapController._MODEL_DONE_NOTIFY_METHOD, modelID=modelID,
+        exitStatus=0, endTime=time.time())
+
+    sc._assignModelToFreeSlot("a")
+    slotOfA = getModelSlot("a")
+    sc._assignModelToFreeSlot("b")
+    slotOfB = getModelSlot("b")
+
+    completeModel("a")
+    completeModel("b")
+
+    # Without affinity, the most-recently-freed slot (that of "b") would have
+    # been assigned
+    sc._assignModelToFreeSlot("a")
+    self.assertEqual(getModelSlot("a"), slotOfA)
+
+    sc._assignModelToFreeSlot("b")
+    self.assertEqual(getModelSlot("b"), slotOfB)
+
+
+  @ConfigAttributePatch(
+    ModelSwapperConfig.CONFIG_NAME,
+    ModelSwapperConfig().baseConfigDir,
+    (("resident_model_runner", "enabled", "false"),
+     ("swap_controller", "slot_affinity", "true")))
+  @patch.multiple(swap_controller, autospec=True,
+                  ModelSwapperInterface=mock.DEFAULT,
+                  SlotAgent=mock.DEFAULT)
+  def testSlotAffinityFallbackSparesSlotOfWaitingModel(self, **kwargs):
+    # With slot affinity, a model without a free slot of its own should not
+    # take the slot that last ran a waiting model
+    kwargs["ModelSwapperInterface"].return_value.modelInputPending. \
+      return_value = False
+
+    sc = SwapController(concurrency=3)
+
+    def getModelSlot(modelID):
+      return sc._runningModelsMap[modelID].slotIndex
+
+    def completeModel(modelID):
+      sc._handleModelDoneNotifyEvent(
+        method=SwapController._MODEL_DONE_NOTIFY_METHOD, modelID=modelID,
+        exitStatus=0, endTime=time.time())
+
+    sc._assignModelToFreeSlot("a")
+    slotOfA = getModelSlot("a")
+    sc._assignModelToFreeSlot("b")
+    slotOfB = getModelSlot("b")
+    sc._assignModelToFreeSlot("c")
+
+    completeModel("b")
+    completeModel("a")
+
+    sc._waitingModels.addWaitingModel("a", time.time())
+
+    # Without sparing the slot of "a", the most-recently-freed slot (that of
+    # "a") would have been assigned
+    sc._assignModelToFreeSlot("d")
+    self.assertEqual(getModelSlot("d"), slotOfB)
+
+    modelID, _waitSec = sc._waitingModels.popNextModel(time.time())
+    sc._assignModelToFreeSlot(modelID)
+    self.assertEqual(getModelSlot("a"), slotOfA)
+
+    self.assertEqual(sc._numSlotAffinityHits, 1)
+    self.assertEqual(sc._numSlotAffinityMisses, 0)
+    self.assertEqual(sc._numSlotAffinityFirstRuns, 4)
+
+
+  @ConfigAttributePatch(
+    ModelSwapperConfig.CONFIG_NAME,
+    ModelSwapperConfig().baseConfigDir,
+    (("resident_model_runner", "enabled", "true"),))
+  @patch.multiple(swap_controller, autospec=True,
+                  ModelSwapperInterface=mock.DEFAULT,
+                  SlotAgent=mock.DEFAULT)
+  def testSlotAffinityIsDroppedOnEvictionAndModelDeletion(self, **kwargs):
+    kwargs["ModelSwapperInterface"].return_value.modelInputPending. \
+      return_value = False
+
+    sc = SwapController(concurrency=2)
+
+    def runModel(modelID, evictedModelIDs=(), report=None):
+      sc._assignModelToFreeSlot(modelID)
+      slotIndex = sc._runningModelsMap[modelID].slotIndex
+      if report is not None:
+        sc._handleModelRuntimeStatsReportEvent(
+          method=SwapController._MODEL_RUNTIME_STATS_REPORT_METHOD,
+          modelID=modelID, report=report)
+      sc._handleModelEvictionReportEvent(
+        method=SwapController._MODEL_EVICTION_REPORT_METHOD, modelID=modelID,
+        slotIndex=slotIndex, evictedModelIDs=list(evictedModelIDs))
+      sc._handleModelDoneNotifyEvent(
+        method=SwapController._MODEL_DONE_NOTIFY_METHOD, modelID=modelID,
+        exitStatus=0, endTime=time.time())
+      return slotIndex
+
+    slotA = runModel("a")
+    slotB = runModel("b")
+    self.assertEqual(slotA, slotB)
+
+    # A slot may hold several models in its resident ModelRunner's cache
+    self.assertEqual(sc._modelSlotAffinityMap, dict(a=slotA, b=slotA))
+
+    # An eviction in the slot drops the evicted model's affinity
+    runModel("c", evictedModelIDs=["a"])
+    self.assertEqual(sc._modelSlotAffinityMap, dict(b=slotA, c=slotA))
+
+    # An eviction in another slot doesn't drop the affinity
+    sc._handleModelEvictionReportEvent(
+      method=SwapController._MODEL_EVICTION_REPORT_METHOD, modelID="x",
+      slotIndex=1 - slotA, evictedModelIDs=["b"])
+    self.assertEqual(sc._modelSlotAffinityMap, dict(b=slotA, c=slotA))
+
+    # A deleted model is forgotten
+    runModel("b", evictedModelIDs=["b"], report=dict(numDeletions=1))
+    self.assertEqual(sc._modelSlotAffinityMap, dict(c=slotA))
+
+
+  @ConfigAttributePatch(
+    ModelSwapperConfig.CONFIG_NAME,
+    ModelSwapperConfig().baseConfigDir,
+    (("swap_controller", "memory_budget_mb", "1000"),
+     ("swap_controller", "default_model_memory_mb", "400")))
+  @patch.multiple(swap_controller, autospec=True,
+                  ModelSwapperInterface=mock.DEFAULT,
+                  SlotAgent=mock.DEFAULT)
+  def testMemoryBudgetLimitsAdmissionAndEviction(self, **kwargs):
+    kwargs["ModelSwapperInterface"].return_value.modelInputPending. \
+      return_value = False
+
+    mb = 1024 * 1024
+
+    sc = SwapController(concurrency=3)
+
+    def notifyNewInput(modelID):
+      sc._handleNewInputNotifyEvent(
+        method=SwapController._NEW_INPUT_NOTIFY_METHOD, modelID=modelID)
+
+    def reportMemory(modelID, memoryFootprint):
+      sc._handleModelMemoryReportEvent(
+        method=SwapController._MODEL_MEMORY_REPORT_METHOD, modelID=modelID,
+        memoryFootprint=memoryFootprint)
+
+    notifyNewInput("a")
+    notifyNewInput("b")
+    self.assertItemsEqual(sc._runningModelsMap.keys(), ["a", "b"])
+
+    reportMemory("a", 100 * mb)
+    reportMemory("b", 700 * mb)
+
+    # "c" doesn't fit in the budget at the default estimate, even though there
+    # is a free slot, so it waits and the model that frees enough memory for it
+    # is preempted
+    notifyNewInput("c")
+    self.assertEqual(list(sc._waitingModels), ["c"])
+    self.assertEqual(len(sc._freeSlots), 1)
+    self.assertEqual(sc._pendingPreemptSlotsSet,
+                     set([sc._runningModelsMap["b"].slotIndex]))
+
+    # Once "b" is done, "c" fits in the budget
+    sc._handleModelDoneNotifyEvent(
+      method=SwapController._MODEL_DONE_NOTIFY_METHOD, modelID="b",
+      exitStatus=0, endTime=time.time())
+
+    self.assertFalse(sc._waitingModels)
+    self.assertItemsEqual(sc._runningModelsMap.keys(), ["a", "c"])
+    self.assertEqual(sc._runningModelsMap["c"].memoryFootprint, 400 * mb)
+
+    # Admission of "b" is now based on its reported footprint, so "c" rather
+    # than the smaller "a" is preempted
+    notifyNewInput("b")
+    self.assertEqual(list(sc._waitingModels), ["b"])
+    self.assertEqual(sc._pendingPreemptSlotsSet,
+                     set([sc._runningModelsMap["c"].slotIndex]))
+
+    # The reported footprint of a deleted model is forgotten
+    sc._handleModelRuntimeStatsReportEvent(
+      method=SwapController._MODEL_RUNTIME_STATS_REPORT_METHOD, modelID="a",
+      report=dict(numDeletions=1))
+    self.assertNotIn("a", sc._modelMemoryFootprintMap)
+
+
+  @ConfigAttributePatch(
+    ModelSwapperConfig.CONFIG_NAME,
+    ModelSwapperConfig().baseConfigDir,
+    (("swap_controller", "memory_budget_mb", "1000"),
+     ("resident_model_runner", "enabled", "true")))
+  @patch.multiple(swap_controller, autospec=True,
+                  ModelSwapperInterface=mock.DEFAULT,
+                  SlotAgent=mock.DEFAULT)
+  def testMemoryBudgetCannotBeCombinedWithResidentModelRunner(self, **kwargs):
+    with self.assertRaises(ValueError):
+      SwapController(concurrency=1)
+
+    self.assertEqual(kwargs["SlotAgent"].call_count, 0)
+
+
+  @ConfigAttributePatch(
+    ModelSwapperConfig.CONFIG_NAME,
+    ModelSwapperConfig().baseConfigDir,
+    (("swap_controller", "scheduling_policy", "heap"),
+     ("swap_controller", "min_run_quantum_sec", "0.1")))
+  @patch.multiple(swap_controller, autospec=True,
+                  ModelSwapperInterface=mock.DEFAULT,
+                  SlotAgent=mock.DEFAULT)
+  def testPreemptionIsDeferredUntilRunQuantumExpires(self, **kwargs):
+    kwargs["ModelSwapperInterface"].return_value.getModelInputBacklog. \
+      return_value = 1
+
+    sc = SwapController(concurrency=1)
+
+    sc._handleNewInputNotifyEvent(
+      method=SwapController._NEW_INPUT_NOTIFY_METHOD, modelID="a")
+    slotOfA = sc._runningModelsMap["a"].slotIndex
+
+    # "a" hasn't had its run quantum yet, so preemption is deferred
+    sc._handleNewInputNotifyEvent(
+      method=SwapController._NEW_INPUT_NOTIFY_METHOD, modelID="b")
+    self.assertEqual(list(sc._waitingModels), ["b"])
+    self.assertFalse(sc._pendingPreemptSlotsSet)
+    self.assertIsNotNone(sc._preemptionRetryTimer)
+
+    evt = sc._eventQ.get(timeout=5)
+    self.assertEqual(evt["method"], SwapController._PREEMPTION_RETRY_METHOD)
+    sc._handlePreemptionRetryEvent(**evt)
+
+    self.assertIsNone(sc._preemptionRetryTimer)
+    self.assertEqual(sc._pendingPreemptSlotsSet, set([slotOfA]))
+
+
+  @ConfigAttributePatch(
+    ModelSwapperConfig.CONFIG_NAME,
+    ModelSwapperConfig().baseConfigDir,
+    (("swap_controller", "scheduling_policy", "heap"),
+     ("swap_controller", "min_run_quantum_sec", "1000")))
+  @patch.multiple(swap_controller, autospec=True,
+                  ModelSwapperInterface=mock.DEFAULT,
+                  SlotAgent=mock.DEFAULT)
+  def testHeapPolicyIsFedInputQueueDepth(self, **kwargs):
+    swapperMock = kwargs["ModelSwapperInterface"].return_value
+    swapperMock.getModelInputBacklog.return_value = 3
+
+    sc = SwapController(concurrency=1)
+
+    def notifyNewInput(modelID):
+      sc._handleNewInputNotifyEvent(
+        method=SwapController._NEW_INPUT_NOTIFY_METHOD, modelID=modelID)
+
+    # The running model's queue isn't queried
+    notifyNewInput("a")
+    self.assertEqual(swapperMock.getModelInputBacklog.call_count, 0)
+
+    notifyNewInput("b")
+    self.assertEqual(sc._waitingModels._backlogMap["b"], 3)
+
+    swapperMock.getModelInputBacklog.return_value = 8
+    notifyNewInput("b")
+    self.assertEqual(sc._waitingModels._backlogMap["b"], 8)
+
+    self.assertEqual(swapperMock.getModelInputBacklog.call_args_list,
+                     [mock.call("b"), mock.call("b")])
+
+    sc._preemptionRetryTimer.cancel()
+
+
+  @ConfigAttributePatch(
+    ModelSwapperConfig.CONFIG_NAME,
+    ModelSwapperConfig().baseConfigDir,
+    (("swap_controller", "prefetch_depth", "2"),))
+  @patch.multiple(swap_controller, autospec=True,
+                  CheckpointPrefetcher=mock.DEFAULT,
+                  ModelSwapperInterface=mock.DEFAULT,
+                  SlotAgent=mock.DEFAULT)
+  def testCheckpointsOfNextWaitingModelsArePrefetched(self, **kwargs):
+    kwargs["ModelSwapperInterface"].return_value.modelInputPending. \
+      return_value = False
+    prefetcherMock = kwargs["CheckpointPrefetcher"].return_value
+
+    sc = SwapController(concurrency=1)
+
+    for modelID in ("a", "b", "c", "d"):
+      sc._handleNewInputNotifyEvent(
+        method=SwapController._NEW_INPUT_NOTIFY_METHOD, modelID=modelID)
+
+    # "a" started right away; only the next two waiting models are prefetched
+    self.assertItemsEqual(
+      set(c[0][0] for c in prefetcherMock.requestPrefetch.call_args_list),
+      ["b", "c"])
+    self.assertEqual(prefetcherMock.noteModelStarted.call_count, 0)
+
+    prefetcherMock.requestPrefetch.reset_mock()
+    sc._handleModelDoneNotifyEvent(
+      method=SwapController._MODEL_DONE_NOTIFY_METHOD, modelID="a",
+      exitStatus=0, endTime=time.time())
+
+    prefetcherMock.noteModelStarted.assert_called_once_with("b")
+    self.assertItemsEqual(
+      [c[0][0] for c in prefetcherMock.requestPrefetch.call_args_list],
+      ["c", "d"])
+
+
   @patch.object(
     SwapController,
     "_NOTIFICATION_READER_THREAD_START_WAIT_TIMEOUT_SEC",
@@ -633,6 +633,7 @@ class InferenceResultTestCase(unittest.TestCase):
                          status=MetricStatus.ACTIVE,
                          parameters=None)
     repoMock.getMetric.return_value = metricRowMock
+    repoMock.getAnomalyLikelihoodParams.return_value = None
 
     class MetricDataRowSpec(object):
       uid = None
@@ -720,6 +721,309 @@ class InferenceResultTestCase(unittest.TestCase):
     self.assertEqual(updateAnomalyLikelihoodParamsMock.call_count, 0)
 
 
+  def testProcessModelInferenceResultsWithInputValuesSkipsMetricDataQuery(
+      self, repoMock, *_args):
+    """Inference results that carry the input timestamps and values should be
+    processed without loading the corresponding metric_data rows
+    """
+
+    class MetricRowSpec(object):
+      uid = None
+      status = None
+
+    metricRowMock = Mock(spec_set=MetricRowSpec, uid="abc",
+                         status=MetricStatus.ACTIVE)
+    repoMock.getMetric.return_value = metricRowMock
+    repoMock.getAnomalyLikelihoodParams.return_value = None
+
+    timestamp = datetime.datetime(2015, 4, 17, 12, 3, 35)
+    inferenceResults = [
+      ModelInferenceResult(rowID=1, status=0, anomalyScore=0.5,
+                           multiStepBestPredictions={1: 2.5},
+                           timestamp=timestamp, value=10.9),
+      ModelInferenceResult(rowID=2, status=0, anomalyScore=0.25,
+                           timestamp=timestamp + datetime.timedelta(minutes=5),
+                           value=-1)]
+
+    runner = anomaly_service.AnomalyService()
+    runner.likelihoodHelper.updateModelAnomalyScores = Mock(
+      spec_set=runner.likelihoodHelper.updateModelAnomalyScores,
+      return_value=dict())
+
+    with patch.object(runner, "_updateAnomalyLikelihoodParams", autospec=True):
+      metricObj, metricDataRows = runner._processModelInferenceResults(
+        inferenceResults=inferenceResults, metricID="abc")
+
+    self.assertIs(metricObj, metricRowMock)
+    self.assertFalse(repoMock.getMetricData.called)
+
+    self.assertEqual(
+      [(row.uid, row.rowid, row.timestamp, row.metric_value,
+        row.raw_anomaly_score, row.multi_step_best_predictions)
+       for row in metricDataRows],
+      [("abc", 1, timestamp, 10.9, 0.5, {1: 2.5}),
+       ("abc", 2, timestamp + datetime.timedelta(minutes=5), -1, 0.25,
+        None)])
+
+    self.assertEqual(
+      [result["rowid"]
+       for result in repoMock.updateMetricDataResults.call_args[0][2]],
+      [1, 2])
+
+
+  def testProcessModelInferenceResultsWithoutInputValuesQueriesMetricData(
+      self, repoMock, *_args):
+    """Inference results that don't carry the input timestamps and values (e.g.,
+    from legacy model runners) should be matched with the metric_data rows
+    loaded from the repository
+    """
+
+    class MetricRowSpec(object):
+      uid = None
+      status = None
+
+    metricRowMock = Mock(spec_set=MetricRowSpec, uid="abc",
+                         status=MetricStatus.ACTIVE)
+    repoMock.getMetric.return_value = metricRowMock
+    repoMock.getAnomalyLikelihoodParams.return_value = None
+
+    timestamp = datetime.datetime(2015, 4, 17, 12, 3, 35)
+    metricDataRow = MagicMock(
+      items=Mock(return_value=dict(uid="abc", rowid=1, timestamp=timestamp,
+                                   metric_value=10.9, raw_anomaly_score=None,
+                                   anomaly_score=None, display_value=None,
+                                   multi_step_best_predictions=None).items()),
+      rowid=1,
+      raw_anomaly_score=None)
+    repoMock.getMetricData.return_value = [metricDataRow]
+
+    runner = anomaly_service.AnomalyService()
+    runner.likelihoodHelper.updateModelAnomalyScores = Mock(
+      spec_set=runner.likelihoodHelper.updateModelAnomalyScores,
+      return_value=dict())
+
+    with patch.object(runner, "_updateAnomalyLikelihoodParams", autospec=True):
+      _metricObj, metricDataRows = runner._processModelInferenceResults(
+        inferenceResults=[ModelInferenceResult(rowID=1, status=0,
+                                               anomalyScore=0.5)],
+        metricID="abc")
+
+    self.assertEqual(repoMock.getMetricData.call_count, 1)
+    self.assertEqual(repoMock.getMetricData.call_args[1],
+                     dict(start=1, stop=1))
+
+    self.assertEqual(len(metricDataRows), 1)
+    self.assertIsInstance(metricDataRows[0],
+                          anomaly_service.MutableMetricDataRow)
+    self.assertEqual(metricDataRows[0].timestamp, timestamp)
+    self.assertEqual(metricDataRows[0].metric_value, 10.9)
+    self.assertEqual(metricDataRows[0].raw_anomaly_score, 0.5)
+
+
+  def testProcessModelInferenceResultsWithFractionalSecondsQueriesMetricData(
+      self, repoMock, *_args):
+    """Inference results carrying a timestamp with a fractional part should be
+    matched with the metric_data rows, since those store whole seconds
+    """
+
+    class MetricRowSpec(object):
+      uid = None
+      status = None
+
+    metricRowMock = Mock(spec_set=MetricRowSpec, uid="abc",
+                         status=MetricStatus.ACTIVE)
+    repoMock.getMetric.return_value = metricRowMock
+    repoMock.getAnomalyLikelihoodParams.return_value = None
+
+    storedTimestamp = datetime.datetime(2015, 4, 17, 12, 3, 36)
+    metricDataRow = MagicMock(
+      items=Mock(return_value=dict(uid="abc", rowid=1,
+                                   timestamp=storedTimestamp,
+                                   metric_value=10.9, raw_anomaly_score=None,
+                                   anomaly_score=None, display_value=None,
+                                   multi_step_best_predictions=None).items()),
+      rowid=1,
+      raw_anomaly_score=None)
+    repoMock.getMetricData.return_value = [metricDataRow]
+
+    runner = anomaly_service.AnomalyService()
+    runner.likelihoodHelper.updateModelAnomalyScores = Mock(
+      spec_set=runner.likelihoodHelper.updateModelAnomalyScores,
+      return_value=dict())
+
+    with patch.object(runner, "_updateAnomalyLikelihoodParams", autospec=True):
+      _metricObj, metricDataRows = runner._processModelInferenceResults(
+        inferenceResults=[
+          ModelInferenceResult(
+            rowID=1, status=0, anomalyScore=0.5,
+            timestamp=datetime.datetime(2015, 4, 17, 12, 3, 35, 600000),
+            value=10.9)],
+        metricID="abc")
+
+    self.assertEqual(repoMock.getMetricData.call_count, 1)
+    self.assertEqual(metricDataRows[0].timestamp, storedTimestamp)
+
+
+  def _processCachedMetricBatches(self, repoMock, metricCacheSize,
+                                  updateParamsSideEffect):
+    """ Process two inference result batches of an ACTIVE metric with the given
+    side effect of _updateAnomalyLikelihoodParams
+
+    :returns: (runner, updateModelAnomalyScoresMock, updateParamsMock,
+      [result of each batch])
+    """
+
+    class MetricRowSpec(object):
+      uid = None
+      status = None
+
+    metricRowMock = Mock(spec_set=MetricRowSpec, uid="abc",
+                         status=MetricStatus.ACTIVE)
+    repoMock.getMetric.return_value = metricRowMock
+    repoMock.getAnomalyLikelihoodParams.return_value = Mock(
+      params=json.dumps(dict(params="saved")), version=5)
+
+    timestamp = datetime.datetime(2015, 4, 17, 12, 3, 35)
+    batches = [
+      [ModelInferenceResult(rowID=rowID, status=0, anomalyScore=0.5,
+                            timestamp=(timestamp +
+                                       datetime.timedelta(minutes=5 * rowID)),
+                            value=float(rowID))
+       for rowID in rowIDs]
+      for rowIDs in ([1, 2], [3, 4])]
+
+    runner = anomaly_service.AnomalyService()
+    runner._metricCacheSize = metricCacheSize
+    updateModelAnomalyScoresMock = Mock(
+      spec_set=runner.likelihoodHelper.updateModelAnomalyScores,
+      return_value=dict(params="likelihood-state"))
+    runner.likelihoodHelper.updateModelAnomalyScores = (
+      updateModelAnomalyScoresMock)
+
+    with patch.object(runner, "_updateAnomalyLikelihoodParams", autospec=True,
+                      side_effect=updateParamsSideEffect) as updateParamsMock:
+      results = [
+        runner._processModelInferenceResults(inferenceResults=batch,
+                                             metricID="abc")
+        for batch in batches]
+
+    return runner, updateModelAnomalyScoresMock, updateParamsMock, results
+
+
+  def testMetricCacheSkipsMetricLookupOfLaterBatches(self, repoMock, *_args):
+    runner, updateScoresMock, updateParamsMock, results = (
+      self._processCachedMetricBatches(
+        repoMock, metricCacheSize=10,
+        updateParamsSideEffect=[6, 7]))
+
+    self.assertIsNotNone(results[0])
+    self.assertIsNotNone(results[1])
+    self.assertEqual(repoMock.getMetric.call_count, 1)
+    self.assertEqual(repoMock.getAnomalyLikelihoodParams.call_count, 1)
+
+    # The second batch is processed with the anomaly likelihood params saved by
+    # the first one, and the tail of raw anomaly scores is carried over
+    firstCall, secondCall = updateScoresMock.call_args_list
+    self.assertEqual(firstCall[1]["anomalyLikelihoodParams"],
+                     dict(params="saved"))
+    self.assertEqual(secondCall[1]["anomalyLikelihoodParams"],
+                     dict(params="likelihood-state"))
+    sampleTail = secondCall[1]["sampleTail"]
+    self.assertIs(sampleTail, firstCall[1]["sampleTail"])
+
+    self.assertEqual(
+      [call[1]["refVersion"] for call in updateParamsMock.call_args_list],
+      [5, 6])
+
+    cachedMetric = runner._metricCache["abc"]
+    self.assertEqual(cachedMetric.likelihoodParams,
+                     dict(params="likelihood-state"))
+    self.assertEqual(cachedMetric.likelihoodParamsVersion, 7)
+
+
+  def testMetricCacheDisabled(self, repoMock, *_args):
+    runner, updateScoresMock, updateParamsMock, results = (
+      self._processCachedMetricBatches(
+        repoMock, metricCacheSize=0,
+        updateParamsSideEffect=[6, 6]))
+
+    self.assertIsNotNone(results[1])
+    self.assertEqual(repoMock.getMetric.call_count, 2)
+    self.assertEqual(repoMock.getAnomalyLikelihoodParams.call_count, 2)
+    self.assertEqual(runner._metricCache, dict())
+
+    for call in updateScoresMock.call_args_list:
+      self.assertEqual(call[1]["anomalyLikelihoodParams"],
+                       dict(params="saved"))
+      self.assertIsNone(call[1]["sampleTail"])
+
+    for call in updateParamsMock.call_args_list:
+      self.assertEqual(call[1]["refVersion"], 5)
+
+
+  def testMetricCacheEntryIsEvictedOnRejection(self, repoMock, *_args):
+    runner, _updateScoresMock, _updateParamsMock, results = (
+      self._processCachedMetricBatches(
+        repoMock, metricCacheSize=10,
+        updateParamsSideEffect=[
+          6,
+          app_exceptions.MetricNotActiveError("faking it")]))
+
+    self.assertIsNotNone(results[0])
+    self.assertIsNone(results[1])
+    self.assertEqual(repoMock.getMetric.call_count, 1)
+    self.assertNotIn("abc", runner._metricCache)
+
+
+  def testStaleMetricCacheEntryIsReloaded(self, repoMock, *_args):
+    runner, updateScoresMock, updateParamsMock, results = (
+      self._processCachedMetricBatches(
+        repoMock, metricCacheSize=10,
+        updateParamsSideEffect=[
+          6,
+          app_exceptions.AnomalyLikelihoodParamsChangedError("faking it"),
+          6]))
+
+    self.assertIsNotNone(results[1])
+    self.assertEqual(repoMock.getMetric.call_count, 2)
+    self.assertEqual(updateScoresMock.call_count, 3)
+
+    # The batch is reprocessed with freshly loaded anomaly likelihood params
+    self.assertEqual(updateScoresMock.call_args[1]["anomalyLikelihoodParams"],
+                     dict(params="saved"))
+    self.assertEqual(
+      [call[1]["refVersion"] for call in updateParamsMock.call_args_list],
+      [5, 6, 5])
+    self.assertEqual(runner._metricCache["abc"].likelihoodParamsVersion, 6)
+
+
+  def testRepeatedlyChangedParamsRejectBatch(self, repoMock, *_args):
+    paramsChangedError = (
+      app_exceptions.AnomalyLikelihoodParamsChangedError("faking it"))
+    runner, updateScoresMock, _updateParamsMock, results = (
+      self._processCachedMetricBatches(
+        repoMock, metricCacheSize=10,
+        updateParamsSideEffect=[6, paramsChangedError, paramsChangedError]))
+
+    # The second batch is reprocessed only once, then rejected
+    self.assertIsNotNone(results[0])
+    self.assertIsNone(results[1])
+    self.assertEqual(updateScoresMock.call_count, 3)
+    self.assertNotIn("abc", runner._metricCache)
+
+
+  def testMetricCacheEvictsLeastRecentlyUsedMetrics(self, *_args):
+    runner = anomaly_service.AnomalyService()
+    runner._metricCacheSize = 2
+
+    runner._cacheMetric("a", Mock())
+    runner._cacheMetric("b", Mock())
+    runner._cacheMetric("a", runner._metricCache.pop("a"))
+    runner._cacheMetric("c", Mock())
+
+    self.assertEqual(runner._metricCache.keys(), ["a", "c"])
+
+
   def testTruncatedInferenceResultsInScrubInferernceResults(
       self, *_args):
     """Calling _scrubInferenceResultsAndInitMetricData with fewer
@@ -921,47 +1225,77 @@ class InferenceResultTestCase(unittest.TestCase):
 
 class UpdateAnomalyLikelihoodParamsTestCase(unittest.TestCase):
 
-  def testUpdateAnomalyLikelihoodParams(
-      self, *_args):
-    """ Test AnomalyService._updateAnomalyLikelihoodParams()
-    """
-    class MetricDataRowSpec(object):
+  @staticmethod
+  def _createConnMock(metricStatus, saveRowCount):
+    class MetricRowSpec(object):
       status = None
 
-    repositoryWrap = Mock(wraps=anomaly_service.repository)
-
     conn = Mock(spec_set=sqlalchemy.engine.Connection)
     conn.execute.side_effect = [
-      # for repository.getMetricWithUpdateLock:
+      # for repository.getMetric:
       Mock(spec_set=sqlalchemy.engine.ResultProxy,
            first=Mock(
              spec_set=sqlalchemy.engine.ResultProxy.first,
              side_effect=[
                Mock(
-                 spec_set=MetricDataRowSpec,
-                 status=MetricStatus.ACTIVE)])),
+                 spec_set=MetricRowSpec,
+                 status=metricStatus)])),
 
-      # for repository.updateMetricColumns:
-      Mock(spec_set=sqlalchemy.engine.ResultProxy)
+      # for repository.saveAnomalyLikelihoodParams:
+      Mock(spec_set=sqlalchemy.engine.ResultProxy, rowcount=saveRowCount)
     ]
 
+    return conn
+
+
+  def testUpdateAnomalyLikelihoodParams(self):
+    """ Test AnomalyService._updateAnomalyLikelihoodParams()
+    """
+    repositoryWrap = Mock(wraps=anomaly_service.repository)
+
+    conn = self._createConnMock(MetricStatus.ACTIVE, saveRowCount=1)
+
     with patch.object(anomaly_service, "repository", new=repositoryWrap):
-      modelParams = json.dumps(dict())
+      version = anomaly_service.AnomalyService._updateAnomalyLikelihoodParams(
+        conn=conn,
+        metricId="123abcde",
+        likelihoodParams="likelihood-state",
+        refVersion=3)
+
+    self.assertEqual(version, 4)
+
+    # The metric row isn't locked, nor are model params rewritten
+    self.assertTrue(repositoryWrap.getMetric.called)
+    self.assertFalse(repositoryWrap.getMetricWithUpdateLock.called)
+    self.assertFalse(repositoryWrap.updateMetricColumns.called)
+
+    repositoryWrap.saveAnomalyLikelihoodParams.assert_called_once_with(
+      conn, "123abcde", json.dumps("likelihood-state"), 3)
+
+
+  def testUpdateAnomalyLikelihoodParamsOfInactiveMetric(self):
+    conn = self._createConnMock(MetricStatus.UNMONITORED, saveRowCount=1)
+
+    with self.assertRaises(app_exceptions.MetricNotActiveError):
       anomaly_service.AnomalyService._updateAnomalyLikelihoodParams(
         conn=conn,
         metricId="123abcde",
-        modelParamsJson=modelParams,
-        likelihoodParams="likelihood-state")
+        likelihoodParams="likelihood-state",
+        refVersion=3)
 
-    self.assertTrue(repositoryWrap.getMetricWithUpdateLock.called)
-    self.assertTrue(repositoryWrap.updateMetricColumns.called)
+    self.assertEqual(conn.execute.call_count, 1)
+
+
+  def testUpdateChangedAnomalyLikelihoodParams(self):
+    conn = self._createConnMock(MetricStatus.ACTIVE, saveRowCount=0)
+
+    with self.assertRaises(app_exceptions.AnomalyLikelihoodParamsChangedError):
+      anomaly_service.AnomalyService._updateAnomalyLikelihoodParams(
+        conn=conn,
+        metricId="123abcde",
+        likelihoodParams="likelihood-state",
+        refVersion=None)
 
-    _connArg, _metricIdArg, fieldsArg = (
-      repositoryWrap.updateMetricColumns.call_args[0])
-    self.assertEqual(
-      fieldsArg,
-      {"model_params": json.dumps({"anomalyLikelihoodParams":
-                                   "likelihood-state"})})
 
 
 class MutableMetricDataRowTestCase(unittest.TestCase):
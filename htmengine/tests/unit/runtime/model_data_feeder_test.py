@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+# ----------------------------------------------------------------------
+# Numenta Platform for Intelligent Computing (NuPIC)
+# Copyright (C) 2015, Numenta, Inc.  Unless you have purchased from
+# Numenta, Inc. a separate commercial license for this software code, the
+# following terms and conditions apply:
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero Public License for more details.
+#
+# You should have received a copy of the GNU Affero Public License
+# along with this program.  If not, see http://www.gnu.org/licenses.
+#
+# http://numenta.org/licenses/
+# ----------------------------------------------------------------------
+
+"""
+Unit tests for htmengine.runtime.model_data_feeder
+"""
+
+from datetime import datetime, timedelta
+import unittest
+
+from mock import Mock
+
+from htmengine.model_swapper import model_swapper_interface
+from htmengine.model_swapper.runtime_stats import RuntimeStatsReader
+from htmengine.runtime import model_data_feeder
+
+
+
+def _createInputRows(numRows):
+  now = datetime.utcnow()
+  return [
+    model_swapper_interface.ModelInputRow(
+      rowID=1+i, data=(now + timedelta(seconds=60*i), float(i),))
+    for i in xrange(numRows)
+  ]
+
+
+
+class AdaptiveBatchSizerTestCase(unittest.TestCase):
+
+
+  def _createSizer(self, rowsPerSec, maxBatchBytes=10**9):
+    statsReader = Mock(spec_set=RuntimeStatsReader)
+    statsReader.getRowsPerSec.return_value = rowsPerSec
+
+    return model_data_feeder.AdaptiveBatchSizer(
+      defaultBatchSize=100,
+      maxBatchSize=1000,
+      targetBatchSec=2.0,
+      maxBatchBytes=maxBatchBytes,
+      statsReader=statsReader,
+      batchFormat=model_swapper_interface.BatchPackager.FORMAT_JSON)
+
+
+  def testDefaultBatchSizeUntilRateIsObserved(self):
+    sizer = self._createSizer(rowsPerSec=None)
+
+    self.assertEqual(sizer.getBatchSize("abc", _createInputRows(200)), 100)
+    sizer._statsReader.getRowsPerSec.assert_called_with("abc")
+
+
+  def testBatchSizeFollowsRate(self):
+    self.assertEqual(
+      self._createSizer(rowsPerSec=150.0).getBatchSize(
+        "abc", _createInputRows(900)),
+      300)
+
+    # Limited by the max batch size
+    self.assertEqual(
+      self._createSizer(rowsPerSec=10000.0).getBatchSize(
+        "abc", _createInputRows(3000)),
+      1000)
+
+    # But at least one row
+    self.assertEqual(
+      self._createSizer(rowsPerSec=0.1).getBatchSize(
+        "abc", _createInputRows(3)),
+      1)
+
+
+  def testBatchSizeIsLimitedByMessageSize(self):
+    inputRows = _createInputRows(100)
+    bytesPerRow = len(model_swapper_interface.BatchPackager.marshal(
+      inputRows)) / 100.0
+
+    sizer = self._createSizer(rowsPerSec=10000.0,
+                              maxBatchBytes=int(bytesPerRow * 20))
+
+    self.assertLessEqual(sizer.getBatchSize("abc", inputRows), 20)
+
+
+  def testRowsAreSpreadEvenlyAcrossBatches(self):
+    sizer = self._createSizer(rowsPerSec=None)
+
+    # Three batches of 67 rows instead of 100, 100 and 1 rows
+    self.assertEqual(sizer.getBatchSize("abc", _createInputRows(201)), 67)
+
+    # Fewer rows than a batch
+    self.assertEqual(sizer.getBatchSize("abc", _createInputRows(7)), 7)
+
+
+
+class SendInputRowsToModelTestCase(unittest.TestCase):
+
+
+  def testBatchSizerOverridesBatchSize(self):
+    inputRows = _createInputRows(10)
+    batchSizer = Mock(spec_set=model_data_feeder.AdaptiveBatchSizer)
+    batchSizer.getBatchSize.return_value = 4
+    modelSwapper = Mock(spec_set=model_swapper_interface.ModelSwapperInterface)
+
+    model_data_feeder.sendInputRowsToModel(
+      modelId="abc",
+      inputRows=inputRows,
+      batchSize=100,
+      modelSwapper=modelSwapper,
+      logger=Mock(),
+      profiling=False,
+      batchSizer=batchSizer)
+
+    batchSizer.getBatchSize.assert_called_once_with("abc", inputRows)
+    self.assertEqual(
+      [args[1] for args, _kwargs in modelSwapper.submitRequests.call_args_list],
+      [inputRows[0:4], inputRows[4:8], inputRows[8:10]])
+
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -27,6 +27,7 @@ from collections import namedtuple
 import contextlib
 import json
 import logging
+import re
 import select
 import socket
 import time
@@ -58,6 +59,12 @@ class ConsumerCancelled(MessageBusConnectorError):
 
 
 
+# Message queue name and the number of messages that are ready for delivery in
+# it; messageCount is None if the broker doesn't have queue statistics yet
+MessageQueueDepth = namedtuple("MessageQueueDepth", "name messageCount")
+
+
+
 # Decorator for retrying operations on potentially-transient AMQP errrors
 _RETRY_ON_AMQP_ERROR = error_handling.retry(
   timeoutSec=10, initialRetryDelaySec=0.05, maxRetryDelaySec=2,
@@ -218,20 +225,32 @@ class MessageBusConnector(object):
         raise
 
 
-  @_RETRY_ON_AMQP_ERROR
   def isEmpty(self, mqName):
     """
     raises: MessageQueueNotFound
     """
+    # NOTE: we implement this on top of getMessageCount(), which already uses
+    # _RETRY_ON_AMQP_ERROR, so we don't need retries on this method.
+    return self.getMessageCount(mqName) == 0
+
+
+  @_RETRY_ON_AMQP_ERROR
+  def getMessageCount(self, mqName):
+    """ Get the number of messages in the message queue that are ready for
+    delivery; unlike the counts from iterMessageQueueDepths, this is current.
+
+    retval: number of ready messages
+    raises: MessageQueueNotFound
+    """
     try:
       r = self._channelMgr.client.declareQueue(mqName,
                                                passive=True)
-      return r.messageCount == 0
+      return r.messageCount
     except amqp.exceptions.AmqpChannelError as e:
       if e.code == amqp.constants.AMQPErrorCodes.NOT_FOUND:
         self._channelMgr.reset()
         raise MessageQueueNotFound(
-          "isEmpty: mq=%s not found (%r)" % (mqName, e,))
+          "getMessageCount: mq=%s not found (%r)" % (mqName, e,))
       else:
         raise
 
@@ -258,10 +277,67 @@ class MessageBusConnector(object):
 
     retval: (possibly empty) sequence of message queue names
     """
-    connectionParams = amqp.connection.RabbitmqManagementConnectionParams()
-
     # Use RabbitMQ Management Plugin to retrieve the names of message
     # queues
+    queues = self._queryManagementQueues(params={"columns": "name"})
+    return tuple(d["name"] for d in queues)
+
+
+  def iterMessageQueueDepths(self, namePrefix=None, pageSize=500):
+    """ Get names and message counts of all message queues (or of those whose
+    names start with namePrefix) in a single RabbitMQ management query,
+    instead of a passive declare per queue. The queues are retrieved a page at
+    a time from brokers that support pagination of the management API
+    (RabbitMQ 3.6+), so only one page of queues is decoded at a time; older
+    brokers return all queues at once.
+
+    NOTE: the message counts come from the broker's queue statistics, which
+    lag behind the actual queue contents by up to the broker's statistics
+    collection interval (5 seconds by default).
+
+    :param namePrefix: if not None, only queues with names that start with this
+      prefix are returned
+    :param pageSize: max number of queues to retrieve per management query
+
+    :returns: generator of MessageQueueDepth namedtuples
+    """
+    params = {"columns": "name,messages_ready",
+              "page_size": pageSize}
+    if namePrefix is not None:
+      params["name"] = "^" + re.escape(namePrefix)
+      params["use_regex"] = "true"
+
+    page = 1
+    while True:
+      result = self._queryManagementQueues(params=dict(params, page=page))
+
+      if isinstance(result, dict):
+        items = result["items"]
+        pageCount = result["page_count"]
+      else:
+        # The broker doesn't support pagination and returned all queues
+        items = result
+        pageCount = page
+
+      for d in items:
+        if namePrefix is None or d["name"].startswith(namePrefix):
+          yield MessageQueueDepth(name=d["name"],
+                                  messageCount=d.get("messages_ready"))
+
+      if page >= pageCount:
+        break
+
+      page += 1
+
+
+  def _queryManagementQueues(self, params):
+    """ Query the queues of our vhost via the RabbitMQ Management Plugin
+
+    :param params: query parameters of the management API request
+
+    :returns: the decoded JSON response
+    """
+    connectionParams = amqp.connection.RabbitmqManagementConnectionParams()
 
     # Buld a URL for retrieving queue names from the default vhost
     # NOTE: we encode the default vhost name ("/") in hex because it cannot be
@@ -277,16 +353,16 @@ class MessageBusConnector(object):
         url,
         auth=(connectionParams.username,
               connectionParams.password),
-        params={"columns": "name"})
+        params=params)
 
       response.raise_for_status()
     except Exception:
       self._logger.exception(
-        "getAllMessageQueues failed; url=%r; response=%r", url, response)
+        "Management query of queues failed; url=%r; params=%r; response=%r",
+        url, params, response)
       raise
 
-
-    return tuple(d["name"] for d in json.loads(response.text))
+    return json.loads(response.text)
 
 
   @_RETRY_ON_AMQP_ERROR
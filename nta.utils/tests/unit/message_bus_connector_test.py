@@ -0,0 +1,113 @@
+# ----------------------------------------------------------------------
+# Numenta Platform for Intelligent Computing (NuPIC)
+# Copyright (C) 2015, Numenta, Inc.  Unless you have purchased from
+# Numenta, Inc. a separate commercial license for this software code, the
+# following terms and conditions apply:
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero Public License for more details.
+#
+# You should have received a copy of the GNU Affero Public License
+# along with this program.  If not, see http://www.gnu.org/licenses.
+#
+# http://numenta.org/licenses/
+# ----------------------------------------------------------------------
+
+"""Unit tests for the management queries of message_bus_connector"""
+
+import json
+import unittest
+
+from mock import Mock, patch
+
+from nta.utils import message_bus_connector
+from nta.utils.message_bus_connector import (
+  MessageBusConnector,
+  MessageQueueDepth)
+
+
+
+# Disable warning: Access to a protected member
+# pylint: disable=W0212
+
+
+
+def _createResponse(result):
+  response = Mock(text=json.dumps(result))
+  return response
+
+
+
+@patch.object(message_bus_connector.amqp.connection,
+              "RabbitmqManagementConnectionParams", autospec=True,
+              return_value=Mock(host="localhost", port=15672, vhost="/",
+                                username="guest", password="guest"))
+@patch.object(message_bus_connector, "_ChannelManager", autospec=True)
+class ManagementQueryTestCase(unittest.TestCase):
+  """ Unit tests for MessageBusConnector's management queries """
+
+
+  @patch.object(message_bus_connector.requests, "get", autospec=True)
+  def testIterMessageQueueDepthsPaginated(self, requestsGetMock, *_args):
+    requestsGetMock.side_effect = [
+      _createResponse(dict(page=1, page_count=2, items=[
+        dict(name="prefix.a", messages_ready=3),
+        dict(name="prefix.b", messages_ready=0)])),
+      _createResponse(dict(page=2, page_count=2, items=[
+        dict(name="prefix.c")]))
+    ]
+
+    with MessageBusConnector() as bus:
+      queueDepths = list(bus.iterMessageQueueDepths(namePrefix="prefix.",
+                                                    pageSize=2))
+
+    self.assertEqual(queueDepths,
+                     [MessageQueueDepth(name="prefix.a", messageCount=3),
+                      MessageQueueDepth(name="prefix.b", messageCount=0),
+                      MessageQueueDepth(name="prefix.c", messageCount=None)])
+
+    self.assertEqual(requestsGetMock.call_count, 2)
+    for page, (args, kwargs) in enumerate(requestsGetMock.call_args_list, 1):
+      self.assertEqual(args[0], "http://localhost:15672/api/queues/%2f")
+      self.assertEqual(kwargs["params"]["page"], page)
+      self.assertEqual(kwargs["params"]["page_size"], 2)
+      self.assertEqual(kwargs["params"]["name"], r"^prefix\.")
+      self.assertEqual(kwargs["params"]["use_regex"], "true")
+
+
+  @patch.object(message_bus_connector.requests, "get", autospec=True)
+  def testIterMessageQueueDepthsUnpaginated(self, requestsGetMock, *_args):
+    # Brokers that don't support pagination return all queues unfiltered
+    requestsGetMock.return_value = _createResponse([
+      dict(name="prefix.a", messages_ready=3),
+      dict(name="other", messages_ready=1)])
+
+    with MessageBusConnector() as bus:
+      queueDepths = list(bus.iterMessageQueueDepths(namePrefix="prefix."))
+
+    self.assertEqual(queueDepths,
+                     [MessageQueueDepth(name="prefix.a", messageCount=3)])
+    self.assertEqual(requestsGetMock.call_count, 1)
+
+
+  @patch.object(message_bus_connector.requests, "get", autospec=True)
+  def testGetAllMessageQueues(self, requestsGetMock, *_args):
+    requestsGetMock.return_value = _createResponse([dict(name="a"),
+                                                    dict(name="b")])
+
+    with MessageBusConnector() as bus:
+      self.assertEqual(bus.getAllMessageQueues(), ("a", "b"))
+
+    self.assertEqual(requestsGetMock.call_args[1]["params"],
+                     {"columns": "name"})
+
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -27,6 +27,7 @@ from htmengine.exceptions import (HTMEngineError,
                                   MetricNotActiveError,
                                   MetricStatisticsNotReadyError,
                                   MetricStatusChangedError,
+                                  AnomalyLikelihoodParamsChangedError,
                                   DuplicateRecordError)
 
 
@@ -33,6 +33,7 @@ from taurus_engine.repository.migrate import migrate
 import htmengine.repository
 from htmengine.repository import (addMetric,
                                   addMetricData,
+                                  deleteAnomalyLikelihoodParams,
                                   deleteMetric,
                                   deleteModel,
                                   getCustomMetricByName,
@@ -42,6 +43,7 @@ from htmengine.repository import (addMetric,
                                   getAllMetrics,
                                   getAllMetricsForServer,
                                   getAllModels,
+                                  getAnomalyLikelihoodParams,
                                   getMetric,
                                   getMetricWithSharedLock,
                                   getMetricWithUpdateLock,
@@ -54,6 +56,7 @@ from htmengine.repository import (addMetric,
                                   getMetricStats,
                                   getUnprocessedModelDataCount,
                                   listMetricIDsForInstance,
+                                  saveAnomalyLikelihoodParams,
                                   saveMetricInstanceStatus,
                                   setMetricCollectorError,
                                   setMetricLastTimestamp,
@@ -61,6 +64,7 @@ from htmengine.repository import (addMetric,
                                   updateMetricColumns,
                                   updateMetricColumnsForRefStatus,
                                   updateMetricDataColumns,
+                                  updateMetricDataResults,
                                   lockOperationExclusive,
                                   OperationLock)
 
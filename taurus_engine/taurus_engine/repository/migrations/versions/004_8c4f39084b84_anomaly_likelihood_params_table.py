@@ -0,0 +1,89 @@
+# ----------------------------------------------------------------------
+# Numenta Platform for Intelligent Computing (NuPIC)
+# Copyright (C) 2016, Numenta, Inc.  Unless you have purchased from
+# Numenta, Inc. a separate commercial license for this software code, the
+# following terms and conditions apply:
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero Public License for more details.
+#
+# You should have received a copy of the GNU Affero Public License
+# along with this program.  If not, see http://www.gnu.org/licenses.
+#
+# http://numenta.org/licenses/
+# ----------------------------------------------------------------------
+
+"""Moves anomaly likelihood params from metric.model_params to the new
+anomaly_likelihood_params table.
+
+Revision ID: 8c4f39084b84
+Revises: 2695f59d78bd
+Create Date: 2016-10-03 11:42:17.508213
+"""
+
+import json
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# Revision identifiers, used by Alembic. Do not change.
+revision = '8c4f39084b84'
+down_revision = '2695f59d78bd'
+
+
+
+def upgrade():
+  """ Creates table 'anomaly_likelihood_params' and moves the
+  'anomalyLikelihoodParams' of existing models' model_params to it. Must be
+  run while the anomaly service is stopped.
+  """
+  op.create_table('anomaly_likelihood_params',
+    sa.Column('uid', sa.VARCHAR(length=40), nullable=False),
+    sa.Column('version', sa.INTEGER(), autoincrement=False, nullable=False),
+    sa.Column('params', sa.TEXT(), nullable=False),
+    sa.ForeignKeyConstraint(['uid'], [u'metric.uid'],
+      name='anomaly_likelihood_params_to_metric_fk', onupdate='CASCADE',
+      ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('uid')
+  )
+
+  metric = sa.table('metric',
+                    sa.column('uid', sa.VARCHAR),
+                    sa.column('model_params', sa.TEXT))
+  likelihoodParamsTable = sa.table('anomaly_likelihood_params',
+                                   sa.column('uid', sa.VARCHAR),
+                                   sa.column('version', sa.INTEGER),
+                                   sa.column('params', sa.TEXT))
+
+  conn = op.get_bind()
+
+  rows = conn.execute(
+    sa.select([metric.c.uid, metric.c.model_params])
+    .where(metric.c.model_params.isnot(None))).fetchall()
+
+  for uid, modelParamsJson in rows:
+    modelParams = json.loads(modelParamsJson)
+    if "anomalyLikelihoodParams" not in modelParams:
+      continue
+
+    likelihoodParams = modelParams.pop("anomalyLikelihoodParams")
+
+    conn.execute(likelihoodParamsTable.insert() # pylint: disable=E1120
+                 .values(uid=uid, version=1,
+                         params=json.dumps(likelihoodParams)))
+
+    conn.execute(metric.update() # pylint: disable=E1120
+                 .where(metric.c.uid == uid)
+                 .values(model_params=json.dumps(modelParams)))
+
+
+
+def downgrade():
+  raise NotImplementedError("Rollback is not supported.")
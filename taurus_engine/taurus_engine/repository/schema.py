@@ -25,4 +25,5 @@ from htmengine.repository.schema import (metadata,
                                          instance_status_history,
                                          metric,
                                          metric_data,
+                                         anomaly_likelihood_params,
                                          lock)
@@ -27,7 +27,9 @@ stopped.
 
 import argparse
 import logging
+import os
 import random
+import shutil
 import sys
 import traceback
 
@@ -175,6 +177,18 @@ def _cleanModelCheckpoints():
 
 
 
+def _cleanModelInputSpool():
+  """Delete the model input spools of input shard queues"""
+  g_log.info("Deleting model input spools")
+
+  spoolDir = os.path.expanduser(os.path.expandvars(
+    model_swapper.ModelSwapperConfig().get("interface_bus", "input_spool_dir")))
+
+  if os.path.exists(spoolDir):
+    shutil.rmtree(spoolDir)
+
+
+
 def _resetAll(suppressPrompt):
   """Reset Taurus Engine's message queues/exchanges, model checkpoints, and
   repository database. NOTE: must be executed while all Taurus Engine and Taurus
@@ -201,6 +215,10 @@ def _resetAll(suppressPrompt):
   _cleanModelCheckpoints()
 
 
+  # Delete model input spools
+  _cleanModelInputSpool()
+
+
 
 @logExceptions(g_log)
 def main(args):